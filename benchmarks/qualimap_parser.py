@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""Benchmark the parsing of Qualimap genome_results.txt reports.
+
+Writes real-size reports (the full bamqc header sections, the cumulative coverage
+lines and one row per contig; GRCh38 with alt, decoy and HLA contigs has 3366)
+and times parsing them with the single-pass, section-dispatched parser in
+ngi_pipeline.utils.qualimap against trying the per-line regular expressions of
+the sarek QualiMapParser in turn on every line, as it used to.
+
+    python benchmarks/qualimap_parser.py [--reports 200] [--contigs 3366]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from ngi_pipeline.engines.sarek.parsers import QualiMapParser
+from ngi_pipeline.utils.qualimap import GenomeResults
+
+
+def write_genome_results(path, n_contigs, seed=0):
+    rnd = random.Random(seed)
+    lines = [
+        "BamQC report",
+        "-----------------------------------",
+        "",
+        ">>>>>>> Input",
+        "",
+        "     bam file = /scratch/P12345_1001.recal.bam",
+        "     outfile = P12345_1001.recal.qc/genome_results.txt",
+        "",
+        "",
+        ">>>>>>> Reference",
+        "",
+        "     number of bases = 3,217,346,917 bp",
+        "     number of contigs = {:,}".format(n_contigs),
+        "",
+        "",
+        ">>>>>>> Globals",
+        "",
+        "     number of windows = 400",
+        "     number of reads = 967,817,737",
+        "     number of mapped reads = 960,000,000 (99.19%)",
+        "     number of secondary alignments = 0",
+        "     number of mapped paired reads (first in pair) = 480,000,000",
+        "     number of mapped paired reads (second in pair) = 480,000,000",
+        "     number of mapped bases = 144,000,000,000 bp",
+        "     number of sequenced bases = 143,500,000,000 bp",
+        "     number of duplicated reads (flagged) = 96,000,000",
+        "",
+        "",
+        ">>>>>>> Insert size",
+        "",
+        "     mean insert size = 412.3",
+        "     std insert size = 98.7",
+        "     median insert size = 398",
+        "",
+        "",
+        ">>>>>>> Mapping quality",
+        "",
+        "     mean mapping quality = 54.12",
+        "",
+        "",
+        ">>>>>>> ACTG content",
+        "",
+        "     number of A's = 42,000,000,000 bp (29.2%)",
+        "     number of C's = 30,000,000,000 bp (20.8%)",
+        "     number of T's = 42,000,000,000 bp (29.2%)",
+        "     number of G's = 30,000,000,000 bp (20.8%)",
+        "     number of N's = 1,000,000 bp (0%)",
+        "     GC percentage = 41.67%",
+        "",
+        "",
+        ">>>>>>> Mismatches and indels",
+        "",
+        "    general error rate = 0.0051",
+        "    number of mismatches = 700,000,000",
+        "    number of insertions = 12,000,000",
+        "    mapped reads with insertion percentage = 1.21%",
+        "    number of deletions = 13,000,000",
+        "    mapped reads with deletion percentage = 1.3%",
+        "    homopolymer indels = 55.1%",
+        "",
+        "",
+        ">>>>>>> Coverage",
+        "",
+        "     mean coverageData = 30.5X",
+        "     std coverageData = 12.4X",
+        "",
+    ]
+    for x in range(1, 51):
+        lines.append(
+            "     There is a {:.2f}% of reference with a coverageData >= {}X".format(
+                max(0.0, 100.0 - x * 2.1), x
+            )
+        )
+    lines.extend(["", "", ">>>>>>> Coverage per contig", ""])
+    for i in range(n_contigs):
+        if i < 22:
+            name = "chr{}".format(i + 1)
+        elif i < 25:
+            name = ["chrX", "chrY", "chrM"][i - 22]
+        else:
+            name = "chrUn_JTFH0100{:04d}v1_decoy".format(i)
+        length = rnd.randint(1000, 250000000) if i < 25 else rnd.randint(1000, 200000)
+        mean = rnd.uniform(0, 60)
+        lines.append(
+            "\t{}\t{}\t{}\t{:.4f}\t{:.4f}".format(
+                name, length, int(length * mean), mean, rnd.uniform(0, 30)
+            )
+        )
+    with open(path, "w") as fh:
+        fh.write("\n".join(lines))
+        fh.write("\n")
+
+
+def parse_with_regex_cascade(path):
+    """Parse a report the way the sarek QualiMapParser used to, trying the
+    regular expressions one after the other on every line."""
+    data = {}
+    with open(path, "r") as fh:
+        for line in fh:
+            data.update(
+                QualiMapParser._parse_numeric_assignment(line)
+                or QualiMapParser._parse_assignment(line)
+                or QualiMapParser._parse_cumulative_coverage(line)
+                or QualiMapParser._parse_contig_coverage(line)
+                or dict()
+            )
+    return data
+
+
+def parse_with_genome_results(path):
+    genome_results = GenomeResults(path)
+    with open(path, "r") as fh:
+        genome_results.parse(fh)
+    return genome_results
+
+
+def time_parser(parse_fn, paths, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for path in paths:
+            parse_fn(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Time parsing real-size Qualimap genome_results.txt reports."
+    )
+    parser.add_argument(
+        "-n", "--reports", type=int, default=200, help="The number of reports parsed"
+    )
+    parser.add_argument(
+        "-c",
+        "--contigs",
+        type=int,
+        default=3366,
+        help="The number of contigs in each report",
+    )
+    parser.add_argument(
+        "-r", "--repeats", type=int, default=3, help="Report the best of this many runs"
+    )
+    parsed_args = parser.parse_args(args)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i in range(parsed_args.reports):
+            path = os.path.join(
+                tmp_dir, "P12345_{}".format(1001 + i), "genome_results.txt"
+            )
+            os.makedirs(os.path.dirname(path))
+            write_genome_results(path, parsed_args.contigs, seed=i)
+            paths.append(path)
+        print(
+            "{} reports of {} contigs ({:.1f} MB)".format(
+                len(paths),
+                parsed_args.contigs,
+                sum(os.path.getsize(x) for x in paths) / 1e6,
+            )
+        )
+        results = [
+            (
+                "regex cascade",
+                time_parser(parse_with_regex_cascade, paths, parsed_args.repeats),
+            ),
+            (
+                "section dispatch",
+                time_parser(parse_with_genome_results, paths, parsed_args.repeats),
+            ),
+        ]
+        for name, elapsed in results:
+            print(
+                "{:<18}{:8.3f} s  {:8.2f} ms/report".format(
+                    name, elapsed, 1000.0 * elapsed / len(paths)
+                )
+            )
+        print("speedup: {:.1f}x".format(results[0][1] / results[1][1]))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""Benchmark a tracking cycle over many SLURM jobs against the SLURM simulator.
+
+Submits the jobs to a ngi_pipeline.utils.slurm_simulator with its commands first on
+the PATH and times checking the state of all of them with the batched
+get_slurm_job_statuses against one get_slurm_job_status call per job, as the
+tracking used to, the latter on a subset of the jobs and scaled up, and against
+asking the stand-in for slurmrestd of the simulator over a keep-alive connection
+(see ngi_pipeline.utils.slurmrestd). Submitting a batch of jobs with sbatch is
+likewise timed against submitting them over slurmrestd. Besides the time the
+number of commands run (one fork each), the slurmrestd requests, the read and
+write syscalls of this process and the CPU time of the commands are reported; the
+stand-in server runs in this process, so its syscalls are counted too.
+
+    python benchmarks/slurm_tracking.py [--jobs 1000] [--per-job 50] [--submit 100]
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from ngi_pipeline.utils import slurm
+from ngi_pipeline.utils.slurm_simulator import SlurmRestdServer, SlurmSimulator
+from ngi_pipeline.utils.slurmrestd import SlurmRestClient
+
+
+def io_syscalls():
+    """The read and write syscalls of this process so far, (0, 0) if not known."""
+    counts = {}
+    try:
+        with open("/proc/self/io", "r") as fh:
+            for line in fh:
+                name, _, value = line.partition(":")
+                counts[name] = int(value)
+    except (IOError, OSError, ValueError):
+        pass
+    return counts.get("syscr", 0), counts.get("syscw", 0)
+
+
+def time_cycle(simulator, check, job_ids, repeats):
+    """The best of repeats runs of check(job_ids), with what the best run cost."""
+    best = None
+    for _ in range(repeats):
+        calls = simulator.calls()
+        syscr, syscw = io_syscalls()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+        check(job_ids)
+        elapsed = time.perf_counter() - start
+        children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        syscr_after, syscw_after = io_syscalls()
+        calls = simulator.calls() - calls
+        requests = calls.pop("slurmrestd", 0)
+        result = {
+            "elapsed": elapsed,
+            "forks": sum(calls.values()),
+            "requests": requests,
+            "syscr": syscr_after - syscr,
+            "syscw": syscw_after - syscw,
+            "child_cpu": (children_after.ru_utime + children_after.ru_stime)
+            - (children.ru_utime + children.ru_stime),
+        }
+        if best is None or result["elapsed"] < best["elapsed"]:
+            best = result
+    return best
+
+
+def check_per_job(job_ids):
+    for job_id in job_ids:
+        slurm.get_slurm_job_status(job_id)
+
+
+def print_results(results):
+    print(
+        "{:<20}{:>10}{:>8}{:>10}{:>10}{:>10}{:>12}".format(
+            "", "time (s)", "forks", "requests", "syscr", "syscw", "child cpu"
+        )
+    )
+    for name, result in results:
+        print(
+            "{:<20}{:10.3f}{:8.0f}{:10.0f}{:10.0f}{:10.0f}{:12.3f}".format(
+                name,
+                result["elapsed"],
+                result["forks"],
+                result["requests"],
+                result["syscr"],
+                result["syscw"],
+                result["child_cpu"],
+            )
+        )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Time a tracking cycle over many simulated SLURM jobs."
+    )
+    parser.add_argument(
+        "-n", "--jobs", type=int, default=1000, help="The number of jobs tracked"
+    )
+    parser.add_argument(
+        "-p",
+        "--per-job",
+        type=int,
+        default=50,
+        help="The number of jobs checked one at a time, scaled up to all jobs",
+    )
+    parser.add_argument(
+        "-s",
+        "--submit",
+        type=int,
+        default=100,
+        help="The number of jobs submitted in a batch",
+    )
+    parser.add_argument(
+        "-r", "--repeats", type=int, default=3, help="Report the best of this many runs"
+    )
+    parsed_args = parser.parse_args(args)
+    tmp_dir = tempfile.mkdtemp()
+    server = None
+    try:
+        script = os.path.join(tmp_dir, "job.sh")
+        with open(script, "w") as fh:
+            fh.write("#!/bin/bash\n#SBATCH -n 16\n#SBATCH -t 3-00:00:00\ntrue\n")
+        simulator = SlurmSimulator(
+            os.path.join(tmp_dir, "simulator"),
+            clock="manual",
+            queue_delay=[0, 3600],
+            runtime=[600, 14400],
+            failure_rate=0.05,
+        )
+        job_ids = []
+        for _ in range(parsed_args.jobs):
+            result = simulator.sbatch(["--parsable", script])
+            job_ids.append(result.stdout.strip())
+        # some jobs queued, most running and some finished
+        simulator.advance(1800)
+        os.environ.update(simulator.environ())
+        server = SlurmRestdServer(simulator.simulator_dir)
+        threading.Thread(target=server.serve_forever).start()
+        client = SlurmRestClient(server.url)
+        print(
+            "{} jobs, per-job checks on {} of them".format(
+                len(job_ids), min(parsed_args.per_job, len(job_ids))
+            )
+        )
+        scale = float(len(job_ids)) / min(parsed_args.per_job, len(job_ids))
+        per_job = time_cycle(
+            simulator,
+            check_per_job,
+            job_ids[: parsed_args.per_job],
+            parsed_args.repeats,
+        )
+        per_job = dict((k, v * scale) for k, v in per_job.items())
+        batched = time_cycle(
+            simulator, slurm.get_slurm_job_statuses, job_ids, parsed_args.repeats
+        )
+        restd = time_cycle(
+            simulator, client.get_job_states, job_ids, parsed_args.repeats
+        )
+        print_results(
+            (
+                ("per-job sacct", per_job),
+                ("batched sacct", batched),
+                ("slurmrestd", restd),
+            )
+        )
+        print(
+            "speedup: {:.1f}x batched, {:.1f}x slurmrestd".format(
+                per_job["elapsed"] / batched["elapsed"],
+                per_job["elapsed"] / restd["elapsed"],
+            )
+        )
+
+        print("\nsubmitting {} jobs".format(parsed_args.submit))
+        scripts = [script] * parsed_args.submit
+        submitted = [
+            (
+                "sbatch",
+                time_cycle(
+                    simulator, slurm.submit_slurm_scripts, scripts, parsed_args.repeats
+                ),
+            ),
+            (
+                "slurmrestd",
+                time_cycle(simulator, client.submit_jobs, scripts, parsed_args.repeats),
+            ),
+        ]
+        print_results(submitted)
+        print(
+            "speedup: {:.1f}x".format(
+                submitted[0][1]["elapsed"] / submitted[1][1]["elapsed"]
+            )
+        )
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmp_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
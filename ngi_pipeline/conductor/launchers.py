@@ -78,9 +78,14 @@ def launch_analysis(
                     project_name=project.name, level="ERROR", info_text=error_text
                 )
             continue
+        qc_job_array = None
         if not no_qc:
             try:
                 qc_analysis_module = load_engine_module("qc", config)
+                # the qc of the samples is submitted as one job array, if so configured
+                qc_job_array = qc_analysis_module.create_job_array(
+                    project, config=config
+                )
             except RuntimeError as e:
                 LOG.error("Could not launch qc analysis: {}".format(e))
         for sample in project:
@@ -93,7 +98,10 @@ def launch_analysis(
                         '"{}"'.format(project, sample, qc_analysis_module.__name__)
                     )
                     qc_analysis_module.analyze(
-                        project=project, sample=sample, config=config
+                        project=project,
+                        sample=sample,
+                        job_array=qc_job_array,
+                        config=config,
                     )
                 except Exception as e:
                     error_text = (
@@ -111,5 +119,7 @@ def launch_analysis(
                             level="ERROR",
                             info_text=e,
                         )
-            # Launch actual best-practice analysis
+        if qc_job_array:
+            qc_analysis_module.submit_job_array(project, qc_job_array, config=config)
+        # Launch actual best-practice analysis
         analysis.engine.analyze(analysis)
@@ -5,4 +5,5 @@ __all__ = [
     "local_process_tracking",
     "session",
     "sqlalchemy_db",
+    "tracking",
 ]
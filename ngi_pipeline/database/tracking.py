@@ -0,0 +1,937 @@
+"""The local job tracking database shared by the analysis engines.
+
+All engines record the jobs they launch in the same (currently sqlite) database:
+sample-level analyses (piper_ngi, sarek) in the sampleanalysis table and
+project-level analyses (rna_ngi) in the projectanalysis table. The metrics parsed
+from the QC output of the analyses are kept in the parsedmetrics table, so that
+Charon can be synced again without parsing the files again, and the number of
+attempts at analyzing a sample is counted in the analysisattempt table, which
+outlives the rows of the individual attempts, as does the failedbatch table of
+the work directories kept by failed batches of samples. One pooled engine
+is kept per database file for the lifetime of the process, and nested sessions
+opened by the same thread share the outermost one, so that an invocation works
+in a single session scope.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import threading
+
+from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.classes import with_ngi_config
+from ngi_pipeline.utils.slurm import get_slurm_job_metrics, slurm_job_spec
+from ngi_pipeline.utils.spool import JobCompletionSpool
+
+from sqlalchemy import create_engine, func, inspect, literal, or_, text
+from sqlalchemy import BigInteger, Column, DateTime, Float, Index, Integer, String, Text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+LOG = minimal_logger(__name__)
+
+# Declare the base class
+Base = declarative_base()
+Session = sessionmaker()
+
+# Version of the tracking database schema, stored in the sqlite user_version pragma
+SCHEMA_VERSION = 10
+
+# The states a tracked job can be in; rows in a terminal state are no longer polled
+STATE_SUBMITTED = "SUBMITTED"
+STATE_RUNNING = "RUNNING"
+STATE_DONE = "DONE"
+STATE_FAILED = "FAILED"
+TERMINAL_STATES = (STATE_DONE, STATE_FAILED)
+
+# The engines, keyed by absolute database path
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+# The sessions currently open in each thread, keyed by absolute database path
+_SESSION_SCOPE = threading.local()
+
+
+@contextlib.contextmanager
+@with_ngi_config
+def get_db_session(database_path=None, config=None, config_file_path=None):
+    """Return a session connection to the database. A session requested while the
+    same thread already has one open on the database is the open session, and it
+    is only closed when the outermost caller is done with it.
+
+    :param str database_path: The path to the database (default is the
+                              record_tracking_db_path in the database config section)
+    """
+    if not database_path:
+        database_path = config["database"]["record_tracking_db_path"]
+    database_abspath = os.path.abspath(database_path)
+    open_sessions = _SESSION_SCOPE.__dict__.setdefault("sessions", {})
+    if database_abspath in open_sessions:
+        yield open_sessions[database_abspath]
+        return
+    session = Session(bind=get_engine(database_abspath))
+    open_sessions[database_abspath] = session
+    try:
+        yield session
+    finally:
+        del open_sessions[database_abspath]
+        session.close()
+
+
+def get_engine(database_path):
+    """Return the engine for a database, creating the database or bringing its
+    schema up to date the first time it is connected to in this process.
+
+    :param str database_path: The path to the database
+
+    :returns: The sqlalchemy engine
+    :raises RuntimeError: If the database could not be created
+    """
+    database_abspath = os.path.abspath(database_path)
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(database_abspath)
+        if engine is not None and os.path.exists(database_abspath):
+            return engine
+        if engine is not None:
+            # The database was removed from under us
+            engine.dispose()
+        if not os.path.exists(database_abspath):
+            LOG.info('Creating local job tracking database "{}"'.format(database_path))
+            try:
+                engine = create_database_populate_schema(database_abspath)
+            except OperationalError as e:
+                raise RuntimeError(
+                    "Could not create database at {}: {}".format(database_abspath, e)
+                )
+        else:
+            LOG.debug(
+                'Local job tracking database at "{}" already exists; '
+                "connecting.".format(database_abspath)
+            )
+            engine = _init_engine(database_abspath)
+            upgrade_database_schema(engine)
+        _ENGINES[database_abspath] = engine
+        return engine
+
+
+def _init_engine(database_path):
+    """Create the engine connection."""
+    database_abspath = os.path.abspath(database_path)
+    return create_engine(
+        "sqlite:///{}".format(database_abspath),
+        poolclass=QueuePool,
+        connect_args={"check_same_thread": False},
+    )
+
+
+def create_database_populate_schema(location):
+    """Create the database and populate it with the schema."""
+    engine = _init_engine(location)
+    # Create the folder if necessary
+    if not os.path.exists(os.path.dirname(location)):
+        try:
+            os.makedirs(os.path.dirname(location))
+        except OSError:
+            LOG.info(
+                'Failed to create database directory at "{}", continuing without local database'.format(
+                    os.path.dirname(location)
+                )
+            )
+            pass
+    # Create the tables & sqlite file
+    Base.metadata.create_all(engine)
+    _set_schema_version(engine, SCHEMA_VERSION)
+    return engine
+
+
+def _get_schema_version(engine):
+    with engine.connect() as connection:
+        return connection.execute(text("PRAGMA user_version")).scalar()
+
+
+def _set_schema_version(engine, version):
+    with engine.begin() as connection:
+        connection.execute(text("PRAGMA user_version = {:d}".format(version)))
+
+
+# Columns added to the sampleanalysis table since version 1, as (name, sqlite column type)
+_ADDED_COLUMNS = (
+    # schema version 2
+    ("state", "VARCHAR(20)"),
+    ("submitted_at", "DATETIME"),
+    ("last_polled_at", "DATETIME"),
+    ("finished_at", "DATETIME"),
+    ("exit_code", "INTEGER"),
+    # schema version 4
+    ("input_bytes", "BIGINT"),
+    # schema version 5
+    ("slurm_array_task_id", "INTEGER"),
+    # schema version 7
+    ("attempt", "INTEGER"),
+    # schema version 8
+    ("batch_id", "VARCHAR(50)"),
+    # schema version 9
+    ("local_job_id", "INTEGER"),
+)
+
+
+def upgrade_database_schema(engine):
+    """Bring an existing tracking database up to the current schema version.
+
+    Version 1 databases only have the job identifiers; the state, timestamp and
+    exit code columns are added and the existing rows are marked as submitted so
+    that they are polled as before. Version 3 databases also have the tables of
+    all the engines (before, the rna_ngi table was never created by the pipeline).
+    Version 4 adds the size of the input data and the harvested job metrics.
+    Version 5 adds the task id of analyses submitted as part of a job array.
+    Version 6 adds the table of parsed metrics.
+    Version 7 adds the attempt number of the analyses and the table counting them.
+    Version 8 adds the batch of samples analyzed together in one run.
+    Version 9 adds the job id of analyses queued with the local scheduler.
+    Version 10 adds the table of the work directories kept by failed batches.
+
+    :param engine: The sqlalchemy engine connected to the database
+    """
+    if _get_schema_version(engine) >= SCHEMA_VERSION:
+        return
+    inspector = inspect(engine)
+    if SampleAnalysis.__tablename__ not in inspector.get_table_names():
+        # No sample analyses yet (e.g. only the rna_ngi table); just add the tables
+        Base.metadata.create_all(engine)
+        _set_schema_version(engine, SCHEMA_VERSION)
+        return
+    # Adds the tables that are missing, leaves the existing ones alone
+    Base.metadata.create_all(engine)
+    existing_columns = set(
+        column["name"] for column in inspector.get_columns(SampleAnalysis.__tablename__)
+    )
+    LOG.info(
+        "Upgrading local job tracking database to schema version {}".format(
+            SCHEMA_VERSION
+        )
+    )
+    with engine.begin() as connection:
+        for column_name, column_type in _ADDED_COLUMNS:
+            if column_name not in existing_columns:
+                connection.execute(
+                    text(
+                        "ALTER TABLE {} ADD COLUMN {} {}".format(
+                            SampleAnalysis.__tablename__, column_name, column_type
+                        )
+                    )
+                )
+        connection.execute(
+            text(
+                "UPDATE {} SET state = :state WHERE state IS NULL".format(
+                    SampleAnalysis.__tablename__
+                )
+            ),
+            {"state": STATE_SUBMITTED},
+        )
+    # create_all skips tables that already exist, indexes included
+    existing_indexes = set(
+        index["name"] for index in inspector.get_indexes(SampleAnalysis.__tablename__)
+    )
+    for index in SampleAnalysis.__table__.indexes:
+        if index.name not in existing_indexes:
+            index.create(engine)
+    _set_schema_version(engine, SCHEMA_VERSION)
+
+
+class SampleAnalysis(Base):
+    __tablename__ = "sampleanalysis"
+
+    project_id = Column(String(50), primary_key=True)
+    project_name = Column(String(50))
+    project_base_path = Column(String(100))
+    sample_id = Column(String(50), primary_key=True)
+    workflow = Column(String(50), primary_key=True)
+    engine = Column(String(50))
+    analysis_dir = Column(String(100))
+    # Only one of these is ever used
+    process_id = Column(Integer)
+    slurm_job_id = Column(Integer)
+    # Job state bookkeeping (schema version 2)
+    state = Column(String(20), default=STATE_SUBMITTED)
+    submitted_at = Column(DateTime, default=datetime.datetime.now)
+    last_polled_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    exit_code = Column(Integer)
+    # Total size of the input fastq files (schema version 4)
+    input_bytes = Column(BigInteger)
+    # The task of the job array slurm_job_id, if submitted as one (schema version 5)
+    slurm_array_task_id = Column(Integer)
+    # The attempt at analyzing the sample this job is, counting from 1 (schema version 7)
+    attempt = Column(Integer)
+    # The batch of samples analyzed in the same run as this one, if any (schema version 8)
+    batch_id = Column(String(50))
+    # The job id of analyses queued with the local scheduler, instead of process_id
+    # or slurm_job_id (schema version 9)
+    local_job_id = Column(Integer)
+
+    __table_args__ = (Index("ix_sampleanalysis_engine_state", "engine", "state"),)
+
+    @classmethod
+    def tracked(
+        cls, session, engine=None, live_only=False, project_id=None, terminal_only=False
+    ):
+        """Query the tracked analyses, optionally restricted to an engine.
+
+        :param session: The database session to query
+        :param str engine: Only return analyses run by this engine (e.g. "piper_ngi")
+        :param bool live_only: Only return analyses not yet in a terminal state
+        :param str project_id: Only return analyses of this project
+        :param bool terminal_only: Only return analyses in a terminal state, i.e.
+                                   those whose outcome has not yet been reported
+
+        :returns: The query object
+        """
+        query = session.query(cls)
+        if engine:
+            query = query.filter(cls.engine == engine)
+        if project_id:
+            query = query.filter(cls.project_id == project_id)
+        if live_only:
+            query = query.filter(
+                or_(cls.state.is_(None), cls.state.notin_(TERMINAL_STATES))
+            )
+        if terminal_only:
+            query = query.filter(cls.state.in_(TERMINAL_STATES))
+        return query
+
+    @property
+    def slurm_job_spec(self):
+        """The id SLURM knows the job by, i.e. the job id or, for a task of a job
+        array, "<job id>_<task id>" (None for local processes)."""
+        if not self.slurm_job_id:
+            return None
+        return slurm_job_spec(self.slurm_job_id, self.slurm_array_task_id)
+
+    def is_terminal(self):
+        """True if a final state for this job has already been recorded."""
+        return self.state in TERMINAL_STATES
+
+    def record_poll(self, state, exit_code=None, finished_at=None):
+        """Record the outcome of polling the job. A terminal state also sets the
+        exit code and the time the job finished (default is when it was found to
+        be finished).
+        """
+        now = datetime.datetime.now()
+        self.last_polled_at = now
+        self.state = state
+        if state in TERMINAL_STATES:
+            self.exit_code = exit_code
+            self.finished_at = self.finished_at or finished_at or now
+
+    @classmethod
+    def record_job_completions(cls, session, engine, records):
+        """Record the outcome reported by finished jobs through the job completion
+        spool (see ngi_pipeline.utils.spool) on the matching tracked analyses.
+
+        :param session: The database session to use
+        :param str engine: The engine the records were spooled for
+        :param list records: The (record name, record dict) tuples read from the spool
+
+        :returns: The number of analyses updated
+        :rtype: int
+        """
+        if not records:
+            return 0
+        analyses = dict(
+            ((x.project_id, x.sample_id, x.workflow), x)
+            for x in cls.tracked(session, engine=engine, live_only=True).all()
+        )
+        n_updated = 0
+        for _, record in records:
+            analysis = analyses.get(
+                (
+                    record.get("project_id"),
+                    record.get("sample_id"),
+                    record.get("workflow"),
+                )
+            )
+            exit_code = record.get("exit_code")
+            if analysis is None or type(exit_code) is not int:
+                continue
+            job_id = (
+                analysis.slurm_job_spec or analysis.local_job_id or analysis.process_id
+            )
+            if job_id and str(job_id) != str(record.get("job_id")):
+                # Left behind by an earlier run of the same analysis
+                continue
+            analysis.record_poll(
+                STATE_DONE if exit_code == 0 else STATE_FAILED,
+                exit_code=exit_code,
+                finished_at=JobCompletionSpool.record_timestamp(record, "finished_at"),
+            )
+            n_updated += 1
+        return n_updated
+
+    def __repr__(self):
+        return (
+            "<SampleRunAnalysis({project_id}/{sample_id}: job id "
+            "{job_id}, engine {engine}, "
+            "workflow {workflow}, state {state})>".format(
+                project_id=self.project_id,
+                sample_id=self.sample_id,
+                job_id=(self.slurm_job_spec or self.local_job_id or self.process_id),
+                engine=self.engine,
+                workflow=self.workflow,
+                state=self.state,
+            )
+        )
+
+
+class ProjectAnalysis(Base):
+    __tablename__ = "projectanalysis"
+
+    project_id = Column(String(50), primary_key=True)
+    project_name = Column(String(50))
+    project_base_path = Column(String(100))
+    workflow = Column(String(50))
+    engine = Column(String(50))
+    analysis_dir = Column(String(100))
+    job_id = Column(Integer, primary_key=True)
+    run_mode = Column(String(50))
+
+    def __repr__(self):
+        return (
+            "<ProjectAnalysis({project_id}/: job id "
+            "{job_id}, engine {engine}, "
+            "workflow {workflow})>".format(
+                project_id=self.project_id,
+                job_id=(self.job_id),
+                engine=self.engine,
+                workflow=self.workflow,
+            )
+        )
+
+
+class AnalysisAttempt(Base):
+    """The number of attempts at analyzing a sample with a workflow since the
+    analysis last finished successfully (schema version 7)"""
+
+    __tablename__ = "analysisattempt"
+
+    project_id = Column(String(50), primary_key=True)
+    sample_id = Column(String(50), primary_key=True)
+    workflow = Column(String(50), primary_key=True)
+    engine = Column(String(50))
+    attempts = Column(Integer, default=0)
+    last_attempt_at = Column(DateTime)
+
+    @classmethod
+    def next_attempt(cls, session, engine, project_id, sample_id, workflow):
+        """Count a new attempt at analyzing a sample.
+
+        :param session: The database session to use
+        :param str engine: The engine running the workflow (e.g. "sarek")
+        :param str project_id: The project of the sample
+        :param str sample_id: The sample
+        :param str workflow: The workflow
+
+        :returns: The number of the new attempt, counting from 1
+        :rtype: int
+        """
+        attempt = session.query(cls).get((project_id, sample_id, workflow))
+        if attempt is None:
+            attempt = cls(
+                project_id=project_id,
+                sample_id=sample_id,
+                workflow=workflow,
+                attempts=0,
+            )
+            session.add(attempt)
+        attempt.engine = engine
+        attempt.attempts = (attempt.attempts or 0) + 1
+        attempt.last_attempt_at = datetime.datetime.now()
+        return attempt.attempts
+
+    @classmethod
+    def reset(cls, session, project_id, sample_id, workflow):
+        """Stop counting the attempts at analyzing a sample, e.g. once it has
+        finished successfully.
+
+        :param session: The database session to use
+        :param str project_id: The project of the sample
+        :param str sample_id: The sample
+        :param str workflow: The workflow
+        """
+        attempt = session.query(cls).get((project_id, sample_id, workflow))
+        if attempt is not None:
+            session.delete(attempt)
+
+    def __repr__(self):
+        return (
+            "<AnalysisAttempt({project_id}/{sample_id}: workflow {workflow}, "
+            "{attempts} attempts)>".format(
+                project_id=self.project_id,
+                sample_id=self.sample_id,
+                workflow=self.workflow,
+                attempts=self.attempts,
+            )
+        )
+
+
+class FailedBatch(Base):
+    """A sample of a batch of samples whose run failed, and the work directory
+    the run left behind for resuming it (schema version 10). The run can only be
+    resumed if the same samples are batched together again, so the work directory
+    is no longer needed once any of the samples has finished successfully since,
+    in whatever batch."""
+
+    __tablename__ = "failedbatch"
+
+    project_id = Column(String(50), primary_key=True)
+    workflow = Column(String(50), primary_key=True)
+    batch_id = Column(String(50), primary_key=True)
+    sample_id = Column(String(50), primary_key=True)
+    engine = Column(String(50))
+    work_dir = Column(String(200))
+    failed_at = Column(DateTime)
+
+    @classmethod
+    def record(
+        cls, session, engine, project_id, sample_id, workflow, batch_id, work_dir
+    ):
+        """Record that the run of a batch failed for one of its samples.
+
+        :param session: The database session to use
+        :param str engine: The engine running the workflow (e.g. "sarek")
+        :param str project_id: The project of the sample
+        :param str sample_id: The sample
+        :param str workflow: The workflow
+        :param str batch_id: The batch the sample was analyzed in
+        :param str work_dir: The work directory of the batch
+        """
+        failed_batch = session.query(cls).get(
+            (project_id, workflow, batch_id, sample_id)
+        )
+        if failed_batch is None:
+            failed_batch = cls(
+                project_id=project_id,
+                workflow=workflow,
+                batch_id=batch_id,
+                sample_id=sample_id,
+            )
+            session.add(failed_batch)
+        failed_batch.engine = engine
+        failed_batch.work_dir = work_dir
+        failed_batch.failed_at = datetime.datetime.now()
+
+    @classmethod
+    def stale(cls, session, engine, succeeded=(), max_age_days=None):
+        """Find the failed batches whose work directory is no longer needed, i.e.
+        those with a sample that has finished successfully since and, if
+        max_age_days is given, those that failed longer ago than that. A batch that
+        is being analyzed again is left alone.
+
+        :param session: The database session to use
+        :param str engine: Only consider the batches of this engine
+        :param list succeeded: The (project_id, sample_id, workflow) tuples of the
+                               analyses that have finished successfully
+        :param int max_age_days: The number of days to keep a work directory around
+                                 (default is to keep it until it is no longer needed)
+
+        :returns: A dict with the (project_id, workflow, batch_id) of the stale
+                  batches as keys and their work directory as values
+        :rtype: dict
+        """
+        succeeded = set(succeeded)
+        cutoff = (
+            datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+            if max_age_days is not None
+            else None
+        )
+        failed_batches = session.query(cls).filter(cls.engine == engine).all()
+        running_batches = set(
+            session.query(
+                SampleAnalysis.project_id,
+                SampleAnalysis.workflow,
+                SampleAnalysis.batch_id,
+            )
+            .filter(SampleAnalysis.batch_id.isnot(None))
+            .distinct()
+            .all()
+        )
+        stale_batches = {}
+        for failed_batch in failed_batches:
+            batch_key = (
+                failed_batch.project_id,
+                failed_batch.workflow,
+                failed_batch.batch_id,
+            )
+            if batch_key in running_batches:
+                continue
+            if (
+                failed_batch.project_id,
+                failed_batch.sample_id,
+                failed_batch.workflow,
+            ) in succeeded or (
+                cutoff is not None
+                and failed_batch.failed_at is not None
+                and failed_batch.failed_at < cutoff
+            ):
+                stale_batches[batch_key] = failed_batch.work_dir
+        return stale_batches
+
+    @classmethod
+    def remove(cls, session, project_id, workflow, batch_id):
+        """Stop keeping track of a failed batch, e.g. once its work directory has
+        been removed.
+
+        :param session: The database session to use
+        :param str project_id: The project of the batch
+        :param str workflow: The workflow
+        :param str batch_id: The batch
+        """
+        session.query(cls).filter_by(
+            project_id=project_id, workflow=workflow, batch_id=batch_id
+        ).delete()
+
+    def __repr__(self):
+        return (
+            "<FailedBatch({project_id}/{batch_id}: workflow {workflow}, "
+            "sample {sample_id})>".format(
+                project_id=self.project_id,
+                batch_id=self.batch_id,
+                workflow=self.workflow,
+                sample_id=self.sample_id,
+            )
+        )
+
+
+class JobMetrics(Base):
+    """The resource usage of a finished SLURM job, as reported by sacct (schema version 4)"""
+
+    __tablename__ = "jobmetrics"
+
+    engine = Column(String(50), primary_key=True)
+    # the unique id of the job, also for tasks of a job array
+    slurm_job_id = Column(Integer, primary_key=True)
+    workflow = Column(String(50))
+    project_id = Column(String(50))
+    sample_id = Column(String(50))
+    input_bytes = Column(BigInteger)
+    state = Column(String(20))
+    # seconds
+    elapsed = Column(Float)
+    total_cpu = Column(Float)
+    timelimit = Column(Float)
+    # bytes
+    max_rss = Column(BigInteger)
+    alloc_cpus = Column(Integer)
+    harvested_at = Column(DateTime, default=datetime.datetime.now)
+
+    __table_args__ = (Index("ix_jobmetrics_engine_workflow", "engine", "workflow"),)
+
+    @classmethod
+    def history(cls, session, engine, workflow, limit=None):
+        """Query the metrics of the jobs of a workflow that completed successfully,
+        most recent first.
+
+        :param session: The database session to query
+        :param str engine: The engine running the workflow (e.g. "piper_ngi")
+        :param str workflow: The workflow
+        :param int limit: The maximum number of jobs to return
+
+        :returns: The query object
+        """
+        query = (
+            session.query(cls)
+            .filter(cls.engine == engine, cls.workflow == workflow)
+            .filter(cls.state == "COMPLETED", cls.elapsed > 0)
+            .order_by(cls.harvested_at.desc())
+        )
+        if limit:
+            query = query.limit(limit)
+        return query
+
+    def __repr__(self):
+        return (
+            "<JobMetrics({engine}/{workflow} {project_id}/{sample_id}: job id "
+            "{slurm_job_id}, {state}, elapsed {elapsed}s, cpu {total_cpu}s on "
+            "{alloc_cpus} cores, max rss {max_rss})>".format(
+                engine=self.engine,
+                workflow=self.workflow,
+                project_id=self.project_id,
+                sample_id=self.sample_id,
+                slurm_job_id=self.slurm_job_id,
+                state=self.state,
+                elapsed=self.elapsed,
+                total_cpu=self.total_cpu,
+                alloc_cpus=self.alloc_cpus,
+                max_rss=self.max_rss,
+            )
+        )
+
+
+class ParsedMetrics(Base):
+    """The metrics parsed from a QC output file of a sample or seqrun, along with
+    the size and modification time the file had when it was parsed (schema version 6)"""
+
+    __tablename__ = "parsedmetrics"
+
+    project_id = Column(String(50), primary_key=True)
+    sample_id = Column(String(50), primary_key=True)
+    # empty for metrics of the whole sample
+    seqrun_id = Column(String(100), primary_key=True, default="")
+    # what was parsed from the file, e.g. "qualimap_coverage"
+    source = Column(String(50), primary_key=True)
+    source_path = Column(String(255), primary_key=True)
+    source_size = Column(BigInteger)
+    # nanoseconds
+    source_mtime = Column(BigInteger)
+    # JSON
+    metrics = Column(Text)
+    parsed_at = Column(DateTime, default=datetime.datetime.now)
+
+    @classmethod
+    def for_project(cls, session, project_id):
+        """Query the metrics stored for a project.
+
+        :param session: The database session to query
+        :param str project_id: The project id
+
+        :returns: The query object
+        """
+        return session.query(cls).filter(cls.project_id == project_id)
+
+    def __repr__(self):
+        return (
+            "<ParsedMetrics({project_id}/{sample_id}/{seqrun_id}: {source} "
+            "from {source_path})>".format(
+                project_id=self.project_id,
+                sample_id=self.sample_id,
+                seqrun_id=self.seqrun_id,
+                source=self.source,
+                source_path=self.source_path,
+            )
+        )
+
+
+class ParsedMetricsStore(object):
+    """Parses QC output files through the parsedmetrics table, so that a file is
+    only parsed again if it has changed since. The stored metrics of a project are
+    read with a single query the first time one of its files is looked up. Newly
+    parsed metrics are held back until flush is called, so that the store can be
+    used from worker threads while the thread owning the tracking database session
+    writes them.
+    """
+
+    def __init__(self, database_path=None, config=None):
+        """
+        :param str database_path: The path to the tracking database (default is the
+                                  record_tracking_db_path in the database config section)
+        :param dict config: The parsed NGI configuration
+        """
+        self.database_path = database_path
+        self.config = config
+        # project id -> {(sample id, seqrun id, source, source path): (size, mtime, metrics JSON)}
+        self._projects = {}
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def _stored_metrics(self, project_id):
+        with self._lock:
+            stored = self._projects.get(project_id)
+            if stored is not None:
+                return stored
+            stored = {}
+            try:
+                with get_db_session(
+                    database_path=self.database_path, config=self.config
+                ) as session:
+                    for row in ParsedMetrics.for_project(session, project_id):
+                        stored[
+                            (row.sample_id, row.seqrun_id, row.source, row.source_path)
+                        ] = (row.source_size, row.source_mtime, row.metrics)
+            except (OperationalError, RuntimeError, KeyError) as e:
+                LOG.warning(
+                    "Could not read the parsed metrics of project {}: {}".format(
+                        project_id, e
+                    )
+                )
+            self._projects[project_id] = stored
+            return stored
+
+    def get(self, source, source_path, parse_fn, project_id, sample_id, seqrun_id=None):
+        """Return the metrics parsed from a file, parsing it only if it is not in
+        the store or has changed since it was stored.
+
+        :param str source: What is parsed from the file, e.g. "qualimap_coverage"
+        :param str source_path: The path to the file
+        :param parse_fn: The function parsing the file, called with source_path; it
+                         should return a value that can be stored as JSON
+        :param str project_id: The project id
+        :param str sample_id: The sample id
+        :param str seqrun_id: The seqrun id, for metrics of a seqrun
+
+        :returns: What parse_fn returns
+        :raises: Whatever parse_fn raises
+        """
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            # let the parser report the problem
+            return parse_fn(source_path)
+        key = (sample_id, seqrun_id or "", source, os.path.abspath(source_path))
+        stored = self._stored_metrics(project_id)
+        with self._lock:
+            size, mtime, metrics = stored.get(key, (None, None, None))
+        if size == stat.st_size and mtime == stat.st_mtime_ns:
+            try:
+                return json.loads(metrics)
+            except (TypeError, ValueError):
+                pass
+        value = parse_fn(source_path)
+        metrics = json.dumps(value)
+        with self._lock:
+            stored[key] = (stat.st_size, stat.st_mtime_ns, metrics)
+            self._pending.append(
+                ParsedMetrics(
+                    project_id=project_id,
+                    sample_id=key[0],
+                    seqrun_id=key[1],
+                    source=source,
+                    source_path=key[3],
+                    source_size=stat.st_size,
+                    source_mtime=stat.st_mtime_ns,
+                    metrics=metrics,
+                )
+            )
+        return value
+
+    def flush(self, session=None):
+        """Write the newly parsed metrics to the tracking database.
+
+        :param session: The database session to add them to, which the caller then
+                        commits; if not given, they are committed in a session of
+                        their own. Failing to write them there is only logged.
+
+        :returns: The number of metrics written
+        :rtype: int
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+        if not pending:
+            return 0
+        if session is not None:
+            for parsed_metrics in pending:
+                session.merge(parsed_metrics)
+            return len(pending)
+        try:
+            with get_db_session(
+                database_path=self.database_path, config=self.config
+            ) as session:
+                for parsed_metrics in pending:
+                    session.merge(parsed_metrics)
+                session.commit()
+        except (OperationalError, RuntimeError, KeyError) as e:
+            LOG.warning("Could not store the parsed metrics: {}".format(e))
+            return 0
+        return len(pending)
+
+
+def harvest_job_metrics(session, analyses):
+    """Store the resource usage of the SLURM jobs of finished analyses, queried from
+    sacct in batch, along with the engine, workflow, sample and input size of the
+    analysis. The analyses of a batch of samples share their job, which is stored
+    once under the batch id, with the input size of all the samples in it.
+    Analyses run as local processes are skipped. Failing to get the metrics is
+    only logged, as they are not needed to track the analyses.
+
+    :param session: The database session to use
+    :param list analyses: The finished SampleAnalysis objects
+
+    :returns: The number of jobs the metrics were stored for
+    :rtype: int
+    """
+    analyses = [x for x in analyses if x.slurm_job_id]
+    if not analyses:
+        return 0
+    analyses_by_job = {}
+    for analysis in analyses:
+        analyses_by_job.setdefault(analysis.slurm_job_spec, []).append(analysis)
+    try:
+        job_metrics = get_slurm_job_metrics(list(analyses_by_job))
+    except (RuntimeError, ValueError) as e:
+        LOG.warning("Could not harvest slurm job metrics: {}".format(e))
+        return 0
+    n_harvested = 0
+    for job_spec, job_analyses in analyses_by_job.items():
+        metrics = job_metrics.get(job_spec)
+        if not metrics:
+            continue
+        analysis = job_analyses[0]
+        input_bytes = [x.input_bytes for x in job_analyses]
+        session.merge(
+            JobMetrics(
+                engine=analysis.engine,
+                workflow=analysis.workflow,
+                project_id=analysis.project_id,
+                sample_id=analysis.batch_id or analysis.sample_id,
+                input_bytes=None if None in input_bytes else sum(input_bytes),
+                **metrics
+            )
+        )
+        n_harvested += 1
+    LOG.debug("Harvested metrics of {} slurm jobs".format(n_harvested))
+    return n_harvested
+
+
+def delete_analyses(session, model, **criteria):
+    """Delete all the tracked analyses matching the criteria in one statement,
+    rather than loading and deleting them one by one.
+
+    :param session: The database session to use
+    :param model: The tracking table to delete from (SampleAnalysis or ProjectAnalysis)
+    :param criteria: The column values to match, e.g. project_id="P123"
+
+    :returns: The number of analyses deleted
+    :rtype: int
+    """
+    return session.query(model).filter_by(**criteria).delete()
+
+
+def running_analyses_for_project(session, project_id):
+    """List the analyses of all the engines that are running for a project. Both
+    tables have the project id leading their primary key, so this is a single
+    indexed query.
+
+    :param session: The database session to query
+    :param str project_id: The project id
+
+    :returns: Rows with the engine, workflow, project_id, sample_id (None for
+              project-level analyses), job_id, state and analysis_dir
+    :rtype: list
+    """
+    sample_analyses = SampleAnalysis.tracked(
+        session, live_only=True, project_id=project_id
+    ).with_entities(
+        SampleAnalysis.engine,
+        SampleAnalysis.workflow,
+        SampleAnalysis.project_id,
+        SampleAnalysis.sample_id,
+        func.coalesce(
+            SampleAnalysis.slurm_job_id,
+            SampleAnalysis.local_job_id,
+            SampleAnalysis.process_id,
+        ).label("job_id"),
+        SampleAnalysis.state,
+        SampleAnalysis.analysis_dir,
+    )
+    # Project analyses are only tracked until they have finished
+    project_analyses = session.query(
+        ProjectAnalysis.engine,
+        ProjectAnalysis.workflow,
+        ProjectAnalysis.project_id,
+        literal(None, String).label("sample_id"),
+        ProjectAnalysis.job_id,
+        literal(STATE_RUNNING, String).label("state"),
+        ProjectAnalysis.analysis_dir,
+    ).filter(ProjectAnalysis.project_id == project_id)
+    return sample_analyses.union_all(project_analyses).all()
@@ -0,0 +1,156 @@
+"""An index of the files in the stage directories of a piper analysis directory.
+
+Piper writes its output to stage directories (01_raw_alignments,
+05_processed_alignments, 07_variant_calls, ...) under ANALYSIS/<project>/piper_ngi.
+Rather than globbing these directories again for every sample and every file
+pattern, they are listed once with a single scandir pass each and the entries
+are indexed by the sample name they start with, so looking up the files of a
+sample is a dictionary lookup. The index of a directory is reused for as long as
+none of the directories has changed (as told by their modification times) and
+is dropped explicitly whenever files are moved or deleted.
+"""
+
+import bisect
+import fnmatch
+import os
+import threading
+
+from ngi_pipeline.log.loggers import minimal_logger
+
+LOG = minimal_logger(__name__)
+
+# The stage directories are named like "05_processed_alignments"
+STAGE_DIR_PATTERN = "??_*"
+
+_INDEX_CACHE = {}
+_INDEX_CACHE_LOCK = threading.Lock()
+
+
+def _sample_key(name):
+    """The index key of a file name or sample name. Piper sometimes renames
+    P123_456 to P123-456, and done/failed markers are hidden files, so these
+    differences are normalized away; the key of a file starts with the key of
+    the sample it belongs to."""
+    return name.lstrip(".").replace("-", "_")
+
+
+def _stat_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class AnalysisDirIndex(object):
+    """The entries of the stage directories of one analysis directory."""
+
+    def __init__(self, analysis_dir):
+        """
+        :param str analysis_dir: The piper analysis directory of a project
+        """
+        self.analysis_dir = analysis_dir
+        # stage dir name -> sorted list of entry names
+        self.stages = {}
+        # sorted list of (sample key, stage dir name, entry name)
+        self._keys = []
+        self._mtimes = {}
+        self.scan()
+
+    def __repr__(self):
+        return "AnalysisDirIndex({})".format(self.analysis_dir)
+
+    def scan(self):
+        """List the stage directories, replacing what was indexed before.
+        Directories that cannot be read are left out."""
+        stages = {}
+        mtimes = {self.analysis_dir: _stat_mtime(self.analysis_dir)}
+        try:
+            stage_dirs = [
+                x.name
+                for x in os.scandir(self.analysis_dir)
+                if fnmatch.fnmatch(x.name, STAGE_DIR_PATTERN) and x.is_dir()
+            ]
+        except OSError:
+            stage_dirs = []
+        for stage in stage_dirs:
+            stage_path = os.path.join(self.analysis_dir, stage)
+            mtimes[stage_path] = _stat_mtime(stage_path)
+            try:
+                stages[stage] = sorted(x.name for x in os.scandir(stage_path))
+            except OSError as e:
+                LOG.debug('Could not list directory "{}": {}'.format(stage_path, e))
+        self.stages = stages
+        self._keys = sorted(
+            (_sample_key(name), stage, name)
+            for stage, names in stages.items()
+            for name in names
+        )
+        self._mtimes = mtimes
+
+    def is_current(self):
+        """Whether none of the indexed directories has changed since they were listed.
+
+        :rtype: bool
+        """
+        # adding or removing a stage directory changes the analysis dir itself
+        return all(_stat_mtime(path) == mtime for path, mtime in self._mtimes.items())
+
+    def files(self, name_pattern, sample_name=None, stage_pattern=STAGE_DIR_PATTERN):
+        """Return the paths of the indexed files matching the patterns, as glob would
+        for os.path.join(analysis_dir, stage_pattern, name_pattern) (only patterns
+        starting with "." match hidden files).
+
+        :param str name_pattern: The shell pattern of the file names
+        :param str sample_name: The sample the file names start with; only the
+                                files of this sample are looked at (optional)
+        :param str stage_pattern: The shell pattern of the stage directories
+
+        :returns: The matching paths, sorted
+        :rtype: list
+        """
+        if sample_name is None:
+            candidates = (
+                (stage, name) for stage, names in self.stages.items() for name in names
+            )
+        else:
+            prefix = _sample_key(sample_name)
+            start = bisect.bisect_left(self._keys, (prefix,))
+            candidates = []
+            for key, stage, name in self._keys[start:]:
+                if not key.startswith(prefix):
+                    break
+                candidates.append((stage, name))
+        hidden = name_pattern.startswith(".")
+        return sorted(
+            os.path.join(self.analysis_dir, stage, name)
+            for stage, name in candidates
+            if name.startswith(".") == hidden
+            and fnmatch.fnmatch(stage, stage_pattern)
+            and fnmatch.fnmatch(name, name_pattern)
+        )
+
+
+def get_analysis_dir_index(analysis_dir):
+    """Return the index of an analysis directory, listing it again only if it has
+    changed since it was last indexed.
+
+    :param str analysis_dir: The piper analysis directory of a project
+
+    :rtype: AnalysisDirIndex
+    """
+    analysis_dir = os.path.abspath(analysis_dir)
+    with _INDEX_CACHE_LOCK:
+        index = _INDEX_CACHE.get(analysis_dir)
+        if index is None or not index.is_current():
+            index = AnalysisDirIndex(analysis_dir)
+            _INDEX_CACHE[analysis_dir] = index
+        return index
+
+
+def invalidate_analysis_dir_index(analysis_dir):
+    """Drop the index of an analysis directory, e.g. after moving or deleting files in it.
+
+    :param str analysis_dir: The piper analysis directory of a project
+    """
+    with _INDEX_CACHE_LOCK:
+        _INDEX_CACHE.pop(os.path.abspath(analysis_dir), None)
@@ -4,11 +4,8 @@ from __future__ import print_function
 
 import glob
 import os
-import re
 import shlex
 import shutil
-import subprocess
-import time
 import datetime
 
 
@@ -33,10 +30,12 @@ from ngi_pipeline.engines.piper_ngi.local_process_tracking import (
 from ngi_pipeline.engines.piper_ngi.utils import (
     check_for_preexisting_sample_runs,
     create_exit_code_file_path,
+    create_fastq_staging_commands,
     create_log_file_path,
     create_sbatch_header,
     find_previous_genotype_analyses,
     find_previous_sample_analyses,
+    get_sample_input_bytes,
     get_valid_seqruns_for_sample,
     launch_piper_job,
     record_analysis_details,
@@ -48,14 +47,23 @@ from ngi_pipeline.engines.piper_ngi.utils import (
 from ngi_pipeline.log.loggers import log_process_non_blocking, minimal_logger
 from ngi_pipeline.utils.filesystem import (
     load_modules,
-    execute_command_line,
     rotate_file,
     safe_makedir,
     match_files_under_dir,
 )
+from ngi_pipeline.utils.checksums import checksum_command
 from ngi_pipeline.utils.classes import with_ngi_config
 from ngi_pipeline.utils.filesystem import fastq_files_under_dir, is_index_file
-from ngi_pipeline.utils.slurm import get_slurm_job_status
+from ngi_pipeline.utils.local_scheduler import get_local_scheduler
+from ngi_pipeline.utils.resources import predict_job_resources
+from ngi_pipeline.utils.slurm import (
+    SlurmJobArray,
+    seconds_to_slurm_time,
+    submit_slurm_script,
+    wait_for_slurm_jobs,
+)
+from ngi_pipeline.utils.spool import get_job_completion_spool
+from ngi_pipeline.utils.trash import start_trash_reaper
 
 LOG = minimal_logger(__name__)
 
@@ -64,217 +72,337 @@ LOG = minimal_logger(__name__)
 def analyze(analysis_object, level="sample", config=None, config_file_path=None):
     """Analyze data at the sample level.
 
+    If the slurm "job_arrays" config option is set, the sbatch jobs of all the
+    samples are submitted together as a single job array once they have all been
+    set up, with at most "array_throttle" of them running at the same time.
+
+    If the piper "reap_trash" config option is set, the results of previous
+    analyses moved to the trash are deleted in the background once all the jobs
+    have been submitted.
+
     :param NGIAnalysis analysis_object: holds all the parameters for the analysis
 
     :raises ValueError: If exec_mode is an unsupported value
     """
     charon_session = CharonSession()
-    for sample in analysis_object.project:
-        try:
-            charon_reported_status = charon_session.sample_get(
-                analysis_object.project.project_id, sample
-            ).get("analysis_status")
-            # Check Charon to ensure this hasn't already been processed
-            do_analyze = handle_sample_status(
-                analysis_object, sample, charon_reported_status
-            )
-            if not do_analyze:
+    job_array = None
+    array_tasks = []
+    submitted_jobs = []
+    slurm_config = analysis_object.config.get("slurm", {})
+    if analysis_object.exec_mode == "sbatch" and slurm_config.get("job_arrays"):
+        job_array = SlurmJobArray(
+            array_dir=os.path.join(
+                analysis_object.project.base_path,
+                "ANALYSIS",
+                analysis_object.project.dirname,
+                "piper_ngi",
+                "sbatch",
+            ),
+            job_name="piper_{}-{}".format(analysis_object.project.project_id, level),
+            throttle=slurm_config.get("array_throttle"),
+        )
+    try:
+        for sample in analysis_object.project:
+            try:
+                charon_reported_status = charon_session.sample_get(
+                    analysis_object.project.project_id, sample
+                ).get("analysis_status")
+                # Check Charon to ensure this hasn't already been processed
+                do_analyze = handle_sample_status(
+                    analysis_object, sample, charon_reported_status
+                )
+                if not do_analyze:
+                    continue
+            except CharonError as e:
+                LOG.error(e)
                 continue
-        except CharonError as e:
-            LOG.error(e)
-            continue
-        if level == "sample":
-            status_field = "alignment_status"
-        elif level == "genotype":
-            status_field = "genotype_status"
-        else:
-            LOG.warning('Unknown workflow level: "{}"'.format(level))
-            status_field = "alignment_status"  # Or should we abort?
-        try:
-            check_for_preexisting_sample_runs(
-                analysis_object.project,
-                sample,
-                analysis_object.restart_running_jobs,
-                analysis_object.restart_finished_jobs,
-                status_field,
-            )
-        except RuntimeError as e:
-            raise RuntimeError(
-                'Aborting processing of project/sample "{}/{}": ' "{}".format(
-                    analysis_object.project, sample, e
+            if level == "sample":
+                status_field = "alignment_status"
+            elif level == "genotype":
+                status_field = "genotype_status"
+            else:
+                LOG.warning('Unknown workflow level: "{}"'.format(level))
+                status_field = "alignment_status"  # Or should we abort?
+            try:
+                check_for_preexisting_sample_runs(
+                    analysis_object.project,
+                    sample,
+                    analysis_object.restart_running_jobs,
+                    analysis_object.restart_finished_jobs,
+                    status_field,
                 )
-            )
-        if analysis_object.exec_mode.lower() not in ("sbatch", "local"):
-            raise ValueError(
-                '"exec_mode" param must be one of "sbatch" or "local" '
-                'value was "{}"'.format(analysis_object.exec_mode)
-            )
-        if analysis_object.exec_mode == "local":
-            modules_to_load = analysis_object.config.get("piper", {}).get(
-                "load_modules", []
-            )
-            load_modules(modules_to_load)
-        for workflow_subtask in workflows.get_subtasks_for_level(level=level):
-            if level == "genotype":
-                genotype_status = (
-                    None  # Some records in Charon lack this field, I'm guessing
+            except RuntimeError as e:
+                raise RuntimeError(
+                    'Aborting processing of project/sample "{}/{}": ' "{}".format(
+                        analysis_object.project, sample, e
+                    )
                 )
-                try:
-                    charon_session = CharonSession()
-                    genotype_status = charon_session.sample_get(
-                        projectid=analysis_object.project.project_id,
-                        sampleid=sample.name,
-                    ).get("genotype_status")
-                except CharonError as e:
-                    LOG.error(
-                        "Couldn't determine genotyping status for project/"
-                        'sample "{}/{}"; skipping analysis.'.format(
-                            analysis_object.project, sample
-                        )
+            if analysis_object.exec_mode.lower() not in ("sbatch", "local"):
+                raise ValueError(
+                    '"exec_mode" param must be one of "sbatch" or "local" '
+                    'value was "{}"'.format(analysis_object.exec_mode)
+                )
+            if analysis_object.exec_mode == "local":
+                modules_to_load = analysis_object.config.get("piper", {}).get(
+                    "load_modules", []
+                )
+                load_modules(modules_to_load)
+            for workflow_subtask in workflows.get_subtasks_for_level(level=level):
+                if level == "genotype":
+                    genotype_status = (
+                        None  # Some records in Charon lack this field, I'm guessing
                     )
-                    continue
-                if (
-                    find_previous_genotype_analyses(analysis_object.project, sample)
-                    or genotype_status == "DONE"
-                ):
-                    if not analysis_object.restart_finished_jobs:
-                        LOG.info(
-                            'Project/sample "{}/{}" has completed genotype '
-                            "analysis previously; skipping (use flag to force "
-                            "analysis)".format(analysis_object.project, sample)
+                    try:
+                        charon_session = CharonSession()
+                        genotype_status = charon_session.sample_get(
+                            projectid=analysis_object.project.project_id,
+                            sampleid=sample.name,
+                        ).get("genotype_status")
+                    except CharonError as e:
+                        LOG.error(
+                            "Couldn't determine genotyping status for project/"
+                            'sample "{}/{}"; skipping analysis.'.format(
+                                analysis_object.project, sample
+                            )
                         )
                         continue
-            if analysis_object.restart_running_jobs:
-                # Kill currently-running jobs if they exist
-                kill_running_sample_analysis(
-                    workflow_subtask=workflow_subtask,
-                    project_id=analysis_object.project.project_id,
-                    sample_id=sample.name,
-                )
-            # This checks the local jobs database
-            if not is_sample_analysis_running_local(
-                workflow_subtask=workflow_subtask,
-                project_id=analysis_object.project.project_id,
-                sample_id=sample.name,
-            ):
-                LOG.info(
-                    'Launching "{}" analysis for sample "{}" in project ' '"{}"'.format(
-                        workflow_subtask, sample, analysis_object.project
-                    )
-                )
-                try:
-                    log_file_path = create_log_file_path(
+                    if (
+                        find_previous_genotype_analyses(analysis_object.project, sample)
+                        or genotype_status == "DONE"
+                    ):
+                        if not analysis_object.restart_finished_jobs:
+                            LOG.info(
+                                'Project/sample "{}/{}" has completed genotype '
+                                "analysis previously; skipping (use flag to force "
+                                "analysis)".format(analysis_object.project, sample)
+                            )
+                            continue
+                if analysis_object.restart_running_jobs:
+                    # Kill currently-running jobs if they exist
+                    kill_running_sample_analysis(
                         workflow_subtask=workflow_subtask,
-                        project_base_path=analysis_object.project.base_path,
-                        project_name=analysis_object.project.dirname,
                         project_id=analysis_object.project.project_id,
                         sample_id=sample.name,
                     )
-                    rotate_file(log_file_path)
-                    exit_code_path = create_exit_code_file_path(
-                        workflow_subtask=workflow_subtask,
-                        project_base_path=analysis_object.project.base_path,
-                        project_name=analysis_object.project.dirname,
-                        project_id=analysis_object.project.project_id,
-                        sample_id=sample.name,
+                # This checks the local jobs database
+                if not is_sample_analysis_running_local(
+                    workflow_subtask=workflow_subtask,
+                    project_id=analysis_object.project.project_id,
+                    sample_id=sample.name,
+                ):
+                    LOG.info(
+                        'Launching "{}" analysis for sample "{}" in project '
+                        '"{}"'.format(workflow_subtask, sample, analysis_object.project)
                     )
-                    if level == "sample":
-                        remove_previous_sample_analyses(analysis_object.project, sample)
-                        default_files_to_copy = None
-                    elif level == "genotype":
-                        remove_previous_genotype_analyses(analysis_object.project)
-                        default_files_to_copy = None
-
-                    # Update the project to keep only valid fastq files for setup.xml creation
-                    if level == "genotype":
-                        updated_project, default_files_to_copy = (
-                            collect_files_for_sample_analysis(
-                                analysis_object.project,
-                                sample,
-                                restart_finished_jobs=True,
-                                status_field="genotype_status",
-                            )
-                        )
-                    else:
-                        updated_project, default_files_to_copy = (
-                            collect_files_for_sample_analysis(
-                                analysis_object.project,
-                                sample,
-                                analysis_object.restart_finished_jobs,
-                                status_field="alignment_status",
-                            )
+                    try:
+                        log_file_path = create_log_file_path(
+                            workflow_subtask=workflow_subtask,
+                            project_base_path=analysis_object.project.base_path,
+                            project_name=analysis_object.project.dirname,
+                            project_id=analysis_object.project.project_id,
+                            sample_id=sample.name,
                         )
-                    setup_xml_cl, setup_xml_path = build_setup_xml(
-                        project=updated_project,
-                        sample=sample,
-                        workflow=workflow_subtask,
-                        local_scratch_mode=(analysis_object.exec_mode == "sbatch"),
-                        config=analysis_object.config,
-                    )
-                    piper_cl = build_piper_cl(
-                        project=analysis_object.project,
-                        workflow_name=workflow_subtask,
-                        setup_xml_path=setup_xml_path,
-                        exit_code_path=exit_code_path,
-                        config=analysis_object.config,
-                        exec_mode=analysis_object.exec_mode,
-                    )
-                    if analysis_object.exec_mode == "sbatch":
-                        process_id = None
-                        slurm_job_id = sbatch_piper_sample(
-                            [setup_xml_cl, piper_cl],
-                            workflow_subtask,
-                            analysis_object.project,
-                            sample,
-                            restart_finished_jobs=analysis_object.restart_finished_jobs,
-                            files_to_copy=default_files_to_copy,
+                        rotate_file(log_file_path)
+                        exit_code_path = create_exit_code_file_path(
+                            workflow_subtask=workflow_subtask,
+                            project_base_path=analysis_object.project.base_path,
+                            project_name=analysis_object.project.dirname,
+                            project_id=analysis_object.project.project_id,
+                            sample_id=sample.name,
                         )
-                        for x in range(10):
-                            # Time delay to let sbatch get its act together
-                            # (takes a few seconds to be visible with sacct)
-                            try:
-                                get_slurm_job_status(slurm_job_id)
-                                break
-                            except ValueError:
-                                time.sleep(2)
+                        if level == "sample":
+                            remove_previous_sample_analyses(
+                                analysis_object.project, sample
+                            )
+                            default_files_to_copy = None
+                        elif level == "genotype":
+                            remove_previous_genotype_analyses(
+                                analysis_object.project, sample
+                            )
+                            default_files_to_copy = None
+
+                        # Update the project to keep only valid fastq files for setup.xml creation
+                        if level == "genotype":
+                            updated_project, default_files_to_copy = (
+                                collect_files_for_sample_analysis(
+                                    analysis_object.project,
+                                    sample,
+                                    restart_finished_jobs=True,
+                                    status_field="genotype_status",
+                                )
+                            )
                         else:
-                            LOG.error(
-                                "sbatch file for sample {}/{} did not "
-                                "queue properly! Job ID {} cannot be "
-                                "found.".format(
-                                    analysis_object.project, sample, slurm_job_id
+                            updated_project, default_files_to_copy = (
+                                collect_files_for_sample_analysis(
+                                    analysis_object.project,
+                                    sample,
+                                    analysis_object.restart_finished_jobs,
+                                    status_field="alignment_status",
                                 )
                             )
-                    else:  # "local"
-                        raise NotImplementedError(
-                            "Local execution not currently implemented. "
-                            "I'm sure Denis can help you with this."
+                        setup_xml_cl, setup_xml_path = build_setup_xml(
+                            project=updated_project,
+                            sample=sample,
+                            workflow=workflow_subtask,
+                            local_scratch_mode=(analysis_object.exec_mode == "sbatch"),
+                            config=analysis_object.config,
                         )
-                        # slurm_job_id = None
-                        # launch_piper_job(setup_xml_cl, project)
-                        # process_handle = launch_piper_job(piper_cl, project)
-                        # process_id = process_handle.pid
-                    try:
-                        record_process_sample(
+                        piper_cl = build_piper_cl(
                             project=analysis_object.project,
-                            sample=sample,
-                            analysis_module_name="piper_ngi",
-                            slurm_job_id=slurm_job_id,
-                            process_id=process_id,
-                            workflow_subtask=workflow_subtask,
+                            workflow_name=workflow_subtask,
+                            setup_xml_path=setup_xml_path,
+                            exit_code_path=exit_code_path,
+                            config=analysis_object.config,
+                            exec_mode=analysis_object.exec_mode,
                         )
-                    except RuntimeError as e:
-                        LOG.error(e)
-                        ## Question: should we just kill the run in this case or let it go?
-                        continue
-                except (NotImplementedError, RuntimeError, ValueError) as e:
-                    error_msg = (
-                        'Processing project "{}" / sample "{}" / workflow "{}" '
-                        "failed: {}".format(
-                            analysis_object.project, sample, workflow_subtask, e
+                        if analysis_object.exec_mode == "sbatch":
+                            process_id = local_job_id = None
+                            slurm_job_id = sbatch_piper_sample(
+                                [setup_xml_cl, piper_cl],
+                                workflow_subtask,
+                                analysis_object.project,
+                                sample,
+                                restart_finished_jobs=analysis_object.restart_finished_jobs,
+                                files_to_copy=default_files_to_copy,
+                                job_array=job_array,
+                            )
+                            if job_array is not None:
+                                # This is the array task id; the sample is recorded
+                                # once the job array has been submitted
+                                array_tasks.append(
+                                    (
+                                        sample,
+                                        workflow_subtask,
+                                        slurm_job_id,
+                                        get_sample_input_bytes(
+                                            updated_project,
+                                            updated_project.samples[sample.name],
+                                        ),
+                                    )
+                                )
+                                continue
+                            # The job is recorded right away; whether it has been
+                            # queued is checked for all the jobs at once
+                            submitted_jobs.append((sample, slurm_job_id))
+                        else:  # "local"
+                            process_id = slurm_job_id = None
+                            local_job_id = submit_piper_sample_locally(
+                                [setup_xml_cl, piper_cl],
+                                workflow_subtask,
+                                updated_project,
+                                updated_project.samples[sample.name],
+                                exit_code_path,
+                                config=analysis_object.config,
+                            )
+                        try:
+                            record_process_sample(
+                                project=analysis_object.project,
+                                sample=sample,
+                                analysis_module_name="piper_ngi",
+                                slurm_job_id=slurm_job_id,
+                                process_id=process_id,
+                                local_job_id=local_job_id,
+                                workflow_subtask=workflow_subtask,
+                                input_bytes=get_sample_input_bytes(
+                                    updated_project,
+                                    updated_project.samples[sample.name],
+                                ),
+                            )
+                        except RuntimeError as e:
+                            LOG.error(e)
+                            ## Question: should we just kill the run in this case or let it go?
+                            continue
+                    except (NotImplementedError, RuntimeError, ValueError) as e:
+                        error_msg = (
+                            'Processing project "{}" / sample "{}" / workflow "{}" '
+                            "failed: {}".format(
+                                analysis_object.project, sample, workflow_subtask, e
+                            )
                         )
-                    )
-                    LOG.error(error_msg)
+                        LOG.error(error_msg)
+    finally:
+        # whatever has been submitted or set up is tracked, also if a later sample
+        # could not be processed
+        if submitted_jobs:
+            wait_for_piper_jobs(
+                analysis_object.project, submitted_jobs, config=analysis_object.config
+            )
+        if array_tasks:
+            submit_piper_job_array(
+                analysis_object.project,
+                job_array,
+                array_tasks,
+                config=analysis_object.config,
+            )
+    piper_config = analysis_object.config.get("piper", {})
+    if piper_config.get("reap_trash"):
+        # empty the trash filled by removing previous analyses
+        start_trash_reaper(
+            [
+                os.path.join(
+                    analysis_object.project.base_path,
+                    "ANALYSIS",
+                    analysis_object.project.project_id,
+                )
+            ],
+            max_workers=piper_config.get("trash_reaper_workers", 4),
+        )
+
+
+def wait_for_piper_jobs(project, submitted_jobs, config):
+    """Wait for the sbatch jobs submitted for the samples of a project, which
+    have already been recorded in the local tracking database, to become visible
+    to sacct, checking all of them together. Jobs that do not show up within the
+    slurm "job_visibility_timeout" (seconds, default 60) are logged.
+
+    :param NGIProject project: The NGIProject
+    :param list submitted_jobs: The (sample, slurm job id) tuples of the submitted jobs
+    :param dict config: The parsed configuration file
+    """
+    missing = wait_for_slurm_jobs(
+        [x[1] for x in submitted_jobs],
+        max_wait=config.get("slurm", {}).get("job_visibility_timeout", 60),
+        config=config,
+    )
+    for sample, slurm_job_id in submitted_jobs:
+        if str(slurm_job_id) in missing:
+            LOG.error(
+                "sbatch file for sample {}/{} did not queue properly! Job ID {} "
+                "cannot be found.".format(project, sample, slurm_job_id)
+            )
+
+
+def submit_piper_job_array(project, job_array, array_tasks, config=None):
+    """Submit the sample analyses collected in a job array and record each of them
+    in the local tracking database as a task of the job array.
+
+    :param NGIProject project: The NGIProject
+    :param SlurmJobArray job_array: The job array holding the sbatch files
+    :param list array_tasks: The (sample, workflow subtask, array task id, input
+                             bytes) tuples of the analyses in the job array
+    :param dict config: The parsed configuration file
+    """
+    try:
+        slurm_job_id = job_array.submit(config=config)
+    except (RuntimeError, ValueError) as e:
+        LOG.error(
+            'Could not submit the analyses of project "{}" as a job array: '
+            "{}".format(project, e)
+        )
+        return
+    for sample, workflow_subtask, array_task_id, input_bytes in array_tasks:
+        try:
+            record_process_sample(
+                project=project,
+                sample=sample,
+                analysis_module_name="piper_ngi",
+                slurm_job_id=slurm_job_id,
+                slurm_array_task_id=array_task_id,
+                workflow_subtask=workflow_subtask,
+                input_bytes=input_bytes,
+            )
+        except RuntimeError as e:
+            LOG.error(e)
 
 
 def collect_files_for_sample_analysis(
@@ -373,6 +501,82 @@ def collect_files_for_sample_analysis(
     return (proj_obj, files_to_copy)
 
 
+@with_ngi_config
+def submit_piper_sample_locally(
+    command_line_list,
+    workflow_name,
+    project,
+    sample,
+    exit_code_path,
+    config=None,
+    config_file_path=None,
+):
+    """Queue a piper sample-level workflow with the local scheduler, which runs it
+    on this machine once the cores and memory it needs are available (see
+    ngi_pipeline.utils.local_scheduler). These are the job_cores and job_memory of
+    the local_scheduler config section, unless predicted from earlier runs of the
+    workflow as for sbatch_piper_sample.
+
+    :param list command_line_list: The list of command lines to execute (in order)
+    :param str workflow_name: The name of the workflow to execute
+    :param NGIProject project: The NGIProject
+    :param NGISample sample: The NGISample
+    :param str exit_code_path: The file to write the exit code of the workflow to
+    :param dict config: The parsed configuration file (optional)
+    :param str config_file_path: The path to the configuration file (optional)
+
+    :returns: The local job id
+    :rtype: int
+    :raises RuntimeError: If no local scheduler is configured
+    :raises ValueError: If the job needs more cores or memory than the local scheduler has
+    """
+    job_identifier = "{}-{}-{}".format(project.project_id, sample, workflow_name)
+    local_scheduler = get_local_scheduler(config=config)
+    if local_scheduler is None:
+        raise RuntimeError(
+            "No local scheduler queue_dir specified in configuration file "
+            'for job "{}"'.format(job_identifier)
+        )
+    scheduler_config = config.get("local_scheduler", {})
+    num_cores = scheduler_config.get("job_cores")
+    memory = scheduler_config.get("job_memory")
+    job_resources = predict_job_resources(
+        "piper_ngi", workflow_name, get_sample_input_bytes(project, sample), config
+    )
+    if job_resources:
+        num_cores = job_resources.cores or num_cores
+        memory = job_resources.memory or memory
+    job_completion_spool = get_job_completion_spool("piper_ngi", config)
+    start_commands = finish_commands = None
+    if job_completion_spool:
+        start_commands = [job_completion_spool.job_started_command()]
+        finish_commands = job_completion_spool.job_finished_commands(
+            project_id=project.project_id,
+            sample_id=sample.name,
+            workflow=workflow_name,
+            exit_code_variable="NGI_EXIT_CODE",
+        )
+    local_job_id = local_scheduler.submit(
+        " && ".join(command_line_list),
+        job_name="piper_{}".format(job_identifier),
+        working_dir=os.path.join(
+            project.base_path, "ANALYSIS", project.dirname, "piper_ngi"
+        ),
+        exit_code_path=exit_code_path,
+        cores=num_cores,
+        memory=memory,
+        start_commands=start_commands,
+        finish_commands=finish_commands,
+    )
+    LOG.info(
+        'Queued job "{}" with the local scheduler as job {}'.format(
+            job_identifier, local_job_id
+        )
+    )
+    record_analysis_details(project, job_identifier)
+    return local_job_id
+
+
 @with_ngi_config
 def sbatch_piper_sample(
     command_line_list,
@@ -382,17 +586,25 @@ def sbatch_piper_sample(
     libprep=None,
     restart_finished_jobs=False,
     files_to_copy=None,
+    job_array=None,
     config=None,
     config_file_path=None,
 ):
-    """sbatch a piper sample-level workflow.
+    """sbatch a piper sample-level workflow. The cores and walltime requested are
+    predicted from earlier runs of the workflow if resource prediction is configured
+    (see ngi_pipeline.utils.resources).
 
     :param list command_line_list: The list of command lines to execute (in order)
     :param str workflow_name: The name of the workflow to execute
     :param NGIProject project: The NGIProject
     :param NGISample sample: The NGISample
+    :param SlurmJobArray job_array: Add the sbatch file to this job array instead of
+                                    submitting it (optional)
     :param dict config: The parsed configuration file (optional)
     :param str config_file_path: The path to the configuration file (optional)
+
+    :returns: The slurm job id, or the array task id if added to a job array
+    :rtype: int
     """
     job_identifier = "{}-{}-{}".format(project.project_id, sample, workflow_name)
     # Paths to the various data directories
@@ -418,6 +630,12 @@ def sbatch_piper_sample(
         config.get("piper", {}).get("job_walltime", {}).get(workflow_name)
         or "4-00:00:00"
     )
+    job_resources = predict_job_resources(
+        "piper_ngi", workflow_name, get_sample_input_bytes(project, sample), config
+    )
+    if job_resources:
+        num_cores = job_resources.cores or num_cores
+        slurm_time = seconds_to_slurm_time(job_resources.walltime)
     slurm_out_log = os.path.join(
         perm_analysis_dir, "logs", "{}_sbatch.out".format(job_identifier)
     )
@@ -450,7 +668,11 @@ def sbatch_piper_sample(
             project, sample, restart_finished_jobs
         )
 
-    # Fastq files to copy
+    job_completion_spool = get_job_completion_spool("piper_ngi", config)
+    if job_completion_spool:
+        sbatch_text_list.append(job_completion_spool.job_started_command())
+
+    # Fastq files to copy, destinations relative to $SNIC_TMP
     fastq_src_dst_list = []
     directories_to_create = set()
     for libprep in sample:
@@ -465,7 +687,7 @@ def sbatch_piper_sample(
                 src_file = os.path.join(
                     project.base_path, "DATA", project_specific_path, fastq
                 )
-                dst_file = os.path.join("$SNIC_TMP/DATA/", project_specific_path, fastq)
+                dst_file = os.path.join("DATA", project_specific_path, fastq)
                 fastq_src_dst_list.append([src_file, dst_file])
 
     sbatch_text_list.append("echo -ne '\\n\\nCopying fastq files at '")
@@ -473,8 +695,15 @@ def sbatch_piper_sample(
     if fastq_src_dst_list:
         for directory in directories_to_create:
             sbatch_text_list.append("mkdir -p {}".format(directory))
-        for src_file, dst_file in fastq_src_dst_list:
-            sbatch_text_list.append("rsync -rptoDLv {} {}".format(src_file, dst_file))
+        sbatch_dir = os.path.join(perm_analysis_dir, "sbatch")
+        safe_makedir(sbatch_dir)
+        sbatch_text_list.extend(
+            create_fastq_staging_commands(
+                fastq_src_dst_list,
+                os.path.join(sbatch_dir, "{}.fastq_manifest".format(job_identifier)),
+                config,
+            )
+        )
     else:
         raise ValueError(
             (
@@ -544,11 +773,18 @@ def sbatch_piper_sample(
             project.project_id, sample.name
         )
     )
-    sbatch_text_list.append("for f in $MD5FILES")
-    sbatch_text_list.append("do")
-    sbatch_text_list.append("    md5sum $f | awk '{printf $1}' > $f.md5 &")
-    sbatch_text_list.append("done")
-    sbatch_text_list.append("wait")
+    # only files that changed since the last run are hashed again
+    sbatch_text_list.append(
+        checksum_command(
+            "MD5FILES",
+            os.path.join(perm_analysis_dir, "checksums", "{}.json".format(sample.name)),
+            base_dir=scratch_analysis_dir,
+            md5sum_file_path=os.path.join(
+                scratch_analysis_dir, "checksums", "{}.md5".format(sample.name)
+            ),
+            threads=config.get("piper", {}).get("checksum_threads", 4),
+        )
+    )
 
     # Copying back files
     sbatch_text_list.append(
@@ -566,13 +802,24 @@ def sbatch_piper_sample(
     sbatch_text_list.append("then")
     sbatch_text_list.append("  if [[ $PIPER_RETURN_CODE == 0 ]]")
     sbatch_text_list.append("  then")
-    sbatch_text_list.append("    echo '0'> {}".format(piper_status_file))
+    sbatch_text_list.append("    NGI_EXIT_CODE=0")
     sbatch_text_list.append("  else")
-    sbatch_text_list.append("    echo '1'> {}".format(piper_status_file))
+    sbatch_text_list.append("    NGI_EXIT_CODE=1")
     sbatch_text_list.append("  fi")
     sbatch_text_list.append("else")
-    sbatch_text_list.append("  echo '2'> {}".format(piper_status_file))
+    sbatch_text_list.append("  NGI_EXIT_CODE=2")
     sbatch_text_list.append("fi")
+    sbatch_text_list.append("echo $NGI_EXIT_CODE > {}".format(piper_status_file))
+    if job_completion_spool:
+        sbatch_text_list.extend(
+            job_completion_spool.job_finished_commands(
+                project_id=project.project_id,
+                sample_id=sample.name,
+                workflow=workflow_name,
+                exit_code_variable="NGI_EXIT_CODE",
+                rsync_exit_code_variable="RSYNC_RETURN_CODE",
+            )
+        )
 
     # Write the sbatch file
     sbatch_dir = os.path.join(perm_analysis_dir, "sbatch")
@@ -581,24 +828,32 @@ def sbatch_piper_sample(
     rotate_file(sbatch_outfile)
     with open(sbatch_outfile, "w") as f:
         f.write("\n".join(sbatch_text_list))
+    if job_array is not None:
+        array_task_id = job_array.add_task(
+            sbatch_outfile,
+            stdout=slurm_out_log,
+            stderr=slurm_err_log,
+            key=job_identifier,
+        )
+        LOG.info(
+            "Added sbatch file {} for job {} to job array {} as task {}".format(
+                sbatch_outfile, job_identifier, job_array.job_name, array_task_id
+            )
+        )
+        record_analysis_details(project, job_identifier)
+        return array_task_id
     LOG.info(
         "Queueing sbatch file {} for job {}".format(sbatch_outfile, job_identifier)
     )
-    # Queue the sbatch file
-    p_handle = execute_command_line(
-        "sbatch {}".format(sbatch_outfile),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    p_out, p_err = p_handle.communicate()
+    # Queue the sbatch file, with sbatch or over slurmrestd as configured
     try:
-        slurm_job_id = re.match(r"Submitted batch job (\d+)", p_out).groups()[0]
-    except AttributeError:
+        slurm_job_id = submit_slurm_script(sbatch_outfile, config=config)
+    except RuntimeError as e:
         raise RuntimeError(
             'Could not submit sbatch job for workflow "{}": ' "{}".format(
-                job_identifier, p_err
+                job_identifier, e
             )
         )
     # Detail which seqruns we've started analyzing so we can update statuses later
     record_analysis_details(project, job_identifier)
-    return int(slurm_job_id)
+    return slurm_job_id
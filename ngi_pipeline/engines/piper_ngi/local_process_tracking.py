@@ -1,3 +1,5 @@
+import collections
+import functools
 import glob
 import inspect
 import os
@@ -9,7 +11,16 @@ from ngi_pipeline.conductor.classes import NGIProject
 from ngi_pipeline.database.classes import CharonSession, CharonError
 from ngi_pipeline.log.loggers import minimal_logger
 from ngi_pipeline.utils.communication import mail_analysis
-from ngi_pipeline.engines.piper_ngi.database import SampleAnalysis, get_db_session
+from ngi_pipeline.database.tracking import (
+    ParsedMetricsStore,
+    SampleAnalysis,
+    get_db_session,
+    harvest_job_metrics,
+    STATE_DONE,
+    STATE_FAILED,
+    STATE_RUNNING,
+    TERMINAL_STATES,
+)
 from ngi_pipeline.engines.piper_ngi.utils import (
     create_exit_code_file_path,
     create_project_obj_from_analysis_log,
@@ -17,44 +28,238 @@ from ngi_pipeline.engines.piper_ngi.utils import (
 )
 from ngi_pipeline.engines.piper_ngi.parsers import (
     parse_genotype_concordance,
+    find_qualimap_genome_results,
     parse_mean_coverage_from_qualimap,
     parse_deduplication_percentage,
     parse_qualimap_reads,
     parse_qualimap_coverage,
 )
-from ngi_pipeline.utils.slurm import get_slurm_job_status, kill_slurm_job_by_id
+from ngi_pipeline.utils.slurm import (
+    get_slurm_job_status,
+    kill_slurm_job_by_id,
+    slurm_job_spec,
+)
 from ngi_pipeline.utils.parsers import STHLM_UUSNP_SEQRUN_RE, STHLM_UUSNP_SAMPLE_RE
 from sqlalchemy.exc import IntegrityError, OperationalError
 from ngi_pipeline.utils.charon import recurse_status_for_sample
 from ngi_pipeline.utils.classes import with_ngi_config
+from ngi_pipeline.utils.local_scheduler import ACTIVE_JOB_STATES, get_local_scheduler
+from ngi_pipeline.utils.pyutils import ordered_thread_map
+from ngi_pipeline.utils.spool import get_job_completion_spool
 from ngi_pipeline.utils.post_analysis import run_multiqc
+from ngi_pipeline.utils.coverage_table import (
+    coverage_table_dir,
+    stage_sample_coverage,
+    update_coverage_tables,
+)
+from ngi_pipeline.utils.qualimap import parse_genome_results
 
 
 LOG = minimal_logger(__name__)
 
 
+class _SampleUpdate(object):
+    """The changes to make to a tracking database row once its sample has been
+    processed; these are applied on the thread that owns the database session."""
+
+    def __init__(self):
+        self.poll = None
+        self.delete = False
+        self.multiqc_project = None
+
+    def record_poll(self, state, exit_code=None):
+        self.poll = (state, exit_code)
+
+    def apply(self, sample_entry, session):
+        if self.poll:
+            sample_entry.record_poll(*self.poll)
+        if self.delete:
+            session.delete(sample_entry)
+
+
+_TrackedSample = collections.namedtuple(
+    "_TrackedSample",
+    [
+        "project_id",
+        "project_name",
+        "project_base_path",
+        "sample_id",
+        "workflow",
+        "engine",
+        "slurm_job_id",
+        "slurm_array_task_id",
+        "process_id",
+        "local_job_id",
+        "state",
+        "exit_code",
+        "submitted_at",
+        "last_polled_at",
+    ],
+)
+
+
 @with_ngi_config
 def update_charon_with_local_jobs_status(
-    quiet=False, config=None, config_file_path=None
+    quiet=False, max_workers=None, config=None, config_file_path=None
 ):
-    """Check the status of all locally-tracked jobs and update Charon accordingly."""
+    """Check the status of all locally-tracked jobs and update Charon accordingly.
+
+    The outcome reported by jobs that have finished since the last check is
+    first picked up from the job completion spool; the jobs that have not
+    reported are taken to be running and are only polled, and their exit code
+    file checked, once they have gone the poll interval of the spool without
+    being polled. The consumed records are pruned once they are old enough.
+
+    The samples are checked on a pool of max_workers threads (default is the
+    piper "tracking_workers" config value, or one sample at a time). Each sample
+    is handled start to finish by a single worker, so its log messages come out
+    in order; a sample that could not be checked is logged and its row left as it
+    is, for the next run. The tracking database is only modified from this thread
+    and is committed once at the end, along with the metrics parsed from the QC output
+    of the samples (see ParsedMetricsStore). If the slurm "harvest_job_metrics"
+    config option is set, the resource usage of the jobs that have finished is
+    stored as well.
+
+    :param bool quiet: Don't send notification emails
+    :param int max_workers: The number of samples to check concurrently
+    """
     if quiet and not config.get("quiet"):
         config["quiet"] = True
+    if max_workers is None:
+        max_workers = config.get("piper", {}).get("tracking_workers", 1)
     LOG.info("Updating Charon with the status of all locally-tracked jobs...")
     multiqc_projects = set()
+    finished_entries = []
+    job_completion_spool = get_job_completion_spool("piper_ngi", config)
+    spooled_records = (
+        job_completion_spool.new_records() if job_completion_spool else []
+    )
+    metrics_store = ParsedMetricsStore(config=config)
     with get_db_session() as session:
         charon_session = CharonSession()
-        for sample_entry in session.query(SampleAnalysis).all():
-            # Local names
-            workflow = sample_entry.workflow
-            project_name = sample_entry.project_name
-            project_id = sample_entry.project_id
-            project_base_path = sample_entry.project_base_path
-            sample_id = sample_entry.sample_id
-            engine = sample_entry.engine
-            # Only one of these id fields (slurm, pid) will have a value
-            slurm_job_id = sample_entry.slurm_job_id
-            process_id = sample_entry.process_id
+        SampleAnalysis.record_job_completions(session, "piper_ngi", spooled_records)
+        # The live jobs are polled; the finished jobs still tracked are those whose
+        # Charon update failed on an earlier run, which are only reported again
+        sample_entries = (
+            SampleAnalysis.tracked(session, engine="piper_ngi", live_only=True).all()
+            + SampleAnalysis.tracked(
+                session, engine="piper_ngi", terminal_only=True
+            ).all()
+        )
+        # Workers only get plain copies of the rows, never the session's objects
+        tracked_samples = [
+            _TrackedSample(*[getattr(x, field) for field in _TrackedSample._fields])
+            for x in sample_entries
+        ]
+        sample_updates = ordered_thread_map(
+            functools.partial(
+                _update_charon_with_sample_status,
+                charon_session=charon_session,
+                config=config,
+                job_completion_spool=job_completion_spool,
+                metrics_store=metrics_store,
+            ),
+            tracked_samples,
+            max_workers=max_workers,
+        )
+        for sample_entry, (tracked_sample, sample_update, exception) in zip(
+            sample_entries, sample_updates
+        ):
+            if exception is not None:
+                # Charon may already have been updated for the other samples, so
+                # their outcome is still recorded; this one is checked again next run
+                LOG.error(
+                    "Exception raised when processing project/sample {}/{}, "
+                    "please review: {}".format(
+                        tracked_sample.project_name, tracked_sample.sample_id, exception
+                    )
+                )
+                continue
+            sample_update.apply(sample_entry, session)
+            if sample_entry.is_terminal():
+                finished_entries.append(sample_entry)
+            if sample_update.multiqc_project:
+                multiqc_projects.add(sample_update.multiqc_project)
+        if config.get("slurm", {}).get("harvest_job_metrics"):
+            harvest_job_metrics(session, finished_entries)
+        metrics_store.flush(session)
+        session.commit()
+    if job_completion_spool:
+        # Only now that the outcome has been committed are the records consumed
+        job_completion_spool.acknowledge(spooled_records)
+        job_completion_spool.prune()
+    # Run Multiqc
+    for pj_tuple in multiqc_projects:
+        LOG.info("Running MultiQC on project {}".format(pj_tuple[1]))
+        run_multiqc(pj_tuple[0], pj_tuple[1], pj_tuple[2])
+    if config.get("analysis", {}).get("export_coverage_table"):
+        update_coverage_tables(
+            sorted(
+                set(
+                    coverage_table_dir(pj_tuple[0], pj_tuple[1])
+                    for pj_tuple in multiqc_projects
+                )
+            )
+        )
+
+
+def _update_charon_with_sample_status(
+    tracked_sample,
+    charon_session,
+    config,
+    job_completion_spool=None,
+    metrics_store=None,
+):
+    """Check the status of one locally-tracked job and update Charon accordingly.
+
+    :param _TrackedSample tracked_sample: A copy of the tracking database row
+    :param CharonSession charon_session: The (shared) Charon session
+    :param dict config: The parsed NGI configuration
+    :param JobCompletionSpool job_completion_spool: The spool finished jobs report
+                                                    through, if any, in which case a
+                                                    job without a completion record is
+                                                    only polled once its poll interval
+                                                    has passed
+    :param ParsedMetricsStore metrics_store: Where to look up the metrics parsed earlier
+                                             from the QC output (optional)
+
+    :returns: The changes to make to the tracking database row
+    :rtype: _SampleUpdate
+    """
+    sample_update = _SampleUpdate()
+    # Local names
+    workflow = tracked_sample.workflow
+    project_name = tracked_sample.project_name
+    project_id = tracked_sample.project_id
+    project_base_path = tracked_sample.project_base_path
+    sample_id = tracked_sample.sample_id
+    engine = tracked_sample.engine
+    # Only one of these id fields (slurm, pid, local job) will have a value
+    slurm_job_id = tracked_sample.slurm_job_id
+    slurm_array_task_id = tracked_sample.slurm_array_task_id
+    process_id = tracked_sample.process_id
+    local_job_id = tracked_sample.local_job_id
+    piper_exit_code = job_running = None
+    job_polled = True
+    if tracked_sample.state in TERMINAL_STATES:
+        # Outcome was recorded on an earlier run (or picked up from the spool)
+        # but Charon has not been updated yet; no need to look at the job again
+        piper_exit_code = tracked_sample.exit_code
+    else:
+        if job_completion_spool:
+            # Finished jobs have reported through the spool; a job is only polled,
+            # and its exit code file checked, if it has gone without reporting for
+            # a while, in case it stopped without doing so
+            if job_completion_spool.poll_overdue(
+                tracked_sample.last_polled_at or tracked_sample.submitted_at
+            ):
+                job_running = _job_is_running(
+                    slurm_job_id, process_id, slurm_array_task_id, local_job_id, config
+                )
+            else:
+                job_running = True
+                job_polled = False
+        if not job_running:
             piper_exit_code = get_exit_code(
                 workflow_name=workflow,
                 project_base_path=project_base_path,
@@ -62,29 +267,196 @@ def update_charon_with_local_jobs_status(
                 project_id=project_id,
                 sample_id=sample_id,
             )
-            label = "project/sample {}/{}".format(project_name, sample_id)
+        if type(piper_exit_code) is int:
+            sample_update.record_poll(
+                STATE_DONE if piper_exit_code == 0 else STATE_FAILED,
+                exit_code=piper_exit_code,
+            )
+    label = "project/sample {}/{}".format(project_name, sample_id)
 
-            if workflow not in (
-                "merge_process_variantcall",
-                "genotype_concordance",
-            ):
-                LOG.error(
-                    'Unknown workflow "{}" for {}; cannot update '
-                    "Charon. Skipping sample.".format(workflow, label)
+    if workflow not in (
+        "merge_process_variantcall",
+        "genotype_concordance",
+    ):
+        LOG.error(
+            'Unknown workflow "{}" for {}; cannot update '
+            "Charon. Skipping sample.".format(workflow, label)
+        )
+        return sample_update
+
+    try:
+        project_obj = create_project_obj_from_analysis_log(
+            project_name, project_id, project_base_path, sample_id, workflow
+        )
+    except IOError as e:  # analysis log file is missing!
+        error_text = (
+            "Could not find analysis log file! Cannot update "
+            "Charon for {} run {}/{}: {}".format(workflow, project_id, sample_id, e)
+        )
+        LOG.error(error_text)
+        if not config.get("quiet"):
+            mail_analysis(
+                project_name=project_name,
+                sample_name=sample_id,
+                engine_name=engine,
+                level="ERROR",
+                info_text=error_text,
+                workflow=workflow,
+            )
+        return sample_update
+    try:
+        if piper_exit_code == 0:
+            # 0 -> Job finished successfully
+            if workflow == "merge_process_variantcall":
+                sample_status_field = "analysis_status"
+                seqrun_status_field = "alignment_status"
+                set_status = "ANALYZED"  # sample level
+            elif workflow == "genotype_concordance":
+                sample_status_field = seqrun_status_field = "genotype_status"
+                set_status = "DONE"  # sample level
+            recurse_status = "DONE"  # For the seqrun level
+            info_text = (
+                'Workflow "{}" for {} finished succesfully. '
+                "Recording status {} in Charon".format(workflow, label, set_status)
+            )
+            LOG.info(info_text)
+            if not config.get("quiet"):
+                mail_analysis(
+                    project_name=project_name,
+                    sample_name=sample_id,
+                    engine_name=engine,
+                    level="INFO",
+                    info_text=info_text,
+                    workflow=workflow,
                 )
-                continue
+            charon_session.sample_update(
+                projectid=project_id,
+                sampleid=sample_id,
+                **{sample_status_field: set_status},
+            )
+            recurse_status_for_sample(
+                project_obj,
+                status_field=seqrun_status_field,
+                status_value=recurse_status,
+                config=config,
+            )
+            # Job is only deleted if the Charon status update succeeds
+            sample_update.delete = True
+            # add project to MultiQC
+            sample_update.multiqc_project = (
+                project_base_path,
+                project_id,
+                project_name,
+            )
 
-            try:
-                project_obj = create_project_obj_from_analysis_log(
-                    project_name, project_id, project_base_path, sample_id, workflow
+            if workflow == "merge_process_variantcall":
+                # Parse seqrun output results / update Charon
+                # This is a semi-optional step -- failure here will send an
+                # email but not more than once. The record is still removed
+                # from the local jobs database, so this will have to be done
+                # manually if you want it done at all.
+                piper_qc_dir = os.path.join(
+                    project_base_path,
+                    "ANALYSIS",
+                    project_id,
+                    "piper_ngi",
+                    "02_preliminary_alignment_qc",
                 )
-            except IOError as e:  # analysis log file is missing!
-                error_text = (
-                    "Could not find analysis log file! Cannot update "
-                    "Charon for {} run {}/{}: {}".format(
-                        workflow, project_id, sample_id, e
+                update_coverage_for_sample_seqruns(
+                    project_id, sample_id, piper_qc_dir, metrics_store=metrics_store
+                )
+                update_sample_duplication_and_coverage(
+                    project_id,
+                    sample_id,
+                    project_base_path,
+                    metrics_store=metrics_store,
+                    config=config,
+                )
+
+            elif workflow == "genotype_concordance":
+                piper_gt_dir = os.path.join(
+                    project_base_path,
+                    "ANALYSIS",
+                    project_id,
+                    "piper_ngi",
+                    "03_genotype_concordance",
+                )
+                try:
+                    update_gtc_for_sample(
+                        project_id,
+                        sample_id,
+                        piper_gt_dir,
+                        metrics_store=metrics_store,
                     )
+                except (CharonError, IOError, ValueError) as e:
+                    LOG.error(e)
+        elif type(piper_exit_code) is int and piper_exit_code > 0:
+            # 1 -> Job failed
+            set_status = "FAILED"
+            error_text = (
+                'Workflow "{}" for {} failed. Recording status '
+                "{} in Charon.".format(workflow, label, set_status)
+            )
+            LOG.error(error_text)
+            if not config.get("quiet"):
+                mail_analysis(
+                    project_name=project_name,
+                    sample_name=sample_id,
+                    engine_name=engine,
+                    level="ERROR",
+                    info_text=error_text,
+                    workflow=workflow,
+                )
+            if workflow == "merge_process_variantcall":
+                sample_status_field = "analysis_status"
+                seqrun_status_field = "alignment_status"
+            elif workflow == "genotype_concordance":
+                sample_status_field = seqrun_status_field = "genotype_status"
+            charon_session.sample_update(
+                projectid=project_id,
+                sampleid=sample_id,
+                **{sample_status_field: set_status},
+            )
+            recurse_status_for_sample(
+                project_obj,
+                status_field=seqrun_status_field,
+                status_value=set_status,
+                config=config,
+            )
+            # Job is only deleted if the Charon update succeeds
+            sample_update.delete = True
+        else:
+            # None -> Job still running OR exit code was never written (failure)
+            if job_running is None:
+                job_running = _job_is_running(
+                    slurm_job_id, process_id, slurm_array_task_id, local_job_id, config
+                )
+            # Job did not write an exit code and is also not running
+            JOB_FAILED = not job_running
+            if JOB_FAILED:
+                # Recorded as a failure so the job isn't polled again
+                sample_update.record_poll(STATE_FAILED, exit_code=1)
+                set_status = "FAILED"
+                error_text = (
+                    "No exit code found but job not running "
+                    "for {} / {}: setting status to {} in "
+                    "Charon".format(label, workflow, set_status)
                 )
+                if slurm_job_id:
+                    exit_code_file_path = create_exit_code_file_path(
+                        workflow_subtask=workflow,
+                        project_base_path=project_base_path,
+                        project_name=project_name,
+                        project_id=project_id,
+                        sample_id=sample_id,
+                    )
+                    error_text += (
+                        ' (slurm job id "{}", exit code file path '
+                        '"{}")'.format(
+                            slurm_job_spec(slurm_job_id, slurm_array_task_id),
+                            exit_code_file_path,
+                        )
+                    )
                 LOG.error(error_text)
                 if not config.get("quiet"):
                     mail_analysis(
@@ -95,88 +467,68 @@ def update_charon_with_local_jobs_status(
                         info_text=error_text,
                         workflow=workflow,
                     )
-                continue
-            try:
-                if piper_exit_code == 0:
-                    # 0 -> Job finished successfully
-                    if workflow == "merge_process_variantcall":
-                        sample_status_field = "analysis_status"
-                        seqrun_status_field = "alignment_status"
-                        set_status = "ANALYZED"  # sample level
-                    elif workflow == "genotype_concordance":
-                        sample_status_field = seqrun_status_field = "genotype_status"
-                        set_status = "DONE"  # sample level
-                    recurse_status = "DONE"  # For the seqrun level
-                    info_text = (
-                        'Workflow "{}" for {} finished succesfully. '
-                        "Recording status {} in Charon".format(
-                            workflow, label, set_status
-                        )
-                    )
-                    LOG.info(info_text)
-                    if not config.get("quiet"):
-                        mail_analysis(
-                            project_name=project_name,
-                            sample_name=sample_id,
-                            engine_name=engine,
-                            level="INFO",
-                            info_text=info_text,
-                            workflow=workflow,
-                        )
-                    charon_session.sample_update(
-                        projectid=project_id,
-                        sampleid=sample_id,
-                        **{sample_status_field: set_status},
-                    )
-                    recurse_status_for_sample(
-                        project_obj,
-                        status_field=seqrun_status_field,
-                        status_value=recurse_status,
-                        config=config,
+                if workflow == "merge_process_variantcall":
+                    sample_status_field = "analysis_status"
+                    seqrun_status_field = "alignment_status"
+                elif workflow == "genotype_concordance":
+                    sample_status_field = seqrun_status_field = "genotype_status"
+                charon_session.sample_update(
+                    projectid=project_id,
+                    sampleid=sample_id,
+                    **{sample_status_field: set_status},
+                )
+                recurse_status_for_sample(
+                    project_obj,
+                    status_field=seqrun_status_field,
+                    status_value=set_status,
+                    config=config,
+                )
+                # Job is only deleted if the Charon update succeeds
+                LOG.debug("Deleting local entry {}".format(tracked_sample))
+                sample_update.delete = True
+            else:  # Job still running
+                if job_polled:
+                    # Not recorded as polled otherwise, so that it is polled in time
+                    sample_update.record_poll(STATE_RUNNING)
+                set_status = "UNDER_ANALYSIS"
+                if workflow == "merge_process_variantcall":
+                    sample_status_field = "analysis_status"
+                    seqrun_status_field = "alignment_status"
+                    recurse_status = "RUNNING"
+                elif workflow == "genotype_concordance":
+                    sample_status_field = seqrun_status_field = "genotype_status"
+                    recurse_status = "UNDER_ANALYSIS"
+                try:
+                    remote_sample = charon_session.sample_get(
+                        projectid=project_id, sampleid=sample_id
                     )
-                    # Job is only deleted if the Charon status update succeeds
-                    session.delete(sample_entry)
-                    # add project to MultiQC
-                    multiqc_projects.add((project_base_path, project_id, project_name))
-
-                    if workflow == "merge_process_variantcall":
-                        # Parse seqrun output results / update Charon
-                        # This is a semi-optional step -- failure here will send an
-                        # email but not more than once. The record is still removed
-                        # from the local jobs database, so this will have to be done
-                        # manually if you want it done at all.
-                        piper_qc_dir = os.path.join(
-                            project_base_path,
-                            "ANALYSIS",
-                            project_id,
-                            "piper_ngi",
-                            "02_preliminary_alignment_qc",
-                        )
-                        update_coverage_for_sample_seqruns(
-                            project_id, sample_id, piper_qc_dir
+                    charon_status = remote_sample.get(sample_status_field)
+                    if charon_status and not charon_status == set_status:
+                        LOG.warning(
+                            "Tracking inconsistency for {}: Charon status "
+                            'for field "{}" is "{}" but local process tracking '
+                            "database indicates it is running. Setting value "
+                            "in Charon to {}.".format(
+                                label,
+                                sample_status_field,
+                                charon_status,
+                                set_status,
+                            )
                         )
-                        update_sample_duplication_and_coverage(
-                            project_id, sample_id, project_base_path
+                        charon_session.sample_update(
+                            projectid=project_id,
+                            sampleid=sample_id,
+                            **{sample_status_field: set_status},
                         )
-
-                    elif workflow == "genotype_concordance":
-                        piper_gt_dir = os.path.join(
-                            project_base_path,
-                            "ANALYSIS",
-                            project_id,
-                            "piper_ngi",
-                            "03_genotype_concordance",
+                        recurse_status_for_sample(
+                            project_obj,
+                            status_field=seqrun_status_field,
+                            status_value=recurse_status,
+                            config=config,
                         )
-                        try:
-                            update_gtc_for_sample(project_id, sample_id, piper_gt_dir)
-                        except (CharonError, IOError, ValueError) as e:
-                            LOG.error(e)
-                elif type(piper_exit_code) is int and piper_exit_code > 0:
-                    # 1 -> Job failed
-                    set_status = "FAILED"
-                    error_text = (
-                        'Workflow "{}" for {} failed. Recording status '
-                        "{} in Charon.".format(workflow, label, set_status)
+                except CharonError as e:
+                    error_text = "Unable to update/verify Charon " "for {}: {}".format(
+                        label, e
                     )
                     LOG.error(error_text)
                     if not config.get("quiet"):
@@ -185,185 +537,97 @@ def update_charon_with_local_jobs_status(
                             sample_name=sample_id,
                             engine_name=engine,
                             level="ERROR",
-                            info_text=error_text,
                             workflow=workflow,
+                            info_text=error_text,
                         )
-                    if workflow == "merge_process_variantcall":
-                        sample_status_field = "analysis_status"
-                        seqrun_status_field = "alignment_status"
-                    elif workflow == "genotype_concordance":
-                        sample_status_field = seqrun_status_field = "genotype_status"
-                    charon_session.sample_update(
-                        projectid=project_id,
-                        sampleid=sample_id,
-                        **{sample_status_field: set_status},
-                    )
-                    recurse_status_for_sample(
-                        project_obj,
-                        status_field=seqrun_status_field,
-                        status_value=set_status,
-                        config=config,
-                    )
-                    # Job is only deleted if the Charon update succeeds
-                    session.delete(sample_entry)
-                else:
-                    # None -> Job still running OR exit code was never written (failure)
-                    JOB_FAILED = None
-                    if slurm_job_id:
-                        try:
-                            slurm_exit_code = get_slurm_job_status(slurm_job_id)
-                        except ValueError as e:
-                            slurm_exit_code = 1
-                        if (
-                            slurm_exit_code is not None
-                        ):  # "None" indicates job is still running
-                            JOB_FAILED = True
-                    else:
-                        if not psutil.pid_exists(process_id):
-                            # Job did not write an exit code and is also not running
-                            JOB_FAILED = True
-                    if JOB_FAILED:
-                        set_status = "FAILED"
-                        error_text = (
-                            "No exit code found but job not running "
-                            "for {} / {}: setting status to {} in "
-                            "Charon".format(label, workflow, set_status)
-                        )
-                        if slurm_job_id:
-                            exit_code_file_path = create_exit_code_file_path(
-                                workflow_subtask=workflow,
-                                project_base_path=project_base_path,
-                                project_name=project_name,
-                                project_id=project_id,
-                                sample_id=sample_id,
-                            )
-                            error_text += (
-                                ' (slurm job id "{}", exit code file path '
-                                '"{}")'.format(slurm_job_id, exit_code_file_path)
-                            )
-                        LOG.error(error_text)
-                        if not config.get("quiet"):
-                            mail_analysis(
-                                project_name=project_name,
-                                sample_name=sample_id,
-                                engine_name=engine,
-                                level="ERROR",
-                                info_text=error_text,
-                                workflow=workflow,
-                            )
-                        if workflow == "merge_process_variantcall":
-                            sample_status_field = "analysis_status"
-                            seqrun_status_field = "alignment_status"
-                        elif workflow == "genotype_concordance":
-                            sample_status_field = seqrun_status_field = (
-                                "genotype_status"
-                            )
-                        charon_session.sample_update(
-                            projectid=project_id,
-                            sampleid=sample_id,
-                            **{sample_status_field: set_status},
-                        )
-                        recurse_status_for_sample(
-                            project_obj,
-                            status_field=seqrun_status_field,
-                            status_value=set_status,
-                            config=config,
-                        )
-                        # Job is only deleted if the Charon update succeeds
-                        LOG.debug("Deleting local entry {}".format(sample_entry))
-                        session.delete(sample_entry)
-                    else:  # Job still running
-                        set_status = "UNDER_ANALYSIS"
-                        if workflow == "merge_process_variantcall":
-                            sample_status_field = "analysis_status"
-                            seqrun_status_field = "alignment_status"
-                            recurse_status = "RUNNING"
-                        elif workflow == "genotype_concordance":
-                            sample_status_field = seqrun_status_field = (
-                                "genotype_status"
-                            )
-                            recurse_status = "UNDER_ANALYSIS"
-                        try:
-                            remote_sample = charon_session.sample_get(
-                                projectid=project_id, sampleid=sample_id
-                            )
-                            charon_status = remote_sample.get(sample_status_field)
-                            if charon_status and not charon_status == set_status:
-                                LOG.warning(
-                                    "Tracking inconsistency for {}: Charon status "
-                                    'for field "{}" is "{}" but local process tracking '
-                                    "database indicates it is running. Setting value "
-                                    "in Charon to {}.".format(
-                                        label,
-                                        sample_status_field,
-                                        charon_status,
-                                        set_status,
-                                    )
-                                )
-                                charon_session.sample_update(
-                                    projectid=project_id,
-                                    sampleid=sample_id,
-                                    **{sample_status_field: set_status},
-                                )
-                                recurse_status_for_sample(
-                                    project_obj,
-                                    status_field=seqrun_status_field,
-                                    status_value=recurse_status,
-                                    config=config,
-                                )
-                        except CharonError as e:
-                            error_text = (
-                                "Unable to update/verify Charon " "for {}: {}".format(
-                                    label, e
-                                )
-                            )
-                            LOG.error(error_text)
-                            if not config.get("quiet"):
-                                mail_analysis(
-                                    project_name=project_name,
-                                    sample_name=sample_id,
-                                    engine_name=engine,
-                                    level="ERROR",
-                                    workflow=workflow,
-                                    info_text=error_text,
-                                )
-            except CharonError as e:
-                error_text = "Unable to update Charon for {}: " "{}".format(label, e)
-                LOG.error(error_text)
-                if not config.get("quiet"):
-                    mail_analysis(
-                        project_name=project_name,
-                        sample_name=sample_id,
-                        engine_name=engine,
-                        level="ERROR",
-                        workflow=workflow,
-                        info_text=error_text,
-                    )
-            except OSError as e:
-                error_text = (
-                    "Permissions error when trying to update Charon "
-                    '"{}" status for "{}": {}'.format(workflow, label, e)
-                )
-                LOG.error(error_text)
-                if not config.get("quiet"):
-                    mail_analysis(
-                        project_name=project_name,
-                        sample_name=sample_id,
-                        engine_name=engine,
-                        level="ERROR",
-                        workflow=workflow,
-                        info_text=error_text,
-                    )
-        session.commit()
-    # Run Multiqc
-    for pj_tuple in multiqc_projects:
-        LOG.info("Running MultiQC on project {}".format(pj_tuple[1]))
-        run_multiqc(pj_tuple[0], pj_tuple[1], pj_tuple[2])
+    except CharonError as e:
+        error_text = "Unable to update Charon for {}: " "{}".format(label, e)
+        LOG.error(error_text)
+        if not config.get("quiet"):
+            mail_analysis(
+                project_name=project_name,
+                sample_name=sample_id,
+                engine_name=engine,
+                level="ERROR",
+                workflow=workflow,
+                info_text=error_text,
+            )
+    except OSError as e:
+        error_text = (
+            "Permissions error when trying to update Charon "
+            '"{}" status for "{}": {}'.format(workflow, label, e)
+        )
+        LOG.error(error_text)
+        if not config.get("quiet"):
+            mail_analysis(
+                project_name=project_name,
+                sample_name=sample_id,
+                engine_name=engine,
+                level="ERROR",
+                workflow=workflow,
+                info_text=error_text,
+            )
+    return sample_update
+
+
+def _job_is_running(
+    slurm_job_id, process_id, slurm_array_task_id=None, local_job_id=None, config=None
+):
+    """Check whether a job is still running, using either its slurm job id or
+    (for local jobs) its local scheduler job id or process id.
+
+    :param int slurm_job_id: The slurm job id, if this is a slurm job
+    :param int process_id: The process id, if this is a local job
+    :param int slurm_array_task_id: The job array task id, if the slurm job is a job array
+    :param int local_job_id: The job id, if this job was queued with the local scheduler
+    :param dict config: The parsed NGI configuration, holding the local_scheduler section
+
+    :returns: True if the job is still running
+    :rtype: bool
+    """
+    if slurm_job_id:
+        try:
+            # "None" indicates job is still running
+            return (
+                get_slurm_job_status(slurm_job_id, slurm_array_task_id, config=config)
+                is None
+            )
+        except ValueError:
+            return False
+    if local_job_id:
+        local_scheduler = get_local_scheduler(config=config)
+        if local_scheduler is None:
+            return False
+        job = local_scheduler.poll([local_job_id]).get(local_job_id)
+        return job is not None and job["state"] in ACTIVE_JOB_STATES
+    return psutil.pid_exists(process_id)
+
+
+def _parse_metrics(
+    parse_fn,
+    source,
+    file_path,
+    project_id,
+    sample_id,
+    seqrun_id=None,
+    metrics_store=None,
+):
+    """Parse a QC output file, or look up what was parsed from it earlier."""
+    if metrics_store is None:
+        return parse_fn(file_path)
+    return metrics_store.get(
+        source, file_path, parse_fn, project_id, sample_id, seqrun_id=seqrun_id
+    )
 
 
 @with_ngi_config
 def update_gtc_for_sample(
-    project_id, sample_id, piper_gtc_path, config=None, config_file_path=None
+    project_id,
+    sample_id,
+    piper_gtc_path,
+    metrics_store=None,
+    config=None,
+    config_file_path=None,
 ):
     """Find the genotype concordance file for this sample, if it exists,
     and update the sample record in Charon with the value parsed from it.
@@ -371,6 +635,8 @@ def update_gtc_for_sample(
     :param str project_id: The id of the project
     :param str sample_id: The id the sample
     :param str piper_gtc_path: The path to the piper genotype concordance directory
+    :param ParsedMetricsStore metrics_store: Where to look up the metrics parsed
+                                             earlier (optional)
 
     :raises CharonError: If there is some Error -- with Charon
     :raises IOError: If the path specified is missing or inaccessible
@@ -378,7 +644,14 @@ def update_gtc_for_sample(
     """
     gtc_file = os.path.join(piper_gtc_path, "{}.gt_concordance".format(sample_id))
     try:
-        concordance_value = parse_genotype_concordance(gtc_file)[sample_id]
+        concordance_value = _parse_metrics(
+            parse_genotype_concordance,
+            "genotype_concordance",
+            gtc_file,
+            project_id,
+            sample_id,
+            metrics_store=metrics_store,
+        )[sample_id]
     except KeyError:
         raise ValueError(
             'Concordance data for sample "{}" not found in gt '
@@ -402,12 +675,19 @@ def update_gtc_for_sample(
 
 @with_ngi_config
 def update_sample_duplication_and_coverage(
-    project_id, sample_id, project_base_path, config=None, config_file_path=None
+    project_id,
+    sample_id,
+    project_base_path,
+    metrics_store=None,
+    config=None,
+    config_file_path=None,
 ):
     """Update Charon with the duplication rates for said sample.
 
     :param str project_base_path: The path to the project dir
     :param str sample_id: The sample name (e.g. P1170_105)
+    :param ParsedMetricsStore metrics_store: Where to look up the metrics parsed
+                                             earlier (optional)
 
     """
 
@@ -430,7 +710,14 @@ def update_sample_duplication_and_coverage(
     )
 
     try:
-        dup_pc = parse_deduplication_percentage(dup_file_path)
+        dup_pc = _parse_metrics(
+            parse_deduplication_percentage,
+            "picard_duplication",
+            dup_file_path,
+            project_id,
+            sample_id,
+            metrics_store=metrics_store,
+        )
     except:
         dup_pc = 0
         LOG.error(
@@ -439,8 +726,22 @@ def update_sample_duplication_and_coverage(
             )
         )
     try:
-        cov = parse_qualimap_coverage(genome_results_file_path)
-        reads = parse_qualimap_reads(genome_results_file_path)
+        cov = _parse_metrics(
+            parse_qualimap_coverage,
+            "qualimap_coverage",
+            genome_results_file_path,
+            project_id,
+            sample_id,
+            metrics_store=metrics_store,
+        )
+        reads = _parse_metrics(
+            parse_qualimap_reads,
+            "qualimap_reads",
+            genome_results_file_path,
+            project_id,
+            sample_id,
+            metrics_store=metrics_store,
+        )
     except IOError as e:
         cov = 0
         reads = 0
@@ -449,6 +750,19 @@ def update_sample_duplication_and_coverage(
                 genome_results_file_path
             )
         )
+    if config.get("analysis", {}).get("export_coverage_table"):
+        try:
+            stage_sample_coverage(
+                coverage_table_dir(project_base_path, project_id),
+                sample_id,
+                parse_genome_results(genome_results_file_path),
+                percent_duplication=dup_pc,
+            )
+        except (IOError, OSError) as e:
+            LOG.error(
+                "Could not stage the coverage of sample {} for the coverage "
+                "table: {}".format(sample_id, e)
+            )
     try:
         charon_session = CharonSession()
         charon_session.sample_update(
@@ -483,7 +797,12 @@ def update_sample_duplication_and_coverage(
 
 @with_ngi_config
 def update_coverage_for_sample_seqruns(
-    project_id, sample_id, piper_qc_dir, config=None, config_file_path=None
+    project_id,
+    sample_id,
+    piper_qc_dir,
+    metrics_store=None,
+    config=None,
+    config_file_path=None,
 ):
     """Find all the valid seqruns for a particular sample, parse their
     qualimap output files, and update Charon with the mean autosomal
@@ -491,6 +810,8 @@ def update_coverage_for_sample_seqruns(
 
     :param str piper_qc_dir: The path to the Piper qc dir (02_preliminary_alignment_qc at time of writing)
     :param str sample_id: The sample name (e.g. P1170_105)
+    :param ParsedMetricsStore metrics_store: Where to look up the metrics parsed
+                                             earlier (optional)
 
     :raises OSError: If the qc path specified is missing or otherwise inaccessible
     :raises ValueError: If arguments are incorrect
@@ -508,14 +829,39 @@ def update_coverage_for_sample_seqruns(
                     "genome_results.txt",
                 )
             )
-            ma_coverage = parse_mean_coverage_from_qualimap(
-                piper_qc_dir, sample_id, seqrun_id
-            )
+            if metrics_store is not None:
+                # Same files as parse_mean_coverage_from_qualimap, only the parse is cached
+                ma_coverage = sum(
+                    _parse_metrics(
+                        parse_qualimap_coverage,
+                        "qualimap_coverage",
+                        path,
+                        project_id,
+                        sample_id,
+                        seqrun_id=seqrun_id,
+                        metrics_store=metrics_store,
+                    )
+                    for path in find_qualimap_genome_results(
+                        piper_qc_dir, sample_id, seqrun_id
+                    )
+                )
+            else:
+                ma_coverage = parse_mean_coverage_from_qualimap(
+                    piper_qc_dir, sample_id, seqrun_id
+                )
 
             reads = 0
             for path in genome_results_file_paths:
                 try:
-                    reads += parse_qualimap_reads(path)
+                    reads += _parse_metrics(
+                        parse_qualimap_reads,
+                        "qualimap_reads",
+                        path,
+                        project_id,
+                        sample_id,
+                        seqrun_id=seqrun_id,
+                        metrics_store=metrics_store,
+                    )
                 except IOError as e:
                     LOG.error(
                         "Cannot find the genome_results.txt file to get the number of reads in {}".format(
@@ -569,6 +915,9 @@ def record_process_sample(
     analysis_module_name,
     process_id=None,
     slurm_job_id=None,
+    input_bytes=None,
+    slurm_array_task_id=None,
+    local_job_id=None,
     config=None,
     config_file_path=None,
 ):
@@ -586,6 +935,9 @@ def record_process_sample(
             workflow=workflow_subtask,
             process_id=process_id,
             slurm_job_id=slurm_job_id,
+            slurm_array_task_id=slurm_array_task_id,
+            local_job_id=local_job_id,
+            input_bytes=input_bytes,
         )
         try:
             session.add(sample_db_obj)
@@ -728,10 +1080,10 @@ def kill_running_sample_analysis(workflow_subtask, project_id, sample_id):
                     '...sample run "{}" is currently being analyzed '
                     '(workflow subtask "{}") and has slurm job id "{}"; '
                     "trying to kill it...".format(
-                        sample_run_name, workflow_subtask, slurm_job_id
+                        sample_run_name, workflow_subtask, sample_run.slurm_job_spec
                     )
                 )
-                kill_slurm_job_by_id(slurm_job_id)
+                kill_slurm_job_by_id(slurm_job_id, sample_run.slurm_array_task_id)
             except Exception as e:
                 LOG.error(
                     'Could not kill sample run "{}": {}'.format(sample_run_name, e)
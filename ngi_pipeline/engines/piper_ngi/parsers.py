@@ -4,8 +4,8 @@ import glob
 import os
 import sys
 
-from collections import namedtuple
 from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.qualimap import parse_genome_results
 
 
 LOG = minimal_logger(__name__)
@@ -26,38 +26,11 @@ def parse_results_for_workflow(workflow_name, *args, **kwargs):
 
 
 def parse_qualimap_reads(genome_results_file):
-    globals_section = False
-    with open(genome_results_file, "r") as f:
-        for line in f:
-            if line.startswith(">>>>>>> Globals"):
-                globals_section = True
-                continue
-            if globals_section:
-                if "number of reads" in line:
-                    return int(line.split("=")[-1].strip().replace(",", ""))
-    return 0
+    return parse_genome_results(genome_results_file).number_of_reads()
 
 
 def parse_qualimap_coverage(genome_results_file):
-    autosomal_cov_length = 0
-    autosomal_cov_bases = 0
-    coverage_section = False
-    with open(genome_results_file, "r") as f:
-        for line in f:
-            if line.startswith(">>>>>>> Coverage per contig"):
-                coverage_section = True
-                continue
-            if coverage_section:
-                line = line.strip()
-                if line:
-                    sections = line.split()
-                    if sections[0].isdigit() and int(sections[0]) <= 22:
-                        autosomal_cov_length += float(sections[1])
-                        autosomal_cov_bases += float(sections[2])
-        if autosomal_cov_length and autosomal_cov_bases:
-            return autosomal_cov_bases / autosomal_cov_length
-        else:
-            return 0.0
+    return parse_genome_results(genome_results_file).autosomal_coverage()
 
 
 def parse_mean_autosomal_coverage_for_sample(piper_qc_dir, sample_id):
@@ -91,6 +64,31 @@ def parse_mean_coverage_from_qualimap(
     :returns: The mean autosomal coverage
     :rtype: int
 
+    :raises OSError: If the qc path specified is missing or otherwise inaccessible
+    :raises ValueError: If arguments are incorrect
+    """
+    mean_autosomal_coverage = 0
+    # Examine each lane and update the dict with its alignment metrics
+    for genome_result in find_qualimap_genome_results(
+        piper_qc_dir, sample_id, seqrun_id=seqrun_id, fcid=fcid
+    ):
+        # Get the alignment results for this lane
+        mean_autosomal_coverage += parse_qualimap_coverage(genome_result)
+    return mean_autosomal_coverage
+
+
+def find_qualimap_genome_results(piper_qc_dir, sample_id, seqrun_id=None, fcid=None):
+    """Find the Qualimap genome_results.txt files of a particular sample OR seqrun
+    (if seqrun_id is passed) in piper_qc_dir, one per lane.
+
+    :param str piper_qc_dir: The path to the Piper qc dir (02_preliminary_alignment_qc at time of writing)
+    :param str sample_id: The sample name (e.g. P1170_105)
+    :param str seqrun_id: The run id (e.g. 140821_D00458_0029_AC45JGANXX) (optional) (specify either this or fcid)
+    :param str fcid: The FCID (optional) (specify either this or seqrun_id)
+
+    :returns: The paths to the genome_results.txt files
+    :rtype: list
+
     :raises OSError: If the qc path specified is missing or otherwise inaccessible
     :raises ValueError: If arguments are incorrect
     """
@@ -140,8 +138,7 @@ def parse_mean_coverage_from_qualimap(
                     piper_qc_path
                 )
             )
-    mean_autosomal_coverage = 0
-    # Examine each lane and update the dict with its alignment metrics
+    genome_results = []
     for qc_lane in piper_qc_dirs:
         genome_result = os.path.join(qc_lane, "genome_results.txt")
         # This means that if any of the lanes are missing results, the sequencing run is marked as a failure.
@@ -151,65 +148,117 @@ def parse_mean_coverage_from_qualimap(
                     piper_qc_dir
                 )
             )
-        # Get the alignment results for this lane
-        mean_autosomal_coverage += parse_qualimap_coverage(genome_result)
-    return mean_autosomal_coverage
+        genome_results.append(genome_result)
+    return genome_results
+
+
+GENOTYPE_CONCORDANCE_SUMMARY = "#:GATKTable:GenotypeConcordance_Summary"
+
+
+def _concordance_column_name(header):
+    return header.lower().replace("-", "_").replace(" ", "_")
+
+
+def iter_genotype_concordance(lines, source=None):
+    """Read the per-sample summary table of a GATK GenotypeConcordance report in
+    a single pass, yielding the overall genotype concordance of each sample in
+    it (tables of several samples included) as it is read. The "ALL" summary row
+    is left out.
+
+    :param lines: An iterable of the lines of the report, e.g. an open file
+    :param str source: The name of the report, for the log and error messages
+
+    :returns: A generator of (sample name, concordance) tuples
+    :raises ValueError: If the report has no per-sample summary table
+    """
+    lines = iter(lines)
+    for line in lines:
+        if line.startswith(GENOTYPE_CONCORDANCE_SUMMARY):
+            break
+    else:
+        raise ValueError(
+            "Unable to find genotype concordance summary "
+            'section in genotype file "{}"'.format(source)
+        )
+    # the header fields hold single spaces, so they are separated by two or more
+    header_values = [
+        _concordance_column_name(h.strip())
+        for h in next(lines, "").strip().split("  ")
+        if h.strip()
+    ]
+    try:
+        sample_index = header_values.index("sample")
+        concordance_index = header_values.index("overall_genotype_concordance")
+    except ValueError:
+        raise ValueError(
+            "Unable to find the sample and overall genotype concordance columns "
+            'in genotype file "{}"'.format(source)
+        )
+    for line in lines:
+        values = line.split()
+        if not values:
+            break
+        if len(values) != len(header_values):
+            LOG.error(
+                'Unable to parse genotype concordance line "{}"; number '
+                "of data fields does not match number of header fields "
+                "({} != {}); skipping".format(
+                    " ".join(values), len(values), len(header_values)
+                )
+            )
+            continue
+        sample = values[sample_index]
+        if sample == "ALL":
+            continue
+        try:
+            yield sample, float(values[concordance_index])
+        except ValueError:
+            LOG.error(
+                "Unable to parse overall genotype concordance "
+                'value for sample "{}" (value "{}" is not a '
+                "number)".format(sample, values[concordance_index])
+            )
 
 
 def parse_genotype_concordance(genotype_concordance_file):
+    """Parse the overall genotype concordance of the samples in a GATK
+    GenotypeConcordance report.
+
+    :param str genotype_concordance_file: The path to the report
+
+    :returns: A dict of sample name to concordance
+    :rtype: dict
+    :raises IOError: If the report cannot be read
+    :raises ValueError: If the report has no per-sample summary table
+    """
     genotype_concordance_file = os.path.realpath(genotype_concordance_file)
-    concordance_data = []
-    gt_values_list = []
-    with open(genotype_concordance_file, "r") as f:
-        for line in iter(f.readline, ""):
-            header_location = None
-            if line.startswith("#:GATKTable:GenotypeConcordance_Summary"):
-                header_values = [
-                    h.strip() for h in f.readline().strip().split("  ") if h.strip()
-                ]
-                header_values = [
-                    h.lower().replace("-", "_").replace(" ", "_") for h in header_values
-                ]
-                GTValue = namedtuple("GTValue", header_values)
-                f.readline()  # Skip first ("ALL") summary line
-                data_location = f.tell()
-                break
-        else:
-            raise ValueError(
-                "Unable to find genotype concordance summary "
-                'section in genotype file "{}"'.format(genotype_concordance_file)
-            )
     with open(genotype_concordance_file, "r") as f:
-        f.seek(data_location)
-        for line in iter(f.readline, ""):
-            if line.strip() != "":
-                try:
-                    gt_values_list.append(GTValue._make(line.strip().split()))
-                except TypeError as e:
-                    LOG.error(
-                        'Unable to parse genotype concordance line "{}"; number '
-                        "of data fields does not match number of header fields "
-                        "fields ({}); skipping".format(
-                            " ".join(line.strip().split()), e
-                        )
-                    )
-                    continue
-            else:
-                break
-    samples_gtc_dict = {}
-    for gt_entry in gt_values_list:
+        return dict(iter_genotype_concordance(f, source=genotype_concordance_file))
+
+
+def parse_genotype_concordance_files(genotype_concordance_files):
+    """Parse the overall genotype concordance from a batch of GATK
+    GenotypeConcordance reports. Reports that cannot be parsed are logged and
+    left out.
+
+    :param list genotype_concordance_files: The paths to the reports
+
+    :returns: A dict of report path to a dict of sample name to concordance
+    :rtype: dict
+    """
+    concordance_by_file = {}
+    for genotype_concordance_file in genotype_concordance_files:
         try:
-            samples_gtc_dict[gt_entry.sample] = float(
-                gt_entry.overall_genotype_concordance
+            concordance_by_file[genotype_concordance_file] = parse_genotype_concordance(
+                genotype_concordance_file
             )
-        except ValueError as e:
+        except (IOError, OSError, ValueError) as e:
             LOG.error(
-                "Unable to parse overall genotype concordance "
-                'value for sample "{}" (value "{}" is not a '
-                "number)".format(gt_entry.sample, gt_entry.overall_genotype_concordance)
+                'Unable to parse genotype concordance file "{}": {}'.format(
+                    genotype_concordance_file, e
+                )
             )
-            continue
-    return samples_gtc_dict
+    return concordance_by_file
 
 
 def parse_deduplication_percentage(deduplication_file):
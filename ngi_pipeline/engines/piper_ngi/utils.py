@@ -1,7 +1,6 @@
 import collections
 import datetime
 import fnmatch
-import glob
 import os
 import shutil
 import subprocess
@@ -9,12 +8,19 @@ import yaml
 
 from ngi_pipeline.conductor.classes import NGIProject
 from ngi_pipeline.database.classes import CharonSession
+from ngi_pipeline.engines.piper_ngi.analysis_index import (
+    get_analysis_dir_index,
+    invalidate_analysis_dir_index,
+)
 from ngi_pipeline.log.loggers import log_process_non_blocking, minimal_logger
 from ngi_pipeline.utils.filesystem import (
     execute_command_line,
     rotate_file,
     safe_makedir,
+    total_file_size,
 )
+from ngi_pipeline.utils.slurm import slurm_memory_to_bytes
+from ngi_pipeline.utils.trash import move_to_trash
 
 LOG = minimal_logger(__name__)
 
@@ -52,125 +58,99 @@ def launch_piper_job(command_line, project, log_file_path=None):
     return popen_object
 
 
-def find_previous_genotype_analyses(project_obj, sample_obj):
-    project_dir_path = os.path.join(
+def _piper_analysis_dir(project_obj):
+    return os.path.join(
         project_obj.base_path, "ANALYSIS", project_obj.project_id, "piper_ngi"
     )
-    project_dir_pattern = os.path.join(project_dir_path, "??_genotype_concordance")
+
+
+def _genotype_analysis_files(index, sample_name):
+    """The genotype concordance files of a sample and their .done/.failed markers."""
+    # P123_456 is renamed by Piper to P123-456? Sometimes? Always?
+    piper_sample_name = sample_name.replace("_", "-", 1)
+    sample_files = []
+    for name_pattern in (
+        "{}*".format(sample_name),
+        "{}*".format(piper_sample_name),
+        ".{}*.done".format(sample_name),
+        ".{}*.done".format(piper_sample_name),
+        ".{}*.failed".format(sample_name),
+        ".{}*.failed".format(piper_sample_name),
+    ):
+        sample_files.extend(
+            x
+            for x in index.files(
+                name_pattern,
+                sample_name=sample_name,
+                stage_pattern="??_genotype_concordance",
+            )
+            if x not in sample_files
+        )
+    return sample_files
+
+
+def find_previous_genotype_analyses(project_obj, sample_obj):
+    project_dir_path = _piper_analysis_dir(project_obj)
     LOG.debug(
         "Searching for previous genotype analysis output files in " "{}".format(
             project_dir_path
         )
     )
-    piper_sample_name = sample_obj.name.replace("_", "-", 1)
-    sample_files = glob.glob(
-        os.path.join(project_dir_pattern, "{}*".format(sample_obj.name))
-    )
-    # P123_456 is renamed by Piper to P123-456? Sometimes? Always?
-    sample_files.extend(
-        glob.glob(os.path.join(project_dir_pattern, "{}*".format(piper_sample_name)))
-    )
-
-    sample_done_files = glob.glob(
-        os.path.join(project_dir_pattern, ".{}*.done".format(sample_obj.name))
-    )
-    sample_done_files.extend(
-        glob.glob(
-            os.path.join(project_dir_pattern, ".{}*.done".format(piper_sample_name))
-        )
-    )
-    sample_failed_files = glob.glob(
-        os.path.join(project_dir_pattern, ".{}*.failed".format(sample_obj.name))
+    sample_files = _genotype_analysis_files(
+        get_analysis_dir_index(project_dir_path), sample_obj.name
     )
-    sample_failed_files.extend(
-        glob.glob(
-            os.path.join(project_dir_pattern, ".{}*.failed".format(piper_sample_name))
-        )
-    )
-    sample_valid_files = []
     for sample_file in sample_files:
         sample_dirname, sample_basename = os.path.split(sample_file)
         sample_done_name = os.path.join(
             sample_dirname, ".{}.done".format(sample_basename)
         )
-        if sample_done_name in sample_done_files:
-            sample_valid_files.append(sample_file)
-    if sample_valid_files:
-        return True
-    else:
-        return False
+        if sample_done_name in sample_files:
+            return True
+    return False
 
 
-def remove_previous_genotype_analyses(project_obj):
-    """Remove genotype concordance analysis results for a sample, including
-    .failed and .done files.
-    Doesn't throw an error if it can't read a directory, but does if it can't
-    delete a file it knows about.
+def remove_previous_genotype_analyses(project_obj, sample_obj=None):
+    """Remove genotype concordance analysis results for a sample (or all the
+    samples of the project), including .failed and .done files. They are moved
+    to the trash of the project (see ngi_pipeline.utils.trash) and deleted later.
+    Doesn't throw an error if it can't read a directory or remove a file.
 
     :param NGIProject project_obj: The NGIProject object with relevant NGISamples
+    :param NGISample sample_obj: The relevant NGISample object (optional)
 
     :returns: Nothing
     :rtype: None
     """
-    project_dir_path = os.path.join(
-        project_obj.base_path, "ANALYSIS", project_obj.project_id, "piper_ngi"
-    )
-    project_dir_pattern = os.path.join(project_dir_path, "??_genotype_concordance")
+    project_dir_path = _piper_analysis_dir(project_obj)
     LOG.info("deleting previous analysis in {}".format(project_dir_path))
-    for sample in project_obj:
-        piper_sample_name = sample.name.replace("_", "-", 1)
-        sample_files = glob.glob(
-            os.path.join(project_dir_pattern, "{}*".format(sample.name))
-        )
-        # P123_456 is renamed by Piper to P123-456? Sometimes? Always?
-        sample_files.extend(
-            glob.glob(
-                os.path.join(project_dir_pattern, "{}*".format(piper_sample_name))
-            )
-        )
-        sample_files.extend(
-            glob.glob(
-                os.path.join(project_dir_pattern, ".{}*.done".format(piper_sample_name))
-            )
-        )
-        sample_files.extend(
-            glob.glob(
-                os.path.join(
-                    project_dir_pattern, ".{}*.failed".format(piper_sample_name)
-                )
-            )
-        )
+    index = get_analysis_dir_index(project_dir_path)
+    sample_names = [sample_obj.name] if sample_obj else list(project_obj.samples)
+    sample_files = []
+    for sample_name in sample_names:
+        sample_files.extend(_genotype_analysis_files(index, sample_name))
     if sample_files:
         LOG.info(
             "Deleting genotype files for samples {} under " "{}".format(
-                ", ".join(project_obj.samples), project_dir_path
+                ", ".join(sample_names), project_dir_path
             )
         )
-        errors = []
-        for sample_file in sample_files:
-            LOG.debug("Deleting file {}".format(sample_file))
-            try:
-                if os.path.isdir(sample_file):
-                    shutil.rmtree(sample_file)
-                else:
-                    os.remove(sample_file)
-            except OSError as e:
-                errors.append("{}: {}".format(sample_file, e))
-        if errors:
-            LOG.warning(
-                "Error when removing one or more files: {}".format("\n".join(errors))
-            )
+        try:
+            move_to_trash(sample_files, os.path.dirname(project_dir_path))
+        except OSError as e:
+            LOG.warning("Error when removing one or more files: {}".format(e))
+        invalidate_analysis_dir_index(project_dir_path)
     else:
         LOG.debug(
             "No genotype analysis files found to delete for project {} "
-            "/ samples {}".format(project_obj, ", ".join(project_obj.samples))
+            "/ samples {}".format(project_obj, ", ".join(sample_names))
         )
 
 
 def remove_previous_sample_analyses(project_obj, sample_obj=None):
     """Remove analysis results for a sample, including .failed and .done files.
-    Doesn't throw an error if it can't read a directory, but does if it can't
-    delete a file it knows about.
+    They are moved to the trash of the project (see ngi_pipeline.utils.trash) and
+    deleted later. Doesn't throw an error if it can't read a directory or remove
+    a file.
 
     :param NGIProject project_obj: The NGIProject object with relevant NGISamples
     :param NGISample sample_obj: The relevant NGISample object
@@ -185,20 +165,14 @@ def remove_previous_sample_analyses(project_obj, sample_obj=None):
         LOG.info(
             "Deleting files for samples {}".format(sample_obj or project_obj.samples)
         )
-        errors = []
+        project_dir_path = _piper_analysis_dir(project_obj)
         for sample_file in sample_files:
             LOG.info("Deleting file {}".format(sample_file))
-            try:
-                if os.path.isdir(sample_file):
-                    shutil.rmtree(sample_file)
-                else:
-                    os.remove(sample_file)
-            except OSError as e:
-                errors.append("{}: {}".format(sample_file, e))
-        if errors:
-            LOG.warning(
-                "Error when removing one or more files: {}".format("\n".join(errors))
-            )
+        try:
+            move_to_trash(sample_files, os.path.dirname(project_dir_path))
+        except OSError as e:
+            LOG.warning("Error when removing one or more files: {}".format(e))
+        invalidate_analysis_dir_index(project_dir_path)
     else:
         LOG.debug(
             "No sample analysis files found to delete for project {} "
@@ -218,40 +192,20 @@ def find_previous_sample_analyses(
     :returns: A list of files
     :rtype: list
     """
-    sample_files = (
-        set()
-    )  # This isn't really necessary but scoping makes me want to do it
-    project_dir_path = os.path.join(
-        project_obj.base_path, "ANALYSIS", project_obj.project_id, "piper_ngi"
-    )
-    project_dir_pattern = os.path.join(project_dir_path, "??_*")
+    sample_files = set()
+    index = get_analysis_dir_index(_piper_analysis_dir(project_obj))
     for sample in project_obj:
         if sample_obj and sample.name != sample_obj.name:
             continue
-        sample_files.update(
-            glob.glob(os.path.join(project_dir_pattern, "{}.*".format(sample.name)))
-        )
         # P123_456 is renamed by Piper to P123-456? Sometimes? Always?
         piper_sample_name = sample.name.replace("_", "?", 1)
-        sample_files.update(
-            glob.glob(
-                os.path.join(project_dir_pattern, "{}.*".format(piper_sample_name))
-            )
-        )
-        sample_files.update(
-            glob.glob(
-                os.path.join(
-                    project_dir_pattern, ".{}.*.done".format(piper_sample_name)
-                )
-            )
-        )
-        sample_files.update(
-            glob.glob(
-                os.path.join(
-                    project_dir_pattern, ".{}.*.fail".format(piper_sample_name)
-                )
-            )
-        )
+        for name_pattern in (
+            "{}.*".format(sample.name),
+            "{}.*".format(piper_sample_name),
+            ".{}.*.done".format(piper_sample_name),
+            ".{}.*.fail".format(piper_sample_name),
+        ):
+            sample_files.update(index.files(name_pattern, sample_name=sample.name))
     # Include genotype files?
     if not include_genotype_files:
         sample_files = [
@@ -263,15 +217,15 @@ def find_previous_sample_analyses(
 
 def rotate_previous_analysis(project_obj):
     """Rotates the files from the existing analysis starting at 03_merged_aligments"""
-    project_dir_path = os.path.join(
-        project_obj.base_path, "ANALYSIS", project_obj.project_id, "piper_ngi"
-    )
-    # analysis_move = glob.glob(os.path.join(project_dir_path, '0[3-9]_*'))
+    project_dir_path = _piper_analysis_dir(project_obj)
+    index = get_analysis_dir_index(project_dir_path)
     for sample in project_obj:
         # P123_456 is renamed by Piper to P123-456
         piper_sample_name = sample.name.replace("_", "-", 1)
-        sample_files = glob.glob(
-            os.path.join(project_dir_path, "0[3-9]_*", "{}.*".format(piper_sample_name))
+        sample_files = index.files(
+            "{}.*".format(piper_sample_name),
+            sample_name=sample.name,
+            stage_pattern="0[3-9]_*",
         )
         if sample_files:
             LOG.info(
@@ -304,6 +258,7 @@ def rotate_previous_analysis(project_obj):
                     )
                 )
                 shutil.move(sample_file, previous_analysis_dirpath)
+            invalidate_analysis_dir_index(project_dir_path)
 
 
 def get_finished_seqruns_for_sample(
@@ -543,6 +498,89 @@ SBATCH_HEADER = """#!/bin/bash -l
 """
 
 
+def get_sample_input_bytes(project_obj, sample_obj):
+    """Get the total size of the fastq files of a sample, as listed in the
+    sample object, under the project's DATA directory.
+
+    :param NGIProject project_obj: The NGIProject object
+    :param NGISample sample_obj: The NGISample object
+
+    :returns: The total size in bytes
+    :rtype: int
+    """
+    return total_file_size(
+        os.path.join(
+            project_obj.base_path,
+            "DATA",
+            project_obj.dirname,
+            sample_obj.dirname,
+            libprep.dirname,
+            seqrun.dirname,
+            fastq,
+        )
+        for libprep in sample_obj
+        for seqrun in libprep
+        for fastq in seqrun.fastq_files
+    )
+
+
+def create_fastq_staging_commands(fastq_src_dst_list, manifest_path, config):
+    """Write the fastq files to stage to node-local scratch ($SNIC_TMP) to a
+    manifest and return the sbatch commands that copy them in parallel.
+
+    The free space on scratch is checked first; if it cannot hold the fastq files
+    plus the "reserved_scratch" space, or if copying fails, the fastq files are
+    instead linked from project storage so that they are read from there. The
+    number of parallel copies is set by the "parallel_streams" option:
+
+        piper:
+            fastq_staging:
+                parallel_streams: 4
+                reserved_scratch: "200G"   # scratch space to leave for the analysis
+
+    :param list fastq_src_dst_list: The [source, destination] pairs of the fastq
+                                    files; destinations are relative to $SNIC_TMP
+    :param str manifest_path: The path to write the manifest to
+    :param dict config: The parsed configuration file
+
+    :returns: The list of sbatch command lines
+    :rtype: list
+    """
+    staging_config = config.get("piper", {}).get("fastq_staging") or {}
+    parallel_streams = int(staging_config.get("parallel_streams", 4))
+    reserved_scratch = (
+        slurm_memory_to_bytes(str(staging_config.get("reserved_scratch", 0))) or 0
+    )
+    with open(manifest_path, "w") as f:
+        for src_file, dst_file in fastq_src_dst_list:
+            f.write("{}\t{}\n".format(src_file, dst_file))
+    fastq_bytes = total_file_size(src_file for src_file, _ in fastq_src_dst_list)
+    # Manifest lines become "source destination" argument pairs, run from $SNIC_TMP
+    manifest_args = "cd $SNIC_TMP && tr '\\t' '\\n' < {} | xargs -d '\\n' -n 2".format(
+        manifest_path
+    )
+    return [
+        "NGI_SCRATCH_NEEDED={:d}".format(fastq_bytes + reserved_scratch),
+        "NGI_SCRATCH_FREE=$(( $(df -Pk $SNIC_TMP | awk 'NR == 2 {print $4}') * 1024 ))",
+        "NGI_STAGING_RC=1",
+        "if (( NGI_SCRATCH_FREE >= NGI_SCRATCH_NEEDED ))",
+        "then",
+        "  echo 'Staging {} fastq files with {} parallel streams'".format(
+            len(fastq_src_dst_list), parallel_streams
+        ),
+        "  ({} -P {:d} rsync -rptoDL)".format(manifest_args, parallel_streams),
+        "  NGI_STAGING_RC=$?",
+        "else",
+        '  echo "Only $NGI_SCRATCH_FREE bytes free on scratch, $NGI_SCRATCH_NEEDED needed"',
+        "fi",
+        "if [[ $NGI_STAGING_RC != 0 ]]",
+        "then",
+        "  echo 'Reading the fastq files from project storage'",
+        "  ({} ln -sf)".format(manifest_args),
+        "fi",
+    ]
+
+
 def create_sbatch_header(
     slurm_project_id,
     slurm_queue,
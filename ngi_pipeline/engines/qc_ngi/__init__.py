@@ -1 +1 @@
-from .launchers import analyze
+from .launchers import analyze, create_job_array, submit_job_array
@@ -2,25 +2,31 @@
 fastq_screen."""
 
 import os
-import re
-import subprocess
 
 from ngi_pipeline.engines.qc_ngi.workflows import return_cls_for_workflow
 from ngi_pipeline.log.loggers import minimal_logger
 from ngi_pipeline.utils.classes import with_ngi_config
 from ngi_pipeline.utils.filesystem import (
-    execute_command_line,
     rotate_file,
     safe_makedir,
 )
 from ngi_pipeline.utils.parsers import find_fastq_read_pairs
+from ngi_pipeline.utils.slurm import SlurmJobArray, submit_slurm_script
 
 LOG = minimal_logger(__name__)
 
 
 @with_ngi_config
-def analyze(project, sample, quiet=False, config=None, config_file_path=None):
-    """The main entry point for the qc pipeline."""
+def analyze(
+    project, sample, quiet=False, job_array=None, config=None, config_file_path=None
+):
+    """The main entry point for the qc pipeline.
+
+    :param NGIProject project: The NGIProject
+    :param NGISample sample: The NGISample
+    :param SlurmJobArray job_array: Add the sbatch file to this job array (see
+                                    create_job_array) instead of submitting it
+    """
     ## TODO implement "quiet" feature
     ## TODO implement mailing on failure
     LOG.info("Launching qc analysis for project/sample {}/{}".format(project, sample))
@@ -48,8 +54,17 @@ def analyze(project, sample, quiet=False, config=None, config_file_path=None):
     qc_cl_list = return_cls_for_workflow("qc", paired_fastq_files, sample_analysis_path)
 
     sbatch_file_path = create_sbatch_file(qc_cl_list, project, sample, config)
+    if job_array is not None:
+        array_task_id = job_array.add_task(sbatch_file_path, key=sample)
+        LOG.info(
+            "Added qc sbatch file for project/sample "
+            '"{}"/"{}" to job array {} as task {}'.format(
+                project, sample, job_array.job_name, array_task_id
+            )
+        )
+        return
     try:
-        slurm_job_id = queue_sbatch_file(sbatch_file_path)
+        slurm_job_id = queue_sbatch_file(sbatch_file_path, config=config)
     except RuntimeError as e:
         LOG.error(
             "Failed to queue qc sbatch file for project/sample " '"{}"/"{}"!'.format(
@@ -61,39 +76,87 @@ def analyze(project, sample, quiet=False, config=None, config_file_path=None):
             "Queued qc sbatch file for project/sample "
             '"{}"/"{}": slurm job id {}'.format(project, sample, slurm_job_id)
         )
-        slurm_jobid_file = os.path.join(
-            log_dir_path, "{}-{}.slurmjobid".format(project.project_id, sample)
+        write_slurm_jobid_file(project, sample, slurm_job_id)
+
+
+def write_slurm_jobid_file(project, sample, slurm_job_id):
+    """Write the slurm job id of the qc of a sample to the logs directory.
+
+    :param NGIProject project: The NGIProject
+    :param NGISample sample: The NGISample
+    :param slurm_job_id: The slurm job id, or the job specification of a job array task
+    """
+    slurm_jobid_file = os.path.join(
+        project.base_path,
+        "ANALYSIS",
+        project.project_id,
+        "qc_ngi",
+        "logs",
+        "{}-{}.slurmjobid".format(project.project_id, sample),
+    )
+    LOG.info(
+        'Writing slurm job id "{}" to file "{}"'.format(slurm_job_id, slurm_jobid_file)
+    )
+    try:
+        with open(slurm_jobid_file, "w") as f:
+            f.write("{}\n".format(slurm_job_id))
+    except IOError as e:
+        LOG.warning(
+            "Could not write slurm job id for project/sample "
+            '{}/{} to file "{}" ({})'.format(project, sample, slurm_jobid_file, e)
         )
-        LOG.info(
-            'Writing slurm job id "{}" to file "{}"'.format(
-                slurm_job_id, slurm_jobid_file
-            )
+
+
+@with_ngi_config
+def create_job_array(project, config=None, config_file_path=None):
+    """Create the job array to collect the qc sbatch files of the samples of a
+    project in, if the slurm "job_arrays" config option is set. At most
+    "array_throttle" of the samples are analyzed at the same time.
+
+    :param NGIProject project: The NGIProject
+
+    :returns: The job array, or None if job arrays are not used
+    :rtype: SlurmJobArray
+    """
+    slurm_config = config.get("slurm", {})
+    if not slurm_config.get("job_arrays"):
+        return None
+    return SlurmJobArray(
+        array_dir=os.path.join(
+            project.base_path, "ANALYSIS", project.project_id, "qc_ngi", "sbatch"
+        ),
+        job_name="qc_{}".format(project.project_id),
+        throttle=slurm_config.get("array_throttle"),
+    )
+
+
+def submit_job_array(project, job_array, config=None):
+    """Submit the qc sbatch files collected in a job array and write the job
+    specification of each task to the slurm job id file of its sample.
+
+    :param NGIProject project: The NGIProject
+    :param SlurmJobArray job_array: The job array holding the sbatch files
+    :param dict config: The parsed configuration file
+    """
+    try:
+        job_array.submit(config=config)
+    except (RuntimeError, ValueError) as e:
+        LOG.error(
+            'Failed to queue qc job array for project "{}": {}'.format(project, e)
         )
-        try:
-            with open(slurm_jobid_file, "w") as f:
-                f.write("{}\n".format(slurm_job_id))
-        except IOError as e:
-            LOG.warning(
-                "Could not write slurm job id for project/sample "
-                '{}/{} to file "{}" ({})'.format(project, sample, slurm_jobid_file, e)
-            )
+        return
+    for sample, _, slurm_job_spec in job_array.task_job_specs():
+        write_slurm_jobid_file(project, sample, slurm_job_spec)
 
 
-def queue_sbatch_file(sbatch_file_path):
+def queue_sbatch_file(sbatch_file_path, config=None):
     LOG.info("Queueing sbatch file {}".format(sbatch_file_path))
-    p_handle = execute_command_line(
-        "sbatch {}".format(sbatch_file_path),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    p_out, p_err = p_handle.communicate()
     try:
-        slurm_job_id = re.match(r"Submitted batch job (\d+)", p_out).groups()[0]
-    except AttributeError:
+        return submit_slurm_script(sbatch_file_path, config=config)
+    except RuntimeError as e:
         raise RuntimeError(
-            'Could not submit sbatch file "{}": ' "{}".format(sbatch_file_path, p_err)
+            'Could not submit sbatch file "{}": ' "{}".format(sbatch_file_path, e)
         )
-    return int(slurm_job_id)
 
 
 SBATCH_HEADER = """#!/bin/bash -l
@@ -109,6 +172,16 @@ SBATCH_HEADER = """#!/bin/bash -l
 
 
 def create_sbatch_file(cl_list, project, sample, config):
+    """Write the sbatch file for the qc of a sample.
+
+    :param list cl_list: The lists of command lines to execute
+    :param NGIProject project: The NGIProject
+    :param NGISample sample: The NGISample
+    :param dict config: The parsed configuration file
+
+    :returns: The path to the sbatch file
+    :rtype: str
+    """
     project_analysis_path = os.path.join(
         project.base_path, "ANALYSIS", project.project_id, "qc_ngi"
     )
@@ -7,6 +7,7 @@ import subprocess
 import sys
 
 from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.checksums import checksum_command
 from ngi_pipeline.utils.classes import with_ngi_config
 from ngi_pipeline.utils.filesystem import load_modules, safe_makedir
 from ngi_pipeline.utils.pyutils import flatten
@@ -61,9 +62,22 @@ def workflow_qc(input_files, output_dir, config):
                 )
             )
     # If specified in the config generate md5 for the fastq files
-    if config.get("qc", {}).get("make_md5", False):
-        md5_fls = 'files_for_md5="{}"'.format(" ".join(flatten(input_files)))
-        md5_cmd = "for fl in $files_for_md5; do md5sum $fl | awk '{printf $1}' > ${fl}.md5; done"
+    fastq_files = list(flatten(input_files))
+    if config.get("qc", {}).get("make_md5", False) and fastq_files:
+        # the fastq files are only hashed once, however many times qc is run
+        md5_fls = 'files_for_md5="{}"'.format(" ".join(fastq_files))
+        md5_cmd = checksum_command(
+            "files_for_md5",
+            os.path.join(output_dir, "checksums.json"),
+            base_dir=os.path.commonpath(
+                [os.path.dirname(os.path.abspath(x)) for x in fastq_files]
+            ),
+            md5sum_file_path=os.path.join(
+                output_dir,
+                "{}.md5".format(os.path.basename(os.path.normpath(output_dir))),
+            ),
+            threads=config.get("qc", {}).get("checksum_threads", 4),
+        )
         cl_list.append([md5_fls, md5_cmd])
     return cl_list
 
@@ -1,7 +1,11 @@
 from ngi_pipeline.log.loggers import minimal_logger
 from ngi_pipeline.utils.classes import with_ngi_config
 from ngi_pipeline.database.classes import CharonSession, CharonError
-from ngi_pipeline.engines.rna_ngi.database import get_session, ProjectAnalysis
+from ngi_pipeline.database.tracking import (
+    ProjectAnalysis,
+    delete_analyses,
+    get_db_session,
+)
 from ngi_pipeline.utils.charon import recurse_status_for_sample
 from ngi_pipeline.utils.communication import mail_analysis
 
@@ -13,14 +17,14 @@ LOG = minimal_logger(__name__)
 
 def remove_analysis(projectid):
     job_id = None
-    with get_session() as db_session:
+    with get_db_session() as db_session:
         job = (
             db_session.query(ProjectAnalysis)
             .filter(ProjectAnalysis.project_id == projectid)
             .one()
         )
         job_id = job.job_id
-        db_session.delete(job)
+        delete_analyses(db_session, ProjectAnalysis, project_id=projectid)
         db_session.commit()
     return job_id
 
@@ -29,57 +33,59 @@ def remove_analysis(projectid):
 def update_charon_with_local_jobs_status(
     quiet=False, config=None, config_file_path=None
 ):
-    jobs = []
-    with get_session() as db_session:
+    with get_db_session(config=config) as db_session:
         jobs = (
             db_session.query(ProjectAnalysis)
             .filter(ProjectAnalysis.engine == "rna_ngi")
             .all()
         )
+        for job in jobs:
+            _update_charon_with_job_status(job, db_session)
 
-    for job in jobs:
-        # check if it's running
-        try:
-            os.kill(job.job_id, 0)
-        except:
-            # Process is not running anymore
-            exit_code_path = os.path.join(
-                job.project_base_path,
-                "ANALYSIS",
-                job.project_id,
-                "rna_ngi",
-                "nextflow_exit_code.out",
-            )
-            if os.path.isfile(exit_code_path):
-                with open(exit_code_path, "r") as exit_file:
-                    exit_code = exit_file.read()
-                    if exit_code == "0":
-                        update_analysis(job.project_id, True)
-                        # clean work dir and merged fastqs
-                        nextflow_work_path = os.path.join(
-                            job.project_base_path,
-                            "ANALYSIS",
-                            job.project_id,
-                            "rna_ngi",
-                            "work",
-                        )
-                        shutil.rmtree(nextflow_work_path)
-                        merged_path = os.path.join(
-                            job.project_base_path,
-                            "ANALYSIS",
-                            job.project_id,
-                            "rna_ngi",
-                            "fastqs",
-                        )
-                        shutil.rmtree(merged_path)
 
-                    else:
-                        update_analysis(job.project_id, False)
-            else:
-                update_analysis(job.project_id, False)
-            with get_session() as db_session:
-                db_session.delete(job)
-                db_session.commit()
+def _update_charon_with_job_status(job, db_session):
+    """Report the outcome of a finished job to Charon and stop tracking it."""
+    # check if it's running
+    try:
+        os.kill(job.job_id, 0)
+    except:
+        # Process is not running anymore
+        exit_code_path = os.path.join(
+            job.project_base_path,
+            "ANALYSIS",
+            job.project_id,
+            "rna_ngi",
+            "nextflow_exit_code.out",
+        )
+        if os.path.isfile(exit_code_path):
+            with open(exit_code_path, "r") as exit_file:
+                exit_code = exit_file.read()
+                if exit_code == "0":
+                    update_analysis(job.project_id, True)
+                    # clean work dir and merged fastqs
+                    nextflow_work_path = os.path.join(
+                        job.project_base_path,
+                        "ANALYSIS",
+                        job.project_id,
+                        "rna_ngi",
+                        "work",
+                    )
+                    shutil.rmtree(nextflow_work_path)
+                    merged_path = os.path.join(
+                        job.project_base_path,
+                        "ANALYSIS",
+                        job.project_id,
+                        "rna_ngi",
+                        "fastqs",
+                    )
+                    shutil.rmtree(merged_path)
+
+                else:
+                    update_analysis(job.project_id, False)
+        else:
+            update_analysis(job.project_id, False)
+        db_session.delete(job)
+        db_session.commit()
 
 
 def update_analysis(project_id, status):
@@ -136,7 +142,7 @@ def record_project_job(
     config=None,
     config_file_path=None,
 ):
-    with get_session() as db_session:
+    with get_db_session(config=config) as db_session:
         project_db_obj = ProjectAnalysis(
             project_id=project.project_id,
             job_id=job_id,
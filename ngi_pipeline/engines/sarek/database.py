@@ -1,4 +1,5 @@
 import contextlib
+import threading
 
 from ngi_pipeline.database.classes import CharonError, CharonSession
 from ngi_pipeline.engines.sarek.process import (
@@ -8,8 +9,19 @@ from ngi_pipeline.engines.sarek.process import (
     ProcessExitStatusUnknown,
     ProcessConnector,
     SlurmConnector,
+    LocalSchedulerConnector,
+)
+from ngi_pipeline.database.tracking import (
+    AnalysisAttempt,
+    FailedBatch,
+    get_db_session,
+    harvest_job_metrics,
+    ParsedMetricsStore,
+    SampleAnalysis,
+    STATE_DONE,
+    STATE_FAILED,
+    STATE_RUNNING,
 )
-from ngi_pipeline.engines.piper_ngi.database import get_db_session, SampleAnalysis
 from ngi_pipeline.engines.sarek.exceptions import (
     AnalysisPipelineNotSpecifiedError,
     DatabaseProjectException,
@@ -21,8 +33,11 @@ from ngi_pipeline.engines.sarek.exceptions import (
     AlignmentStatusForAnalysisStatusNotFoundError,
     SampleUpdateError,
     SeqrunUpdateError,
+    SeqrunsUpdateError,
     AnalysisReferenceNotSpecifiedError,
 )
+from ngi_pipeline.utils.pyutils import ordered_thread_map
+from ngi_pipeline.utils.spool import get_job_completion_spool
 
 
 class CharonConnector(object):
@@ -58,6 +73,80 @@ class CharonConnector(object):
         self.config = config
         self.log = log
         self.charon_session = charon_session or CharonSession(config=self.config)
+        # the libpreps and seqruns of the samples prefetched with `prefetched_sample`, keyed by (projectid, sampleid)
+        self._sample_trees = {}
+        self._sample_trees_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def prefetched_sample(self, projectid, sampleid):
+        """
+        Context manager fetching the libpreps and seqruns of a sample from Charon once on entry, so that the libprep
+        QC status and seqrun alignment status lookups for the sample within the context are answered from memory
+        instead of with a request each. The prefetched state is dropped on exit, or as soon as the sample is updated
+        through this connector.
+
+        :param projectid: the project id of the sample
+        :param sampleid: the sample id
+        """
+        self.prefetch_sample(projectid, sampleid)
+        try:
+            yield
+        finally:
+            self.forget_sample(projectid, sampleid)
+
+    def prefetch_sample(self, projectid, sampleid):
+        """
+        Fetch the libpreps and the seqruns of each libprep of a sample from Charon and keep them for subsequent
+        lookups, until `forget_sample` is called. If the sample could not be fetched, the lookups will query Charon as
+        usual.
+
+        :param projectid: the project id of the sample
+        :param sampleid: the sample id
+        :return: a dict with the libprep objects keyed by libprepid under "libpreps" and a dict for each libprepid,
+        with the seqrun objects keyed by seqrunid, under "seqruns", or None if the sample could not be fetched
+        """
+        try:
+            libpreps = {
+                x["libprepid"]: x
+                for x in self.charon_session.sample_get_libpreps(projectid, sampleid)[
+                    "libpreps"
+                ]
+            }
+            seqruns = {
+                libprepid: {
+                    x["seqrunid"]: x
+                    for x in self.charon_session.libprep_get_seqruns(
+                        projectid, sampleid, libprepid
+                    )["seqruns"]
+                }
+                for libprepid in libpreps
+            }
+        except (KeyError, CharonError) as e:
+            self.log.warning(
+                "could not prefetch libpreps and seqruns for sample {} in project {}: {}".format(
+                    sampleid, projectid, e
+                )
+            )
+            return None
+        sample_tree = {"libpreps": libpreps, "seqruns": seqruns}
+        with self._sample_trees_lock:
+            self._sample_trees[(projectid, sampleid)] = sample_tree
+        return sample_tree
+
+    def forget_sample(self, projectid, sampleid):
+        """
+        Drop the libpreps and seqruns prefetched for a sample, if any.
+
+        :param projectid: the project id of the sample
+        :param sampleid: the sample id
+        :return: None
+        """
+        with self._sample_trees_lock:
+            self._sample_trees.pop((projectid, sampleid), None)
+
+    def _prefetched_sample(self, projectid, sampleid):
+        with self._sample_trees_lock:
+            return self._sample_trees.get((projectid, sampleid))
 
     def _fetch_project_field(self, projectid, field_key, exception_type=None):
         try:
@@ -96,6 +185,10 @@ class CharonConnector(object):
             raise analysis_status_exception
 
     def libprep_qc_status(self, projectid, sampleid, libprepid):
+        sample_tree = self._prefetched_sample(projectid, sampleid)
+        libprep = sample_tree["libpreps"].get(libprepid) if sample_tree else None
+        if libprep and "qc" in libprep:
+            return libprep["qc"]
         try:
             return self.charon_session.libprep_get(projectid, sampleid, libprepid)["qc"]
         except (KeyError, CharonError) as e:
@@ -110,6 +203,14 @@ class CharonConnector(object):
             raise sample_exception
 
     def seqrun_alignment_status(self, projectid, sampleid, libprepid, seqrunid):
+        sample_tree = self._prefetched_sample(projectid, sampleid)
+        seqrun = (
+            sample_tree["seqruns"].get(libprepid, {}).get(seqrunid)
+            if sample_tree
+            else None
+        )
+        if seqrun and "alignment_status" in seqrun:
+            return seqrun["alignment_status"]
         try:
             return self.charon_session.seqrun_get(
                 projectid, sampleid, libprepid, seqrunid
@@ -183,12 +284,16 @@ class CharonConnector(object):
         recurse=False,
         restrict_to_libpreps=None,
         restrict_to_seqruns=None,
+        max_workers=None,
     ):
         """
         Update a sample according to the `sample_update_kwargs` dict. If recurse is True, the affected seqruns will be
         updated according to the `seqrun_update_kwargs` dict as well. Optionally, the libpreps and seqruns to
         recurse into can be restricted.
 
+        The seqruns are listed and updated on a pool of `max_workers` threads. An update is attempted for every seqrun
+        even if updating some of them fails, and the sample is only updated if all seqruns were updated.
+
         :param projectid: the Charon projectid of the project to update
         :param sampleid: the Charon sampleid of the sample to update
         :param sample_update_kwargs: a dict to pass as keyword arguments to the
@@ -201,48 +306,95 @@ class CharonConnector(object):
         :param restrict_to_seqruns: dict with libprepids as keys and a list with seqrunids as values. If specified,
         the seqruns to update for a libprepid will be restricted to the seqruns in the list. Default is to update
         all seqruns for the libpreps iterated over
+        :param max_workers: the number of seqruns to update concurrently. If not specified, the "charon_workers"
+        option in the sarek section of the configuration will be used, defaulting to one seqrun at a time
+        :raises: a SeqrunUpdateError if a seqrun could not be updated (a SeqrunsUpdateError, holding all of them, if
+        several seqruns could not be updated) or a SampleUpdateError if the sample could not be updated
         :return: a response object
         """
+        if max_workers is None:
+            max_workers = (self.config or {}).get("sarek", {}).get("charon_workers", 1)
         try:
             if recurse:
-                # iterate over all libpreps, taking the restrict_to_libpreps argument into account
-                for libprep in self.sample_libpreps(
-                    projectid, sampleid, restrict_to=restrict_to_libpreps
-                ):
-                    libprepid = libprep["libprepid"]
-                    # iterate over the seqruns for the libprep and restrict to the specified seqruns if the libprep is
-                    # a key in the restrict_to_seqruns dict
-                    for seqrun in self.libprep_seqruns(
-                        projectid,
-                        sampleid,
-                        libprepid,
-                        restrict_to=restrict_to_seqruns.get(libprepid)
-                        if restrict_to_seqruns
-                        else None,
-                    ):
-                        try:
-                            # set the alignment status on the seqrun according to the mapping
-                            self.charon_session.seqrun_update(
-                                projectid,
-                                sampleid,
-                                libprepid,
-                                seqrun["seqrunid"],
-                                **seqrun_update_kwargs,
-                            )
-                        except CharonError as e:
-                            raise SeqrunUpdateError(
-                                projectid,
-                                sampleid,
-                                libprepid,
-                                seqrun["seqrunid"],
-                                reason=e,
-                            )
+                self._set_seqrun_attribute(
+                    projectid,
+                    sampleid,
+                    seqrun_update_kwargs,
+                    restrict_to_libpreps,
+                    restrict_to_seqruns,
+                    max_workers,
+                )
             # lastly, update the analysis status of the sample
             return self.charon_session.sample_update(
                 projectid, sampleid, **sample_update_kwargs
             )
         except CharonError as e:
             raise SampleUpdateError(projectid, sampleid, reason=e)
+        finally:
+            # whatever was prefetched for the sample may no longer be accurate
+            self.forget_sample(projectid, sampleid)
+
+    def _set_seqrun_attribute(
+        self,
+        projectid,
+        sampleid,
+        seqrun_update_kwargs,
+        restrict_to_libpreps,
+        restrict_to_seqruns,
+        max_workers,
+    ):
+        """
+        Update the seqruns of a sample on behalf of `set_sample_attribute`, see there for the arguments.
+        """
+        # iterate over all libpreps, taking the restrict_to_libpreps argument into account
+        libprepids = [
+            libprep["libprepid"]
+            for libprep in self.sample_libpreps(
+                projectid, sampleid, restrict_to=restrict_to_libpreps
+            )
+        ]
+
+        # list the seqruns for each libprep and restrict to the specified seqruns if the libprep is a key in the
+        # restrict_to_seqruns dict
+        def _libprep_seqruns(libprepid):
+            return self.libprep_seqruns(
+                projectid,
+                sampleid,
+                libprepid,
+                restrict_to=(
+                    restrict_to_seqruns.get(libprepid) if restrict_to_seqruns else None
+                ),
+            )
+
+        seqrun_keys = []
+        for libprepid, seqruns, exception in ordered_thread_map(
+            _libprep_seqruns, libprepids, max_workers=max_workers
+        ):
+            if exception is not None:
+                raise exception
+            seqrun_keys.extend((libprepid, seqrun["seqrunid"]) for seqrun in seqruns)
+
+        def _seqrun_update(seqrun_key):
+            try:
+                # set the alignment status on the seqrun according to the mapping
+                return self.charon_session.seqrun_update(
+                    projectid, sampleid, *seqrun_key, **seqrun_update_kwargs
+                )
+            except CharonError as e:
+                raise SeqrunUpdateError(projectid, sampleid, *seqrun_key, reason=e)
+
+        # attempt to update all seqruns before giving up
+        errors = [
+            exception
+            for _, _, exception in ordered_thread_map(
+                _seqrun_update, seqrun_keys, max_workers=max_workers
+            )
+            if exception is not None
+        ]
+        if len(errors) == 1:
+            raise errors[0]
+        if errors:
+            raise SeqrunsUpdateError(projectid, sampleid, errors)
 
     def sample_libpreps(self, projectid, sampleid, restrict_to=None):
         """
@@ -253,6 +405,13 @@ class CharonConnector(object):
         :param restrict_to: list with libprepids. If specified, only libpreps whose id is in the list will be returned
         :return: list of libpreps, represented as dicts, belonging to the specified sample
         """
+        sample_tree = self._prefetched_sample(projectid, sampleid)
+        if sample_tree:
+            return [
+                x
+                for x in sample_tree["libpreps"].values()
+                if restrict_to is None or x["libprepid"] in restrict_to
+            ]
         try:
             return [
                 x
@@ -276,6 +435,13 @@ class CharonConnector(object):
         :param restrict_to: list with seqrunids. If specified, only seqruns whose id is in the list will be returned
         :return: list of seqruns, represented as dicts, belonging to the specified libprep
         """
+        sample_tree = self._prefetched_sample(projectid, sampleid)
+        if sample_tree and libprepid in sample_tree["seqruns"]:
+            return [
+                x
+                for x in sample_tree["seqruns"][libprepid].values()
+                if restrict_to is None or x["seqrunid"] in restrict_to
+            ]
         try:
             return [
                 x
@@ -328,13 +494,22 @@ class CharonConnector(object):
 class TrackingConnector(object):
     """
     The TrackingConnector class provides an interface to the local SQLite tracking database. Underneath, it uses some
-    of the code from ngi_pipeline.engines.piper_ngi.database
+    of the code from ngi_pipeline.database.tracking
     """
 
     # mapping between process connector types and the corresponding db field storing the job identifier
     PIDFIELD_FROM_PROCESS_CONNECTOR_TYPE = {
         ProcessConnector: "process_id",
         SlurmConnector: "slurm_job_id",
+        LocalSchedulerConnector: "local_job_id",
+    }
+
+    # mapping between a process status and the corresponding job state to record in the tracking database
+    STATE_FROM_PROCESS_STATUS = {
+        ProcessRunning: STATE_RUNNING,
+        ProcessExitStatusSuccessful: STATE_DONE,
+        ProcessExitStatusFailed: STATE_FAILED,
+        ProcessExitStatusUnknown: STATE_FAILED,
     }
 
     def __init__(self, config, log, tracking_session=None):
@@ -349,10 +524,14 @@ class TrackingConnector(object):
         self.config = config
         self.log = log
         self.tracking_session = tracking_session
+        self._defer_commit = False
+        self.job_completion_spool = get_job_completion_spool("sarek", config)
+        self._spooled_records = []
+        self._metrics_store = ParsedMetricsStore(config=config)
 
     class _SampleAnalysis(SampleAnalysis):
         """
-        Subclassing the SampleAnalysis model from ngi_pipeline.engines.piper_ngi.database so that we can override
+        Subclassing the SampleAnalysis model from ngi_pipeline.database.tracking so that we can override
         stuff if necessary
         """
 
@@ -364,6 +543,25 @@ class TrackingConnector(object):
             process_connector_type
         ]
 
+    @staticmethod
+    def state_from_process_status(process_status):
+        return TrackingConnector.STATE_FROM_PROCESS_STATUS[process_status]
+
+    @staticmethod
+    def process_status_from_state(state, exit_code):
+        """
+        Translate a terminal state recorded in the tracking database back into the corresponding ProcessStatus type
+
+        :param state: the recorded state, one of the terminal states
+        :param exit_code: the recorded exit code, or None if it could not be determined
+        :return: the ProcessExitStatus type corresponding to the recorded state and exit code
+        """
+        if state == STATE_DONE:
+            return ProcessExitStatusSuccessful
+        if exit_code is None:
+            return ProcessExitStatusUnknown
+        return ProcessExitStatusFailed
+
     @contextlib.contextmanager
     def db_session(self):
         """
@@ -377,6 +575,106 @@ class TrackingConnector(object):
                 self.tracking_session = db_session
                 yield self.tracking_session
 
+    @contextlib.contextmanager
+    def deferred_commit(self):
+        """
+        Context manager that keeps a database session open and holds back the commits of the changes made to the
+        tracking database within the context, committing them all once when the context exits
+        :return: a database session
+        """
+        with self.db_session() as db_session:
+            self._defer_commit = True
+            try:
+                yield db_session
+            finally:
+                self._defer_commit = False
+                self._commit(db_session)
+
+    def _commit(self, db_session):
+        if not self._defer_commit:
+            db_session.commit()
+            # the consumed job completion records can be released once their outcome has been committed
+            if self._spooled_records:
+                self.job_completion_spool.acknowledge(self._spooled_records)
+                self._spooled_records = []
+
+    def job_completion_commands(self, projectid, sampleid, analysis_type):
+        """
+        Get the shell commands a job should run when it has finished, in order to report its outcome through the job
+        completion spool. The exit code is expected in the shell variable NGI_EXIT_CODE.
+
+        :param projectid: project id for the sample
+        :param sampleid: sample id for the sample
+        :param analysis_type: the name of the analysis instance class (e.g. SarekAnalysisGermline)
+        :return: a list of shell commands, or None if no job completion spool is configured
+        """
+        if self.job_completion_spool is None:
+            return None
+        return self.job_completion_spool.job_finished_commands(
+            projectid, sampleid, analysis_type, "NGI_EXIT_CODE"
+        )
+
+    def consume_job_completions(self):
+        """
+        Record the outcome reported by the jobs that have finished since the last time, as found in the job completion
+        spool, for the analyses tracked in the local tracking database. The records are marked as consumed once the
+        changes have been committed.
+
+        :return: the number of analyses updated
+        """
+        if self.job_completion_spool is None:
+            return 0
+        records = self.job_completion_spool.new_records()
+        with self.db_session() as db_session:
+            n_updated = self._SampleAnalysis.record_job_completions(
+                db_session, "sarek", records
+            )
+            self._spooled_records.extend(records)
+            self._commit(db_session)
+        return n_updated
+
+    def prune_job_completions(self):
+        """
+        Remove the job completion records consumed long enough ago, as set by the max_age_days of the job completion
+        spool
+
+        :return: None
+        """
+        if self.job_completion_spool is not None:
+            self.job_completion_spool.prune()
+
+    @property
+    def metrics_store(self):
+        """
+        The store of the metrics parsed from the analysis results, which is kept in the tracking database also when the
+        analyses are tracked through another session
+        :return: a ParsedMetricsStore instance
+        """
+        return self._metrics_store
+
+    def store_parsed_metrics(self):
+        """
+        Write the analysis metrics parsed since the last time to the tracking database, in a session of their own
+
+        :return: the number of metrics written
+        """
+        return self.metrics_store.flush()
+
+    def harvest_job_metrics(self, analyses):
+        """
+        Store the resource usage of the slurm jobs of finished analyses in the tracking database, if the
+        "harvest_job_metrics" option in the slurm section of the configuration is set
+
+        :param analyses: the finished analyses, as instances of SampleAnalysis
+        :return: the number of jobs the metrics were stored for
+        """
+        if not analyses or not self.config.get("slurm", {}).get("harvest_job_metrics"):
+            return 0
+        with self.db_session() as db_session:
+            n_harvested = harvest_job_metrics(db_session, analyses)
+            self._commit(db_session)
+        return n_harvested
+
     def record_process_sample(
         self,
         projectid,
@@ -386,10 +684,14 @@ class TrackingConnector(object):
         engine,
         pid,
         process_connector_type,
+        input_bytes=None,
+        array_task_id=None,
+        batch_id=None,
     ):
         """
         Add the processing details for a sample as a record in the tracking database. The database model is defined
-        by the _SampleAnalysis class.
+        by the _SampleAnalysis class. The analysis is recorded as the next attempt at analyzing the sample since the
+        last time its analysis finished successfully.
 
         :param projectid: project id for the sample
         :param sampleid: sample id for the sample
@@ -398,10 +700,17 @@ class TrackingConnector(object):
         :param engine: the name of the analysis engine (e.g. sarek)
         :param pid: the process or job id for the analysis
         :param process_connector_type: the type of the process connector used to start the analysis
+        :param input_bytes: the total size of the input fastq files, if known
+        :param array_task_id: the task id, if the analysis was submitted as part of a slurm job array
+        :param batch_id: the id of the batch, if the sample was analyzed together with other samples in one run
         """
         # different database fields are used to record the process id depending on if it's a slurm job or a local job,
         # therefore we'll map the process connector type to the corresponding name of the field
         pidfield = self.pidfield_from_process_connector_type(process_connector_type)
+        with self.db_session() as db_session:
+            attempt = AnalysisAttempt.next_attempt(
+                db_session, engine, projectid, sampleid, analysis_type
+            )
         db_obj = self._SampleAnalysis(
             project_id=projectid,
             project_name=projectid,
@@ -409,31 +718,118 @@ class TrackingConnector(object):
             project_base_path=project_base_path,
             workflow=analysis_type,
             engine=engine,
+            input_bytes=input_bytes,
+            slurm_array_task_id=array_task_id,
+            attempt=attempt,
+            batch_id=batch_id,
             **{pidfield: pid},
         )
+        if attempt > 1:
+            self.log.info(
+                "{} - {}: recorded as attempt {} at the analysis".format(
+                    projectid, sampleid, attempt
+                )
+            )
 
         with self.db_session() as db_session:
             db_session.add(db_obj)
-            db_session.commit()
+            self._commit(db_session)
 
     def remove_analysis(self, analysis):
         """
-        Remove an analysis record from the database
+        Remove an analysis record from the database. If the analysis finished successfully, the count of attempts at
+        analyzing the sample starts over
         :param analysis: the analysis record, as an instance of SampleAnalysis, to remove from the database
         """
         with self.db_session() as db_session:
+            if analysis.state == STATE_DONE:
+                AnalysisAttempt.reset(
+                    db_session,
+                    analysis.project_id,
+                    analysis.sample_id,
+                    analysis.workflow,
+                )
             db_session.delete(analysis)
-            db_session.commit()
+            self._commit(db_session)
+
+    def update_analysis(self, analysis):
+        """
+        Persist changes made to an analysis record, e.g. a recorded job state
+        :param analysis: the analysis record, as an instance of SampleAnalysis, that has been modified
+        """
+        with self.db_session() as db_session:
+            self._commit(db_session)
+
+    def record_failed_batch(
+        self, projectid, sampleid, analysis_type, batch_id, work_dir
+    ):
+        """
+        Record that the run of a batch of samples did not finish successfully for a sample, so that the work
+        directory kept for resuming the run can be removed once it is no longer needed, see `stale_failed_batches`
+        :param projectid: project id for the sample
+        :param sampleid: sample id for the sample
+        :param analysis_type: the name of the analysis instance class (e.g. SarekAnalysisGermline)
+        :param batch_id: the id of the batch the sample was analyzed in
+        :param work_dir: the path to the work directory of the batch
+        """
+        with self.db_session() as db_session:
+            FailedBatch.record(
+                db_session,
+                "sarek",
+                projectid,
+                sampleid,
+                analysis_type,
+                batch_id,
+                work_dir,
+            )
+            self._commit(db_session)
+
+    def stale_failed_batches(self, succeeded_analyses, max_age_days=None):
+        """
+        Get the failed batches whose work directory is no longer needed, i.e. those with a sample that has since
+        finished successfully, in another batch or on its own, and those kept for more than max_age_days. A batch that
+        is being analyzed again is left out
+        :param succeeded_analyses: the analyses that have finished successfully, with the project_id, sample_id and
+        workflow attributes of SampleAnalysis
+        :param max_age_days: optional number of days after which the work directory of a failed batch is removed
+        regardless
+        :return: a dict with the (project id, analysis type, batch id) of the stale batches as keys and the paths to
+        their work directories as values
+        """
+        with self.db_session() as db_session:
+            return FailedBatch.stale(
+                db_session,
+                "sarek",
+                succeeded=[
+                    (analysis.project_id, analysis.sample_id, analysis.workflow)
+                    for analysis in succeeded_analyses
+                ],
+                max_age_days=max_age_days,
+            )
+
+    def remove_failed_batch(self, projectid, analysis_type, batch_id):
+        """
+        Stop keeping track of a failed batch, once its work directory has been removed
+        :param projectid: project id for the batch
+        :param analysis_type: the name of the analysis instance class (e.g. SarekAnalysisGermline)
+        :param batch_id: the id of the batch
+        """
+        with self.db_session() as db_session:
+            FailedBatch.remove(db_session, projectid, analysis_type, batch_id)
+            self._commit(db_session)
 
     def tracked_analyses(self):
         """
         :return: a generator of SampleAnalysis objects representing analyses having "sarek" as the analysis engine
-        that are tracked in the local tracking database
+        that are tracked in the local tracking database. The analyses still running are followed by those that have
+        finished but whose outcome could not be reported to Charon on an earlier run
         """
         with self.db_session() as db_session:
-            for analysis in (
-                db_session.query(self._SampleAnalysis)
-                .filter(self._SampleAnalysis.engine == "sarek")
-                .all()
-            ):
+            for analysis in self._SampleAnalysis.tracked(
+                db_session, engine="sarek", live_only=True
+            ).all():
+                yield analysis
+            for analysis in self._SampleAnalysis.tracked(
+                db_session, engine="sarek", terminal_only=True
+            ).all():
                 yield analysis
@@ -104,6 +104,26 @@ class SeqrunUpdateError(DatabaseSeqrunException):
     MESSAGE = "seqrun attribute could not be set"
 
 
+class SeqrunsUpdateError(SeqrunUpdateError):
+    """
+    Raised when several seqruns of a sample could not be updated, the SeqrunUpdateError for each of them is in
+    `errors`.
+    """
+
+    def __init__(self, projectid, sampleid, errors):
+        # not about a single seqrun, so skip the seqrun part of the message
+        DatabaseSampleException.__init__(
+            self,
+            projectid,
+            sampleid,
+            message="{} for {} seqruns".format(self.MESSAGE, len(errors)),
+            reason="; ".join(str(e) for e in errors),
+        )
+        self.libprepid = None
+        self.seqrunid = None
+        self.errors = errors
+
+
 class SampleAnalysisStatusNotSetError(DatabaseSampleException):
     def __init__(self, projectid, sampleid, status, reason=None):
         super(SampleAnalysisStatusNotSetError, self).__init__(
@@ -1,12 +1,13 @@
+import os
 import time
 
 from ngi_pipeline.engines.sarek.database import CharonConnector, TrackingConnector
-from ngi_pipeline.engines.sarek.exceptions import SampleNotValidForAnalysisError
 from ngi_pipeline.engines.sarek.local_process_tracking import (
     update_charon_with_local_jobs_status,
 )
 from ngi_pipeline.engines.sarek.models.sarek import SarekAnalysis
-from ngi_pipeline.engines.sarek.process import SlurmConnector
+from ngi_pipeline.engines.sarek.process import LocalSchedulerConnector, SlurmConnector
+from ngi_pipeline.utils.local_scheduler import get_local_scheduler
 
 
 def analyze(analysis_object):
@@ -20,16 +21,34 @@ def analyze(analysis_object):
     :param analysis_object: an ngi_pipeline.conductor.classes.NGIAnalysis object holding parameters for the analysis
     :return: None
     """
-    # get a SlurmConnector that will take care of submitting analysis jobs
-    slurm_project_id = analysis_object.config["environment"]["project_id"]
-    slurm_mail_user = analysis_object.config["mail"]["recipient"]
-    slurm_conector = SlurmConnector(
-        slurm_project_id,
-        slurm_mail_user,
-        cwd="/scratch",
-        slurm_mail_events="TIME_LIMIT_80",
-        **analysis_object.config.get("slurm", {}),
-    )
+    if analysis_object.exec_mode == "local":
+        # get a LocalSchedulerConnector that will queue the analysis jobs to run on this machine
+        local_scheduler = get_local_scheduler(config=analysis_object.config)
+        if local_scheduler is None:
+            analysis_object.log.error(
+                "Cannot run SAREK analysis locally for {}: no local_scheduler queue_dir configured".format(
+                    analysis_object.project.project_id
+                )
+            )
+            return
+        scheduler_config = analysis_object.config["local_scheduler"]
+        process_connector = LocalSchedulerConnector(
+            local_scheduler,
+            cwd="/scratch",
+            cores=scheduler_config.get("job_cores"),
+            memory=scheduler_config.get("job_memory"),
+        )
+    else:
+        # get a SlurmConnector that will take care of submitting analysis jobs
+        slurm_project_id = analysis_object.config["environment"]["project_id"]
+        slurm_mail_user = analysis_object.config["mail"]["recipient"]
+        process_connector = SlurmConnector(
+            slurm_project_id,
+            slurm_mail_user,
+            cwd="/scratch",
+            slurm_mail_events="TIME_LIMIT_80",
+            **analysis_object.config.get("slurm", {}),
+        )
 
     # get a CharonConnector that will interface with the Charon database
     charon_connector = CharonConnector(analysis_object.config, analysis_object.log)
@@ -47,14 +66,30 @@ def analyze(analysis_object):
         analysis_object.log,
         charon_connector=charon_connector,
         tracking_connector=tracking_connector,
-        process_connector=slurm_conector,
+        process_connector=process_connector,
     )
 
-    # iterate over the samples in the project and launch analysis for each
-    for sample_object in analysis_object.project:
+    # if so configured, submit the analyses of all samples as a single job array
+    if isinstance(process_connector, SlurmConnector) and analysis_object.config.get(
+        "slurm", {}
+    ).get("job_arrays"):
+        process_connector.open_job_array(
+            "{}-{}".format(analysis_object.project.name, str(analysis_engine)),
+            os.path.join(
+                analysis_object.project.base_path,
+                "ANALYSIS",
+                analysis_object.project.project_id,
+                str(analysis_engine),
+            ),
+        )
+
+    # launch analysis for the samples in the project, one at a time or in batches of samples, depending on the config
+    analysis_engine.analyze_samples(list(analysis_object.project), analysis_object)
+
+    if getattr(process_connector, "job_array", None) is not None:
         try:
-            analysis_engine.analyze_sample(sample_object, analysis_object)
-        except SampleNotValidForAnalysisError as e:
+            analysis_engine.submit_job_array()
+        except RuntimeError as e:
             analysis_object.log.error(e)
 
     # finally, let's force a sync of the local SQLite DB and Charon
@@ -1,26 +1,64 @@
+import collections
+import errno
 import os
+import threading
 
 from ngi_pipeline.conductor.classes import NGIProject
+from ngi_pipeline.database.tracking import TERMINAL_STATES
 from ngi_pipeline.engines.sarek.database import CharonConnector, TrackingConnector
 from ngi_pipeline.engines.sarek.models.sarek import SarekAnalysis
 from ngi_pipeline.engines.sarek.models.sample import SarekAnalysisSample
 from ngi_pipeline.engines.sarek.process import (
     JobStatus,
+    ProcessConnector,
     ProcessStatus,
     ProcessRunning,
+    ProcessExitStatus,
     ProcessExitStatusSuccessful,
+    ProcessExitStatusFailed,
+    SlurmConnector,
+    LocalJobStatus,
+    LocalSchedulerConnector,
 )
+from ngi_pipeline.engines.sarek.exceptions import SlurmStatusNotRecognizedError
 from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.coverage_table import coverage_table_dir, update_coverage_tables
 from ngi_pipeline.utils.classes import with_ngi_config
+from ngi_pipeline.utils.pyutils import ordered_thread_map
+from ngi_pipeline.utils.slurm import slurm_job_spec
 
 
 @with_ngi_config
 def update_charon_with_local_jobs_status(
-    config=None, log=None, tracking_connector=None, charon_connector=None, **kwargs
+    config=None,
+    log=None,
+    tracking_connector=None,
+    charon_connector=None,
+    max_workers=None,
+    **kwargs
 ):
     """
     Update Charon with the local changes in the SQLite tracking database.
 
+    The outcome reported by the jobs that have finished since the last update is first picked up from the job
+    completion spool, so that these jobs do not have to be polled.
+
+    The analyses are checked in stages: the analysis samples are first recreated from their tsv files on a pool of
+    worker threads, sharing the analysis instances and recreated projects between the analyses of the same project
+    (see AnalysisTrackerCache). The status of all slurm jobs is then polled with a single query, and that of all jobs
+    queued with the local scheduler with a single look at the queue, after which the status and results of the
+    analyses are reported to Charon on the worker pool, each analysis being handled by one worker so that its log
+    messages stay in order. The workers only read detached copies of the tracked analyses (see _TrackedAnalysis),
+    never the objects bound to the database session. Any changes to the tracking database are made from the calling
+    thread and committed once all analyses have been checked, along with the resource usage of the finished jobs if
+    metrics harvesting is enabled. The metrics parsed from the analysis results are then stored in the tracking
+    database, so that the results are not parsed again when Charon is synced again. If the "export_coverage_table"
+    option in the analysis section of the configuration is set, the coverage of the successfully finished analyses is
+    then merged into the coverage tables of their projects. The temporary work directories of the successfully
+    finished analyses are removed after that, once for all the samples of a batch analyzed in the same run. The work
+    directory of a batch that did not finish successfully is kept for resuming it, and recorded in the tracking
+    database, until it is no longer needed (see `reap_failed_batches`).
+
     :param config: optional dict with configuration options. If not specified, the global configuration will be used
     instead
     :param log: optional log instance. If not specified, a new log instance will be created
@@ -28,6 +66,8 @@ def update_charon_with_local_jobs_status(
     a new connector will be created
     :param charon_connector: optional connector to the charon database. If not specified, a new connector will be
     created
+    :param max_workers: optional number of analyses to check concurrently. If not specified, the "tracking_workers"
+    option in the sarek section of the configuration will be used, defaulting to one analysis at a time
     :param kwargs: placeholder for additional, unused options
     :return: None
     """
@@ -35,43 +75,363 @@ def update_charon_with_local_jobs_status(
 
     tracking_connector = tracking_connector or TrackingConnector(config, log)
     charon_connector = charon_connector or CharonConnector(config, log)
+    if max_workers is None:
+        max_workers = config.get("sarek", {}).get("tracking_workers", 1)
     log.debug("updating Charon status for locally tracked jobs")
-    # iterate over the analysis processes tracked in the local database
-    for analysis in tracking_connector.tracked_analyses():
-        try:
-            log.debug(
-                "checking status for analysis of {}:{} with {}:{}, having {}".format(
-                    analysis.project_id,
-                    analysis.sample_id,
-                    analysis.engine,
-                    analysis.workflow,
-                    "pid {}".format(analysis.process_id)
-                    if analysis.process_id is not None
-                    else "sbatch job id {}".format(analysis.slurm_job_id),
-                )
+    finished_trackers = []
+    with tracking_connector.deferred_commit():
+        # pick up the outcome reported by the jobs that have finished since last time
+        tracking_connector.consume_job_completions()
+        # create an AnalysisTracker instance for each of the analysis processes tracked in the local database
+        # the analysis instances and recreated projects are shared by the analyses of the same workflow and project
+        tracker_cache = AnalysisTrackerCache()
+        analysis_trackers = [
+            AnalysisTracker(
+                analysis,
+                charon_connector,
+                tracking_connector,
+                log,
+                config,
+                tracker_cache=tracker_cache,
             )
-            # create an AnalysisTracker instance for the analysis
-            analysis_tracker = AnalysisTracker(
-                analysis, charon_connector, tracking_connector, log, config
+            for analysis in tracking_connector.tracked_analyses()
+        ]
+        # recreate the analysis samples from the tsv files on the worker pool. If this fails for an analysis, it is
+        # tried again, and the error is reported, when the analysis is checked
+        for analysis_tracker, _, exception in ordered_thread_map(
+            AnalysisTracker.recreate_analysis_sample,
+            analysis_trackers,
+            max_workers=max_workers,
+        ):
+            if exception is not None:
+                log.debug(
+                    "could not recreate sample {} in project {}: {}".format(
+                        analysis_tracker.tracked_analysis.sample_id,
+                        analysis_tracker.tracked_analysis.project_id,
+                        exception,
+                    )
+                )
+        # poll the status of all slurm jobs at once rather than one job at a time
+        poll_slurm_jobs(analysis_trackers, config, log)
+        poll_local_jobs(analysis_trackers, config, log)
+        for analysis_tracker, _, exception in ordered_thread_map(
+            _check_analysis, analysis_trackers, max_workers=max_workers
+        ):
+            analysis = analysis_tracker.tracked_analysis
+            try:
+                # record the polled status, also if Charon could not be updated
+                analysis_tracker.record_analysis_status()
+                if exception is not None:
+                    raise exception
+                # remove the analysis entry from the local db
+                analysis_tracker.remove_analysis()
+                analysis_tracker.record_failed_batch()
+                finished_trackers.append(analysis_tracker)
+            except Exception as e:
+                log.error(
+                    "exception raised when processing sample {} in project {}, please review: {}".format(
+                        analysis.sample_id, analysis.project_id, e
+                    )
+                )
+        tracking_connector.harvest_job_metrics(
+            [
+                analysis_tracker.analysis_entry
+                for analysis_tracker in analysis_trackers
+                if analysis_tracker.analysis_entry.is_terminal()
+            ]
+        )
+    tracking_connector.store_parsed_metrics()
+    tracking_connector.prune_job_completions()
+    if config.get("analysis", {}).get("export_coverage_table"):
+        # merge the coverage staged by the finished analyses into the tables of their projects
+        update_coverage_tables(
+            sorted(
+                set(
+                    coverage_table_dir(
+                        analysis_tracker.tracked_analysis.project_base_path,
+                        analysis_tracker.tracked_analysis.project_id,
+                    )
+                    for analysis_tracker in finished_trackers
+                    if analysis_tracker.process_status == ProcessExitStatusSuccessful
+                )
             )
-            # recreate the analysis_sample from disk/analysis
-            analysis_tracker.recreate_analysis_sample()
-            # poll the system for the analysis status
-            analysis_tracker.get_analysis_status()
-            # set the analysis status
-            analysis_tracker.report_analysis_status()
-            # set the analysis results
-            analysis_tracker.report_analysis_results()
-            # remove the analysis entry from the local db
-            analysis_tracker.remove_analysis()
-            # do cleanup
-            analysis_tracker.cleanup()
-        except Exception as e:
+        )
+    # do cleanup, once the removals have been committed. The samples of a batch share their work directory, which is
+    # only cleaned up once
+    cleanup_trackers = {}
+    for analysis_tracker in finished_trackers:
+        analysis = analysis_tracker.tracked_analysis
+        cleanup_trackers.setdefault(
+            (
+                analysis.project_base_path,
+                analysis.project_id,
+                analysis.workflow,
+                analysis.batch_id or analysis.sample_id,
+            ),
+            analysis_tracker,
+        )
+    for analysis_tracker, _, exception in ordered_thread_map(
+        AnalysisTracker.cleanup,
+        list(cleanup_trackers.values()),
+        max_workers=max_workers,
+    ):
+        if exception is not None:
             log.error(
-                "exception raised when processing sample {} in project {}, please review: {}".format(
-                    analysis.sample_id, analysis.project_id, e
+                "exception raised when cleaning up after sample {} in project {}, please review: {}".format(
+                    analysis_tracker.tracked_analysis.sample_id,
+                    analysis_tracker.tracked_analysis.project_id,
+                    exception,
                 )
             )
+    reap_failed_batches(
+        tracking_connector,
+        [
+            analysis_tracker.tracked_analysis
+            for analysis_tracker in finished_trackers
+            if analysis_tracker.process_status == ProcessExitStatusSuccessful
+        ],
+        log,
+        max_age_days=config.get("sarek", {}).get("failed_batch_max_age_days"),
+    )
+
+
+def reap_failed_batches(tracking_connector, succeeded_analyses, log, max_age_days=None):
+    """
+    Remove the work directories kept by the batches of samples whose run did not finish successfully, once they are
+    no longer needed. A failed batch is only resumed if the same samples are batched together again, which will not
+    happen once one of them has finished successfully in another batch or on its own. The work directories of failed
+    batches that are older than max_age_days are removed as well, unless the batch is being analyzed again, e.g. to
+    reap the batches whose samples were regrouped and are still running.
+
+    :param tracking_connector: the connector to the tracking database
+    :param succeeded_analyses: the analyses that have finished successfully, as instances of SampleAnalysis or
+    _TrackedAnalysis
+    :param log: a log instance
+    :param max_age_days: optional number of days after which the work directory of a failed batch is removed
+    regardless. If not specified, the work directory is kept until it is no longer needed
+    :return: None
+    """
+    stale_batches = tracking_connector.stale_failed_batches(
+        succeeded_analyses, max_age_days=max_age_days
+    )
+    for (projectid, analysis_type, batch_id), work_dir in sorted(stale_batches.items()):
+        log.info(
+            "removing the work directory {} of the failed batch {} in project {}, which will not be resumed".format(
+                work_dir, batch_id, projectid
+            )
+        )
+        try:
+            ProcessConnector.cleanup(work_dir)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                log.error(
+                    "could not remove the work directory {} of the failed batch {} in project {}: {}".format(
+                        work_dir, batch_id, projectid, e
+                    )
+                )
+                continue
+        tracking_connector.remove_failed_batch(projectid, analysis_type, batch_id)
+
+
+def poll_slurm_jobs(analysis_trackers, config, log):
+    """
+    Poll the status of the slurm jobs of the analyses that have not finished with a single query, instead of
+    polling each job when the analysis is checked. The status is picked up by `AnalysisTracker.poll_analysis_status`.
+    If the query fails, the jobs are polled one at a time as usual.
+
+    :param analysis_trackers: list of AnalysisTracker instances
+    :param config: dict with configuration options, which may set up slurmrestd in the slurm section
+    :param log: a log instance
+    :return: None
+    """
+    trackers_by_job = {}
+    for analysis_tracker in analysis_trackers:
+        analysis = analysis_tracker.tracked_analysis
+        if (
+            analysis.is_terminal()
+            or analysis.process_id is not None
+            or analysis.slurm_job_spec is None
+        ):
+            continue
+        trackers_by_job.setdefault(analysis.slurm_job_spec, []).append(analysis_tracker)
+    if not trackers_by_job:
+        return
+    try:
+        job_statuses = SlurmConnector.get_slurm_job_statuses(
+            list(trackers_by_job), config=config
+        )
+    except SlurmStatusNotRecognizedError as e:
+        log.warning("could not poll the slurm jobs at once: {}".format(e))
+        return
+    log.debug(
+        "polled the status of {} of {} slurm jobs at once".format(
+            len(job_statuses), len(trackers_by_job)
+        )
+    )
+    for job_spec, job_status in job_statuses.items():
+        for analysis_tracker in trackers_by_job[job_spec]:
+            analysis_tracker.job_running = job_status == ProcessRunning
+
+
+def poll_local_jobs(analysis_trackers, config, log):
+    """
+    Poll the status of the jobs queued with the local scheduler by the analyses that have not finished at once,
+    analogous to `poll_slurm_jobs`. If the local scheduler cannot be polled, the jobs are polled one at a time as usual.
+
+    :param analysis_trackers: list of AnalysisTracker instances
+    :param config: dict with configuration options, holding the local_scheduler section
+    :param log: a log instance
+    :return: None
+    """
+    trackers_by_job = {}
+    for analysis_tracker in analysis_trackers:
+        analysis = analysis_tracker.tracked_analysis
+        if analysis.is_terminal() or analysis.local_job_id is None:
+            continue
+        trackers_by_job.setdefault(analysis.local_job_id, []).append(analysis_tracker)
+    if not trackers_by_job:
+        return
+    try:
+        job_statuses = LocalSchedulerConnector.get_local_job_statuses(
+            list(trackers_by_job), config=config
+        )
+    except (RuntimeError, OSError) as e:
+        log.warning("could not poll the local jobs at once: {}".format(e))
+        return
+    for job_id, analysis_trackers_of_job in trackers_by_job.items():
+        # jobs no longer known to the local scheduler are not running
+        job_status = job_statuses.get(job_id)
+        for analysis_tracker in analysis_trackers_of_job:
+            analysis_tracker.job_running = job_status == ProcessRunning
+
+
+def _check_analysis(analysis_tracker):
+    """
+    Check the status of an analysis and report the status and results to Charon. This neither modifies nor reads the
+    tracking database and can therefore be run on a worker thread.
+
+    :param analysis_tracker: the AnalysisTracker instance for the analysis
+    :return: None
+    """
+    analysis = analysis_tracker.tracked_analysis
+    analysis_tracker.log.debug(
+        "checking status for analysis of {}:{} with {}:{}, having {}".format(
+            analysis.project_id,
+            analysis.sample_id,
+            analysis.engine,
+            analysis.workflow,
+            (
+                "pid {}".format(analysis.process_id)
+                if analysis.process_id is not None
+                else (
+                    "local job id {}".format(analysis.local_job_id)
+                    if analysis.local_job_id is not None
+                    else "sbatch job id {}".format(analysis.slurm_job_spec)
+                )
+            ),
+        )
+    )
+    # recreate the analysis_sample from disk/analysis, unless that has already been done
+    if analysis_tracker.analysis_sample is None:
+        analysis_tracker.recreate_analysis_sample()
+    # poll the system for the analysis status
+    analysis_tracker.poll_analysis_status()
+    # set the analysis status
+    analysis_tracker.report_analysis_status()
+    # set the analysis results
+    analysis_tracker.report_analysis_results()
+
+
+class _TrackedAnalysis(
+    collections.namedtuple(
+        "_TrackedAnalysis",
+        [
+            "project_id",
+            "project_base_path",
+            "sample_id",
+            "workflow",
+            "engine",
+            "batch_id",
+            "process_id",
+            "slurm_job_id",
+            "slurm_array_task_id",
+            "local_job_id",
+            "state",
+            "exit_code",
+        ],
+    )
+):
+    """
+    A copy of the fields of a tracked analysis, detached from the database session, for the worker threads checking
+    the analysis. The changes to the analysis are made to the session-bound object on the calling thread.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_analysis_entry(cls, analysis_entry):
+        """
+        :param analysis_entry: an analysis object, as an instance of SampleAnalysis
+        :return: a _TrackedAnalysis instance with the fields of the analysis object
+        """
+        return cls(*[getattr(analysis_entry, field) for field in cls._fields])
+
+    @property
+    def slurm_job_spec(self):
+        """
+        The id slurm knows the job by, see SampleAnalysis.slurm_job_spec
+        """
+        if not self.slurm_job_id:
+            return None
+        return slurm_job_spec(self.slurm_job_id, self.slurm_array_task_id)
+
+    def is_terminal(self):
+        """
+        True if a terminal state had been recorded for the analysis when it was copied
+        """
+        return self.state in TERMINAL_STATES
+
+
+class AnalysisTrackerCache(object):
+    """
+    The SarekAnalysis instances and recreated NGIProject objects shared by the AnalysisTracker instances checked in
+    the same update, so that these are created once per workflow and project rather than once per analysis. The
+    cache can be used from several threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._analysis_instances = {}
+        self._projects = {}
+
+    def analysis_instance(self, workflow, create_instance):
+        """
+        Get the analysis instance for a workflow, creating it the first time.
+
+        :param workflow: the name of the workflow
+        :param create_instance: a function without arguments returning a new SarekAnalysis instance for the workflow
+        :return: the SarekAnalysis instance for the workflow
+        """
+        with self._lock:
+            if workflow not in self._analysis_instances:
+                self._analysis_instances[workflow] = create_instance()
+            return self._analysis_instances[workflow]
+
+    def add_fastq_file_paths(self, project_key, fastq_file_paths):
+        """
+        Add the samples, libpreps and seqruns of a list of fastq file paths to the project recreated for a key.
+
+        :param project_key: a hashable identifying the project (there should be one analysis per sample and key)
+        :param fastq_file_paths: list of fastq file paths, see `AnalysisTracker._project_from_fastq_file_paths`
+        :return: the NGIProject object recreated for the key
+        """
+        with self._lock:
+            project_obj = AnalysisTracker._project_from_fastq_file_paths(
+                fastq_file_paths, project_obj=self._projects.get(project_key)
+            )
+            if project_obj is not None:
+                self._projects[project_key] = project_obj
+            return project_obj
 
 
 class AnalysisTracker(object):
@@ -81,25 +441,39 @@ class AnalysisTracker(object):
     """
 
     def __init__(
-        self, analysis_entry, charon_connector, tracking_connector, log, config=None
+        self,
+        analysis_entry,
+        charon_connector,
+        tracking_connector,
+        log,
+        config=None,
+        tracker_cache=None,
     ):
         """
         Create an AnalysisTracker instance
 
         :param analysis_entry: an analysis object
-        (this is an instance of ngi_pipeline.engines.sarek.database.TrackingConnector._SampleAnalysis)
+        (this is an instance of ngi_pipeline.engines.sarek.database.TrackingConnector._SampleAnalysis). The fields
+        are copied into the `tracked_analysis` attribute when the tracker is created, the methods that may run on a
+        worker thread only read the copy
         :param charon_connector: a charon connector object
         :param tracking_connector: a tracking connector object
         :param log: a log instance
         :param config: optional dict with configuration options
+        :param tracker_cache: optional AnalysisTrackerCache shared with the trackers of other analyses
         """
         self.analysis_entry = analysis_entry
+        self.tracked_analysis = _TrackedAnalysis.from_analysis_entry(analysis_entry)
         self.charon_connector = charon_connector
         self.tracking_connector = tracking_connector
         self.log = log
         self.config = config
+        self.tracker_cache = tracker_cache
         self.analysis_sample = None
         self.process_status = None
+        self.polled_state = None
+        # whether the job is running, if polled along with other jobs (see `poll_slurm_jobs` and `poll_local_jobs`)
+        self.job_running = None
 
     def recreate_analysis_sample(self):
         """
@@ -112,38 +486,54 @@ class AnalysisTracker(object):
 
         :return: None
         """
+
         # get an analysis instance representing the workflow
-        analysis_instance = SarekAnalysis.get_analysis_instance_for_workflow(
-            self.analysis_entry.workflow,
-            self.config,
-            self.log,
-            charon_connector=self.charon_connector,
-            tracking_connector=self.tracking_connector,
+        def _create_analysis_instance():
+            return SarekAnalysis.get_analysis_instance_for_workflow(
+                self.tracked_analysis.workflow,
+                self.config,
+                self.log,
+                charon_connector=self.charon_connector,
+                tracking_connector=self.tracking_connector,
+            )
+
+        analysis_instance = (
+            self.tracker_cache.analysis_instance(
+                self.tracked_analysis.workflow, _create_analysis_instance
+            )
+            if self.tracker_cache is not None
+            else _create_analysis_instance()
         )
         # recreate a NGIProject object from the analysis
         project_obj = self.recreate_project_from_analysis(analysis_instance)
         # extract the sample object corresponding to the analysis entry
         sample_obj = [
-            x for x in project_obj if x.name == self.analysis_entry.sample_id
+            x for x in project_obj if x.name == self.tracked_analysis.sample_id
         ].pop()
         self.analysis_sample = SarekAnalysisSample(
-            project_obj, sample_obj, analysis_instance
+            project_obj,
+            sample_obj,
+            analysis_instance,
+            batch_id=self.tracked_analysis.batch_id,
         )
 
     def recreate_project_from_analysis(self, analysis_instance):
         """
-        Recreate a NGIProject object based on the analysis tsv file for this analysis.
+        Recreate a NGIProject object based on the analysis tsv file for this analysis. If the sample was analyzed in a
+        batch, only the sample's own rows in the tsv file of the batch are used.
 
         :param analysis_instance: a SarekAnalysis instance
         :return: a NGIProject object recreated from the information in the tsv file
         """
         tsv_file_path = analysis_instance.sample_analysis_tsv_file(
-            self.analysis_entry.project_base_path,
-            self.analysis_entry.project_id,
-            self.analysis_entry.sample_id,
+            self.tracked_analysis.project_base_path,
+            self.tracked_analysis.project_id,
+            self.tracked_analysis.batch_id or self.tracked_analysis.sample_id,
         )
         runid_and_fastq_file_paths = (
-            analysis_instance.runid_and_fastq_files_from_tsv_file(tsv_file_path)
+            analysis_instance.runid_and_fastq_files_from_tsv_file(
+                tsv_file_path, sampleid=self.tracked_analysis.sample_id
+            )
         )
         # fetch just the fastq file paths
         fastq_file_paths = [
@@ -151,18 +541,28 @@ class AnalysisTracker(object):
             for runid_and_paths in runid_and_fastq_file_paths
             for fastq_path in runid_and_paths[1:]
         ]
+        if self.tracker_cache is not None:
+            # add the sample to the project shared with the other analyses of the project with the same workflow
+            return self.tracker_cache.add_fastq_file_paths(
+                (
+                    self.tracked_analysis.project_base_path,
+                    self.tracked_analysis.project_id,
+                    self.tracked_analysis.workflow,
+                ),
+                fastq_file_paths,
+            )
         return self._project_from_fastq_file_paths(fastq_file_paths)
 
     @staticmethod
-    def _project_from_fastq_file_paths(fastq_file_paths):
+    def _project_from_fastq_file_paths(fastq_file_paths, project_obj=None):
         """
         recreate the project object from a list of fastq file paths
         :param fastq_file_paths: list of fastq file paths, expected to be arranged in subfolders according to
         [/]path/to/project name/sample name/libprep name/seqrun name/fastq_file_name.fastq.gz
+        :param project_obj: optional NGIProject object to add the samples to, instead of creating a new one
 
         :return: a ngi_pipeline.conductor.classes.NGIProject object recreated from the directory tree and fastq files
         """
-        project_obj = None
         for fastq_file_path in fastq_file_paths:
             seqrun_path, fastq_file_name = os.path.split(fastq_file_path)
             libprep_path, seqrun_name = os.path.split(seqrun_path)
@@ -193,26 +593,81 @@ class AnalysisTracker(object):
         }
 
     def get_analysis_status(self):
+        """
+        Figure out the status of this analysis and record the polled state in the tracking database, see
+        `poll_analysis_status` and `record_analysis_status`.
+
+        :return: None
+        """
+        self.poll_analysis_status()
+        self.record_analysis_status()
+
+    def poll_analysis_status(self):
         """
         Figure out the status of this analysis. If the process is not running, the exit code written to the
-        exit code file will be checked.
+        exit code file will be checked. If a terminal state has already been recorded in the tracking database, the
+        status is taken from there and the process is not polled again.
 
         This method will set the `process_status` attribute to a subclass of ProcessStatus representing the status of
-        this analysis.
+        this analysis and, if the process was polled, the `polled_state` attribute to the state and exit code to
+        record. The tracking database is not modified.
 
         :return: None
         """
-        status_type = (
-            ProcessStatus if self.analysis_entry.process_id is not None else JobStatus
-        )
+        if self.tracked_analysis.is_terminal():
+            self.process_status = self.tracking_connector.process_status_from_state(
+                self.tracked_analysis.state, self.tracked_analysis.exit_code
+            )
+            return
+        if self.tracked_analysis.process_id is not None:
+            status_type = ProcessStatus
+        elif self.tracked_analysis.local_job_id is not None:
+            status_type = LocalJobStatus
+        else:
+            status_type = JobStatus
         processid_or_jobid = (
-            self.analysis_entry.process_id or self.analysis_entry.slurm_job_id
+            self.tracked_analysis.process_id
+            or self.tracked_analysis.local_job_id
+            or self.tracked_analysis.slurm_job_id
         )
+        if self.tracked_analysis.slurm_array_task_id is not None:
+            # a task of a job array is polled by its job specification
+            processid_or_jobid = self.tracked_analysis.slurm_job_spec
         exit_code_path = self.analysis_sample.sample_analysis_exit_code_path()
+        # the job is not polled again if it has been polled along with other jobs
+        status_kwargs = (
+            {"process_running": self.job_running}
+            if self.job_running is not None
+            else {}
+        )
+        self.job_running = None
         self.process_status = status_type.get_type_from_processid_and_exit_code_path(
-            processid_or_jobid, exit_code_path
+            processid_or_jobid, exit_code_path, config=self.config, **status_kwargs
+        )
+        exit_code = None
+        if self.process_status == ProcessExitStatusSuccessful:
+            exit_code = 0
+        elif self.process_status == ProcessExitStatusFailed:
+            exit_code = ProcessExitStatus.get_exit_code(exit_code_path)
+        self.polled_state = (
+            self.tracking_connector.state_from_process_status(self.process_status),
+            exit_code,
         )
 
+    def record_analysis_status(self):
+        """
+        Record the state polled by `poll_analysis_status` in the tracking database. If the process was not polled,
+        this method does nothing.
+
+        :return: None
+        """
+        if self.polled_state is None:
+            return
+        state, exit_code = self.polled_state
+        self.analysis_entry.record_poll(state, exit_code=exit_code)
+        self.tracking_connector.update_analysis(self.analysis_entry)
+        self.polled_state = None
+
     def report_analysis_status(self):
         """
         Update Charon with the analysis status for the sample in this analysis and the corresponding alignment status
@@ -263,7 +718,8 @@ class AnalysisTracker(object):
 
         analysis_metrics = (
             self.analysis_sample.analysis_object.collect_analysis_metrics(
-                self.analysis_sample
+                self.analysis_sample,
+                metrics_store=self.tracking_connector.metrics_store,
             )
         )
         self.log.debug(
@@ -291,6 +747,21 @@ class AnalysisTracker(object):
                 self.analysis_sample.sampleid,
             )
 
+        if (self.config or {}).get("analysis", {}).get("export_coverage_table"):
+            try:
+                self.analysis_sample.analysis_object.stage_sample_coverage(
+                    self.analysis_sample,
+                    percent_duplication=analysis_metrics["percent_duplication"],
+                )
+            except (IOError, OSError) as e:
+                self.log.error(
+                    "could not stage the coverage of sample '{}' in project '{}' for the coverage table: {}".format(
+                        self.analysis_sample.sampleid,
+                        self.analysis_sample.projectid,
+                        e,
+                    )
+                )
+
     def remove_analysis(self, force=False):
         """
         Remove the analysis from the tracking database iff the process status is not ProcessRunning or the removal
@@ -307,8 +778,29 @@ class AnalysisTracker(object):
             msg = "{} skipped".format(msg)
         self.log.debug(msg)
 
+    def record_failed_batch(self):
+        """
+        Record the work directory of the batch in the tracking database if this analysis was part of a batch of samples
+        that did not finish successfully, so that it can be removed once it is no longer needed. If the analysis was
+        not part of a batch, finished successfully or is still running, this method does nothing.
+
+        :return: None
+        """
+        if self.tracked_analysis.batch_id is None or self.process_status in [
+            ProcessRunning,
+            ProcessExitStatusSuccessful,
+        ]:
+            return
+        self.tracking_connector.record_failed_batch(
+            self.tracked_analysis.project_id,
+            self.tracked_analysis.sample_id,
+            self.tracked_analysis.workflow,
+            self.tracked_analysis.batch_id,
+            self.analysis_sample.sample_analysis_work_dir(),
+        )
+
     def cleanup(self):
-        # only cleanup if the process exited successfully
+        # only cleanup if the process exited successfully, the work directory of a failed attempt is kept for resuming it
         if self.process_status != ProcessExitStatusSuccessful:
             return
 
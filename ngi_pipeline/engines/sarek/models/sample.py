@@ -1,7 +1,7 @@
 import os
 
 from ngi_pipeline.engines.sarek.models.resources import Runfolder, SampleFastq
-from ngi_pipeline.utils.filesystem import is_index_file
+from ngi_pipeline.utils.filesystem import is_index_file, total_file_size
 
 
 class SarekAnalysisSample(object):
@@ -14,7 +14,12 @@ class SarekAnalysisSample(object):
     """
 
     def __init__(
-        self, project_object, sample_object, analysis_object, restart_options=None
+        self,
+        project_object,
+        sample_object,
+        analysis_object,
+        restart_options=None,
+        batch_id=None,
     ):
         """
         Create an instance of SarekAnalysisSample
@@ -24,6 +29,8 @@ class SarekAnalysisSample(object):
         :param sample_object: a ngi_pipeline.conductor.classes.NGISample instance representing the sample
         :param analysis_object: a reference to the SarekAnalysis instance that this sample is analyzed with
         :param restart_options: a dict specifying the conditions under which a previously run job should be started
+        :param batch_id: the id of the batch of samples this sample is analyzed together with, if any. The samples in
+        a batch share the analysis path, tsv file, work directory and results directory of the batch
         """
         self.analysis_object = analysis_object
         self.sampleid = sample_object.name
@@ -39,6 +46,15 @@ class SarekAnalysisSample(object):
         }
         self.restart_options.update(restart_options or {})
         self.sample_ngi_object = sample_object
+        self.batch_id = batch_id
+
+    @property
+    def analysisid(self):
+        """
+        :return: the id the analysis paths are named after, i.e. the batch id if the sample is analyzed in a batch and
+        the sample id otherwise
+        """
+        return self.batch_id or self.sampleid
 
     def sample_data_path(self):
         """
@@ -53,7 +69,7 @@ class SarekAnalysisSample(object):
         :return: the path to the analysis output for the sample
         """
         return self.analysis_object.sample_analysis_path(
-            self.project_base_path, self.projectid, self.sampleid
+            self.project_base_path, self.projectid, self.analysisid
         )
 
     def sample_seqrun_path(self, libprepid, seqrunid):
@@ -69,7 +85,7 @@ class SarekAnalysisSample(object):
         :return: the path to the exit code file for this sample and analysis
         """
         return self.analysis_object.sample_analysis_exit_code_path(
-            self.project_base_path, self.projectid, self.sampleid
+            self.project_base_path, self.projectid, self.analysisid
         )
 
     def sample_analysis_tsv_file(self):
@@ -77,17 +93,17 @@ class SarekAnalysisSample(object):
         :return: the path to the tsv file specifying the details of the analysis
         """
         return self.analysis_object.sample_analysis_tsv_file(
-            self.project_base_path, self.projectid, self.sampleid
+            self.project_base_path, self.projectid, self.analysisid
         )
 
     def sample_analysis_work_dir(self):
         return self.analysis_object.sample_analysis_work_dir(
-            self.project_base_path, self.projectid, self.sampleid
+            self.project_base_path, self.projectid, self.analysisid
         )
 
     def sample_analysis_results_dir(self):
         return self.analysis_object.sample_analysis_results_dir(
-            self.project_base_path, self.projectid, self.sampleid
+            self.project_base_path, self.projectid, self.analysisid
         )
 
     def _get_sample_librep(self, libprepid):
@@ -162,6 +178,18 @@ class SarekAnalysisSample(object):
             for libprep_fastq in self._get_runid_and_fastq_files_for_libprep(libprep):
                 yield libprep_fastq
 
+    def sample_input_bytes(self):
+        """
+        Get the total size of the fastq files that will be analyzed for this sample
+
+        :return: the total size in bytes
+        """
+        return total_file_size(
+            fastq_file
+            for runid_and_fastq_files in self.runid_and_fastq_files_for_sample()
+            for fastq_file in runid_and_fastq_files[1:]
+        )
+
     def _get_runid_and_fastq_files_for_libprep(self, libprep):
         """
         See `runid_and_fastq_files_for_sample`. This will iterate over the seqruns returned by `seqruns_to_analyze`
@@ -206,7 +234,8 @@ class SarekAnalysisSample(object):
     def runid_and_fastq_files_from_csv(self):
         """
         Get an ordered representation of the fastq files belonging to this sample from the tsv file. Additionally,
-        the identifier constructed from FCID.LANE.SAMPLE_NUMBER is included.
+        the identifier constructed from FCID.LANE.SAMPLE_NUMBER is included. If the sample is analyzed in a batch,
+        the fastq files of the other samples in the tsv file of the batch are left out.
 
         The fastq files are returned according to the order in the tsv file.
 
@@ -216,6 +245,7 @@ class SarekAnalysisSample(object):
         for (
             runid_and_fastq_file_paths
         ) in self.analysis_object.runid_and_fastq_files_from_tsv_file(
-            self.sample_analysis_tsv_file()
+            self.sample_analysis_tsv_file(),
+            sampleid=self.sampleid,
         ):
             yield runid_and_fastq_file_paths
@@ -1,4 +1,5 @@
 import csv
+import hashlib
 import os
 
 from ngi_pipeline.engines.sarek.database import CharonConnector, TrackingConnector
@@ -9,14 +10,22 @@ from ngi_pipeline.engines.sarek.exceptions import (
 from ngi_pipeline.engines.sarek.models.resources import ReferenceGenome
 from ngi_pipeline.engines.sarek.models.sample import SarekAnalysisSample
 from ngi_pipeline.engines.sarek.models.workflow import NextflowStep, SarekMainStep
-from ngi_pipeline.engines.sarek.parsers import ParserIntegrator
+from ngi_pipeline.engines.sarek.parsers import (
+    ParserIntegrator,
+    QualiMapParser,
+    ReportParser,
+    StoredMetricsParser,
+)
 from ngi_pipeline.engines.sarek.process import (
     ProcessConnector,
     ProcessRunning,
     ProcessExitStatusSuccessful,
     ProcessExitStatusFailed,
 )
+from ngi_pipeline.utils.coverage_table import coverage_table_dir, stage_sample_coverage
 from ngi_pipeline.utils.filesystem import safe_makedir
+from ngi_pipeline.utils.qualimap import parse_genome_results
+from ngi_pipeline.utils.resources import predict_job_resources
 
 
 class SarekAnalysis(object):
@@ -36,6 +45,18 @@ class SarekAnalysis(object):
         },
     }
 
+    # the options in the config sections that configure the engine rather than being passed on the command line
+    ENGINE_OPTIONS = {
+        "nextflow": ["command", "subcommand", "resume"],
+        "sarek": [
+            "command",
+            "tracking_workers",
+            "charon_workers",
+            "batch_size",
+            "failed_batch_max_age_days",
+        ],
+    }
+
     def __init__(
         self,
         reference_genome,
@@ -73,6 +94,8 @@ class SarekAnalysis(object):
             self.config, self.log
         )
         self.process_connector = process_connector or ProcessConnector(cwd=os.curdir)
+        # the analyses added to a job array of the process connector, waiting to be submitted
+        self.job_array_samples = []
 
     def __repr__(self):
         # returns the name of the instance type, e.g. "SarekAnalysis" or "SarekGermlineAnalysis"
@@ -279,7 +302,8 @@ class SarekAnalysis(object):
         """
         Start the analysis for the supplied NGISample object and with the analysis details contained within the supplied
         NGIAnalysis object. If analysis is successfully started, will record the analysis in the local tracking
-        database.
+        database. If a job array has been opened on the process connector, the analysis is added to it and is recorded
+        when the job array is submitted with `submit_job_array`.
 
         Before starting, the status of the sample will be checked against the restart options in the analysis object.
 
@@ -289,7 +313,72 @@ class SarekAnalysis(object):
         :param analysis_object: a NGIAnalysis object containing the details for the analysis
         :return: None
         """
+        analysis_sample = self.sample_to_analyze(sample_object, analysis_object)
+
+        # the libpreps and seqruns to analyze are decided on from their status in Charon, which is looked up again for
+        # the tsv file, the command line and the input size, so fetch the status of all of them once up front
+        with self.charon_connector.prefetched_sample(
+            analysis_sample.projectid, analysis_sample.sampleid
+        ):
+            # get the paths needed for the analysis
+            self.create_tsv_file(analysis_sample)
 
+            # get the command line to use for the analysis
+            cmd = self.command_line(analysis_sample)
+            input_bytes = analysis_sample.sample_input_bytes()
+        # execute the command line using the process connector
+        pid = self.process_connector.execute_process(
+            cmd,
+            working_dir=analysis_sample.sample_analysis_path(),
+            exit_code_path=analysis_sample.sample_analysis_exit_code_path(),
+            job_name="{}-{}-{}".format(
+                analysis_object.project.name, sample_object.name, str(self)
+            ),
+            job_completion_commands=self.tracking_connector.job_completion_commands(
+                analysis_sample.projectid, analysis_sample.sampleid, str(self)
+            ),
+            job_resources=predict_job_resources(
+                "sarek", str(self), input_bytes, self.config
+            ),
+        )
+        if getattr(self.process_connector, "job_array", None) is not None:
+            self.log.info(
+                "added '{}' to job array {} as task {}".format(
+                    cmd, self.process_connector.job_array.job_name, pid
+                )
+            )
+            self.job_array_samples.append((analysis_sample, pid, input_bytes))
+            return
+
+        self.log.info(
+            "launched '{}', with {}, pid: {}".format(
+                cmd, type(self.process_connector), pid
+            )
+        )
+
+        # record the analysis details in the local tracking database
+        self.tracking_connector.record_process_sample(
+            analysis_sample.projectid,
+            analysis_sample.sampleid,
+            analysis_sample.project_base_path,
+            str(self),
+            "sarek",
+            pid,
+            type(self.process_connector),
+            input_bytes=input_bytes,
+        )
+
+    def sample_to_analyze(self, sample_object, analysis_object):
+        """
+        Create a SarekAnalysisSample for the supplied NGISample object and check its status against the restart options
+        in the analysis object.
+
+        :raises: a SampleNotValidForAnalysisError if the sample is not eligible for analysis based on its status and the
+        analysis options in the NGIAnalysis object
+        :param sample_object: a NGISample object representing the sample to start analysis for
+        :param analysis_object: a NGIAnalysis object containing the details for the analysis
+        :return: the SarekAnalysisSample to analyze
+        """
         analysis_sample = SarekAnalysisSample(
             analysis_object.project,
             sample_object,
@@ -311,36 +400,177 @@ class SarekAnalysis(object):
                 analysis_sample.sampleid,
                 "nothing to analyze",
             )
+        return analysis_sample
+
+    def analyze_samples(self, sample_objects, analysis_object):
+        """
+        Start the analysis for the supplied NGISample objects. If the "batch_size" option in the sarek section of the
+        config is larger than 1, the samples eligible for analysis are analyzed in batches of at most that many samples,
+        with one tsv file and one Nextflow run per batch (see `analyze_batch`). Otherwise, each sample is analyzed on
+        its own with `analyze_sample`. Samples that are not eligible for analysis are logged and skipped.
+
+        :param sample_objects: a list of NGISample objects representing the samples to start analysis for
+        :param analysis_object: a NGIAnalysis object containing the details for the analysis
+        :return: None
+        """
+        batch_size = int(self.sarek_config.get("batch_size") or 1)
+        if batch_size < 2:
+            for sample_object in sample_objects:
+                try:
+                    self.analyze_sample(sample_object, analysis_object)
+                except SampleNotValidForAnalysisError as e:
+                    self.log.error(e)
+            return
+
+        samples_to_analyze = []
+        for sample_object in sample_objects:
+            try:
+                analysis_sample = self.sample_to_analyze(sample_object, analysis_object)
+                with self.charon_connector.prefetched_sample(
+                    analysis_sample.projectid, analysis_sample.sampleid
+                ):
+                    # the first row is the header
+                    tsv_rows = self.generate_tsv_file_contents(analysis_sample)
+                    if len(tsv_rows) < 2:
+                        raise SampleNotValidForAnalysisError(
+                            analysis_sample.projectid,
+                            analysis_sample.sampleid,
+                            "no libpreps or seqruns to analyze",
+                        )
+                    input_bytes = analysis_sample.sample_input_bytes()
+            except SampleNotValidForAnalysisError as e:
+                self.log.error(e)
+                continue
+            samples_to_analyze.append((analysis_sample, tsv_rows, input_bytes))
+
+        for i in range(0, len(samples_to_analyze), batch_size):
+            self.analyze_batch(samples_to_analyze[i : i + batch_size], analysis_object)
+
+    @staticmethod
+    def batch_id_for_samples(sampleids):
+        """
+        Get the id of a batch of samples. The id is the same for the same samples, so that a failed batch that is
+        started again uses the same analysis directory.
+
+        :param sampleids: the ids of the samples in the batch
+        :return: the batch id
+        """
+        digest = hashlib.sha1(",".join(sorted(sampleids)).encode("utf-8")).hexdigest()
+        return "batch-{}".format(digest[:10])
 
-        # get the paths needed for the analysis
-        self.create_tsv_file(analysis_sample)
+    def analyze_batch(self, samples_to_analyze, analysis_object):
+        """
+        Start the analysis of a batch of samples as one run, from a tsv file listing the fastq files of all the samples.
+        The results of each sample are written to a directory of their own in the results directory of the batch, so
+        the samples are tracked and their metrics collected separately. Each of the samples is recorded in the local
+        tracking database with the job id and the batch id, or, if a job array has been opened on the process
+        connector, when the job array is submitted.
 
-        # get the command line to use for the analysis and execute it using the process connector
-        cmd = self.command_line(analysis_sample)
+        :param samples_to_analyze: a list of tuples of the SarekAnalysisSample, the tsv rows (including the header row)
+        and the total size of the input fastq files for each sample in the batch
+        :param analysis_object: a NGIAnalysis object containing the details for the analysis
+        :return: None
+        """
+        batch_id = self.batch_id_for_samples(
+            [analysis_sample.sampleid for analysis_sample, _, _ in samples_to_analyze]
+        )
+        for analysis_sample, _, _ in samples_to_analyze:
+            analysis_sample.batch_id = batch_id
+        # the samples in the batch share the paths of the batch, so any of them can stand in for the batch
+        batch_sample = samples_to_analyze[0][0]
+
+        tsv_rows = samples_to_analyze[0][1][:1]
+        for _, sample_tsv_rows, _ in samples_to_analyze:
+            tsv_rows.extend(sample_tsv_rows[1:])
+        self.write_tsv_file(batch_sample.sample_analysis_tsv_file(), tsv_rows)
+
+        cmd = self.command_line(batch_sample)
+        input_bytes = [x[2] for x in samples_to_analyze]
+        batch_input_bytes = None if None in input_bytes else sum(input_bytes)
+        job_completion_commands = []
+        for analysis_sample, _, _ in samples_to_analyze:
+            job_completion_commands.extend(
+                self.tracking_connector.job_completion_commands(
+                    analysis_sample.projectid, analysis_sample.sampleid, str(self)
+                )
+                or []
+            )
         pid = self.process_connector.execute_process(
             cmd,
-            working_dir=analysis_sample.sample_analysis_path(),
-            exit_code_path=analysis_sample.sample_analysis_exit_code_path(),
+            working_dir=batch_sample.sample_analysis_path(),
+            exit_code_path=batch_sample.sample_analysis_exit_code_path(),
             job_name="{}-{}-{}".format(
-                analysis_object.project.name, sample_object.name, str(self)
+                analysis_object.project.name, batch_id, str(self)
+            ),
+            job_completion_commands=job_completion_commands or None,
+            job_resources=predict_job_resources(
+                "sarek", str(self), batch_input_bytes, self.config
             ),
         )
+        if getattr(self.process_connector, "job_array", None) is not None:
+            self.log.info(
+                "added '{}' to job array {} as task {}".format(
+                    cmd, self.process_connector.job_array.job_name, pid
+                )
+            )
+            self.job_array_samples.extend(
+                (analysis_sample, pid, sample_input_bytes)
+                for analysis_sample, _, sample_input_bytes in samples_to_analyze
+            )
+            return
+
         self.log.info(
-            "launched '{}', with {}, pid: {}".format(
-                cmd, type(self.process_connector), pid
+            "launched '{}' for the batch {} of samples {}, with {}, pid: {}".format(
+                cmd,
+                batch_id,
+                ", ".join(x[0].sampleid for x in samples_to_analyze),
+                type(self.process_connector),
+                pid,
             )
         )
+        for analysis_sample, _, sample_input_bytes in samples_to_analyze:
+            self.tracking_connector.record_process_sample(
+                analysis_sample.projectid,
+                analysis_sample.sampleid,
+                analysis_sample.project_base_path,
+                str(self),
+                "sarek",
+                pid,
+                type(self.process_connector),
+                input_bytes=sample_input_bytes,
+                batch_id=batch_id,
+            )
 
-        # record the analysis details in the local tracking database
-        self.tracking_connector.record_process_sample(
-            analysis_sample.projectid,
-            analysis_sample.sampleid,
-            analysis_sample.project_base_path,
-            str(self),
-            "sarek",
-            pid,
-            type(self.process_connector),
+    def submit_job_array(self):
+        """
+        Submit the job array opened on the process connector and record each of the analyses added to it in the local
+        tracking database, as a task of the submitted job array.
+
+        :raises: RuntimeError if the job array could not be submitted
+        :return: None
+        """
+        job_array_samples, self.job_array_samples = self.job_array_samples, []
+        job_array = self.process_connector.submit_job_array()
+        if job_array is None:
+            return
+        self.log.info(
+            "submitted {} analyses as job array {}".format(
+                len(job_array_samples), job_array.job_id
+            )
         )
+        for analysis_sample, array_task_id, input_bytes in job_array_samples:
+            self.tracking_connector.record_process_sample(
+                analysis_sample.projectid,
+                analysis_sample.sampleid,
+                analysis_sample.project_base_path,
+                str(self),
+                "sarek",
+                job_array.job_id,
+                type(self.process_connector),
+                input_bytes=input_bytes,
+                array_task_id=array_task_id,
+                batch_id=analysis_sample.batch_id,
+            )
 
     def sample_should_be_started(self, projectid, sampleid, restart_options):
         """
@@ -443,14 +673,31 @@ class SarekAnalysis(object):
             NextflowStep(
                 self.nextflow_config.get("command", "nextflow"),
                 self.nextflow_config.get("subcommand", "run"),
+                resume=self.resume_analysis(analysis_sample),
                 **{
                     k: v
                     for k, v in self.nextflow_config.items()
-                    if k != "command" and k != "subcommand"
+                    if k not in self.ENGINE_OPTIONS["nextflow"]
                 },
             )
         ]
 
+    def resume_analysis(self, analysis_sample):
+        """
+        Decide whether the Nextflow run of a sample should resume a previous attempt. This is the case if the "resume"
+        option in the nextflow section of the config is set and the work directory of a previous attempt has been kept,
+        i.e. the previous attempt did not finish successfully.
+
+        :param analysis_sample: the SarekAnalysisSample to analyze
+        :return: True if the previous attempt should be resumed, False otherwise
+        """
+        if not self.nextflow_config.get("resume"):
+            return False
+        try:
+            return len(os.listdir(analysis_sample.sample_analysis_work_dir())) > 0
+        except OSError:
+            return False
+
     def command_line(self, analysis_sample):
         raise NotImplementedError(
             "command_line should be implemented in the subclasses"
@@ -467,6 +714,13 @@ class SarekAnalysis(object):
         )
 
     def cleanup(self, analysis_sample):
+        """
+        Remove the Nextflow work directory of a sample. This should only be done once the analysis has finished
+        successfully, the work directory of a failed attempt is needed to resume the analysis.
+
+        :param analysis_sample: the SarekAnalysisSample that was analyzed
+        :return: None
+        """
         self.process_connector.cleanup(analysis_sample.sample_analysis_work_dir())
 
     def create_tsv_file(self, analysis_sample):
@@ -486,7 +740,17 @@ class SarekAnalysis(object):
                 "no libpreps or seqruns to analyze",
             )
 
-        tsv_file = analysis_sample.sample_analysis_tsv_file()
+        return self.write_tsv_file(analysis_sample.sample_analysis_tsv_file(), rows)
+
+    @staticmethod
+    def write_tsv_file(tsv_file, rows):
+        """
+        Write the rows of a tsv file for Sarek. If the path does not exist, it will be created.
+
+        :param tsv_file: the path to the tsv file
+        :param rows: a list of lists, where the inner lists are the fields of each row
+        :return: the path to the written tsv file
+        """
         safe_makedir(os.path.dirname(tsv_file))
         with open(tsv_file, "w") as fh:
             writer = csv.writer(fh, dialect=csv.excel_tab, delimiter=",")
@@ -547,7 +811,11 @@ class SarekGermlineAnalysis(SarekAnalysis):
         """
         local_sarek_config = {"outdir": analysis_sample.sample_analysis_results_dir()}
         local_sarek_config.update(
-            {k: v for k, v in self.sarek_config.items() if k != "command"}
+            {
+                k: v
+                for k, v in self.sarek_config.items()
+                if k not in self.ENGINE_OPTIONS["sarek"]
+            }
         )
         processing_steps = super(SarekGermlineAnalysis, self).processing_steps(
             analysis_sample
@@ -597,24 +865,32 @@ class SarekGermlineAnalysis(SarekAnalysis):
         return rows
 
     @staticmethod
-    def runid_and_fastq_files_from_tsv_file(tsv_file):
+    def runid_and_fastq_files_from_tsv_file(tsv_file, sampleid=None):
         """
         Get the identifier and path to the fastq files listed in a tsv file.
 
         :param tsv_file: the path to the tsv file
+        :param sampleid: if specified, only the fastq files of this sample are returned, e.g. from the tsv file of a
+        batch of samples. This also leaves out the header row
         :return: an iterator where each element is a list having the elements [identifier, fastq file R1,
         fastq file R2 (if available)]
         """
         with open(tsv_file) as fh:
-            reader = csv.reader(fh, dialect=csv.excel_tab)
+            # read the file with the same delimiter as it was written with, see create_tsv_file
+            reader = csv.reader(fh, dialect=csv.excel_tab, delimiter=",")
             for sample in reader:
+                if sampleid is not None and sample[3:4] != [sampleid]:
+                    continue
                 yield sample[4:]
 
-    def collect_analysis_metrics(self, analysis_sample):
+    def collect_analysis_metrics(self, analysis_sample, metrics_store=None):
         """
-        Parse and return the analysis metrics from the finished analysis.
+        Parse and return the analysis metrics from the finished analysis. For a sample analyzed in a batch, only the
+        report files of the sample itself, in its own subdirectory of the results of the batch, are parsed.
 
         :param analysis_sample: the SarekAnalysisSample to analyze
+        :param metrics_store: optional ngi_pipeline.database.tracking.ParsedMetricsStore holding the metrics parsed
+        earlier, so that result files that have not changed since are not parsed again
         :return: a dict with the analysis metric names as keys and a list of corresponding values for each metric
         """
         results_parser = ParserIntegrator()
@@ -622,8 +898,47 @@ class SarekGermlineAnalysis(SarekAnalysis):
             for parser_type, results_file in processing_step.report_files(
                 analysis_sample
             ):
-                results_parser.add_parser(parser_type(results_file))
+                if metrics_store is None:
+                    results_parser.add_parser(parser_type(results_file))
+                    continue
+                results_parser.add_parser(
+                    StoredMetricsParser(
+                        metrics_store.get(
+                            parser_type.__name__,
+                            results_file,
+                            lambda path: parser_type(path).metrics(),
+                            analysis_sample.projectid,
+                            analysis_sample.sampleid,
+                        )
+                    )
+                )
         return {
             metric: results_parser.query_parsers("get_{}".format(metric))[0]
-            for metric in ["percent_duplication", "autosomal_coverage", "total_reads"]
+            for metric in ReportParser.METRICS
         }
+
+    def stage_sample_coverage(self, analysis_sample, percent_duplication=None):
+        """
+        Stage the per-contig coverage from the Qualimap report of the finished analysis for the next update of the
+        coverage table of the project (see ngi_pipeline.utils.coverage_table).
+
+        :param analysis_sample: the SarekAnalysisSample that was analyzed
+        :param percent_duplication: optional duplication rate of the sample to store along with the coverage
+        :return: the paths to the staged files
+        """
+        table_dir = coverage_table_dir(
+            analysis_sample.project_base_path, analysis_sample.projectid
+        )
+        return [
+            stage_sample_coverage(
+                table_dir,
+                analysis_sample.sampleid,
+                parse_genome_results(results_file),
+                percent_duplication=percent_duplication,
+            )
+            for processing_step in self.processing_steps(analysis_sample)
+            for parser_type, results_file in processing_step.report_files(
+                analysis_sample
+            )
+            if parser_type is QualiMapParser
+        ]
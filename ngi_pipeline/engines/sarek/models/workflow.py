@@ -69,17 +69,31 @@ class NextflowStep(WorkflowStep):
     The Nextflow command is implemented as a subclass of workflow step as well.
     """
 
-    def __init__(self, command, subcommand, **kwargs):
+    def __init__(self, command, subcommand, resume=False, **kwargs):
         """
         Create a NextlowStep instance
 
         :param command: the command used to invoke Nextflow
         :param subcommand: the subcommand to pass to Nextflow (e.g. run)
+        :param resume: if True, Nextflow will resume the previous run in the launch directory, re-using the cached
+        results of the tasks that completed successfully (default is False)
         :param kwargs: additional Nextflow parameters to be specified on the command line
         """
         super(NextflowStep, self).__init__(
             "{} {}".format(command, subcommand), hyphen="-", **kwargs
         )
+        self.resume = resume
+
+    def command_line(self):
+        """
+        Generate the command line for launching Nextflow, with the -resume flag appended if the run should be resumed
+
+        :return: the command line for Nextflow as a string
+        """
+        command_line = super(NextflowStep, self).command_line()
+        if self.resume:
+            command_line = "{} -resume".format(command_line)
+        return command_line
 
 
 class SarekWorkflowStep(WorkflowStep):
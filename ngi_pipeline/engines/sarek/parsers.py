@@ -6,6 +6,12 @@ from ngi_pipeline.engines.sarek.exceptions import (
     ParserException,
     ParserMetricNotFoundException,
 )
+from ngi_pipeline.utils.qualimap import (
+    ContigTable,
+    GenomeResults,
+    parse_genome_results,
+    parse_number,
+)
 from six.moves import map
 from six.moves import zip
 
@@ -62,6 +68,9 @@ class ReportParser(object):
     Base class for report parsers
     """
 
+    # the metrics that parsers can be queried for, by calling `get_[METRIC]`
+    METRICS = ["percent_duplication", "autosomal_coverage", "total_reads"]
+
     def __init__(self, result_file):
         """
         Create a new instance of a ReportParser. Will parse the supplied result file and populate the data structure.
@@ -88,6 +97,44 @@ class ReportParser(object):
             "{} has not implemented result parsing".format(type(self).__name__)
         )
 
+    def metrics(self):
+        """
+        Get all the metrics this parser can be queried for, e.g. in order to store them.
+
+        :return: a dict with the metric names as keys and the parsed values as values
+        """
+        metrics = {}
+        for metric in self.METRICS:
+            try:
+                metrics[metric] = getattr(self, "get_{}".format(metric))()
+            except ParserMetricNotFoundException:
+                pass
+        return metrics
+
+
+class StoredMetricsParser(ReportParser):
+    """
+    Parser serving metrics that were parsed from a result file earlier, as returned by `ReportParser.metrics`.
+    """
+
+    def parse_result_file(self, metrics):
+        self.data = dict(metrics)
+
+    def _get_metric(self, metric):
+        try:
+            return self.data[metric]
+        except KeyError:
+            self._raise_implementation_error("get_{}".format(metric))
+
+    def get_percent_duplication(self, *args, **kwargs):
+        return self._get_metric("percent_duplication")
+
+    def get_autosomal_coverage(self, *args, **kwargs):
+        return self._get_metric("autosomal_coverage")
+
+    def get_total_reads(self, *args, **kwargs):
+        return self._get_metric("total_reads")
+
 
 class MultiQCParser(ReportParser):
     def data_source(self, tool, section):
@@ -125,14 +172,49 @@ class QualiMapParser(ReportParser):
 
     AUTOSOMES = [str(i) for i in range(1, 23)]
 
+    NUMERIC_ASSIGNMENT_RE = re.compile(r"^\s+([^=]+) = ([0-9,.]+)")
+    ASSIGNMENT_RE = re.compile(r"^\s+([^=]+)= (.+)$")
+    CUMULATIVE_COVERAGE_RE = re.compile(r"([0-9.]+)%.*>= ([0-9]+X)")
+    CONTIG_COVERAGE_RE = re.compile(
+        r"^\s+(\S+)\s+([0-9]+)\s+([0-9]+)\s+(\S+)\s+(\S+)\s*$"
+    )
+
+    def __init__(self, result_file):
+        # the coverage per contig, as a qualimap.ContigTable
+        self.contigs = ContigTable()
+        super(QualiMapParser, self).__init__(result_file)
+
     def parse_result_file(self, genome_results_file):
-        locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
-        with open(genome_results_file) as fh:
-            self._parse_genome_results_lines(fh)
+        # the report is parsed once and shared with the other parsers reading it
+        self._update_data(parse_genome_results(genome_results_file))
 
     def _parse_genome_results_lines(self, fh):
-        for line in fh:
-            self.data.update(self._parse_entry(line))
+        genome_results = GenomeResults(None)
+        genome_results.parse(fh)
+        self._update_data(genome_results)
+
+    def _update_data(self, genome_results):
+        self.data.update(genome_results.values)
+        self.data.update(genome_results.cumulative_coverage)
+        self.contigs = genome_results.contigs
+
+    def get_contig_coverage(self, contig):
+        """
+        Get the coverage data of a contig, as returned by `_parse_contig_coverage`.
+
+        :param contig: the name of the contig
+        :return: a dict with the contig coverage information or None if there is no data for the contig
+        """
+        coverage = self.contigs.get(contig)
+        if coverage is None:
+            return self.data.get("{} coverage".format(contig))
+        return {
+            "contig": coverage.contig,
+            "length": coverage.length,
+            "mapped bases": coverage.mapped_bases,
+            "mean coverage": coverage.mean_coverage,
+            "standard deviation": coverage.standard_deviation,
+        }
 
     def get_autosomal_coverage(self):
         """
@@ -143,17 +225,24 @@ class QualiMapParser(ReportParser):
         """
         mapped_bases = 0
         total_bases = 0
-        for key in [
-            "chr{} coverage".format(chromosome) for chromosome in self.AUTOSOMES
-        ]:
-            try:
-                data = self.data.get(key) or self.data[key[3:]]
-                mapped_bases += data["mapped bases"]
-                total_bases += data["length"]
-            except KeyError as ke:
+        for chromosome in self.AUTOSOMES:
+            for contig in ["chr{}".format(chromosome), chromosome]:
+                i = self.contigs.index(contig)
+                if i is not None:
+                    mapped_bases += self.contigs.mapped_bases[i]
+                    total_bases += self.contigs.lengths[i]
+                    break
+                data = self.data.get("{} coverage".format(contig))
+                if data:
+                    mapped_bases += data["mapped bases"]
+                    total_bases += data["length"]
+                    break
+            else:
                 raise ParserException(
                     self,
-                    "no coverage data parsed for {}: {}".format(key.split()[0], ke),
+                    "no coverage data parsed for chr{}: '{} coverage'".format(
+                        chromosome, chromosome
+                    ),
                 )
         return float(1.0 * mapped_bases / total_bases)
 
@@ -179,17 +268,14 @@ class QualiMapParser(ReportParser):
         :return: the assignemnt as a dict, with the value as a float or None if no numeric assignment could be parsed
         """
         # identify key = value assignments with numeric values
-        try:
-            key, value = re.search(r"^\s+([^=]+) = ([0-9,.]+)", line).groups()
-            value = locale.atof(value)
-            key = key.strip()
-            return {key: value}
-        except ValueError:
-            # it was an assignment but the conversion to numeric value failed
-            pass
-        except AttributeError:
+        match = QualiMapParser.NUMERIC_ASSIGNMENT_RE.search(line)
+        if match is None:
             # not an assignment or not a numeric assignment
-            pass
+            return
+        key, value = match.groups()
+        value = parse_number(value)
+        if value is not None:
+            return {key.strip(): value}
 
     @staticmethod
     def _parse_assignment(line):
@@ -201,13 +287,10 @@ class QualiMapParser(ReportParser):
         :return: the assignemnt as a dict, with the value as a string or None if no assignment could be parsed
         """
         # identify key = value assignments
-        try:
-            key, value = re.search(r"^\s+([^=]+)= (.+)$", line).groups()
-            key, value = list(map(str.strip, [key, value]))
+        match = QualiMapParser.ASSIGNMENT_RE.search(line)
+        if match is not None:
+            key, value = list(map(str.strip, match.groups()))
             return {key: value}
-        except AttributeError:
-            # not an assignment
-            pass
 
     @staticmethod
     def _parse_cumulative_coverage(line):
@@ -220,12 +303,12 @@ class QualiMapParser(ReportParser):
         parsed
         """
         # identify cumulative coverage calculations
-        try:
-            value, key = re.search(r"([0-9.]+)%.*>= ([0-9]+X)", line).groups()
-            value = locale.atof(value)
-            return {key: value}
-        except AttributeError:
-            pass
+        match = QualiMapParser.CUMULATIVE_COVERAGE_RE.search(line)
+        if match is not None:
+            value, key = match.groups()
+            value = parse_number(value)
+            if value is not None:
+                return {key: value}
 
     @staticmethod
     def _parse_contig_coverage(line):
@@ -238,45 +321,22 @@ class QualiMapParser(ReportParser):
         information as value or None if no contig coverage could be parsed
         """
         # identify contig coverage
+        match = QualiMapParser.CONTIG_COVERAGE_RE.search(line)
+        if match is None:
+            # not a contig coverage row
+            return
+        values = match.groups()
         try:
-            values = re.search(
-                r"^\s+(\S+)\s+([0-9]+)\s+([0-9]+)\s+(\S+)\s+(\S+)\s*$", line
-            ).groups()
-            key = "{} coverage".format(values[0])
             value = dict()
             value["contig"] = values[0]
-            value["length"] = locale.atoi(values[1])
-            value["mapped bases"] = locale.atoi(values[2])
-            value["mean coverage"] = locale.atof(values[3])
-            value["standard deviation"] = locale.atof(values[4])
-            return {key: value}
+            value["length"] = int(values[1])
+            value["mapped bases"] = int(values[2])
+            value["mean coverage"] = float(values[3])
+            value["standard deviation"] = float(values[4])
+            return {"{} coverage".format(values[0]): value}
         except ValueError:
             # problems with the conversion to numeric values
             pass
-        except AttributeError:
-            # not a contig coverage row
-            pass
-
-    def _parse_entry(self, line):
-        """
-        Parse a string, typically a line from the Qualimap result report and try to make the relevant assignment. This
-        is done by trying different assignments until one is successful. The order of assignments is:
-          - _parse_numeric_assignment
-          - _parse_assignment
-          - _parse_cumulative_coverage
-          - _parse_contig_coverage
-
-        :param line: the input string
-        :return: the assignment as a dict returned by the methods above, or an empty dict if no assignment  could be
-        parsed
-        """
-        return (
-            self._parse_numeric_assignment(line)
-            or self._parse_assignment(line)
-            or self._parse_cumulative_coverage(line)
-            or self._parse_contig_coverage(line)
-            or dict()
-        )
 
 
 class PicardMarkDuplicatesParser(ReportParser):
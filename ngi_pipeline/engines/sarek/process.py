@@ -1,13 +1,18 @@
 import datetime
 import errno
 import os
-import re
 import shutil
-import subprocess
 
 from ngi_pipeline.engines.sarek.exceptions import SlurmStatusNotRecognizedError
 from ngi_pipeline.utils.filesystem import execute_command_line, safe_makedir, chdir
+from ngi_pipeline.utils.local_scheduler import ACTIVE_JOB_STATES, get_local_scheduler
+from ngi_pipeline.utils.slurm import SlurmJobArray
 from ngi_pipeline.utils.slurm import get_slurm_job_status as core_get_slurm_job_status
+from ngi_pipeline.utils.slurm import (
+    get_slurm_job_statuses as core_get_slurm_job_statuses,
+)
+from ngi_pipeline.utils.slurm import seconds_to_slurm_time, submit_slurm_script
+from ngi_pipeline.utils.spool import JobCompletionSpool
 
 
 class ProcessConnector(object):
@@ -62,23 +67,30 @@ class ProcessStatus(object):
     """
 
     @classmethod
-    def get_type_from_processid_and_exit_code_path(cls, processid, exit_code_path):
+    def get_type_from_processid_and_exit_code_path(
+        cls, processid, exit_code_path, process_running=None, config=None
+    ):
         """
         Get the process status type from the supplied process id and path to a file where the exit status for the
         process will be stored.
 
         :param processid: process id for the process
         :param exit_code_path: path to the file where the exit code of the process is expected to be stored
+        :param process_running: optional, whether the process is running if this is already known (e.g. from polling
+        several processes at once), in which case the process is not polled
+        :param config: optional dict with configuration options, used for polling slurm and local scheduler jobs
         :return: the type of a subclass of ProcessStatus which represents the status of the process
         """
+        if process_running is None:
+            process_running = cls.is_process_running(processid, config=config)
         return (
             ProcessRunning
-            if cls.is_process_running(processid)
+            if process_running
             else ProcessExitStatus.get_type_from_exit_code_path(exit_code_path)
         )
 
     @staticmethod
-    def is_process_running(processid):
+    def is_process_running(processid, config=None):
         try:
             os.kill(processid, 0)
             return True
@@ -110,8 +122,23 @@ class JobStatus(ProcessStatus):
     """
 
     @staticmethod
-    def is_process_running(jobid):
-        return SlurmConnector.get_slurm_job_status(jobid) == ProcessRunning
+    def is_process_running(jobid, config=None):
+        return (
+            SlurmConnector.get_slurm_job_status(jobid, config=config) == ProcessRunning
+        )
+
+
+class LocalJobStatus(ProcessStatus):
+    """
+    Class representing jobs queued with the local scheduler
+    """
+
+    @staticmethod
+    def is_process_running(jobid, config=None):
+        return (
+            LocalSchedulerConnector.get_local_job_status(jobid, config=config)
+            == ProcessRunning
+        )
 
 
 class ProcessExitStatus(ProcessStatus):
@@ -226,9 +253,53 @@ class SlurmConnector(ProcessConnector):
         self.slurm_parameters = self.SLURM_DEFAULTS.copy()
         # update the slurm parameters with the passed slurm arguments, overriding the defaults
         self.slurm_parameters.update(slurm_args)
+        # the job array collecting the submitted jobs, if one has been opened
+        self.job_array = None
+
+    @property
+    def slurm_config(self):
+        """
+        The slurm parameters in the form of a config, for the SLURM utilities. The parameters are taken from the
+        slurm section of the caller's config, so a "slurmrestd" entry there is used for submitting the jobs.
+        """
+        return {"slurm": self.slurm_parameters}
+
+    def open_job_array(self, job_name, array_dir):
+        """
+        Collect the jobs subsequently passed to `execute_process` in a job array instead of submitting them one by one.
+        The job array is submitted with `submit_job_array`. The number of jobs in the array running at the same time is
+        limited by the "array_throttle" slurm parameter, if set.
+
+        :param job_name: the job name to use for the job array
+        :param array_dir: the directory in which to write the job array index file and driver script
+        :return: the opened SlurmJobArray
+        """
+        self.job_array = SlurmJobArray(
+            array_dir, job_name, throttle=self.slurm_parameters.get("array_throttle")
+        )
+        return self.job_array
+
+    def submit_job_array(self):
+        """
+        Submit the job array opened with `open_job_array`. Subsequent jobs will be submitted one by one again.
+
+        :return: the submitted SlurmJobArray, or None if no job array was open or no jobs were added to it
+        :raises: RuntimeError if the job array could not be submitted
+        """
+        job_array, self.job_array = self.job_array, None
+        if not job_array:
+            return None
+        job_array.submit(config=self.slurm_config)
+        return job_array
 
     def _slurm_script_from_command_line(
-        self, command_line, working_dir, exit_code_path, job_name
+        self,
+        command_line,
+        working_dir,
+        exit_code_path,
+        job_name,
+        job_completion_commands=None,
+        job_resources=None,
     ):
         """
         Create a SLURM script ready for submission based on the supplied command line and the parameters in this
@@ -243,6 +314,11 @@ class SlurmConnector(ProcessConnector):
         :param working_dir: the directory in which to create the SLURM script (expected to exist)
         :param exit_code_path: path to the file where the exit code from the command should be stored
         :param job_name: the job name to use for the SLURM submission
+        :param job_completion_commands: optional list of shell commands to run after the exit code has been written,
+        e.g. for reporting the outcome through the job completion spool. The exit code is available in the shell
+        variable NGI_EXIT_CODE
+        :param job_resources: optional JobResources (see ngi_pipeline.utils.resources) predicted for the job. The
+        predicted walltime and cores, where available, are requested instead of the parameters of this SlurmConnector
         :return: the path to the created SLURM script
         """
         # create the script in the passed working directory
@@ -254,6 +330,14 @@ class SlurmConnector(ProcessConnector):
         )
         slurm_stdout = "{}.out".format(slurm_script)
         slurm_stderr = "{}.err".format(slurm_script)
+        slurm_parameters = self.slurm_parameters.copy()
+        if job_resources is not None:
+            slurm_parameters["slurm_job_time"] = seconds_to_slurm_time(
+                job_resources.walltime
+            )
+            slurm_parameters["slurm_cores"] = (
+                job_resources.cores or slurm_parameters["slurm_cores"]
+            )
 
         with open(slurm_script, "w") as fh:
             fh.write(
@@ -261,24 +345,34 @@ class SlurmConnector(ProcessConnector):
                     slurm_job_name=job_name,
                     slurm_stdout=slurm_stdout,
                     slurm_stderr=slurm_stderr,
-                    slurm_working_directory=self.slurm_parameters.get(
+                    slurm_working_directory=slurm_parameters.get(
                         "slurm_working_directory", working_dir
                     ),
-                    **self.slurm_parameters,
+                    **slurm_parameters,
                 )
             )
             # append any extra SLURM arguments passed
-            for slurm_extra_arg in self.slurm_parameters.get("slurm_extra_args", []):
+            for slurm_extra_arg in slurm_parameters.get("slurm_extra_args", []):
                 fh.write("#SBATCH {}\n".format(slurm_extra_arg))
 
             fh.write('\necho "" > "{}"\n'.format(exit_code_path))
+            fh.write("{}\n".format(JobCompletionSpool.job_started_command()))
             fh.write("{}\n".format(command_line))
-            fh.write('echo "$?" > "{}"\n'.format(exit_code_path))
+            fh.write("NGI_EXIT_CODE=$?\n")
+            fh.write('echo "$NGI_EXIT_CODE" > "{}"\n'.format(exit_code_path))
+            for job_completion_command in job_completion_commands or []:
+                fh.write("{}\n".format(job_completion_command))
 
         return slurm_script
 
     def execute_process(
-        self, command_line, working_dir=None, exit_code_path=None, job_name=None
+        self,
+        command_line,
+        working_dir=None,
+        exit_code_path=None,
+        job_name=None,
+        job_completion_commands=None,
+        job_resources=None,
     ):
         """
         Wrap the supplied command line in a SLURM script and submit it to the job queue.
@@ -290,7 +384,9 @@ class SlurmConnector(ProcessConnector):
         the exit code will be sent to /dev/null
         :param job_name: the job name to use when submitting to the cluster. If not specified, it will be constructed
         from the command line
-        :return: the slurm job id
+        :param job_completion_commands: optional list of shell commands to run when the job has finished
+        :param job_resources: optional JobResources predicted for the job, overriding the requested walltime and cores
+        :return: the slurm job id, or the array task id if a job array has been opened with `open_job_array`
         """
         exit_code_path = exit_code_path or os.devnull
         job_name = job_name or command_line.replace(" ", "_")[0:20]
@@ -299,41 +395,154 @@ class SlurmConnector(ProcessConnector):
         safe_makedir(working_dir)
         with chdir(working_dir):
             slurm_script = self._slurm_script_from_command_line(
-                command_line, working_dir, exit_code_path, job_name
-            )
-            # submit the sbatch file
-            sbatch_command_line = "sbatch {}".format(slurm_script)
-            proc = execute_command_line(
-                sbatch_command_line,
-                shell=False,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+                command_line,
+                working_dir,
+                exit_code_path,
+                job_name,
+                job_completion_commands=job_completion_commands,
+                job_resources=job_resources,
             )
-            stdout, stderr = proc.communicate()
+            if self.job_array is not None:
+                # submitted along with the rest of the job array
+                return self.job_array.add_task(slurm_script, key=job_name)
+            # submit the sbatch file, with sbatch or over slurmrestd as configured
             try:
-                # parse the slurm job id from the sbatch stdout
-                slurm_job_id = re.match(r"Submitted batch job (\d+)", stdout).groups()[
-                    0
-                ]
-                return slurm_job_id
-            except AttributeError:
+                return str(submit_slurm_script(slurm_script, config=self.slurm_config))
+            except RuntimeError as e:
                 raise RuntimeError(
                     'Could not submit sbatch job for workflow "{}": {}'.format(
-                        job_name, stderr
+                        job_name, e
                     )
                 )
 
     @staticmethod
-    def get_slurm_job_status(slurm_job_id):
+    def get_slurm_job_status(slurm_job_id, config=None):
         """
         :param slurm_job_id: the slurm job id
+        :param config: optional, the parsed NGI config, which may set up slurmrestd in its slurm section
         :return: a ProcessStatus type indicating the status
         """
         try:
             return (
                 ProcessRunning
-                if core_get_slurm_job_status(slurm_job_id) is None
+                if core_get_slurm_job_status(slurm_job_id, config=config) is None
                 else ProcessStopped
             )
         except RuntimeError as e:
             raise SlurmStatusNotRecognizedError(slurm_job_id, e)
+
+    @staticmethod
+    def get_slurm_job_statuses(slurm_job_ids, config=None):
+        """
+        Get the status of several slurm jobs with a single query, see `get_slurm_job_status`.
+
+        :param slurm_job_ids: list of slurm job ids or job array task specifications
+        :param config: optional, the parsed NGI config, which may set up slurmrestd in its slurm section
+        :return: a dict with the job specification as key and a ProcessStatus type indicating the status as value.
+        Jobs whose status could not be determined are left out
+        :raises: SlurmStatusNotRecognizedError if the job statuses could not be queried
+        """
+        try:
+            return {
+                slurm_job_id: ProcessRunning if status is None else ProcessStopped
+                for slurm_job_id, status in core_get_slurm_job_statuses(
+                    slurm_job_ids, config=config
+                ).items()
+            }
+        except RuntimeError as e:
+            raise SlurmStatusNotRecognizedError(",".join(map(str, slurm_job_ids)), e)
+
+
+class LocalSchedulerConnector(ProcessConnector):
+    """
+    A ProcessConnector that queues the processes with the local scheduler (see ngi_pipeline.utils.local_scheduler),
+    which runs them on this machine as soon as the cores and memory they need are available.
+    """
+
+    def __init__(self, scheduler, cwd=None, cores=None, memory=None, priority=0):
+        """
+        Creates a LocalSchedulerConnector for queueing processes with a local scheduler.
+
+        :param scheduler: the LocalScheduler to queue the processes with
+        :param cwd: working directory that will be passed to the parent constructor
+        :param cores: the number of cores a process needs, unless predicted. Default is 1
+        :param memory: the memory a process needs, unless predicted, in bytes or as a SLURM memory string
+        :param priority: the priority of the queued processes, the higher the sooner they are started
+        """
+        super(LocalSchedulerConnector, self).__init__(cwd=cwd)
+        self.scheduler = scheduler
+        self.cores = cores
+        self.memory = memory
+        self.priority = priority
+
+    def execute_process(
+        self,
+        command_line,
+        working_dir=None,
+        exit_code_path=None,
+        job_name=None,
+        job_completion_commands=None,
+        job_resources=None,
+    ):
+        """
+        Queue the supplied command line with the local scheduler.
+
+        :param command_line: command line to execute, formatted as a string
+        :param working_dir: the directory to use as working directory for the process. If it does not already exist,
+        it will be created.
+        :param exit_code_path: path to the file where the exit code from the command should be stored
+        :param job_name: the job name to use in the queue. If not specified, it will be constructed from the command line
+        :param job_completion_commands: optional list of shell commands to run when the process has finished
+        :param job_resources: optional JobResources predicted for the process, overriding the cores and memory of this
+        LocalSchedulerConnector
+        :return: the local job id
+        :raises: ValueError if the process needs more cores or memory than the local scheduler has
+        """
+        working_dir = working_dir or self.cwd
+        cores, memory = self.cores, self.memory
+        if job_resources is not None:
+            cores = job_resources.cores or cores
+            memory = job_resources.memory or memory
+        return self.scheduler.submit(
+            command_line,
+            job_name=job_name,
+            working_dir=working_dir,
+            exit_code_path=exit_code_path,
+            cores=cores,
+            memory=memory,
+            priority=self.priority,
+            start_commands=[JobCompletionSpool.job_started_command()],
+            finish_commands=job_completion_commands,
+        )
+
+    @staticmethod
+    def get_local_job_status(local_job_id, config=None):
+        """
+        :param local_job_id: the local job id
+        :param config: optional, the parsed NGI config holding the local_scheduler section
+        :return: a ProcessStatus type indicating the status
+        """
+        return LocalSchedulerConnector.get_local_job_statuses(
+            [local_job_id], config=config
+        ).get(int(local_job_id), ProcessStopped)
+
+    @staticmethod
+    def get_local_job_statuses(local_job_ids, config=None):
+        """
+        Get the status of several local jobs at once, see `get_local_job_status`.
+
+        :param local_job_ids: list of local job ids
+        :param config: optional, the parsed NGI config holding the local_scheduler section
+        :return: a dict with the job id as key and a ProcessStatus type indicating the status as value. Jobs not known
+        to the local scheduler are left out
+        :raises: RuntimeError if no local scheduler has been configured
+        """
+        scheduler = get_local_scheduler(config=config)
+        if scheduler is None:
+            raise RuntimeError("No local_scheduler queue_dir has been configured")
+        return {
+            job_id: (
+                ProcessRunning if job["state"] in ACTIVE_JOB_STATES else ProcessStopped
+            )
+            for job_id, job in scheduler.poll(local_job_ids).items()
+        }
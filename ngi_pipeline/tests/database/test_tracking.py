@@ -0,0 +1,384 @@
+import mock
+import os
+import shutil
+import sqlalchemy
+import tempfile
+import threading
+import unittest
+
+from ngi_pipeline.database import tracking
+
+
+class TestTrackingDB(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.database_path = os.path.join(self.tmp_dir, "tracking.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_engine_cached(self):
+        engine = tracking.get_engine(self.database_path)
+        self.assertTrue(os.path.exists(self.database_path))
+        self.assertIs(engine, tracking.get_engine(self.database_path))
+        # the tables of all engines are created
+        self.assertSetEqual(
+            {
+                "sampleanalysis",
+                "projectanalysis",
+                "jobmetrics",
+                "parsedmetrics",
+                "analysisattempt",
+                "failedbatch",
+            },
+            set(sqlalchemy.inspect(engine).get_table_names()),
+        )
+
+    def test_get_db_session_scope(self):
+        other_thread_sessions = []
+
+        def _get_session():
+            with tracking.get_db_session(database_path=self.database_path) as session:
+                other_thread_sessions.append(session)
+
+        with tracking.get_db_session(database_path=self.database_path) as session:
+            with tracking.get_db_session(database_path=self.database_path) as nested:
+                self.assertIs(session, nested)
+            thread = threading.Thread(target=_get_session)
+            thread.start()
+            thread.join()
+            self.assertIsNot(session, other_thread_sessions[0])
+        with tracking.get_db_session(database_path=self.database_path) as new_session:
+            self.assertIsNot(session, new_session)
+
+    def test_upgrade_database_schema_v2(self):
+        engine = sqlalchemy.create_engine("sqlite:///{}".format(self.database_path))
+        tracking.SampleAnalysis.__table__.create(engine)
+        tracking._set_schema_version(engine, 2)
+        tracking.upgrade_database_schema(engine)
+        self.assertIn("projectanalysis", sqlalchemy.inspect(engine).get_table_names())
+        self.assertEqual(tracking.SCHEMA_VERSION, tracking._get_schema_version(engine))
+
+    def test_analysis_attempts(self):
+        key = ("P123", "P123_1001", "SarekGermlineAnalysis")
+        with tracking.get_db_session(database_path=self.database_path) as session:
+            for expected in [1, 2]:
+                self.assertEqual(
+                    expected,
+                    tracking.AnalysisAttempt.next_attempt(session, "sarek", *key),
+                )
+            self.assertEqual(
+                1,
+                tracking.AnalysisAttempt.next_attempt(
+                    session, "sarek", "P123", "P123_1002", key[2]
+                ),
+            )
+            session.commit()
+        with tracking.get_db_session(database_path=self.database_path) as session:
+            self.assertEqual(
+                2, session.query(tracking.AnalysisAttempt).get(key).attempts
+            )
+            tracking.AnalysisAttempt.reset(session, *key)
+            session.commit()
+            self.assertEqual(
+                1, tracking.AnalysisAttempt.next_attempt(session, "sarek", *key)
+            )
+
+    def test_failed_batches(self):
+        workflow = "SarekGermlineAnalysis"
+        with tracking.get_db_session(database_path=self.database_path) as session:
+            for batch_id, sample_ids in [
+                ("batch-1", ["P123_1001", "P123_1002"]),
+                ("batch-2", ["P123_1003", "P123_1004"]),
+                ("batch-3", ["P123_1005", "P123_1006"]),
+            ]:
+                for sample_id in sample_ids:
+                    tracking.FailedBatch.record(
+                        session,
+                        "sarek",
+                        "P123",
+                        sample_id,
+                        workflow,
+                        batch_id,
+                        "/{}/work".format(batch_id),
+                    )
+            # batch-3 is being analyzed again
+            session.add(
+                tracking.SampleAnalysis(
+                    project_id="P123",
+                    sample_id="P123_1005",
+                    workflow=workflow,
+                    engine="sarek",
+                    batch_id="batch-3",
+                )
+            )
+            session.commit()
+            self.assertDictEqual({}, tracking.FailedBatch.stale(session, "sarek"))
+            # a sample of batch-1 has finished successfully in another batch
+            self.assertDictEqual(
+                {("P123", workflow, "batch-1"): "/batch-1/work"},
+                tracking.FailedBatch.stale(
+                    session,
+                    "sarek",
+                    succeeded=[("P123", "P123_1002", workflow)],
+                ),
+            )
+            self.assertDictEqual(
+                {}, tracking.FailedBatch.stale(session, "piper_ngi", max_age_days=0)
+            )
+            self.assertDictEqual(
+                {
+                    ("P123", workflow, "batch-1"): "/batch-1/work",
+                    ("P123", workflow, "batch-2"): "/batch-2/work",
+                },
+                tracking.FailedBatch.stale(session, "sarek", max_age_days=0),
+            )
+            tracking.FailedBatch.remove(session, "P123", workflow, "batch-1")
+            session.commit()
+            self.assertListEqual(
+                ["batch-2", "batch-2", "batch-3", "batch-3"],
+                sorted(x.batch_id for x in session.query(tracking.FailedBatch)),
+            )
+
+    def test_record_job_completions_array_task(self):
+        with tracking.get_db_session(database_path=self.database_path) as session:
+            analysis = tracking.SampleAnalysis(
+                project_id="P123",
+                sample_id="P123_1001",
+                workflow="merge_process_variantcall",
+                engine="piper_ngi",
+                slurm_job_id=1001,
+                slurm_array_task_id=3,
+            )
+            session.add(analysis)
+            self.assertEqual("1001_3", analysis.slurm_job_spec)
+            record = {
+                "project_id": "P123",
+                "sample_id": "P123_1001",
+                "workflow": "merge_process_variantcall",
+                "exit_code": 0,
+            }
+            # the record of another task of the same job array
+            self.assertEqual(
+                0,
+                tracking.SampleAnalysis.record_job_completions(
+                    session, "piper_ngi", [("a", dict(record, job_id="1001_2"))]
+                ),
+            )
+            self.assertEqual(
+                1,
+                tracking.SampleAnalysis.record_job_completions(
+                    session, "piper_ngi", [("b", dict(record, job_id="1001_3"))]
+                ),
+            )
+            self.assertEqual(tracking.STATE_DONE, analysis.state)
+
+    def test_running_analyses_for_project(self):
+        with tracking.get_db_session(database_path=self.database_path) as session:
+            session.add_all(
+                [
+                    tracking.SampleAnalysis(
+                        project_id="P123",
+                        sample_id="P123_1001",
+                        workflow="merge_process_variantcall",
+                        engine="piper_ngi",
+                        slurm_job_id=1001,
+                        state=tracking.STATE_RUNNING,
+                    ),
+                    tracking.SampleAnalysis(
+                        project_id="P123",
+                        sample_id="P123_1002",
+                        workflow="SarekGermlineAnalysis",
+                        engine="sarek",
+                        process_id=1002,
+                    ),
+                    tracking.SampleAnalysis(
+                        project_id="P123",
+                        sample_id="P123_1003",
+                        workflow="merge_process_variantcall",
+                        engine="piper_ngi",
+                        slurm_job_id=1003,
+                        state=tracking.STATE_DONE,
+                    ),
+                    tracking.SampleAnalysis(
+                        project_id="P124",
+                        sample_id="P124_1001",
+                        workflow="merge_process_variantcall",
+                        engine="piper_ngi",
+                        slurm_job_id=1004,
+                    ),
+                    tracking.ProjectAnalysis(
+                        project_id="P123",
+                        workflow="rna_ngi",
+                        engine="rna_ngi",
+                        job_id=1005,
+                    ),
+                ]
+            )
+            session.commit()
+            running = sorted(
+                (x.engine, x.sample_id, x.job_id, x.state)
+                for x in tracking.running_analyses_for_project(session, "P123")
+            )
+            self.assertListEqual(
+                [
+                    ("piper_ngi", "P123_1001", 1001, tracking.STATE_RUNNING),
+                    ("rna_ngi", None, 1005, tracking.STATE_RUNNING),
+                    ("sarek", "P123_1002", 1002, tracking.STATE_SUBMITTED),
+                ],
+                running,
+            )
+            self.assertEqual(
+                3,
+                tracking.delete_analyses(
+                    session, tracking.SampleAnalysis, project_id="P123"
+                ),
+            )
+            session.commit()
+            self.assertListEqual(
+                ["P124_1001"],
+                [x.sample_id for x in tracking.SampleAnalysis.tracked(session)],
+            )
+
+    @mock.patch("ngi_pipeline.database.tracking.get_slurm_job_metrics")
+    def test_harvest_job_metrics(self, mock_metrics):
+        mock_metrics.return_value = {
+            "1001": dict(
+                slurm_job_id=1001,
+                state="COMPLETED",
+                elapsed=7200.0,
+                total_cpu=108000.0,
+                max_rss=20 * 1024**3,
+                alloc_cpus=16,
+                timelimit=345600.0,
+            ),
+            "1005": dict(
+                slurm_job_id=1005,
+                state="COMPLETED",
+                elapsed=9000.0,
+                total_cpu=144000.0,
+                max_rss=24 * 1024**3,
+                alloc_cpus=16,
+                timelimit=345600.0,
+            ),
+            "1004_2": dict(
+                slurm_job_id=1007,
+                state="COMPLETED",
+                elapsed=3600.0,
+                total_cpu=3600.0,
+                max_rss=1024**3,
+                alloc_cpus=1,
+                timelimit=86400.0,
+            ),
+        }
+        analyses = [
+            tracking.SampleAnalysis(
+                project_id="P123",
+                sample_id="P123_1001",
+                workflow="merge_process_variantcall",
+                engine="piper_ngi",
+                slurm_job_id=1001,
+                input_bytes=123456789,
+            ),
+            # not known to sacct
+            tracking.SampleAnalysis(
+                project_id="P123",
+                sample_id="P123_1002",
+                workflow="merge_process_variantcall",
+                engine="piper_ngi",
+                slurm_job_id=1002,
+            ),
+            # a task of a job array
+            tracking.SampleAnalysis(
+                project_id="P123",
+                sample_id="P123_1004",
+                workflow="merge_process_variantcall",
+                engine="piper_ngi",
+                slurm_job_id=1004,
+                slurm_array_task_id=2,
+            ),
+            # two samples analyzed as a batch in the same job
+            tracking.SampleAnalysis(
+                project_id="P123",
+                sample_id="P123_1005",
+                workflow="SarekGermlineAnalysis",
+                engine="sarek",
+                slurm_job_id=1005,
+                input_bytes=1000,
+                batch_id="batch-0123456789",
+            ),
+            tracking.SampleAnalysis(
+                project_id="P123",
+                sample_id="P123_1006",
+                workflow="SarekGermlineAnalysis",
+                engine="sarek",
+                slurm_job_id=1005,
+                input_bytes=2000,
+                batch_id="batch-0123456789",
+            ),
+            # not a slurm job
+            tracking.SampleAnalysis(
+                project_id="P123",
+                sample_id="P123_1003",
+                workflow="SarekGermlineAnalysis",
+                engine="sarek",
+                process_id=1003,
+            ),
+        ]
+        with tracking.get_db_session(database_path=self.database_path) as session:
+            self.assertEqual(3, tracking.harvest_job_metrics(session, analyses))
+            # harvesting the same job again replaces its metrics
+            self.assertEqual(3, tracking.harvest_job_metrics(session, analyses))
+            session.commit()
+            job_metrics, batch_metrics, array_task_metrics = (
+                session.query(tracking.JobMetrics)
+                .order_by(tracking.JobMetrics.slurm_job_id)
+                .all()
+            )
+        mock_metrics.assert_called_with(["1001", "1002", "1004_2", "1005"])
+        # the job of a batch is stored once, with the input of all its samples
+        self.assertEqual("batch-0123456789", batch_metrics.sample_id)
+        self.assertEqual(3000, batch_metrics.input_bytes)
+        self.assertEqual("P123_1004", array_task_metrics.sample_id)
+        self.assertEqual("merge_process_variantcall", job_metrics.workflow)
+        self.assertEqual(123456789, job_metrics.input_bytes)
+        self.assertEqual(16, job_metrics.alloc_cpus)
+        mock_metrics.side_effect = RuntimeError("sacct not found")
+        with tracking.get_db_session(database_path=self.database_path) as session:
+            self.assertEqual(0, tracking.harvest_job_metrics(session, analyses))
+
+    def test_parsed_metrics_store(self):
+        metrics_file = os.path.join(self.tmp_dir, "P123_1001.metrics")
+        with open(metrics_file, "w") as fh:
+            fh.write("PERCENT_DUPLICATION\n0.25\n")
+        parse_fn = mock.Mock(return_value={"percent_duplication": 25.0})
+        store = tracking.ParsedMetricsStore(database_path=self.database_path)
+        for _ in range(2):
+            self.assertDictEqual(
+                {"percent_duplication": 25.0},
+                store.get("picard", metrics_file, parse_fn, "P123", "P123_1001"),
+            )
+        self.assertEqual(1, parse_fn.call_count)
+        self.assertEqual(1, store.flush())
+        self.assertEqual(0, store.flush())
+        # a new store reads what was stored
+        store = tracking.ParsedMetricsStore(database_path=self.database_path)
+        store.get("picard", metrics_file, parse_fn, "P123", "P123_1001")
+        self.assertEqual(1, parse_fn.call_count)
+        # but parses the file again once it has changed
+        with open(metrics_file, "a") as fh:
+            fh.write("\n")
+        store.get("picard", metrics_file, parse_fn, "P123", "P123_1001")
+        self.assertEqual(2, parse_fn.call_count)
+        with tracking.get_db_session(database_path=self.database_path) as session:
+            self.assertEqual(1, store.flush(session))
+            session.commit()
+            self.assertEqual(
+                1, tracking.ParsedMetrics.for_project(session, "P123").count()
+            )
+        # missing files are left to the parser
+        parse_fn.side_effect = IOError("missing")
+        with self.assertRaises(IOError):
+            store.get(
+                "picard", metrics_file + ".missing", parse_fn, "P123", "P123_1001"
+            )
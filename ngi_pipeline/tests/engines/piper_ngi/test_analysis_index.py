@@ -0,0 +1,78 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from ngi_pipeline.engines.piper_ngi import analysis_index
+
+
+class TestAnalysisDirIndex(unittest.TestCase):
+    def setUp(self):
+        self.analysis_dir = tempfile.mkdtemp()
+        self.files = [
+            os.path.join("05_processed_alignments", "P123_1001.clean.dedup.bam"),
+            os.path.join("05_processed_alignments", ".P123-1001.clean.dedup.bam.done"),
+            os.path.join("05_processed_alignments", "P123_10010.clean.dedup.bam"),
+            os.path.join("07_variant_calls", "P123-1001.genomic.vcf.gz"),
+            os.path.join("07_variant_calls", "P123_1002.genomic.vcf.gz"),
+            os.path.join("previous_analyses", "P123_1001.bam"),
+        ]
+        for file_path in self.files:
+            file_path = os.path.join(self.analysis_dir, file_path)
+            if not os.path.exists(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+            open(file_path, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.analysis_dir)
+        analysis_index.invalidate_analysis_dir_index(self.analysis_dir)
+
+    def test_files(self):
+        index = analysis_index.AnalysisDirIndex(self.analysis_dir)
+        self.assertListEqual(
+            [os.path.join(self.analysis_dir, x) for x in self.files[0:1]],
+            index.files("P123_1001.*", sample_name="P123_1001"),
+        )
+        self.assertListEqual(
+            [
+                os.path.join(self.analysis_dir, x)
+                for x in (self.files[0], self.files[3])
+            ],
+            index.files("P123?1001.*", sample_name="P123_1001"),
+        )
+        self.assertListEqual(
+            [os.path.join(self.analysis_dir, self.files[1])],
+            index.files(".P123?1001.*.done", sample_name="P123_1001"),
+        )
+        self.assertListEqual(
+            [os.path.join(self.analysis_dir, self.files[3])],
+            index.files(
+                "P123?1001.*", sample_name="P123_1001", stage_pattern="0[6-9]_*"
+            ),
+        )
+        # the same as without narrowing down to the files of the sample
+        self.assertListEqual(
+            index.files("P123_1001*"),
+            index.files("P123_1001*", sample_name="P123_1001"),
+        )
+
+    def test_get_analysis_dir_index(self):
+        index = analysis_index.get_analysis_dir_index(self.analysis_dir)
+        with mock.patch.object(analysis_index.AnalysisDirIndex, "scan") as mock_scan:
+            self.assertIs(
+                index, analysis_index.get_analysis_dir_index(self.analysis_dir)
+            )
+            mock_scan.assert_not_called()
+        # files added by a job show up
+        new_file = os.path.join(self.analysis_dir, "07_variant_calls", "P123_1001.vcf")
+        open(new_file, "w").close()
+        os.utime(os.path.dirname(new_file), ns=(0, 0))
+        index = analysis_index.get_analysis_dir_index(self.analysis_dir)
+        self.assertIn(new_file, index.files("P123_1001.*", sample_name="P123_1001"))
+        # as do files moved away, once the index has been invalidated
+        os.remove(new_file)
+        os.utime(os.path.dirname(new_file), ns=(0, 0))
+        analysis_index.invalidate_analysis_dir_index(self.analysis_dir)
+        index = analysis_index.get_analysis_dir_index(self.analysis_dir)
+        self.assertNotIn(new_file, index.files("P123_1001.*", sample_name="P123_1001"))
@@ -42,3 +42,136 @@ class TestSqlAlchemyDB(unittest.TestCase):
                 .one()
             )
         self.assertEqual(query, sample_analysis)
+
+    def test_tracked_live_only(self):
+        with sql_db.get_db_session(database_path=self.database_path) as session:
+            for sample_id, state in (
+                ("P123_1001", None),
+                ("P123_1002", sql_db.STATE_RUNNING),
+                ("P123_1003", sql_db.STATE_DONE),
+                ("P123_1004", sql_db.STATE_FAILED),
+            ):
+                session.add(
+                    sql_db.SampleAnalysis(
+                        project_id="P124",
+                        sample_id=sample_id,
+                        workflow=self.workflow,
+                        engine="live_only_engine",
+                        slurm_job_id=self.process_id,
+                        state=state,
+                    )
+                )
+            session.commit()
+            all_samples = [
+                x.sample_id
+                for x in sql_db.SampleAnalysis.tracked(session, engine="live_only_engine")
+            ]
+            live_samples = [
+                x.sample_id
+                for x in sql_db.SampleAnalysis.tracked(
+                    session, engine="live_only_engine", live_only=True
+                )
+            ]
+            terminal_samples = [
+                x.sample_id
+                for x in sql_db.SampleAnalysis.tracked(
+                    session, engine="live_only_engine", terminal_only=True
+                )
+            ]
+        self.assertEqual(4, len(all_samples))
+        # rows inserted without an explicit state default to submitted
+        self.assertListEqual(["P123_1001", "P123_1002"], sorted(live_samples))
+        self.assertListEqual(["P123_1003", "P123_1004"], sorted(terminal_samples))
+
+    def test_record_poll(self):
+        sample_analysis = sql_db.SampleAnalysis(state=sql_db.STATE_SUBMITTED)
+        sample_analysis.record_poll(sql_db.STATE_RUNNING)
+        self.assertFalse(sample_analysis.is_terminal())
+        self.assertIsNotNone(sample_analysis.last_polled_at)
+        self.assertIsNone(sample_analysis.finished_at)
+        sample_analysis.record_poll(sql_db.STATE_FAILED, exit_code=1)
+        self.assertTrue(sample_analysis.is_terminal())
+        self.assertEqual(1, sample_analysis.exit_code)
+        self.assertIsNotNone(sample_analysis.finished_at)
+
+    def test_upgrade_database_schema(self):
+        database_path = os.path.join(self.tmp_dir, "schema_v1_database")
+        engine = sqlalchemy.create_engine("sqlite:///{}".format(database_path))
+        with engine.begin() as connection:
+            connection.execute(
+                sqlalchemy.text(
+                    "CREATE TABLE sampleanalysis ("
+                    "project_id VARCHAR(50) NOT NULL, project_name VARCHAR(50), "
+                    "project_base_path VARCHAR(100), sample_id VARCHAR(50) NOT NULL, "
+                    "workflow VARCHAR(50) NOT NULL, engine VARCHAR(50), "
+                    "analysis_dir VARCHAR(100), process_id INTEGER, "
+                    "slurm_job_id INTEGER, "
+                    "PRIMARY KEY (project_id, sample_id, workflow))"
+                )
+            )
+            connection.execute(
+                sqlalchemy.text(
+                    "INSERT INTO sampleanalysis (project_id, sample_id, workflow, "
+                    "engine, slurm_job_id) VALUES ('P123', 'P123_456', 'wf', "
+                    "'piper_ngi', 1234)"
+                )
+            )
+        with sql_db.get_db_session(database_path=database_path) as session:
+            sample_analysis = session.query(sql_db.SampleAnalysis).one()
+            self.assertEqual(sql_db.STATE_SUBMITTED, sample_analysis.state)
+            self.assertIsNone(sample_analysis.exit_code)
+        inspector = sqlalchemy.inspect(engine)
+        self.assertIn(
+            "ix_sampleanalysis_engine_state",
+            [x["name"] for x in inspector.get_indexes("sampleanalysis")],
+        )
+        self.assertEqual(
+            sql_db.SCHEMA_VERSION, sql_db._get_schema_version(engine)
+        )
+
+    def test_record_job_completions(self):
+        engine = "completions_engine"
+        with sql_db.get_db_session(database_path=self.database_path) as session:
+            for sample_id, slurm_job_id in (
+                ("P125_1001", 1001),
+                ("P125_1002", 1002),
+                ("P125_1003", 1003),
+            ):
+                session.add(
+                    sql_db.SampleAnalysis(
+                        project_id="P125",
+                        sample_id=sample_id,
+                        workflow=self.workflow,
+                        engine=engine,
+                        slurm_job_id=slurm_job_id,
+                    )
+                )
+            session.commit()
+            records = [
+                ("1", dict(sample_id="P125_1001", job_id="1001", exit_code=0)),
+                ("2", dict(sample_id="P125_1002", job_id="1002", exit_code=2)),
+                # left behind by an earlier job for the same analysis
+                ("3", dict(sample_id="P125_1003", job_id="999", exit_code=0)),
+                # not tracked
+                ("4", dict(sample_id="P125_1004", job_id="1004", exit_code=0)),
+            ]
+            for _, record in records:
+                record.update(
+                    project_id="P125", workflow=self.workflow, finished_at=1500000000
+                )
+            self.assertEqual(
+                2, sql_db.SampleAnalysis.record_job_completions(session, engine, records)
+            )
+            session.commit()
+            states = {
+                x.sample_id: (x.state, x.exit_code)
+                for x in sql_db.SampleAnalysis.tracked(session, engine=engine)
+            }
+            self.assertDictEqual(
+                {
+                    "P125_1001": (sql_db.STATE_DONE, 0),
+                    "P125_1002": (sql_db.STATE_FAILED, 2),
+                    "P125_1003": (sql_db.STATE_SUBMITTED, None),
+                },
+                states,
+            )
@@ -0,0 +1,88 @@
+import mock
+import tempfile
+import unittest
+
+from ngi_pipeline.conductor.classes import NGIProject
+from ngi_pipeline.engines.piper_ngi import launchers
+
+
+class TestLaunchers(unittest.TestCase):
+    def setUp(self):
+        self.project = NGIProject(
+            "S.One_14_01", "S.One_14_01", "P123", tempfile.gettempdir()
+        )
+        self.samples = [
+            self.project.add_sample(sample_id, sample_id)
+            for sample_id in ("P123_1001", "P123_1002")
+        ]
+        patcher = mock.patch.multiple(
+            launchers,
+            CharonSession=mock.DEFAULT,
+            handle_sample_status=mock.Mock(return_value=True),
+            check_for_preexisting_sample_runs=mock.DEFAULT,
+            is_sample_analysis_running_local=mock.Mock(return_value=False),
+            create_log_file_path=mock.DEFAULT,
+            rotate_file=mock.DEFAULT,
+            create_exit_code_file_path=mock.DEFAULT,
+            remove_previous_sample_analyses=mock.DEFAULT,
+            collect_files_for_sample_analysis=mock.DEFAULT,
+            build_setup_xml=mock.Mock(return_value=("setup_xml_cl", "setup.xml")),
+            build_piper_cl=mock.DEFAULT,
+            sbatch_piper_sample=mock.Mock(return_value=1234),
+            get_sample_input_bytes=mock.Mock(return_value=100),
+            record_process_sample=mock.DEFAULT,
+            wait_for_piper_jobs=mock.DEFAULT,
+            submit_piper_job_array=mock.DEFAULT,
+        )
+        self.mocks = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mocks["collect_files_for_sample_analysis"].return_value = (
+            mock.MagicMock(),
+            None,
+        )
+        # the second sample cannot be analyzed
+        self.mocks["check_for_preexisting_sample_runs"].side_effect = [
+            None,
+            RuntimeError("sample is being analyzed"),
+        ]
+
+    def _analyze(self, config):
+        analysis_object = mock.Mock(
+            project=self.project,
+            exec_mode="sbatch",
+            restart_running_jobs=False,
+            restart_finished_jobs=False,
+            config=config,
+        )
+        with self.assertRaises(RuntimeError):
+            launchers.analyze(analysis_object, config=config)
+
+    def test_analyze_aborted(self):
+        # the job already submitted is tracked, and checked for in the queue
+        self._analyze({})
+        self.mocks["record_process_sample"].assert_called_once_with(
+            project=self.project,
+            sample=self.samples[0],
+            analysis_module_name="piper_ngi",
+            slurm_job_id=1234,
+            process_id=None,
+            local_job_id=None,
+            workflow_subtask="merge_process_variantcall",
+            input_bytes=100,
+        )
+        self.mocks["wait_for_piper_jobs"].assert_called_once_with(
+            self.project, [(self.samples[0], 1234)], config={}
+        )
+        self.mocks["submit_piper_job_array"].assert_not_called()
+
+    def test_analyze_aborted_job_array(self):
+        # the task already set up is submitted with the job array
+        self._analyze({"slurm": {"job_arrays": True}})
+        self.mocks["record_process_sample"].assert_not_called()
+        self.mocks["wait_for_piper_jobs"].assert_not_called()
+        job_array = self.mocks["submit_piper_job_array"].call_args[0][1]
+        self.assertIsInstance(job_array, launchers.SlurmJobArray)
+        self.assertListEqual(
+            [(self.samples[0], "merge_process_variantcall", 1234, 100)],
+            self.mocks["submit_piper_job_array"].call_args[0][2],
+        )
@@ -1,3 +1,4 @@
+import datetime
 import unittest
 import mock
 import tempfile
@@ -5,6 +6,9 @@ import shutil
 import os
 
 import ngi_pipeline.engines.piper_ngi.local_process_tracking as tracking
+from ngi_pipeline.engines.piper_ngi.database import get_db_session
+from ngi_pipeline.database.tracking import STATE_SUBMITTED
+from ngi_pipeline.utils.spool import JobCompletionSpool
 
 
 class TestLocalProcessTracking(unittest.TestCase):
@@ -40,6 +44,46 @@ class TestLocalProcessTracking(unittest.TestCase):
             genotype_concordance=0.9, projectid="P123", sampleid="P123_1001"
         )
 
+    @mock.patch("ngi_pipeline.engines.piper_ngi.local_process_tracking.CharonSession")
+    def test_update_gtc_for_sample_metrics_store(self, mock_charon):
+        piper_gtc_path = os.path.join(self.tmp_dir, "03_genotype_concordance")
+        os.mkdir(piper_gtc_path)
+        with open(os.path.join(piper_gtc_path, "P123_1001.gt_concordance"), "w") as f:
+            f.write(
+                "\n".join(
+                    [
+                        "#:GATKTable:GenotypeConcordance_Summary:Per-sample summary statistics",
+                        "Sample   Overall_Genotype_Concordance",
+                        "ALL      0.9",
+                        "P123_1001      0.9",
+                    ]
+                )
+            )
+        database_path = os.path.join(self.tmp_dir, "gtc_metrics.db")
+        metrics_store = tracking.ParsedMetricsStore(database_path=database_path)
+        tracking.update_gtc_for_sample(
+            self.project_id,
+            self.sample_id,
+            piper_gtc_path,
+            metrics_store=metrics_store,
+        )
+        self.assertEqual(1, metrics_store.flush())
+        # nothing is cached among the analysis outputs
+        self.assertListEqual(["P123_1001.gt_concordance"], os.listdir(piper_gtc_path))
+        with mock.patch(
+            "ngi_pipeline.engines.piper_ngi.local_process_tracking.parse_genotype_concordance"
+        ) as mock_parse:
+            tracking.update_gtc_for_sample(
+                self.project_id,
+                self.sample_id,
+                piper_gtc_path,
+                metrics_store=tracking.ParsedMetricsStore(database_path=database_path),
+            )
+            mock_parse.assert_not_called()
+        mock_charon().sample_update.assert_called_with(
+            genotype_concordance=0.9, projectid="P123", sampleid="P123_1001"
+        )
+
     @mock.patch(
         "ngi_pipeline.engines.piper_ngi.local_process_tracking.parse_deduplication_percentage"
     )
@@ -104,6 +148,31 @@ class TestLocalProcessTracking(unittest.TestCase):
             total_reads=100,
         )
 
+    @mock.patch(
+        "ngi_pipeline.engines.piper_ngi.local_process_tracking.get_finished_seqruns_for_sample"
+    )
+    @mock.patch("ngi_pipeline.engines.piper_ngi.local_process_tracking.CharonSession")
+    def test_update_coverage_for_sample_seqruns_metrics_store(
+        self, mock_charon, mock_get_seqruns
+    ):
+        mock_get_seqruns.return_value = {
+            "libprep_01": ["201112_A00187_0331_AHFCFLDSXX"]
+        }
+        piper_qc_dir = os.path.join(self.tmp_dir, "02_preliminary_alignment_qc_store")
+        os.mkdir(piper_qc_dir)
+        metrics_store = mock.Mock()
+        metrics_store.get.return_value = 50
+        # the coverage is looked up for the same files whether it is cached or not,
+        # so a missing qc dir is still an error
+        with self.assertRaises(OSError):
+            tracking.update_coverage_for_sample_seqruns(
+                self.project_id,
+                self.sample_id,
+                piper_qc_dir,
+                metrics_store=metrics_store,
+            )
+        mock_charon().seqrun_update.assert_not_called()
+
     @mock.patch(
         "ngi_pipeline.engines.piper_ngi.local_process_tracking.create_exit_code_file_path"
     )
@@ -120,3 +189,119 @@ class TestLocalProcessTracking(unittest.TestCase):
             self.sample_id,
         )
         self.assertEqual(got_exit_code, 0)
+
+    @mock.patch("ngi_pipeline.engines.piper_ngi.local_process_tracking.run_multiqc")
+    @mock.patch("ngi_pipeline.engines.piper_ngi.local_process_tracking.CharonSession")
+    @mock.patch(
+        "ngi_pipeline.engines.piper_ngi.local_process_tracking._update_charon_with_sample_status"
+    )
+    def test_update_charon_with_local_jobs_status(
+        self, mock_update, mock_charon, mock_multiqc
+    ):
+        database_path = os.path.join(self.tmp_dir, "concurrent_tracking.db")
+        sample_ids = ["P123_{}".format(1001 + i) for i in range(5)]
+        with get_db_session(database_path=database_path) as session:
+            for sample_id in sample_ids:
+                session.add(
+                    tracking.SampleAnalysis(
+                        project_id=self.project_id,
+                        project_name=self.project_name,
+                        project_base_path=self.project_base_path,
+                        sample_id=sample_id,
+                        workflow="merge_process_variantcall",
+                        engine="piper_ngi",
+                        slurm_job_id=1234,
+                    )
+                )
+            session.commit()
+
+        def _update_sample(tracked_sample, charon_session, config, **kwargs):
+            # the first and last samples are done, checking the second one fails and
+            # the others are still running
+            sample_update = tracking._SampleUpdate()
+            if tracked_sample.sample_id == sample_ids[1]:
+                raise RuntimeError("Charon is down")
+            if tracked_sample.sample_id in (sample_ids[0], sample_ids[-1]):
+                sample_update.record_poll(tracking.STATE_DONE, exit_code=0)
+                sample_update.delete = True
+                sample_update.multiqc_project = (
+                    tracked_sample.project_base_path,
+                    tracked_sample.project_id,
+                    tracked_sample.project_name,
+                )
+            else:
+                sample_update.record_poll(tracking.STATE_RUNNING)
+            return sample_update
+
+        mock_update.side_effect = _update_sample
+        with mock.patch.object(
+            tracking,
+            "get_db_session",
+            lambda: get_db_session(database_path=database_path),
+        ):
+            tracking.update_charon_with_local_jobs_status(
+                quiet=True, max_workers=3, config=self.config
+            )
+        self.assertListEqual(
+            sample_ids,
+            sorted([x[0][0].sample_id for x in mock_update.call_args_list]),
+        )
+        mock_multiqc.assert_called_once_with(
+            self.project_base_path, self.project_id, self.project_name
+        )
+        with get_db_session(database_path=database_path) as session:
+            remaining = session.query(tracking.SampleAnalysis).all()
+            # the failed sample is left as it was, to be checked on the next run
+            self.assertListEqual(
+                sample_ids[1:-1], sorted([x.sample_id for x in remaining])
+            )
+            self.assertListEqual(
+                [STATE_SUBMITTED]
+                + [tracking.STATE_RUNNING] * (len(sample_ids) - 3),
+                [x.state for x in sorted(remaining, key=lambda x: x.sample_id)],
+            )
+
+    @mock.patch(
+        "ngi_pipeline.engines.piper_ngi.local_process_tracking.create_project_obj_from_analysis_log"
+    )
+    @mock.patch("ngi_pipeline.engines.piper_ngi.local_process_tracking.get_exit_code")
+    @mock.patch("ngi_pipeline.engines.piper_ngi.local_process_tracking._job_is_running")
+    def test_update_charon_with_sample_status_spool(
+        self, mock_running, mock_exit_code, mock_project
+    ):
+        spool = JobCompletionSpool(self.tmp_dir, "piper_ngi", poll_interval=600)
+        charon_session = mock.Mock()
+        charon_session.sample_get.return_value = {"analysis_status": "UNDER_ANALYSIS"}
+        mock_running.return_value = True
+        now = datetime.datetime.now()
+        tracked_sample = tracking._TrackedSample(
+            project_id=self.project_id,
+            project_name=self.project_name,
+            project_base_path=self.project_base_path,
+            sample_id=self.sample_id,
+            workflow="merge_process_variantcall",
+            engine="piper_ngi",
+            slurm_job_id=1234,
+            slurm_array_task_id=None,
+            process_id=None,
+            local_job_id=None,
+            state=tracking.STATE_RUNNING,
+            exit_code=None,
+            submitted_at=now - datetime.timedelta(hours=2),
+            last_polled_at=now - datetime.timedelta(seconds=60),
+        )
+        # a job without a completion record is not polled until the poll interval has passed
+        sample_update = tracking._update_charon_with_sample_status(
+            tracked_sample, charon_session, {"quiet": True}, job_completion_spool=spool
+        )
+        mock_running.assert_not_called()
+        mock_exit_code.assert_not_called()
+        self.assertIsNone(sample_update.poll)
+        sample_update = tracking._update_charon_with_sample_status(
+            tracked_sample._replace(last_polled_at=now - datetime.timedelta(hours=1)),
+            charon_session,
+            {"quiet": True},
+            job_completion_spool=spool,
+        )
+        mock_running.assert_called_once()
+        self.assertEqual((tracking.STATE_RUNNING, None), sample_update.poll)
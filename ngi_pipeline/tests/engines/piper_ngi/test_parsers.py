@@ -71,6 +71,20 @@ class TestParsers(unittest.TestCase):
         )
         self.assertEqual(got_coverage, 0.5)
 
+    def test_find_qualimap_genome_results(self):
+        piper_qc_dir = os.path.join(self.tmp_dir, "piper_qc_dir_hyphen")
+        qc_dir = os.path.join(piper_qc_dir, "P123-1001.AHFCFLDSXX.P123-1001.qc")
+        os.makedirs(qc_dir)
+        genome_results_file = os.path.join(qc_dir, "genome_results.txt")
+        shutil.copyfile(self.genome_results_file, genome_results_file)
+
+        got_genome_results = parsers.find_qualimap_genome_results(
+            piper_qc_dir, "P123_1001", seqrun_id="201112_A00187_0331_AHFCFLDSXX"
+        )
+        self.assertListEqual([genome_results_file], got_genome_results)
+        with self.assertRaises(OSError):
+            parsers.find_qualimap_genome_results(piper_qc_dir, "P123_1002")
+
     def test_parse_genotype_concordance(self):
         genotype_concordance_file = os.path.join(self.tmp_dir, "gtc_file.txt")
         file_content = [
@@ -86,6 +100,32 @@ class TestParsers(unittest.TestCase):
         expected_gtc = {"P123_1001": 0.913}
         self.assertEqual(got_gtc, expected_gtc)
 
+    def test_parse_genotype_concordance_files(self):
+        file_content = [
+            "#:GATKTable:5:3:%s:%s:%s:%s:%s:;",
+            "#:GATKTable:GenotypeConcordance_Summary:Per-sample summary statistics: NRS, NRD, and OGC",
+            "Sample   Non-Reference Sensitivity  Non-Reference Discrepancy  Overall_Genotype_Concordance",
+            "ALL                          0.010                      0.087                         0.913",
+            "P123_1001                    0.010                      0.087                         0.913",
+            "P123_1002                    0.020                      0.500                         0.500",
+            "P123_1003                    0.020                      0.500",
+            "P123_1004                    0.020                      0.500                         NaN?",
+            "",
+            "#:GATKTable:SiteConcordance_Summary:Site-level summary statistics",
+            "P123_1005                    0.020                      0.500                         0.100",
+        ]
+        gtc_file = os.path.join(self.tmp_dir, "P123_1001.gt_concordance")
+        with open(gtc_file, "w") as f:
+            f.write("\n".join(file_content))
+        bad_gtc_file = os.path.join(self.tmp_dir, "P123_1002.gt_concordance")
+        with open(bad_gtc_file, "w") as f:
+            f.write("\n".join(file_content[:1]))
+        expected_gtc = {"P123_1001": 0.913, "P123_1002": 0.5}
+        self.assertDictEqual(
+            {gtc_file: expected_gtc},
+            parsers.parse_genotype_concordance_files([gtc_file, bad_gtc_file]),
+        )
+
     def test_parse_deduplication_percentage(self):
         deduplication_file = os.path.join(self.tmp_dir, "duplication.txt")
         file_content = [
@@ -3,6 +3,7 @@ import mock
 import tempfile
 import os
 import shutil
+import subprocess
 import yaml
 
 import ngi_pipeline.engines.piper_ngi.utils as utils
@@ -52,8 +53,8 @@ class TestPiperUtils(unittest.TestCase):
         self.assertTrue(previous_analysis_done)
         shutil.rmtree(project_dir)  # Remove dir or it will interfere with other tests
 
-    @mock.patch("ngi_pipeline.engines.piper_ngi.utils.os.remove")
-    def test_remove_previous_genotype_analyses(self, mock_remove):
+    @mock.patch("ngi_pipeline.engines.piper_ngi.utils.move_to_trash")
+    def test_remove_previous_genotype_analyses(self, mock_trash):
         project_dir = os.path.join(
             self.tmp_dir, "ANALYSIS", "P123", "piper_ngi", "02_genotype_concordance"
         )
@@ -61,17 +62,40 @@ class TestPiperUtils(unittest.TestCase):
         sample_file = os.path.join(project_dir, "P123-1001.gtc")
         open(sample_file, "w").close()
         utils.remove_previous_genotype_analyses(self.project_obj)
-        mock_remove.assert_called_once_with(sample_file)
+        mock_trash.assert_called_once_with(
+            [sample_file], os.path.join(self.tmp_dir, "ANALYSIS", "P123")
+        )
+        shutil.rmtree(project_dir)
 
     @mock.patch("ngi_pipeline.engines.piper_ngi.utils.find_previous_sample_analyses")
-    @mock.patch("ngi_pipeline.engines.piper_ngi.utils.os.remove")
-    def test_remove_previous_sample_analyses(self, mock_remove, mock_find):
-        file_to_remove = os.path.join(self.tmp_dir, "a_file")
+    def test_remove_previous_sample_analyses(self, mock_find):
+        file_to_remove = os.path.join(
+            self.tmp_dir, "ANALYSIS", "P123", "piper_ngi", "04_removed", "a_file"
+        )
+        os.makedirs(os.path.dirname(file_to_remove))
         open(file_to_remove, "w").close()
         mock_find.return_value = [file_to_remove]
 
         utils.remove_previous_sample_analyses(self.project_obj)
-        mock_remove.assert_called_once_with(file_to_remove)
+        self.assertFalse(os.path.exists(file_to_remove))
+        trash_dirs = os.listdir(
+            os.path.join(self.tmp_dir, "ANALYSIS", "P123", ".trash")
+        )
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(
+                    self.tmp_dir,
+                    "ANALYSIS",
+                    "P123",
+                    ".trash",
+                    trash_dirs[0],
+                    "piper_ngi",
+                    "04_removed",
+                    "a_file",
+                )
+            )
+        )
+        shutil.rmtree(os.path.dirname(file_to_remove))
 
     def test_find_previous_sample_analyses(self):
         project_dir = os.path.join(
@@ -210,6 +234,68 @@ class TestPiperUtils(unittest.TestCase):
 """
         self.assertEqual(got_header, expected_header)
 
+    def _run_fastq_staging(self, config, path=None):
+        scratch_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        src_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        fastq_src_dst_list = []
+        for read in (1, 2):
+            src_file = os.path.join(src_dir, "P123_1001_R{}.fastq.gz".format(read))
+            with open(src_file, "w") as f:
+                f.write("@read{}\n".format(read))
+            fastq_src_dst_list.append(
+                [src_file, "DATA/P123/P123_1001/P123_1001_R{}.fastq.gz".format(read)]
+            )
+        manifest_path = os.path.join(src_dir, "P123_1001.fastq_manifest")
+        staging_commands = utils.create_fastq_staging_commands(
+            fastq_src_dst_list, manifest_path, config
+        )
+        with open(manifest_path) as f:
+            self.assertEqual(
+                "{}\tDATA/P123/P123_1001/P123_1001_R2.fastq.gz\n".format(
+                    fastq_src_dst_list[1][0]
+                ),
+                f.readlines()[1],
+            )
+        env = dict(os.environ, SNIC_TMP=scratch_dir)
+        if path:
+            env["PATH"] = "{}:{}".format(path, env["PATH"])
+        subprocess.check_call(
+            [
+                "bash",
+                "-c",
+                "\n".join(
+                    ["mkdir -p $SNIC_TMP/DATA/P123/P123_1001"] + staging_commands
+                ),
+            ],
+            env=env,
+        )
+        return [
+            os.path.join(scratch_dir, dst_file) for _, dst_file in fastq_src_dst_list
+        ]
+
+    def test_create_fastq_staging_commands(self):
+        # stand-in for rsync, which copies the source to the destination
+        bin_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        with open(os.path.join(bin_dir, "rsync"), "w") as f:
+            f.write('#!/bin/bash\ncp "${@: -2:1}" "${@: -1}"\n')
+        os.chmod(os.path.join(bin_dir, "rsync"), 0o755)
+        staged_files = self._run_fastq_staging(
+            {"piper": {"fastq_staging": {"parallel_streams": 2}}}, path=bin_dir
+        )
+        for staged_file in staged_files:
+            self.assertTrue(os.path.isfile(staged_file))
+            self.assertFalse(os.path.islink(staged_file))
+
+    def test_create_fastq_staging_commands_no_space(self):
+        # not enough scratch space, so the files are read from project storage
+        staged_files = self._run_fastq_staging(
+            {"piper": {"fastq_staging": {"reserved_scratch": "1000T"}}}
+        )
+        for staged_file in staged_files:
+            self.assertTrue(os.path.islink(staged_file))
+            with open(staged_file) as f:
+                self.assertTrue(f.read().startswith("@read"))
+
     def test_add_exit_code_recording(self):
         cl = ["echo", "Hello!"]
         exit_code_path = "/some/path"
@@ -39,12 +39,50 @@ class TestLaunchers(unittest.TestCase):
             got_jobid = file.read().strip("\n")
         self.assertEqual(got_jobid, "123")
 
-    @mock.patch("ngi_pipeline.engines.qc_ngi.launchers.execute_command_line")
+    @mock.patch("ngi_pipeline.engines.qc_ngi.launchers.return_cls_for_workflow")
+    @mock.patch("ngi_pipeline.engines.qc_ngi.launchers.create_sbatch_file")
+    @mock.patch("ngi_pipeline.engines.qc_ngi.launchers.queue_sbatch_file")
+    def test_analyze_job_array(self, mock_queue, mock_create, mock_commands):
+        mock_commands.return_value = [["echo", "Hello!"]]
+        mock_create.return_value = "/path/to/P123-P123_1001.sbatch"
+        config = {"slurm": {"job_arrays": True, "array_throttle": 4}}
+        job_array = launchers.create_job_array(self.project, config=config)
+        self.assertEqual(4, job_array.throttle)
+        with mock.patch.object(job_array, "add_task") as mock_add_task:
+            launchers.analyze(
+                self.project, self.sample, job_array=job_array, config=config
+            )
+            mock_add_task.assert_called_once_with(
+                "/path/to/P123-P123_1001.sbatch", key=self.sample
+            )
+        mock_queue.assert_not_called()
+        self.assertIsNone(
+            launchers.create_job_array(self.project, config={"slurm": {}})
+        )
+
+    def test_submit_job_array(self):
+        job_array = mock.Mock()
+        job_array.task_job_specs.return_value = [(self.sample, 3, "12345_3")]
+        launchers.submit_job_array(self.project, job_array)
+        job_array.submit.assert_called_once_with(config=None)
+        job_file = os.path.join(
+            self.tmp_dir,
+            "ANALYSIS",
+            "P123",
+            "qc_ngi",
+            "logs",
+            "P123-P123_1001.slurmjobid",
+        )
+        with open(job_file, "r") as file:
+            self.assertEqual("12345_3", file.read().strip("\n"))
+
+    @mock.patch("ngi_pipeline.utils.slurm.subprocess.check_output")
     def test_queue_sbatch_file(self, mock_exec):
-        mock_exec().communicate.return_value = ("Submitted batch job 12345", "")
+        mock_exec.return_value = b"Submitted batch job 12345\n"
         sbatch_file_path = "some/path/job.sbatch"
         job_id = launchers.queue_sbatch_file(sbatch_file_path)
         self.assertEqual(job_id, 12345)
+        mock_exec.assert_called_once_with(["sbatch", sbatch_file_path])
 
     def test_create_sbatch_file(self):
         cl_list = [["echo", "Hello!"]]
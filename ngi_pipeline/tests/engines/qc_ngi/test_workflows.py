@@ -45,18 +45,18 @@ class TestWorkflows(unittest.TestCase):
         input_files = ["file", "another_file"]
         output_dir = "output"
         command_line_list = workflows.workflow_qc(input_files, output_dir, config)
+        md5_command_line = command_line_list.pop()
         expected_command_line_list = [
             ["fastqc", "--option1"],
             ["fastq_screen", "--option2"],
-            [
-                'files_for_md5="file another_file"',
-                "for fl in $files_for_md5; "
-                "do md5sum $fl | "
-                "awk '{printf $1}' > "
-                "${fl}.md5; done",
-            ],
         ]
         self.assertEqual(command_line_list, expected_command_line_list)
+        self.assertEqual('files_for_md5="file another_file"', md5_command_line[0])
+        self.assertIn(
+            "-m ngi_pipeline.utils.checksums --cache output/checksums.json",
+            md5_command_line[1],
+        )
+        self.assertIn('--md5sum-file "output/output.md5"', md5_command_line[1])
 
     def test_workflow_fastqc(self):
         config = {"paths": {"fastqc": "/path/to/fastqc"}, "qc": {"load_modules": ["A"]}}
@@ -0,0 +1,55 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from ngi_pipeline.conductor.classes import NGIProject
+from ngi_pipeline.database.tracking import ProjectAnalysis, get_db_session
+from ngi_pipeline.engines.rna_ngi import local_process_tracking
+
+
+class TestLocalProcessTracking(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.database_path = os.path.join(self.tmp_dir, "tracking.db")
+        self.config = {"database": {"record_tracking_db_path": self.database_path}}
+        self.project = NGIProject("S.One_14_01", "S.One_14_01", "P123", self.tmp_dir)
+        sample = self.project.add_sample("P123_1001", "P123_1001")
+        sample.being_analyzed = True
+        seqrun = sample.add_libprep("A", "A").add_seqrun(
+            "140702_AD_0107_BC3FDPACXX", "140702_AD_0107_BC3FDPACXX"
+        )
+        seqrun.being_analyzed = True
+        self.project.add_sample("P123_1002", "P123_1002")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @mock.patch("ngi_pipeline.engines.rna_ngi.local_process_tracking.CharonSession")
+    def test_record_project_job(self, mock_charon):
+        mock_charon.return_value.libprep_get.return_value = {"qc": "PASSED"}
+        local_process_tracking.record_project_job(
+            self.project,
+            1234,
+            os.path.join(self.tmp_dir, "ANALYSIS", "P123", "rna_ngi"),
+            workflow="rnaseq",
+            config=self.config,
+        )
+        with get_db_session(config=self.config) as db_session:
+            job = db_session.query(ProjectAnalysis).one()
+            self.assertEqual(
+                ("P123", 1234, "rnaseq", "rna_ngi", "local"),
+                (job.project_id, job.job_id, job.workflow, job.engine, job.run_mode),
+            )
+        # only the samples and seqruns being analyzed are marked as such
+        mock_charon.return_value.sample_update.assert_called_once_with(
+            projectid="P123", sampleid="P123_1001", analysis_status="UNDER_ANALYSIS"
+        )
+        mock_charon.return_value.seqrun_update.assert_called_once_with(
+            "P123",
+            "P123_1001",
+            "A",
+            "140702_AD_0107_BC3FDPACXX",
+            alignment_status="RUNNING",
+        )
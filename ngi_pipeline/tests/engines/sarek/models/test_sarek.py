@@ -1,6 +1,7 @@
 import mock
 import os
 import shutil
+import subprocess
 import tempfile
 import unittest
 
@@ -14,6 +15,7 @@ from ngi_pipeline.engines.sarek.models.sample import SarekAnalysisSample
 from ngi_pipeline.engines.sarek.models.sarek import SarekAnalysis, SarekGermlineAnalysis
 from ngi_pipeline.engines.sarek.parsers import ParserIntegrator
 from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.spool import JobCompletionSpool
 from ngi_pipeline.tests.engines.sarek.test_launchers import TestLaunchers
 
 
@@ -345,6 +347,27 @@ class TestSarekGermlineAnalysis(unittest.TestCase):
                 expected_work_dir
             )
 
+    def test_resume_analysis(self, *mocks):
+        sarek_analysis = self.get_instance(*mocks)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            work_dir = os.path.join(tmp_dir, "work")
+            analysis_sample = mock.Mock()
+            analysis_sample.sample_analysis_work_dir.return_value = work_dir
+            sarek_analysis.nextflow_config["resume"] = True
+            # no previous attempt to resume
+            self.assertFalse(sarek_analysis.resume_analysis(analysis_sample))
+            os.makedirs(os.path.join(work_dir, "ab"))
+            self.assertTrue(sarek_analysis.resume_analysis(analysis_sample))
+            nextflow_step = sarek_analysis.processing_steps(analysis_sample)[0]
+            self.assertTrue(nextflow_step.command_line().endswith(" -resume"))
+            self.assertNotIn("resume", nextflow_step.parameters)
+            # resuming is not configured
+            del sarek_analysis.nextflow_config["resume"]
+            self.assertFalse(sarek_analysis.resume_analysis(analysis_sample))
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_command_line(
         self,
         process_connector_mock,
@@ -473,6 +496,127 @@ class TestSarekGermlineAnalysis(unittest.TestCase):
             for sample_obj in self.analysis_obj.project:
                 sarek_analysis.analyze_sample(sample_obj, self.analysis_obj)
 
+    def test_analyze_samples(
+        self,
+        process_connector_mock,
+        tracking_connector_mock,
+        charon_connector_mock,
+        reference_genome_mock,
+    ):
+        sarek_analysis = self.get_instance(
+            process_connector_mock,
+            tracking_connector_mock,
+            charon_connector_mock,
+            reference_genome_mock,
+        )
+        sarek_analysis.sarek_config["batch_size"] = 2
+        tsv_header = ["patient", "sex", "status", "sample", "lane", "fastq_1"]
+
+        def _tsv_rows(analysis_sample):
+            return [
+                tsv_header,
+                [analysis_sample.sampleid, "NA", 0, analysis_sample.sampleid]
+                + ["runid", "{}_R1.fastq.gz".format(analysis_sample.sampleid)],
+            ]
+
+        sample_objs = list(self.analysis_obj.project)
+        sampleids = [x.name for x in sample_objs]
+        with mock.patch.object(
+            sarek_analysis, "sample_should_be_started", return_value=True
+        ), mock.patch.object(
+            sarek_analysis, "generate_tsv_file_contents", side_effect=_tsv_rows
+        ), mock.patch.object(
+            SarekAnalysisSample, "sample_input_bytes", return_value=100
+        ), mock.patch.object(
+            sarek_analysis, "write_tsv_file"
+        ) as tsv_mock:
+            sarek_analysis.analyze_samples(sample_objs, self.analysis_obj)
+
+        batch_id = SarekAnalysis.batch_id_for_samples(reversed(sampleids))
+        self.assertEqual(batch_id, SarekAnalysis.batch_id_for_samples(sampleids))
+        project = self.analysis_obj.project
+        # one tsv file listing the fastq files of both samples
+        tsv_file = SarekGermlineAnalysis.sample_analysis_tsv_file(
+            project.base_path, project.project_id, batch_id
+        )
+        tsv_mock.assert_called_once_with(
+            tsv_file,
+            [tsv_header] + [_tsv_rows(mock.Mock(sampleid=x))[1] for x in sampleids],
+        )
+        # one run writing the results of both samples to the results dir of the batch
+        process_connector_mock.execute_process.assert_called_once()
+        cmd = process_connector_mock.execute_process.call_args[0][0]
+        self.assertIn(
+            "--outdir {}".format(
+                SarekGermlineAnalysis.sample_analysis_results_dir(
+                    project.base_path, project.project_id, batch_id
+                )
+            ),
+            cmd,
+        )
+        self.assertIn("--input {}".format(tsv_file), cmd)
+        # each of the samples is tracked, as part of the batch
+        record_calls = tracking_connector_mock.record_process_sample.call_args_list
+        self.assertListEqual(sampleids, [x[0][1] for x in record_calls])
+        for record_call in record_calls:
+            self.assertEqual(batch_id, record_call[1]["batch_id"])
+            self.assertEqual(100, record_call[1]["input_bytes"])
+
+    def test_analyze_samples_job_completion_records(
+        self,
+        process_connector_mock,
+        tracking_connector_mock,
+        charon_connector_mock,
+        reference_genome_mock,
+    ):
+        sarek_analysis = self.get_instance(
+            process_connector_mock,
+            tracking_connector_mock,
+            charon_connector_mock,
+            reference_genome_mock,
+        )
+        sarek_analysis.sarek_config["batch_size"] = 2
+        spool_dir = tempfile.mkdtemp(prefix="test_job_completion_records_")
+        self.addCleanup(shutil.rmtree, spool_dir)
+        spool = JobCompletionSpool(spool_dir, "sarek")
+        tracking_connector_mock.job_completion_commands.side_effect = (
+            lambda projectid, sampleid, analysis_type: spool.job_finished_commands(
+                projectid, sampleid, analysis_type, "NGI_EXIT_CODE"
+            )
+        )
+        sample_objs = list(self.analysis_obj.project)
+        with mock.patch.object(
+            sarek_analysis, "sample_should_be_started", return_value=True
+        ), mock.patch.object(
+            sarek_analysis,
+            "generate_tsv_file_contents",
+            return_value=[["patient"], ["row"]],
+        ), mock.patch.object(
+            SarekAnalysisSample, "sample_input_bytes", return_value=100
+        ), mock.patch.object(
+            sarek_analysis, "write_tsv_file"
+        ):
+            sarek_analysis.analyze_samples(sample_objs, self.analysis_obj)
+
+        # the end of the job script of the batch, run as one job
+        job_script = "\n".join(
+            [JobCompletionSpool.job_started_command(), "NGI_EXIT_CODE=0"]
+            + process_connector_mock.execute_process.call_args[1][
+                "job_completion_commands"
+            ]
+        )
+        env = dict(os.environ, SLURM_JOB_ID="42")
+        env.pop("SLURM_ARRAY_JOB_ID", None)
+        subprocess.check_call(["bash", "-c", job_script], env=env)
+        # each sample in the batch reports its outcome
+        records = [x[1] for x in spool.new_records()]
+        self.assertListEqual(
+            sorted(x.name for x in sample_objs),
+            sorted(x["sample_id"] for x in records),
+        )
+        self.assertTrue(all(x["job_id"] == "42" for x in records))
+        self.assertTrue(all(x["exit_code"] == 0 for x in records))
+
     def test_runid_and_fastq_files_from_tsv_file(self, *args):
         fh, fake_tsv_file = tempfile.mkstemp(prefix="test_fastq_files_from_tsv_")
         with mock.patch(
@@ -514,6 +658,29 @@ class TestSarekGermlineAnalysis(unittest.TestCase):
             )
         os.unlink(fake_tsv_file)
 
+    def test_runid_and_fastq_files_from_batch_tsv_file(self, *args):
+        tmp_dir = tempfile.mkdtemp(prefix="test_fastq_files_from_tsv_")
+        try:
+            tsv_file = SarekGermlineAnalysis.write_tsv_file(
+                os.path.join(tmp_dir, "batch", "batch.csv"),
+                [
+                    ["patient", "sex", "status", "sample", "lane", "fastq_1"],
+                    ["S1", "NA", 0, "S1", "id.1", "S1_R1.fastq.gz"],
+                    ["S2", "NA", 0, "S2", "id.2", "S2_R1.fastq.gz"],
+                    ["S1", "NA", 0, "S1", "id.3", "S1_R1.fastq.gz"],
+                ],
+            )
+            self.assertListEqual(
+                [["id.1", "S1_R1.fastq.gz"], ["id.3", "S1_R1.fastq.gz"]],
+                list(
+                    SarekGermlineAnalysis.runid_and_fastq_files_from_tsv_file(
+                        tsv_file, sampleid="S1"
+                    )
+                ),
+            )
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_collect_analysis_metrics(
         self,
         process_connector_mock,
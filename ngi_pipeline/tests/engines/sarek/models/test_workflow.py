@@ -4,7 +4,11 @@ import unittest
 
 from ngi_pipeline.engines.sarek.exceptions import ParserException
 from ngi_pipeline.engines.sarek.models.sample import SarekAnalysisSample
-from ngi_pipeline.engines.sarek.models.workflow import SarekWorkflowStep, SarekMainStep
+from ngi_pipeline.engines.sarek.models.workflow import (
+    NextflowStep,
+    SarekWorkflowStep,
+    SarekMainStep,
+)
 from ngi_pipeline.tests.engines.sarek.models.test_sarek import TestSarekGermlineAnalysis
 
 
@@ -87,6 +91,31 @@ class TestSarekWorkflowStep(unittest.TestCase):
             )
 
 
+class TestNextflowStep(unittest.TestCase):
+    def test_command_line(self):
+        nextflow_args = TestSarekGermlineAnalysis.CONFIG["nextflow"]
+        nextflow_step = NextflowStep(
+            nextflow_args["command"],
+            nextflow_args["subcommand"],
+            profile=nextflow_args["profile"],
+        )
+        expected_command_line = "{} {} -profile {}".format(
+            nextflow_args["command"],
+            nextflow_args["subcommand"],
+            nextflow_args["profile"],
+        )
+        self.assertEqual(expected_command_line, nextflow_step.command_line())
+        nextflow_step = NextflowStep(
+            nextflow_args["command"],
+            nextflow_args["subcommand"],
+            resume=True,
+            profile=nextflow_args["profile"],
+        )
+        self.assertEqual(
+            "{} -resume".format(expected_command_line), nextflow_step.command_line()
+        )
+
+
 class TestSarekMainStep(unittest.TestCase):
     def test_report_files(self):
         analysis_sample = mock.Mock(spec=SarekAnalysisSample)
@@ -15,6 +15,7 @@ from ngi_pipeline.engines.sarek.exceptions import (
     SampleAnalysisStatusNotSetError,
     SampleUpdateError,
     SeqrunUpdateError,
+    SeqrunsUpdateError,
 )
 from ngi_pipeline.engines.sarek.process import ProcessStopped
 from ngi_pipeline.log.loggers import minimal_logger
@@ -182,6 +183,83 @@ class TestCharonConnector(unittest.TestCase):
             ],
         )
 
+    def test_prefetched_sample(self, charon_session_mock):
+        self._get_charon_connector(charon_session_mock.return_value)
+        charon_session = self.charon_connector.charon_session
+        charon_session.sample_get_libpreps.return_value = {
+            "libpreps": [dict(qc="PASSED", **x) for x in self.libpreps]
+        }
+        charon_session.libprep_get_seqruns.return_value = {
+            "seqruns": [dict(alignment_status="DONE", **x) for x in self.seqruns]
+        }
+        charon_session.libprep_get.return_value = {"qc": "FAILED"}
+        charon_session.seqrun_get.return_value = {"alignment_status": "RUNNING"}
+        libprepid = self.libpreps[0]["libprepid"]
+        seqrunid = self.seqruns[0]["seqrunid"]
+
+        with self.charon_connector.prefetched_sample(self.project_id, self.sample_id):
+            for _ in range(2):
+                self.assertEqual(
+                    "PASSED",
+                    self.charon_connector.libprep_qc_status(
+                        self.project_id, self.sample_id, libprepid
+                    ),
+                )
+                self.assertEqual(
+                    "DONE",
+                    self.charon_connector.seqrun_alignment_status(
+                        self.project_id, self.sample_id, libprepid, seqrunid
+                    ),
+                )
+                self.assertListEqual(
+                    self.seqruns[0:1],
+                    [
+                        {"seqrunid": x["seqrunid"]}
+                        for x in self.charon_connector.libprep_seqruns(
+                            self.project_id,
+                            self.sample_id,
+                            libprepid,
+                            restrict_to=[seqrunid],
+                        )
+                    ],
+                )
+            # the whole tree was fetched with one request per libprep
+            charon_session.sample_get_libpreps.assert_called_once()
+            self.assertEqual(
+                len(self.libpreps), charon_session.libprep_get_seqruns.call_count
+            )
+            charon_session.libprep_get.assert_not_called()
+            charon_session.seqrun_get.assert_not_called()
+
+            # updating the sample drops the prefetched state
+            self.charon_connector.set_sample_analysis_status(
+                "UNDER_ANALYSIS", self.project_id, self.sample_id
+            )
+            self.assertEqual(
+                "RUNNING",
+                self.charon_connector.seqrun_alignment_status(
+                    self.project_id, self.sample_id, libprepid, seqrunid
+                ),
+            )
+
+        # outside of the context, Charon is queried every time
+        self.assertEqual(
+            "FAILED",
+            self.charon_connector.libprep_qc_status(
+                self.project_id, self.sample_id, libprepid
+            ),
+        )
+
+        # a sample that cannot be prefetched is looked up as usual
+        charon_session.sample_get_libpreps.side_effect = CharonError("raised")
+        with self.charon_connector.prefetched_sample(self.project_id, self.sample_id):
+            self.assertEqual(
+                "FAILED",
+                self.charon_connector.libprep_qc_status(
+                    self.project_id, self.sample_id, libprepid
+                ),
+            )
+
     def _configure_sample_attribute_update(self, charon_session_mock):
         # set up some mocks
         self._get_charon_connector(charon_session_mock.return_value)
@@ -312,6 +390,53 @@ class TestCharonConnector(unittest.TestCase):
                 recurse=True,
             )
 
+    def test_set_sample_attribute_concurrently(self, charon_session_mock):
+        self._configure_sample_attribute_update(charon_session_mock)
+        charon_session = self.charon_connector.charon_session
+        failing_seqruns = [
+            (self.libpreps[0]["libprepid"], self.seqruns[1]["seqrunid"]),
+            (self.libpreps[2]["libprepid"], self.seqruns[0]["seqrunid"]),
+        ]
+
+        def _seqrun_update(projectid, sampleid, libprepid, seqrunid, **kwargs):
+            if (libprepid, seqrunid) in failing_seqruns:
+                raise CharonError("raised CharonError")
+
+        charon_session.seqrun_update.side_effect = _seqrun_update
+        with self.assertRaises(SeqrunsUpdateError) as e:
+            self.charon_connector.set_sample_attribute(
+                self.project_id,
+                self.sample_id,
+                sample_update_kwargs={"analysis_status": "ANALYZED"},
+                seqrun_update_kwargs={"alignment_status": "DONE"},
+                recurse=True,
+                max_workers=4,
+            )
+        # every seqrun was attempted, but the sample was not updated
+        self.assertEqual(
+            len(self.libpreps) * len(self.seqruns),
+            charon_session.seqrun_update.call_count,
+        )
+        charon_session.sample_update.assert_not_called()
+        self.assertListEqual(
+            failing_seqruns, [(x.libprepid, x.seqrunid) for x in e.exception.errors]
+        )
+
+        # with all seqruns updated, the sample is updated as well
+        charon_session.seqrun_update.side_effect = None
+        self.config = {"sarek": {"charon_workers": 4}}
+        self._get_charon_connector(charon_session)
+        self.charon_connector.set_sample_attribute(
+            self.project_id,
+            self.sample_id,
+            sample_update_kwargs={"analysis_status": "ANALYZED"},
+            seqrun_update_kwargs={"alignment_status": "DONE"},
+            recurse=True,
+        )
+        charon_session.sample_update.assert_called_once_with(
+            self.project_id, self.sample_id, analysis_status="ANALYZED"
+        )
+
     def _set_metric_helper(
         self, charon_session_mock, update_fn, update_attribute, attribute_value
     ):
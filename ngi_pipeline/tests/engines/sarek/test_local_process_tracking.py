@@ -1,12 +1,24 @@
 import mock
 import os
+import shutil
+import tempfile
 import unittest
 
-from ngi_pipeline.engines.sarek.local_process_tracking import AnalysisTracker
+from ngi_pipeline.engines.piper_ngi.database import get_db_session
+from ngi_pipeline.engines.sarek.exceptions import SlurmStatusNotRecognizedError
+from ngi_pipeline.engines.sarek.local_process_tracking import (
+    AnalysisTracker,
+    AnalysisTrackerCache,
+    poll_local_jobs,
+    poll_slurm_jobs,
+    reap_failed_batches,
+    update_charon_with_local_jobs_status,
+)
 from ngi_pipeline.engines.sarek.database import TrackingConnector
 from ngi_pipeline.engines.sarek.models.sample import SarekAnalysisSample
 from ngi_pipeline.engines.sarek.models.sarek import SarekAnalysis
 from ngi_pipeline.engines.sarek.process import (
+    ProcessConnector,
     ProcessRunning,
     ProcessStopped,
     ProcessExitStatusSuccessful,
@@ -28,31 +40,37 @@ class TestAnalysisTracker(unittest.TestCase):
         self.project_obj = TestLaunchers.get_NGIProject("1")
         self.process_id = 12345
         self.slurm_job_id = 98765
+        self.config = {"slurm": {"slurmrestd": {"url": "http://localhost:6820"}}}
         self.seqruns = {
             "libprep-A": ["seqrun-1", "seqrun-2"],
             "libprep-B": ["seqrun-1", "seqrun-3"],
             "libprep-C": [],
         }
 
-    def get_analysis_entry(self):
+    def get_analysis_entry(self, **entry_fields):
         analysis_entry = TrackingConnector._SampleAnalysis()
         analysis_entry.project_id = self.project_obj.project_id
         analysis_entry.project_base_path = self.project_obj.base_path
         analysis_entry.sample_id = list(self.project_obj.samples.keys())[0]
         analysis_entry.workflow = "SarekGermlineAnalysis"
+        for key, val in entry_fields.items():
+            setattr(analysis_entry, key, val)
         return analysis_entry
 
-    def get_tracker_instance(self, charon_connector_mock, tracking_connector_mock):
+    def get_tracker_instance(
+        self, charon_connector_mock, tracking_connector_mock, **entry_fields
+    ):
         tracker = AnalysisTracker(
-            self.get_analysis_entry(),
+            self.get_analysis_entry(**entry_fields),
             charon_connector_mock,
             tracking_connector_mock,
             self.log,
+            config=self.config,
         )
         analysis_sample = mock.Mock(spec=SarekAnalysisSample)
         analysis_sample.analysis_object = mock.Mock(spec=SarekAnalysis)
-        analysis_sample.projectid = tracker.analysis_entry.project_id
-        analysis_sample.sampleid = tracker.analysis_entry.sample_id
+        analysis_sample.projectid = tracker.tracked_analysis.project_id
+        analysis_sample.sampleid = tracker.tracked_analysis.sample_id
         tracker.analysis_sample = analysis_sample
         return tracker
 
@@ -112,9 +130,7 @@ class TestAnalysisTracker(unittest.TestCase):
         self.assertEqual(self.project_obj, observed_project_obj)
 
     def helper_analysis_status(self, process_mock, *mocks, **kwargs):
-        tracker = self.get_tracker_instance(*mocks)
-        for key, val in kwargs.items():
-            setattr(tracker.analysis_entry, key, val)
+        tracker = self.get_tracker_instance(*mocks, **kwargs)
 
         expected_exit_code_path = "this-is-a-path"
         tracker.analysis_sample.sample_analysis_exit_code_path.return_value = (
@@ -126,7 +142,7 @@ class TestAnalysisTracker(unittest.TestCase):
         tracker.get_analysis_status()
         self.assertEqual(expected_status, tracker.process_status)
         process_mock.assert_called_once_with(
-            list(kwargs.values())[0], expected_exit_code_path
+            list(kwargs.values())[0], expected_exit_code_path, config=self.config
         )
 
     def test_get_analysis_status_process(self, *mocks):
@@ -145,6 +161,155 @@ class TestAnalysisTracker(unittest.TestCase):
                 job_mock, *mocks, slurm_job_id=self.slurm_job_id
             )
 
+    def test_get_analysis_status_recorded(self, *mocks):
+        tracker = self.get_tracker_instance(
+            *mocks, slurm_job_id=self.slurm_job_id, state="DONE", exit_code=0
+        )
+        tracker.tracking_connector.process_status_from_state.return_value = (
+            ProcessExitStatusSuccessful
+        )
+        with mock.patch(
+            "ngi_pipeline.engines.sarek.local_process_tracking.JobStatus.get_type_from_processid_and_exit_code_path"
+        ) as job_mock:
+            tracker.get_analysis_status()
+            # a job with a recorded terminal state should not be polled again
+            job_mock.assert_not_called()
+        self.assertEqual(ProcessExitStatusSuccessful, tracker.process_status)
+
+    def test_tracked_analysis(self, *mocks):
+        tracker = self.get_tracker_instance(
+            *mocks, slurm_job_id=self.slurm_job_id, slurm_array_task_id=3, state="DONE"
+        )
+        self.assertEqual(
+            "{}_3".format(self.slurm_job_id), tracker.tracked_analysis.slurm_job_spec
+        )
+        self.assertTrue(tracker.tracked_analysis.is_terminal())
+        # the worker side of the tracker does not touch the session-bound analysis entry
+        tracker.analysis_entry = mock.NonCallableMock(spec=[])
+        tracker.tracking_connector.process_status_from_state.return_value = (
+            ProcessExitStatusSuccessful
+        )
+        with mock.patch(
+            "ngi_pipeline.engines.sarek.local_process_tracking.SarekAnalysis.get_analysis_instance_for_workflow"
+        ), mock.patch.object(
+            tracker, "recreate_project_from_analysis", return_value=self.project_obj
+        ):
+            tracker.recreate_analysis_sample()
+            tracker.poll_analysis_status()
+        self.assertEqual(ProcessExitStatusSuccessful, tracker.process_status)
+        tracker.tracking_connector.process_status_from_state.assert_called_once_with(
+            "DONE", None
+        )
+
+    def test_poll_slurm_jobs(self, *mocks):
+        trackers = []
+        for job_id, state in [(1001, None), (1002, None), (1003, "DONE"), (1004, None)]:
+            trackers.append(
+                self.get_tracker_instance(*mocks, slurm_job_id=job_id, state=state)
+            )
+        trackers.append(self.get_tracker_instance(*mocks, process_id=self.process_id))
+
+        with mock.patch(
+            "ngi_pipeline.engines.sarek.local_process_tracking.SlurmConnector.get_slurm_job_statuses"
+        ) as statuses_mock, mock.patch(
+            "ngi_pipeline.engines.sarek.local_process_tracking.JobStatus.is_process_running"
+        ) as running_mock:
+            # the status of job 1004 could not be determined
+            statuses_mock.return_value = {
+                "1001": ProcessRunning,
+                "1002": ProcessStopped,
+            }
+            poll_slurm_jobs(trackers, self.config, self.log)
+            # finished analyses and local processes are not polled
+            statuses_mock.assert_called_once_with(
+                ["1001", "1002", "1004"], config=self.config
+            )
+            self.assertListEqual(
+                [True, False, None, None, None], [x.job_running for x in trackers]
+            )
+            running_mock.return_value = True
+            for tracker in trackers[0:2] + trackers[3:4]:
+                tracker.analysis_sample.sample_analysis_exit_code_path.return_value = (
+                    os.devnull
+                )
+                tracker.poll_analysis_status()
+            # only the job left out of the query is polled on its own
+            running_mock.assert_called_once_with(1004, config=self.config)
+            self.assertListEqual(
+                [ProcessRunning, ProcessExitStatusUnknown, ProcessRunning],
+                [x.process_status for x in trackers[0:2] + trackers[3:4]],
+            )
+
+            # if the jobs could not be polled at once, they are polled one at a time
+            trackers[0].job_running = None
+            statuses_mock.side_effect = SlurmStatusNotRecognizedError("1001", "error")
+            poll_slurm_jobs(trackers[0:1], self.config, self.log)
+            self.assertIsNone(trackers[0].job_running)
+
+    def test_poll_local_jobs(self, *mocks):
+        trackers = []
+        for job_id, state in [(1, None), (2, None), (3, "DONE"), (4, None)]:
+            trackers.append(
+                self.get_tracker_instance(*mocks, local_job_id=job_id, state=state)
+            )
+        trackers.append(
+            self.get_tracker_instance(*mocks, slurm_job_id=self.slurm_job_id)
+        )
+
+        with mock.patch(
+            "ngi_pipeline.engines.sarek.local_process_tracking.LocalSchedulerConnector.get_local_job_statuses"
+        ) as statuses_mock:
+            # job 4 is no longer known to the local scheduler
+            statuses_mock.return_value = {1: ProcessRunning, 2: ProcessStopped}
+            poll_local_jobs(trackers, {}, self.log)
+            statuses_mock.assert_called_once_with([1, 2, 4], config={})
+            self.assertListEqual(
+                [True, False, None, False, None], [x.job_running for x in trackers]
+            )
+            trackers[0].analysis_sample.sample_analysis_exit_code_path.return_value = (
+                os.devnull
+            )
+            trackers[0].poll_analysis_status()
+            self.assertEqual(ProcessRunning, trackers[0].process_status)
+
+            # if the local scheduler could not be polled, the jobs are polled one at a time
+            statuses_mock.side_effect = RuntimeError("no local scheduler")
+            poll_local_jobs(trackers[0:1], {}, self.log)
+            self.assertIsNone(trackers[0].job_running)
+
+    def test_tracker_cache(self, *mocks):
+        tracker_cache = AnalysisTrackerCache()
+        create_mock = mock.Mock(return_value="this-is-an-analysis-instance")
+        for _ in range(2):
+            self.assertEqual(
+                "this-is-an-analysis-instance",
+                tracker_cache.analysis_instance("SarekGermlineAnalysis", create_mock),
+            )
+        create_mock.assert_called_once_with()
+
+        # the samples of a project are added to the same project object
+        fastq_files = {
+            sample_id: [
+                os.path.join(
+                    "/", "base", "DATA", "P123", sample_id, "A", "run-1", "R1.fastq.gz"
+                )
+            ]
+            for sample_id in ["P123_1001", "P123_1002"]
+        }
+        project_key = ("/base", "P123", "SarekGermlineAnalysis")
+        projects = [
+            tracker_cache.add_fastq_file_paths(project_key, fastq_files[sample_id])
+            for sample_id in sorted(fastq_files)
+        ]
+        self.assertIs(projects[0], projects[1])
+        self.assertListEqual(sorted(fastq_files), sorted(projects[0].samples))
+        self.assertIsNot(
+            projects[0],
+            tracker_cache.add_fastq_file_paths(
+                ("/base", "P123", "SomeOtherAnalysis"), fastq_files["P123_1001"]
+            ),
+        )
+
     def test_report_analysis_status(self, *mocks):
         tracker = self.get_tracker_instance(*mocks)
         tracker.process_status = ProcessStopped
@@ -182,7 +347,9 @@ class TestAnalysisTracker(unittest.TestCase):
             "autosomal_coverage": 35.8,
             "total_reads": 123456789,
         }
-        tracker.analysis_sample.analysis_object.collect_analysis_metrics.return_value = expected_metrics
+        tracker.analysis_sample.analysis_object.collect_analysis_metrics.return_value = (
+            expected_metrics
+        )
 
         # if the exit status is not successful, results should not be reported
         tracker.process_status = ProcessExitStatusUnknown
@@ -249,3 +416,137 @@ class TestAnalysisTracker(unittest.TestCase):
         tracker.process_status = ProcessExitStatusSuccessful
         tracker.cleanup()
         cleanup_fn.assert_called_once_with(tracker.analysis_sample)
+
+    def test_record_failed_batch(self, *mocks):
+        tracker = self.get_tracker_instance(*mocks, batch_id="batch-1")
+        tracker.analysis_sample.sample_analysis_work_dir.return_value = "/batch-1/work"
+        record_fn = tracker.tracking_connector.record_failed_batch
+
+        # batches that are running or have finished successfully are not recorded
+        for status in [ProcessRunning, ProcessExitStatusSuccessful]:
+            tracker.process_status = status
+            tracker.record_failed_batch()
+            record_fn.assert_not_called()
+
+        tracker.process_status = ProcessExitStatusFailed
+        tracker.record_failed_batch()
+        record_fn.assert_called_once_with(
+            tracker.tracked_analysis.project_id,
+            tracker.tracked_analysis.sample_id,
+            tracker.tracked_analysis.workflow,
+            "batch-1",
+            "/batch-1/work",
+        )
+
+        # nor are analyses of a single sample
+        record_fn.reset_mock()
+        tracker = self.get_tracker_instance(*mocks)
+        tracker.process_status = ProcessExitStatusFailed
+        tracker.record_failed_batch()
+        tracker.tracking_connector.record_failed_batch.assert_not_called()
+
+
+class TestUpdateCharonWithLocalJobsStatus(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log = minimal_logger(__name__, to_file=False)
+        self.sample_ids = ["P123_{}".format(1001 + i) for i in range(6)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def _check_analysis(analysis_tracker):
+        # odd samples fail to update Charon after the status has been polled
+        sample_no = int(analysis_tracker.tracked_analysis.sample_id.split("_")[-1])
+        analysis_tracker.process_status = ProcessExitStatusSuccessful
+        analysis_tracker.polled_state = ("DONE", 0)
+        if sample_no % 2:
+            raise ValueError("Charon is down")
+
+    def test_update_charon_with_local_jobs_status(self):
+        database_path = os.path.join(self.tmp_dir, "tracking.db")
+        with get_db_session(database_path=database_path) as db_session:
+            tracking_connector = TrackingConnector({}, self.log, db_session)
+            for sample_id in self.sample_ids:
+                tracking_connector.record_process_sample(
+                    "P123",
+                    sample_id,
+                    self.tmp_dir,
+                    "SarekGermlineAnalysis",
+                    "sarek",
+                    1,
+                    ProcessConnector,
+                )
+            with mock.patch(
+                "ngi_pipeline.engines.sarek.local_process_tracking._check_analysis",
+                side_effect=self._check_analysis,
+            ), mock.patch.object(
+                db_session, "commit", wraps=db_session.commit
+            ) as commit_mock, mock.patch.object(
+                AnalysisTracker, "cleanup", autospec=True
+            ) as cleanup_mock:
+                update_charon_with_local_jobs_status(
+                    config={},
+                    log=self.log,
+                    tracking_connector=tracking_connector,
+                    charon_connector=mock.Mock(),
+                    max_workers=4,
+                )
+                # no intermediate commits
+                commit_mock.assert_called_once_with()
+            self.assertListEqual(
+                self.sample_ids[1::2],
+                [
+                    x.tracked_analysis.sample_id
+                    for x in [call[0][0] for call in cleanup_mock.call_args_list]
+                ],
+            )
+        # the failed samples are kept, with the polled state committed
+        with get_db_session(database_path=database_path) as db_session:
+            remaining = db_session.query(TrackingConnector._SampleAnalysis).all()
+            self.assertListEqual(
+                self.sample_ids[::2], sorted([x.sample_id for x in remaining])
+            )
+            self.assertTrue(all(x.state == "DONE" for x in remaining))
+
+    def test_reap_failed_batches(self):
+        database_path = os.path.join(self.tmp_dir, "tracking.db")
+        workflow = "SarekGermlineAnalysis"
+        work_dirs = {
+            batch_id: os.path.join(self.tmp_dir, batch_id, "work")
+            for batch_id in ["batch-1", "batch-2", "batch-3"]
+        }
+        for work_dir in work_dirs.values():
+            os.makedirs(work_dir)
+        with get_db_session(database_path=database_path) as db_session:
+            tracking_connector = TrackingConnector({}, self.log, db_session)
+            for batch_id, sample_ids in [
+                ("batch-1", self.sample_ids[0:2]),
+                ("batch-2", self.sample_ids[2:4]),
+                ("batch-3", self.sample_ids[4:6]),
+            ]:
+                for sample_id in sample_ids:
+                    tracking_connector.record_failed_batch(
+                        "P123", sample_id, workflow, batch_id, work_dirs[batch_id]
+                    )
+            # the work directory of batch-2 has already been removed
+            shutil.rmtree(work_dirs["batch-2"])
+            succeeded = [
+                TrackingConnector._SampleAnalysis(
+                    project_id="P123", sample_id=sample_id, workflow=workflow
+                )
+                for sample_id in [self.sample_ids[1], self.sample_ids[2]]
+            ]
+            reap_failed_batches(tracking_connector, succeeded, self.log)
+            self.assertFalse(os.path.exists(work_dirs["batch-1"]))
+            self.assertTrue(os.path.exists(work_dirs["batch-3"]))
+            self.assertDictEqual(
+                {("P123", workflow, "batch-3"): work_dirs["batch-3"]},
+                tracking_connector.stale_failed_batches([], max_age_days=0),
+            )
+            reap_failed_batches(tracking_connector, [], self.log, max_age_days=0)
+            self.assertFalse(os.path.exists(work_dirs["batch-3"]))
+            self.assertDictEqual(
+                {}, tracking_connector.stale_failed_batches([], max_age_days=0)
+            )
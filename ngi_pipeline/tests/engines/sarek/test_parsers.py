@@ -1,13 +1,14 @@
-import locale
 import mock
 import os
 import tempfile
 import unittest
 
+from ngi_pipeline.engines.sarek.exceptions import ParserMetricNotFoundException
 from ngi_pipeline.engines.sarek.parsers import (
     QualiMapParser,
     PicardMarkDuplicatesParser,
     ParserIntegrator,
+    StoredMetricsParser,
 )
 
 try:
@@ -117,13 +118,9 @@ class ExampleData(object):
 
 class TestQualiMapParser(unittest.TestCase):
     def setUp(self):
-        locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
         self.examples = ExampleData.qualimap_input
         self.examples_expected = ExampleData.qualimap_output
 
-    def tearDown(self):
-        locale.resetlocale()
-
     def helper(self, test_key, test_fn):
         for i in range(len(self.examples[test_key])):
             self.assertDictEqual(
@@ -235,6 +232,25 @@ class TestPicardMarkDuplicatesParser(unittest.TestCase):
                 self.assertEqual(case_data[1], observed_value)
 
 
+class TestStoredMetricsParser(unittest.TestCase):
+    def test_metrics(self):
+        with mock.patch.object(QualiMapParser, "parse_result_file"):
+            parser = QualiMapParser("mocked-result-file")
+        parser.data["number of reads"] = 1234567890
+        # percent duplication is not reported by QualiMap
+        with mock.patch.object(
+            QualiMapParser, "get_autosomal_coverage", return_value=30.5
+        ):
+            metrics = parser.metrics()
+        self.assertDictEqual(
+            {"autosomal_coverage": 30.5, "total_reads": 1234567890}, metrics
+        )
+        stored_parser = StoredMetricsParser(metrics)
+        self.assertEqual(30.5, stored_parser.get_autosomal_coverage())
+        with self.assertRaises(ParserMetricNotFoundException):
+            stored_parser.get_percent_duplication()
+
+
 class TestParserIntegrator(unittest.TestCase):
     markdups_resultfile = None
     qualimap_resultfile = None
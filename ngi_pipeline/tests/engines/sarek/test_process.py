@@ -14,9 +14,12 @@ from ngi_pipeline.engines.sarek.process import (
     ProcessStatus,
     ProcessRunning,
     JobStatus,
+    LocalJobStatus,
+    LocalSchedulerConnector,
     ProcessStopped,
     SlurmConnector,
 )
+from ngi_pipeline.utils.resources import JobResources
 
 
 class TestProcessConnector(unittest.TestCase):
@@ -224,7 +227,9 @@ class TestJobStatus(unittest.TestCase):
         connector_mock.get_slurm_job_status.return_value = ProcessRunning
         self.assertTrue(JobStatus.is_process_running(12345))
         connector_mock.get_slurm_job_status.return_value = ProcessStopped
-        self.assertFalse(JobStatus.is_process_running(12345))
+        config = {"slurm": {"slurmrestd": {"url": "http://localhost:6820"}}}
+        self.assertFalse(JobStatus.is_process_running(12345, config=config))
+        connector_mock.get_slurm_job_status.assert_called_with(12345, config=config)
 
 
 class TestSlurmConnector(unittest.TestCase):
@@ -290,3 +295,136 @@ class TestSlurmConnector(unittest.TestCase):
             self.assertTrue(os.path.exists(observed_script))
             self.assertEqual(expected_script_dir, os.path.dirname(observed_script))
             self.assertEqual(expected_script_name, os.path.basename(observed_script))
+
+    def test__slurm_script_from_command_line_job_resources(self):
+        self._create_slurm_connector()
+        observed_script = self.slurm_connector._slurm_script_from_command_line(
+            "this-is-a-command-line",
+            self.cwd,
+            "this-is-the-exit-code-path",
+            "test_slurm_job",
+            job_resources=JobResources(walltime=5400, cores=4, memory=None),
+        )
+        with open(observed_script) as fh:
+            observed_header = fh.read()
+        self.assertIn("#SBATCH -n 4\n", observed_header)
+        self.assertIn("#SBATCH -t 0-01:30:00\n", observed_header)
+        # the connector's own parameters are left alone
+        self.assertEqual(
+            self.slurm_cores, self.slurm_connector.slurm_parameters["slurm_cores"]
+        )
+
+    @mock.patch("ngi_pipeline.utils.slurm.subprocess.check_output")
+    def test_execute_process_job_array(self, sbatch_mock):
+        self._create_slurm_connector()
+        self.slurm_connector.slurm_parameters["array_throttle"] = 2
+        self.assertIsNone(self.slurm_connector.submit_job_array())
+        self.slurm_connector.open_job_array(
+            "test_slurm_job_array", os.path.join(self.cwd, "array")
+        )
+        for task_id, sample in enumerate(["sample_1", "sample_2"]):
+            self.assertEqual(
+                task_id,
+                self.slurm_connector.execute_process(
+                    "this-is-a-command-line",
+                    working_dir=os.path.join(self.cwd, sample),
+                    job_name=sample,
+                ),
+            )
+        sbatch_mock.assert_not_called()
+        sbatch_mock.return_value = b"Submitted batch job 12345\n"
+        job_array = self.slurm_connector.submit_job_array()
+        self.assertIsNone(self.slurm_connector.job_array)
+        self.assertEqual(12345, job_array.job_id)
+        self.assertEqual(
+            os.path.join(self.cwd, "sample_2"), job_array.tasks[1].working_dir
+        )
+        with open(job_array.driver_script) as fh:
+            driver_script = fh.read()
+        self.assertIn("#SBATCH --array 0-1%2\n", driver_script)
+        self.assertIn("#SBATCH --ntasks {}\n".format(self.slurm_cores), driver_script)
+
+    @mock.patch("ngi_pipeline.engines.sarek.process.submit_slurm_script")
+    def test_execute_process_slurm_config(self, submit_mock):
+        slurmrestd = {"url": "http://localhost:6820"}
+        self.slurm_connector = SlurmConnector(
+            self.slurm_project,
+            self.slurm_mail_user,
+            cwd=self.cwd,
+            slurmrestd=slurmrestd,
+        )
+        submit_mock.return_value = 12345
+        self.assertEqual(
+            "12345",
+            self.slurm_connector.execute_process(
+                "this-is-a-command-line", job_name="test_slurm_job"
+            ),
+        )
+        # the slurmrestd setting of the slurm section is passed on for the submission
+        submit_mock.assert_called_once_with(
+            mock.ANY, config={"slurm": self.slurm_connector.slurm_parameters}
+        )
+        self.assertDictEqual(
+            slurmrestd, submit_mock.call_args[1]["config"]["slurm"]["slurmrestd"]
+        )
+
+    @mock.patch("ngi_pipeline.engines.sarek.process.core_get_slurm_job_statuses")
+    def test_get_slurm_job_statuses(self, statuses_mock):
+        config = {"slurm": {"slurmrestd": {"url": "http://localhost:6820"}}}
+        statuses_mock.return_value = {"1001": None, "1002": 0}
+        self.assertDictEqual(
+            {"1001": ProcessRunning, "1002": ProcessStopped},
+            SlurmConnector.get_slurm_job_statuses(["1001", "1002"], config=config),
+        )
+        statuses_mock.assert_called_once_with(["1001", "1002"], config=config)
+
+
+class TestLocalSchedulerConnector(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = mock.Mock()
+        self.scheduler.submit.return_value = 3
+        self.local_connector = LocalSchedulerConnector(
+            self.scheduler, cwd="/scratch", cores=2, memory="8G", priority=1
+        )
+
+    def test_execute_process(self):
+        self.assertEqual(
+            3,
+            self.local_connector.execute_process(
+                "this-is-a-command-line",
+                exit_code_path="this-is-the-exit-code-path",
+                job_name="test_local_job",
+                job_completion_commands=["this-is-a-completion-command"],
+                job_resources=JobResources(walltime=5400, cores=4, memory=None),
+            ),
+        )
+        self.scheduler.submit.assert_called_once_with(
+            "this-is-a-command-line",
+            job_name="test_local_job",
+            working_dir="/scratch",
+            exit_code_path="this-is-the-exit-code-path",
+            cores=4,
+            memory="8G",
+            priority=1,
+            start_commands=[mock.ANY],
+            finish_commands=["this-is-a-completion-command"],
+        )
+
+    @mock.patch("ngi_pipeline.engines.sarek.process.get_local_scheduler")
+    def test_get_local_job_statuses(self, scheduler_mock):
+        scheduler_mock.return_value.poll.return_value = {
+            1: {"state": "RUNNING"},
+            2: {"state": "QUEUED"},
+            3: {"state": "FAILED"},
+        }
+        self.assertDictEqual(
+            {1: ProcessRunning, 2: ProcessRunning, 3: ProcessStopped},
+            LocalSchedulerConnector.get_local_job_statuses([1, 2, 3, 4], config={}),
+        )
+        self.assertEqual(
+            ProcessStopped, LocalSchedulerConnector.get_local_job_status(4, config={})
+        )
+        self.assertTrue(LocalJobStatus.is_process_running(2))
+        scheduler_mock.return_value = None
+        with self.assertRaises(RuntimeError):
+            LocalSchedulerConnector.get_local_job_statuses([1], config={})
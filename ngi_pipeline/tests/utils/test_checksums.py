@@ -0,0 +1,174 @@
+import hashlib
+import json
+import mock
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from ngi_pipeline.utils import checksums
+
+
+class TestChecksums(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.tmp_dir, "DATA")
+        os.makedirs(os.path.join(self.data_dir, "P123_1001"))
+        self.file_paths = []
+        self.expected = {}
+        for i in range(3):
+            file_path = os.path.join(
+                self.data_dir, "P123_1001", "P123_1001_R{}.fastq.gz".format(i)
+            )
+            content = "@read{}\nACGT\n+\nIIII\n".format(i).encode()
+            with open(file_path, "wb") as fh:
+                fh.write(content)
+            self.file_paths.append(file_path)
+            self.expected[file_path] = hashlib.md5(content).hexdigest()
+        self.manifest_path = os.path.join(self.tmp_dir, "qc_ngi", "checksums.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_compute_md5(self):
+        self.assertEqual(
+            self.expected[self.file_paths[0]],
+            checksums.compute_md5(self.file_paths[0], block_size=3),
+        )
+
+    def test_checksum_files(self):
+        md5sum_file_path = os.path.join(self.tmp_dir, "P123_1001.md5")
+        self.assertDictEqual(
+            self.expected,
+            checksums.checksum_files(
+                self.file_paths,
+                self.manifest_path,
+                base_dir=self.data_dir,
+                md5sum_file_path=md5sum_file_path,
+                max_workers=2,
+            ),
+        )
+        with open("{}.md5".format(self.file_paths[1]), "r") as fh:
+            self.assertEqual(self.expected[self.file_paths[1]], fh.read())
+        with open(self.manifest_path, "r") as fh:
+            self.assertIn("P123_1001/P123_1001_R2.fastq.gz", json.load(fh))
+        # paths relative to the base dir, verifiable with md5sum -c from there
+        with open(md5sum_file_path, "r") as fh:
+            self.assertEqual(
+                "{}  P123_1001/P123_1001_R0.fastq.gz\n".format(
+                    self.expected[self.file_paths[0]]
+                ),
+                fh.readline(),
+            )
+        subprocess.check_call(
+            ["md5sum", "--quiet", "-c", md5sum_file_path], cwd=self.data_dir
+        )
+
+    def test_checksum_files_cached(self):
+        checksums.checksum_files(
+            self.file_paths, self.manifest_path, base_dir=self.data_dir
+        )
+        # the files are copied elsewhere with their times preserved
+        copy_dir = os.path.join(self.tmp_dir, "copy")
+        shutil.copytree(self.data_dir, copy_dir)
+        copied_paths = [x.replace(self.data_dir, copy_dir) for x in self.file_paths]
+        with open(copied_paths[2], "ab") as fh:
+            fh.write(b"changed")
+        with mock.patch(
+            "ngi_pipeline.utils.checksums.compute_md5", return_value="0" * 32
+        ) as mock_md5:
+            computed = checksums.checksum_files(
+                copied_paths, self.manifest_path, base_dir=copy_dir, sidecars=False
+            )
+        # only the file that changed is hashed again
+        mock_md5.assert_called_once_with(copied_paths[2])
+        self.assertEqual(self.expected[self.file_paths[0]], computed[copied_paths[0]])
+        self.assertEqual("0" * 32, computed[copied_paths[2]])
+
+    def test_checksum_files_sidecar(self):
+        # a sidecar written after the file is trusted, a stale one is not
+        with open("{}.md5".format(self.file_paths[0]), "w") as fh:
+            fh.write("a" * 32)
+        with open("{}.md5".format(self.file_paths[1]), "w") as fh:
+            fh.write("b" * 32)
+        os.utime("{}.md5".format(self.file_paths[1]), (0, 0))
+        computed = checksums.checksum_files(
+            self.file_paths, self.manifest_path, base_dir=self.data_dir
+        )
+        self.assertEqual("a" * 32, computed[self.file_paths[0]])
+        self.assertEqual(
+            self.expected[self.file_paths[1]], computed[self.file_paths[1]]
+        )
+
+    def test_checksum_files_rewritten(self):
+        checksums.checksum_files(
+            self.file_paths, self.manifest_path, base_dir=self.data_dir
+        )
+        # rewritten with the same size within the same second, the sidecar of the
+        # earlier content still being more recent than the file
+        stat = os.stat(self.file_paths[0])
+        with open(self.file_paths[0], "wb") as fh:
+            fh.write(b"@read9\nTGCA\n+\nIIII\n")
+        second = stat.st_mtime_ns - stat.st_mtime_ns % 10**9
+        mtime_ns = second + 1 if stat.st_mtime_ns != second + 1 else second + 2
+        os.utime(self.file_paths[0], ns=(stat.st_atime_ns, mtime_ns))
+        os.utime(
+            "{}.md5".format(self.file_paths[0]),
+            ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9),
+        )
+        computed = checksums.checksum_files(
+            self.file_paths, self.manifest_path, base_dir=self.data_dir
+        )
+        self.assertEqual(
+            hashlib.md5(b"@read9\nTGCA\n+\nIIII\n").hexdigest(),
+            computed[self.file_paths[0]],
+        )
+
+    def _run_checksum_command(self):
+        md5sum_file_path = os.path.join(self.tmp_dir, "checksums", "P123_1001.md5")
+        script = "\n".join(
+            [
+                'FILES="{}/P123_1001/*.fastq.gz {}/missing/*.bam"'.format(
+                    self.data_dir, self.data_dir
+                ),
+                checksums.checksum_command(
+                    "FILES",
+                    self.manifest_path,
+                    base_dir=self.data_dir,
+                    md5sum_file_path=md5sum_file_path,
+                ),
+            ]
+        )
+        # the checksum stage is run from this source tree, installed or not
+        package_dir = os.path.dirname(
+            os.path.dirname(os.path.dirname(checksums.__file__))
+        )
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(
+                [package_dir] + os.environ.get("PYTHONPATH", "").split(os.pathsep)
+            ),
+        )
+        subprocess.check_call(["bash", "-c", script], env=env, cwd=self.tmp_dir)
+        for file_path, md5 in self.expected.items():
+            with open("{}.md5".format(file_path), "r") as fh:
+                self.assertEqual(md5, fh.read())
+        with open(md5sum_file_path, "r") as fh:
+            self.assertListEqual(
+                sorted(
+                    "{}  P123_1001/{}\n".format(md5, os.path.basename(file_path))
+                    for file_path, md5 in self.expected.items()
+                ),
+                sorted(fh.readlines()),
+            )
+
+    def test_checksum_command(self):
+        self._run_checksum_command()
+        self.assertTrue(os.path.exists(self.manifest_path))
+
+    def test_checksum_command_fallback(self):
+        # the checksum stage cannot be run, so md5sum is used instead
+        with mock.patch.object(checksums.sys, "executable", "false"):
+            self._run_checksum_command()
+        self.assertFalse(os.path.exists(self.manifest_path))
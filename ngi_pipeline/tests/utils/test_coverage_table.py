@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ngi_pipeline.utils import coverage_table
+from ngi_pipeline.utils.qualimap import GenomeResults
+
+
+def _genome_results(contigs):
+    lines = [">>>>>>> Coverage per contig", ""]
+    lines.extend(
+        "\t{}\t{}\t{}\t{}\t1.0".format(name, length, int(length * mean), mean)
+        for name, length, mean in contigs
+    )
+    genome_results = GenomeResults(None)
+    genome_results.parse(lines)
+    return genome_results
+
+
+class TestCoverageTable(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.table_dir = coverage_table.coverage_table_dir(self.tmp_dir, "P123")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _stage(self, sample_id, x_coverage, percent_duplication, extra=()):
+        contigs = [("1", 1000, 30.0), ("2", 1000, 30.0), ("X", 500, x_coverage)]
+        contigs.extend(extra)
+        return coverage_table.stage_sample_coverage(
+            self.table_dir,
+            sample_id,
+            _genome_results(contigs),
+            percent_duplication=percent_duplication,
+        )
+
+    def test_update_coverage_table(self):
+        self.assertIsNone(coverage_table.update_coverage_table(self.table_dir))
+        self.assertIsNone(coverage_table.CoverageTable.load(self.table_dir))
+        for i in range(5):
+            self._stage("P123_100{}".format(i), 15.0, 10.0 + i * 0.1)
+        self._stage("P123_1005", 30.0, 40.0, extra=[("MT", 16, 2000.0)])
+        coverage_table.update_coverage_table(self.table_dir)
+
+        table = coverage_table.CoverageTable.load(self.table_dir)
+        self.assertIsInstance(table.mean_coverage, np.memmap)
+        self.assertListEqual(
+            ["P123_100{}".format(i) for i in range(6)], table.samples.tolist()
+        )
+        self.assertListEqual(["1", "2", "X", "MT"], table.contigs.tolist())
+        self.assertListEqual([1000, 1000, 500, 16], table.contig_lengths.tolist())
+        self.assertTrue(np.isnan(table.mean_coverage[0, 3]))
+        self.assertEqual(2000.0, table.mean_coverage[5, 3])
+        self.assertEqual(30000, table.mapped_bases[0, 0])
+        np.testing.assert_allclose(
+            coverage_table.autosomal_coverage(table), np.full(6, 30.0)
+        )
+
+        summary = coverage_table.contig_coverage_summary(table)
+        self.assertAlmostEqual(1.0, summary["mean"][0])
+        self.assertAlmostEqual(0.5, summary["percentiles"][2, 2])
+        self.assertAlmostEqual(2000.0 / 30.0, summary["mean"][3])
+        outliers = coverage_table.coverage_outliers(table)
+        self.assertListEqual([5], np.flatnonzero(outliers[:, 2]).tolist())
+        self.assertListEqual(
+            [5], np.flatnonzero(coverage_table.duplication_outliers(table)).tolist()
+        )
+
+        # restaging a sample replaces its row, removing its staged file drops it
+        self._stage("P123_1005", 15.0, 10.2)
+        os.remove(os.path.join(self.table_dir, "staged", "P123_1000.npz"))
+        coverage_table.update_coverage_table(self.table_dir)
+        updated = coverage_table.CoverageTable.load(self.table_dir)
+        self.assertEqual(5, len(updated.samples))
+        self.assertIsNone(updated.sample_index("P123_1000"))
+        row = updated.sample_index("P123_1005")
+        self.assertEqual(15.0, updated.mean_coverage[row, 2])
+        self.assertTrue(np.isnan(updated.mean_coverage[row, 3]))
+        self.assertFalse(coverage_table.coverage_outliers(updated).any())
+        # the previous version of the table has been removed
+        entries = sorted(os.listdir(self.table_dir))
+        self.assertEqual(["current", "staged"], entries[:2])
+        self.assertEqual(1, len(entries[2:]))
+        self.assertTrue(entries[2].startswith(coverage_table.TABLE_VERSION_PREFIX))
+
+    def test_robust_z_scores(self):
+        z_scores = coverage_table.robust_z_scores([1.0, 1.1, 0.9, 1.0, 5.0, np.nan])
+        self.assertGreater(z_scores[4], 3.5)
+        self.assertLess(abs(z_scores[0]), 1.0)
+        self.assertTrue(np.isnan(z_scores[5]))
@@ -0,0 +1,122 @@
+import mock
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ngi_pipeline.utils import local_scheduler
+from ngi_pipeline.utils.local_scheduler import LocalScheduler
+
+
+class TestLocalScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.queue_dir = os.path.join(self.tmp_dir, "queue")
+        self.scheduler = LocalScheduler(self.queue_dir, cores=2, memory="4G")
+
+    def tearDown(self):
+        for job in self.scheduler.poll().values():
+            if job["state"] in local_scheduler.ACTIVE_JOB_STATES:
+                self.scheduler.cancel(job["job_id"])
+        shutil.rmtree(self.tmp_dir)
+
+    def _wait_for(self, job_ids, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            jobs = self.scheduler.poll(job_ids)
+            if all(
+                job["state"] not in local_scheduler.ACTIVE_JOB_STATES
+                for job in jobs.values()
+            ):
+                return jobs
+            time.sleep(0.05)
+        self.fail("jobs {} did not finish in time".format(job_ids))
+
+    def test_init(self):
+        self.assertEqual(2, self.scheduler.cores)
+        self.assertEqual(4 * 1024**3, self.scheduler.memory)
+        # the capacity is kept with the queue
+        self.assertEqual(2, LocalScheduler(self.queue_dir).cores)
+        other_scheduler = LocalScheduler(os.path.join(self.tmp_dir, "other"))
+        self.assertEqual(local_scheduler.machine_cores(), other_scheduler.cores)
+
+    def test_submit(self):
+        exit_code_path = os.path.join(self.tmp_dir, "exit_codes", "job_1.exit")
+        job_1 = self.scheduler.submit(
+            "sleep 0.5", exit_code_path=exit_code_path, cores=1, memory="1G"
+        )
+        job_2 = self.scheduler.submit("exit 3", cores=2)
+        job_3 = self.scheduler.submit("echo three", cores=1)
+        job_4 = self.scheduler.submit("echo four", cores=1, priority=5)
+        states = dict(
+            (job_id, job["state"]) for job_id, job in self.scheduler.poll().items()
+        )
+        # job 4 jumps the queue, job 3 is held back until there is room for job 2
+        self.assertDictEqual(
+            {
+                job_1: local_scheduler.JOB_RUNNING,
+                job_2: local_scheduler.JOB_QUEUED,
+                job_3: local_scheduler.JOB_QUEUED,
+                job_4: local_scheduler.JOB_RUNNING,
+            },
+            states,
+        )
+        self.assertListEqual([1, 2, 3, 4], [job_1, job_2, job_3, job_4])
+        # no exit code until the job has finished
+        with open(exit_code_path) as fh:
+            self.assertEqual("", fh.read().strip())
+
+        jobs = self._wait_for([job_1, job_2, job_3, job_4])
+        self.assertEqual(local_scheduler.JOB_DONE, jobs[job_1]["state"])
+        self.assertEqual(0, jobs[job_1]["exit_code"])
+        with open(exit_code_path) as fh:
+            self.assertEqual("0", fh.readline().strip())
+        self.assertEqual(local_scheduler.JOB_FAILED, jobs[job_2]["state"])
+        self.assertEqual(3, jobs[job_2]["exit_code"])
+        self.assertLessEqual(jobs[job_2]["started_at"], jobs[job_3]["started_at"])
+        with open(os.path.join(self.queue_dir, "jobs", "{}.out".format(job_3))) as fh:
+            self.assertEqual("three\n", fh.read())
+
+    def test_submit_too_large(self):
+        with self.assertRaises(ValueError):
+            self.scheduler.submit("true", cores=3)
+        with self.assertRaises(ValueError):
+            self.scheduler.submit("true", memory="5G")
+        self.assertDictEqual({}, self.scheduler.poll())
+
+    def test_cancel(self):
+        job_1 = self.scheduler.submit("sleep 30", cores=2)
+        job_2 = self.scheduler.submit("sleep 30", cores=2)
+        self.assertTrue(self.scheduler.cancel(job_2))
+        self.assertTrue(self.scheduler.cancel(job_1))
+        self.assertFalse(self.scheduler.cancel(job_1))
+        self.assertFalse(self.scheduler.cancel(12345))
+        jobs = self.scheduler.poll()
+        self.assertEqual(local_scheduler.JOB_CANCELLED, jobs[job_1]["state"])
+        self.assertEqual(local_scheduler.JOB_CANCELLED, jobs[job_2]["state"])
+        self.assertIsNone(jobs[job_2]["pid"])
+
+    def test_get_local_scheduler(self):
+        self.assertIsNone(local_scheduler.get_local_scheduler(config={"slurm": {}}))
+        scheduler = local_scheduler.get_local_scheduler(
+            config={"local_scheduler": {"queue_dir": self.queue_dir, "cores": 4}}
+        )
+        self.assertEqual(self.queue_dir, scheduler.queue_dir)
+        self.assertEqual(4, scheduler.cores)
+        self.assertEqual(4 * 1024**3, scheduler.memory)
+
+    def test_main(self):
+        job_id = self.scheduler.submit("sleep 30", job_name="sleeper", cores=2)
+        self.scheduler.submit("true")
+        with mock.patch("ngi_pipeline.utils.local_scheduler.print") as print_mock:
+            self.assertEqual(0, local_scheduler.main(["-q", self.queue_dir, "list"]))
+        self.assertEqual(2, print_mock.call_count)
+        self.assertTrue(print_mock.call_args_list[0][0][0].endswith("\tsleeper"))
+        self.assertEqual(
+            0, local_scheduler.main(["-q", self.queue_dir, "cancel", str(job_id)])
+        )
+        self.assertEqual(
+            local_scheduler.JOB_CANCELLED,
+            self.scheduler.poll([job_id])[job_id]["state"],
+        )
@@ -1,4 +1,6 @@
-from ngi_pipeline.utils.pyutils import flatten
+import time
+
+from ngi_pipeline.utils.pyutils import flatten, ordered_thread_map
 from six.moves import zip
 
 
@@ -8,3 +10,21 @@ def test_flatten():
     flattened_list = flatten(nested_list)
     for got_element, expected_element in zip(flattened_list, expected_list):
         assert got_element == expected_element
+
+
+def test_ordered_thread_map():
+    def _slow_square(value):
+        # later items finish first
+        time.sleep(0.01 * (5 - value))
+        if value == 3:
+            raise ValueError(value)
+        return value * value
+
+    for max_workers in (1, 4):
+        results = list(ordered_thread_map(_slow_square, range(5), max_workers))
+        assert [item for item, _, _ in results] == list(range(5))
+        assert [result for _, result, _ in results] == [0, 1, 4, None, 16]
+        assert isinstance(results[3][2], ValueError)
+        assert all(
+            exception is None for i, (_, _, exception) in enumerate(results) if i != 3
+        )
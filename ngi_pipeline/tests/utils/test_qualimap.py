@@ -0,0 +1,117 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from ngi_pipeline.utils import qualimap
+
+GENOME_RESULTS = """BamQC report
+-----------------------------------
+
+>>>>>>> Input
+
+     bam file = /scratch/P123_1001.clean.dedup.bam
+     outfile = P123_1001.clean.dedup.qc/genome_results.txt
+
+
+>>>>>>> Globals
+
+     number of windows = 400
+     number of reads = 967,817,737
+     number of mapped reads = 960,000,000 (99.19%)
+
+
+>>>>>>> Coverage
+
+     mean coverageData = 30.5X
+     There is a 99.84% of reference with a coverageData >= 1X
+     There is a 0% of reference with a coverageData >= 49X
+
+
+>>>>>>> Coverage per contig
+
+	1	249250621	7477518630	30.0	12.1
+	21	48129895	1347637060	28.0	10.4
+	X	155270560	2329058400	15.0	8.2
+	GL000192.1	547496	2737480	5.0	1.3
+"""
+
+
+class TestQualimap(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.genome_results_file = os.path.join(self.tmp_dir, "genome_results.txt")
+        with open(self.genome_results_file, "w") as fh:
+            fh.write(GENOME_RESULTS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse_number(self):
+        self.assertEqual(967817737, qualimap.parse_number("967,817,737"))
+        self.assertEqual(47.15, qualimap.parse_number("47.15%"))
+        self.assertEqual(131169423, qualimap.parse_number("131,169,423 bp"))
+        self.assertIsNone(qualimap.parse_number("/path/to.bam"))
+        self.assertIsNone(qualimap.parse_number("1.2.3"))
+
+    def test_parse_genome_results(self):
+        genome_results = qualimap.parse_genome_results(self.genome_results_file)
+        self.assertEqual(967817737, genome_results.number_of_reads())
+        self.assertEqual(
+            "/scratch/P123_1001.clean.dedup.bam", genome_results.values["bam file"]
+        )
+        self.assertEqual(30.5, genome_results.sections["Coverage"]["mean coverageData"])
+        self.assertDictEqual(
+            {"1X": 99.84, "49X": 0}, genome_results.cumulative_coverage
+        )
+        self.assertListEqual(
+            ["1", "21", "X", "GL000192.1"], [x.contig for x in genome_results.contigs]
+        )
+        self.assertEqual(12.1, genome_results.contigs[0].standard_deviation)
+        self.assertAlmostEqual(
+            (7477518630 + 1347637060) / (249250621 + 48129895),
+            genome_results.autosomal_coverage(),
+        )
+        self.assertAlmostEqual(15.0, genome_results.autosomal_coverage(["X"]))
+
+    def test_parse_genome_results_cached(self):
+        with mock.patch(
+            "ngi_pipeline.utils.qualimap.GenomeResults.parse",
+            autospec=True,
+            side_effect=qualimap.GenomeResults.parse,
+        ) as mock_parse:
+            genome_results = qualimap.parse_genome_results(self.genome_results_file)
+            self.assertIs(
+                genome_results, qualimap.parse_genome_results(self.genome_results_file)
+            )
+            self.assertEqual(1, mock_parse.call_count)
+            # a new report is parsed again
+            with open(self.genome_results_file, "a") as fh:
+                fh.write("\t22\t51304566\t1539136980\t30.0\t11.0\n")
+            self.assertEqual(
+                5, len(qualimap.parse_genome_results(self.genome_results_file).contigs)
+            )
+            self.assertEqual(2, mock_parse.call_count)
+
+    def test_contig_table(self):
+        genome_results = qualimap.GenomeResults(None)
+        # only the contig section is parsed as contig rows
+        genome_results.parse(
+            GENOME_RESULTS.replace(
+                "mean coverageData = 30.5X", "mean coverageData = 30.5X\n\tY\t1\t2\t3\t4"
+            ).splitlines(True)
+            + ["\tMT\t16569\t82845\tNaN?\n"]
+        )
+        contigs = genome_results.contigs
+        self.assertEqual(5, len(contigs))
+        self.assertEqual(1, contigs.index("21"))
+        self.assertIsNone(contigs.index("Y"))
+        self.assertEqual(
+            qualimap.ContigCoverage("X", 155270560, 2329058400, 15.0, 8.2),
+            contigs.get("X"),
+        )
+        self.assertEqual(
+            qualimap.ContigCoverage("MT", 16569, 82845, None, None), contigs[-1]
+        )
+        self.assertEqual(48129895, contigs.lengths[1])
@@ -0,0 +1,102 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from ngi_pipeline.database.tracking import JobMetrics, get_db_session
+from ngi_pipeline.utils.resources import predict_job_resources
+
+
+class TestPredictJobResources(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.config = {
+            "database": {
+                "record_tracking_db_path": os.path.join(self.tmp_dir, "tracking.db")
+            },
+            "slurm": {
+                "resource_prediction": {
+                    "safety_margin": 1.5,
+                    "percentile": 100,
+                    "min_history": 3,
+                    "max_walltime": "1-00:00:00",
+                    "max_cores": 16,
+                }
+            },
+        }
+        # one hour and 4 cores' worth of CPU time per GiB of input, peaking at 10 GiB
+        with get_db_session(config=self.config) as session:
+            for job_id in range(1, 5):
+                session.add(
+                    JobMetrics(
+                        engine="piper_ngi",
+                        slurm_job_id=job_id,
+                        workflow="merge_process_variantcall",
+                        input_bytes=job_id * 1024**3,
+                        state="COMPLETED",
+                        elapsed=job_id * 3600.0,
+                        total_cpu=job_id * 4 * 3600.0,
+                        max_rss=job_id * 2.5 * 1024**3,
+                        alloc_cpus=16,
+                        harvested_at=datetime.datetime(2020, 1, job_id),
+                    )
+                )
+            # failed jobs are not taken into account
+            session.add(
+                JobMetrics(
+                    engine="piper_ngi",
+                    slurm_job_id=5,
+                    workflow="merge_process_variantcall",
+                    input_bytes=1024**3,
+                    state="TIMEOUT",
+                    elapsed=345600.0,
+                    total_cpu=16 * 345600.0,
+                    alloc_cpus=16,
+                )
+            )
+            session.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_predict_job_resources(self):
+        job_resources = predict_job_resources(
+            "piper_ngi", "merge_process_variantcall", 2 * 1024**3, self.config
+        )
+        self.assertAlmostEqual(2 * 3600 * 1.5, job_resources.walltime)
+        self.assertEqual(6, job_resources.cores)
+        self.assertEqual(int(10 * 1024**3 * 1.5), job_resources.memory)
+
+    def test_predict_job_resources_capped(self):
+        self.config["slurm"]["resource_prediction"]["mem_per_core"] = "1G"
+        job_resources = predict_job_resources(
+            "piper_ngi", "merge_process_variantcall", 100 * 1024**3, self.config
+        )
+        self.assertEqual(24 * 3600, job_resources.walltime)
+        # enough cores for 15 GiB of memory
+        self.assertEqual(15, job_resources.cores)
+        self.config["slurm"]["resource_prediction"]["mem_per_core"] = "512M"
+        job_resources = predict_job_resources(
+            "piper_ngi", "merge_process_variantcall", 100 * 1024**3, self.config
+        )
+        self.assertEqual(16, job_resources.cores)
+
+    def test_predict_job_resources_unknown_input_size(self):
+        job_resources = predict_job_resources(
+            "piper_ngi", "merge_process_variantcall", None, self.config
+        )
+        self.assertAlmostEqual(4 * 3600 * 1.5, job_resources.walltime)
+
+    def test_predict_job_resources_no_prediction(self):
+        # not enough history
+        self.assertIsNone(
+            predict_job_resources("piper_ngi", "genotype_concordance", 1, self.config)
+        )
+        # not configured
+        del self.config["slurm"]["resource_prediction"]
+        self.assertIsNone(
+            predict_job_resources(
+                "piper_ngi", "merge_process_variantcall", 1, self.config
+            )
+        )
@@ -1,5 +1,9 @@
 import unittest
 import mock
+import os
+import shutil
+import subprocess
+import tempfile
 
 import ngi_pipeline.utils.slurm as slurm
 
@@ -14,6 +18,11 @@ class TestSlurm(unittest.TestCase):
         self.assertTrue(slurm.kill_slurm_job_by_id(self.slurm_job_id))
         mock_subprocess.assert_called_once_with(["scancel", "12345"])
 
+    @mock.patch("ngi_pipeline.utils.slurm.subprocess.check_call")
+    def test_kill_slurm_job_by_id_array_task(self, mock_subprocess):
+        self.assertTrue(slurm.kill_slurm_job_by_id(self.slurm_job_id, 3))
+        mock_subprocess.assert_called_once_with(["scancel", "12345_3"])
+
     @mock.patch("ngi_pipeline.utils.slurm.subprocess.check_call")
     def test_kill_slurm_job_by_id_error(self, mock_subprocess):
         mock_subprocess.side_effect = OSError("Error")
@@ -39,7 +48,225 @@ class TestSlurm(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             got_job_status = slurm.get_slurm_job_status(self.slurm_job_id)
 
+    @mock.patch("ngi_pipeline.utils.slurm.subprocess.check_output")
+    def test_get_slurm_job_statuses(self, mock_subprocess):
+        mock_subprocess.side_effect = [
+            b"12345|COMPLETED\n"
+            b"12345.batch|COMPLETED\n"
+            b"12346|CANCELLED by 1234\n"
+            b"12346.batch|FAILED\n",
+            b"12347|Whut\n"
+            b"12350_2|RUNNING\n"
+            b"12350_[3-4,6%2]|PENDING\n",
+        ]
+        got_statuses = slurm.get_slurm_job_statuses(
+            [12345, "12346", 12347, "12350_2", "12350_4", "12350_5"], batch_size=3
+        )
+        self.assertEqual(2, mock_subprocess.call_count)
+        self.assertIn("12345,12346,12347", mock_subprocess.call_args_list[0][0][0])
+        self.assertDictEqual(
+            {"12345": 0, "12346": 1, "12350_2": None, "12350_4": None}, got_statuses
+        )
+
+        mock_subprocess.side_effect = OSError("Error")
+        with self.assertRaises(RuntimeError):
+            slurm.get_slurm_job_statuses([self.slurm_job_id])
+
+    @mock.patch("ngi_pipeline.utils.slurm.time.sleep")
+    @mock.patch("ngi_pipeline.utils.slurm.subprocess.check_output")
+    def test_wait_for_slurm_jobs(self, mock_subprocess, mock_sleep):
+        mock_subprocess.side_effect = [
+            b"  12345\n  12350_[0-3]\n",
+            OSError("sacct not responding"),
+            b"  12346\n",
+        ]
+        missing = slurm.wait_for_slurm_jobs(
+            [12345, 12346, 12347, "12350_2"], initial_delay=1, max_wait=5
+        )
+        self.assertSetEqual({"12347"}, missing)
+        # one sacct call for all the jobs not seen yet, backing off in between
+        self.assertIn(
+            "12345,12346,12347,12350_2", mock_subprocess.call_args_list[0][0][0]
+        )
+        self.assertIn("12346,12347", mock_subprocess.call_args_list[1][0][0])
+        self.assertListEqual([1, 2], [x[0][0] for x in mock_sleep.call_args_list])
+        self.assertIn("--allocations", mock_subprocess.call_args_list[0][0][0])
+
     def test_slurm_time_to_seconds(self):
         slurm_time_str = "1-3:46:40"
         got_sec = slurm.slurm_time_to_seconds(slurm_time_str)
         self.assertEqual(got_sec, 100000)
+
+    def test_slurm_duration_to_seconds(self):
+        self.assertEqual(slurm.slurm_duration_to_seconds("1-03:46:40"), 100000)
+        self.assertEqual(slurm.slurm_duration_to_seconds("01:02:03"), 3723)
+        self.assertAlmostEqual(slurm.slurm_duration_to_seconds("12:34.567"), 754.567)
+        self.assertIsNone(slurm.slurm_duration_to_seconds("UNLIMITED"))
+        self.assertIsNone(slurm.slurm_duration_to_seconds(""))
+
+    def test_slurm_memory_to_bytes(self):
+        self.assertEqual(slurm.slurm_memory_to_bytes("2048K"), 2097152)
+        self.assertEqual(slurm.slurm_memory_to_bytes("1.5G"), 1610612736)
+        self.assertEqual(slurm.slurm_memory_to_bytes("512"), 512)
+        self.assertIsNone(slurm.slurm_memory_to_bytes(""))
+
+    @mock.patch("ngi_pipeline.utils.slurm.subprocess.check_output")
+    def test_get_slurm_job_metrics(self, mock_subprocess):
+        mock_subprocess.return_value = (
+            b"12345|12345|COMPLETED|02:00:00|1-06:00:00||16|4-00:00:00\n"
+            b"12345.batch|12345.batch|COMPLETED|02:00:00|1-06:00:00|20G|16|\n"
+            b"12345.extern|12345.extern|COMPLETED|02:00:00|00:00.001|1024K|16|\n"
+            b"12346|12346|CANCELLED by 1234|00:10:00|00:05:00||8|3-00:00:00\n"
+            b"12347.batch|12347.batch|FAILED|00:01:00|00:00:30|1M|1|\n"
+            b"12350_2|12352|COMPLETED|01:00:00|01:00:00||1|1-00:00:00\n"
+            b"12350_2.batch|12352.batch|COMPLETED|01:00:00|01:00:00|2G|1|\n"
+            b"12350_[3-4]|12350|PENDING|00:00:00|00:00:00||1|1-00:00:00\n"
+        )
+        got_metrics = slurm.get_slurm_job_metrics(
+            [12345, 12346, "12347", "12350_2"], batch_size=2
+        )
+        self.assertEqual(2, mock_subprocess.call_count)
+        self.assertIn("12345,12346", mock_subprocess.call_args_list[0][0][0])
+        self.assertIn("12347,12350_2", mock_subprocess.call_args_list[1][0][0])
+        self.assertIn("--parsable2", mock_subprocess.call_args_list[0][0][0])
+        self.assertDictEqual(
+            {
+                "slurm_job_id": 12345,
+                "state": "COMPLETED",
+                "elapsed": 7200,
+                "total_cpu": 108000,
+                "max_rss": 20 * 1024**3,
+                "alloc_cpus": 16,
+                "timelimit": 345600,
+            },
+            got_metrics["12345"],
+        )
+        self.assertEqual("CANCELLED", got_metrics["12346"]["state"])
+        self.assertIsNone(got_metrics["12346"]["max_rss"])
+        # only the step line was returned
+        self.assertNotIn("12347", got_metrics)
+        # array tasks are keyed by their task specification
+        self.assertEqual(12352, got_metrics["12350_2"]["slurm_job_id"])
+        self.assertEqual(2 * 1024**3, got_metrics["12350_2"]["max_rss"])
+        self.assertSetEqual({"12345", "12346", "12350_2"}, set(got_metrics))
+
+    @mock.patch("ngi_pipeline.utils.slurm.subprocess.check_output")
+    def test_get_slurm_job_metrics_error(self, mock_subprocess):
+        mock_subprocess.side_effect = OSError("Error")
+        with self.assertRaises(RuntimeError):
+            slurm.get_slurm_job_metrics([self.slurm_job_id])
+
+    def test_slurm_job_spec(self):
+        self.assertEqual("12345", slurm.slurm_job_spec(self.slurm_job_id))
+        self.assertEqual("12345_7", slurm.slurm_job_spec(self.slurm_job_id, 7))
+        self.assertEqual("12345_7", slurm.slurm_job_spec("12345_7"))
+        with self.assertRaises(ValueError):
+            slurm.slurm_job_spec(None)
+        with self.assertRaises(ValueError):
+            slurm.slurm_job_spec("12345_[1-4]")
+
+    def test_seconds_to_slurm_time(self):
+        self.assertEqual(slurm.seconds_to_slurm_time(100000), "1-03:47:00")
+        self.assertEqual(slurm.seconds_to_slurm_time(3600), "0-01:00:00")
+        self.assertEqual(slurm.seconds_to_slurm_time(0.5), "0-00:01:00")
+
+
+class TestSlurmJobArray(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.scripts = []
+        for sample, cores, walltime in (
+            ("P123_1001", 4, "1:00:00"),
+            ("P123_1002", 8, "0-02:00:00"),
+        ):
+            script = os.path.join(self.tmp_dir, "{}.sbatch".format(sample))
+            with open(script, "w") as fh:
+                fh.write(
+                    "\n".join(
+                        [
+                            "#!/bin/bash -l",
+                            "#SBATCH -A ngi2016003",
+                            "#SBATCH -n {}".format(cores),
+                            "#SBATCH -t {}".format(walltime),
+                            "#SBATCH -J {}".format(sample),
+                            '#SBATCH -o "{}.log"'.format(script),
+                            "#SBATCH --qos=short",
+                            "echo {} in $(pwd)".format(sample),
+                        ]
+                    )
+                )
+            self.scripts.append(script)
+        self.job_array = slurm.SlurmJobArray(
+            os.path.join(self.tmp_dir, "array"), "qc_P123", throttle=5
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_add_task(self):
+        self.assertEqual(0, self.job_array.add_task(self.scripts[0], key="P123_1001"))
+        self.assertEqual(
+            1,
+            self.job_array.add_task(
+                self.scripts[1], stderr="/path/to/stderr", working_dir=self.tmp_dir
+            ),
+        )
+        first_task, second_task = self.job_array.tasks
+        # the output file is taken from the script header by default
+        self.assertEqual("{}.log".format(self.scripts[0]), first_task.stdout)
+        self.assertEqual("{}.err".format(self.scripts[0]), first_task.stderr)
+        self.assertEqual("/path/to/stderr", second_task.stderr)
+        self.assertEqual(2, len(self.job_array))
+
+    def test_write(self):
+        for script in self.scripts:
+            self.job_array.add_task(script, working_dir=self.tmp_dir)
+        driver_script = self.job_array.write()
+        with open(driver_script) as fh:
+            driver_lines = fh.read().split("\n")
+        for expected_line in (
+            "#SBATCH -A ngi2016003",
+            "#SBATCH --ntasks 8",
+            "#SBATCH --time 0-02:00:00",
+            "#SBATCH --qos short",
+            "#SBATCH --job-name qc_P123",
+            "#SBATCH --array 0-1%5",
+        ):
+            self.assertIn(expected_line, driver_lines)
+        self.assertFalse([x for x in driver_lines if x.startswith("#SBATCH -J")])
+        with open(self.job_array.index_file) as fh:
+            self.assertEqual(self.scripts[1], fh.readlines()[1].split("\t")[0])
+        # the driver runs the script of its task
+        subprocess.check_call(
+            ["bash", driver_script],
+            env=dict(os.environ, SLURM_ARRAY_TASK_ID="1"),
+        )
+        with open(self.job_array.tasks[1].stdout) as fh:
+            self.assertEqual("P123_1002 in {}".format(self.tmp_dir), fh.read().strip())
+        self.assertFalse(os.path.exists(self.job_array.tasks[0].stdout))
+
+    @mock.patch("ngi_pipeline.utils.slurm.subprocess.check_output")
+    def test_submit(self, mock_subprocess):
+        with self.assertRaises(ValueError):
+            self.job_array.submit()
+        for sample, script in zip(("P123_1001", "P123_1002"), self.scripts):
+            self.job_array.add_task(script, key=sample)
+        mock_subprocess.return_value = b"Submitted batch job 12345\n"
+        self.assertEqual(12345, self.job_array.submit())
+        mock_subprocess.assert_called_once_with(
+            ["sbatch", self.job_array.driver_script]
+        )
+        self.assertListEqual(
+            [("P123_1001", 0, "12345_0"), ("P123_1002", 1, "12345_1")],
+            self.job_array.task_job_specs(),
+        )
+        with self.assertRaises(ValueError):
+            self.job_array.add_task(self.scripts[0])
+
+    @mock.patch("ngi_pipeline.utils.slurm.subprocess.check_output")
+    def test_submit_error(self, mock_subprocess):
+        self.job_array.add_task(self.scripts[0])
+        mock_subprocess.return_value = b"sbatch: error: Batch job submission failed\n"
+        with self.assertRaises(RuntimeError):
+            self.job_array.submit()
+        self.assertIsNone(self.job_array.job_id)
@@ -0,0 +1,194 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from ngi_pipeline.utils import slurm
+from ngi_pipeline.utils import slurm_simulator
+from ngi_pipeline.utils.slurm_simulator import SlurmSimulator
+
+
+class TestSlurmSimulator(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.simulator_dir = os.path.join(self.tmp_dir, "simulator")
+        self.script = os.path.join(self.tmp_dir, "job.sh")
+        with open(self.script, "w") as fh:
+            fh.write(
+                "#!/bin/bash\n"
+                "#SBATCH -J test_job\n"
+                "#SBATCH -n 4\n"
+                "#SBATCH -t 0-00:30:00\n"
+                "echo done > {}\n".format(os.path.join(self.tmp_dir, "job.done"))
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _simulator(self, **settings):
+        settings = dict(
+            dict(clock="manual", queue_delay=[10, 10], runtime=[100, 100]), **settings
+        )
+        return SlurmSimulator(self.simulator_dir, **settings)
+
+    def _sbatch(self, simulator, *args):
+        result = simulator.sbatch(list(args) + [self.script])
+        self.assertEqual(0, result.exit_code)
+        return int(result.stdout.split()[-1])
+
+    def _states(self, simulator, *job_specs):
+        result = simulator.sacct(
+            ["-X", "-P", "-n", "-j", ",".join(job_specs), "-o", "JobID,State"]
+        )
+        return dict(line.split("|") for line in result.stdout.splitlines())
+
+    def test_init(self):
+        with self.assertRaises(ValueError):
+            SlurmSimulator(self.simulator_dir, queue_delays=[1, 2])
+        simulator = self._simulator(seed=7)
+        # the settings are kept with the simulator
+        self.assertEqual(7, SlurmSimulator(self.simulator_dir).settings["seed"])
+        now = simulator.now()
+        self.assertEqual(now + 60, simulator.advance(60))
+        with self.assertRaises(ValueError):
+            SlurmSimulator(self.simulator_dir, clock="wall").advance(60)
+
+    def test_job_states(self):
+        simulator = self._simulator()
+        job_id = self._sbatch(simulator)
+        self.assertEqual(1000, job_id)
+        self.assertEqual({"1000": "PENDING"}, self._states(simulator, "1000"))
+        simulator.advance(50)
+        self.assertEqual({"1000": "RUNNING"}, self._states(simulator, "1000"))
+        simulator.advance(100)
+        self.assertEqual({"1000": "COMPLETED"}, self._states(simulator, "1000"))
+        # the script is not run unless so configured
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, "job.done")))
+        # the time limit of the script is kept to
+        long_job_id = self._sbatch(simulator, "--time", "00:01:00")
+        simulator.advance(200)
+        self.assertEqual(
+            {"1000": "COMPLETED", "1001": "TIMEOUT"},
+            self._states(simulator, "1000", str(long_job_id)),
+        )
+
+    def test_deterministic(self):
+        settings = dict(queue_delay=[0, 100], runtime=[10, 1000], failure_rate=0.5)
+        simulator = self._simulator(**settings)
+        for _ in range(10):
+            self._sbatch(simulator)
+        simulator.advance(500)
+        states = self._states(simulator)
+        self.assertEqual(10, len(states))
+        self.assertIn("FAILED", states.values())
+        self.assertIn("COMPLETED", states.values())
+        simulator = self._simulator(**settings)
+        for _ in range(10):
+            self._sbatch(simulator)
+        simulator.advance(500)
+        self.assertDictEqual(states, self._states(simulator))
+
+    def test_job_array(self):
+        simulator = self._simulator()
+        job_id = self._sbatch(simulator, "--array", "0-4%2")
+        self.assertEqual(
+            {"1000_[0-4%2]": "PENDING"}, self._states(simulator, str(job_id))
+        )
+        simulator.advance(50)
+        self.assertEqual(
+            {"1000_0": "RUNNING", "1000_1": "RUNNING", "1000_[2-4%2]": "PENDING"},
+            self._states(simulator, str(job_id)),
+        )
+        # the tasks have job ids of their own
+        self.assertEqual(1005, self._sbatch(simulator))
+        with mock.patch.dict(os.environ, simulator.environ()):
+            self.assertDictEqual(
+                {"1000_0": None, "1000_3": None},
+                slurm.get_slurm_job_statuses(["1000_0", "1000_3"]),
+            )
+            simulator.advance(1000)
+            metrics = slurm.get_slurm_job_metrics(["1000_4"])
+        self.assertEqual("COMPLETED", metrics["1000_4"]["state"])
+        self.assertEqual(1004, metrics["1000_4"]["slurm_job_id"])
+        self.assertEqual(100.0, metrics["1000_4"]["elapsed"])
+        self.assertEqual(4, metrics["1000_4"]["alloc_cpus"])
+        self.assertEqual(1800.0, metrics["1000_4"]["timelimit"])
+        self.assertGreater(metrics["1000_4"]["max_rss"], 0)
+
+    def test_visibility_lag(self):
+        simulator = self._simulator(clock="wall", visibility_lag=1)
+        job_id = self._sbatch(simulator)
+        self.assertEqual({}, self._states(simulator, str(job_id)))
+        with mock.patch.dict(os.environ, simulator.environ()):
+            self.assertSetEqual(
+                set(), slurm.wait_for_slurm_jobs([job_id], initial_delay=0.25)
+            )
+        self.assertGreater(simulator.calls()["sacct"], 2)
+
+    def test_scancel(self):
+        simulator = self._simulator()
+        job_ids = [str(self._sbatch(simulator)) for _ in range(2)]
+        simulator.advance(50)
+        with mock.patch.dict(os.environ, simulator.environ()):
+            self.assertTrue(slurm.kill_slurm_job_by_id(job_ids[0]))
+            simulator.advance(1000)
+            self.assertEqual(1, slurm.get_slurm_job_status(job_ids[0]))
+            self.assertEqual(0, slurm.get_slurm_job_status(job_ids[1]))
+        self.assertEqual(1, simulator.scancel(["12345"]).exit_code)
+        self.assertEqual(
+            {"1000": "CANCELLED by 0", "1001": "COMPLETED"},
+            self._states(simulator, *job_ids),
+        )
+
+    def test_submit_failure(self):
+        simulator = self._simulator(submit_failure_rate=1.0)
+        result = simulator.sbatch([self.script])
+        self.assertEqual(1, result.exit_code)
+        self.assertTrue(result.stderr.startswith("sbatch: error:"))
+        self.assertEqual(1, simulator.sbatch([]).exit_code)
+
+    def test_run_scripts(self):
+        simulator = self._simulator(run_scripts=True)
+        self._sbatch(simulator, "--output", os.path.join(self.tmp_dir, "slurm-%j.out"))
+        simulator.advance(200)
+        self.assertEqual({"1000": "COMPLETED"}, self._states(simulator, "1000"))
+        with open(os.path.join(self.tmp_dir, "job.done")) as fh:
+            self.assertEqual("done\n", fh.read())
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, "slurm-1000.out")))
+
+    def test_main(self):
+        self.assertEqual(
+            0,
+            slurm_simulator.main(
+                [
+                    "--dir",
+                    self.simulator_dir,
+                    "setup",
+                    "--clock",
+                    "manual",
+                    "--runtime",
+                    "60",
+                    "60",
+                ]
+            ),
+        )
+        with mock.patch("sys.stdout") as stdout_mock:
+            self.assertEqual(
+                0,
+                slurm_simulator.main(
+                    ["--dir", self.simulator_dir, "sbatch", "--parsable", self.script]
+                ),
+            )
+        stdout_mock.write.assert_called_once_with("1000\n")
+        self.assertEqual(
+            0, slurm_simulator.main(["--dir", self.simulator_dir, "advance", "3600"])
+        )
+        self.assertEqual(
+            {"1000": "COMPLETED"},
+            self._states(SlurmSimulator(self.simulator_dir), "1000"),
+        )
+        for command in slurm_simulator.SIMULATED_COMMANDS:
+            self.assertTrue(
+                os.access(os.path.join(self.simulator_dir, "bin", command), os.X_OK)
+            )
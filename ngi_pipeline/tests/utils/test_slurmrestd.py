@@ -0,0 +1,216 @@
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ngi_pipeline.utils import slurm
+from ngi_pipeline.utils import slurmrestd
+from ngi_pipeline.utils.slurm_simulator import SlurmRestdServer, SlurmSimulator
+from ngi_pipeline.utils.slurmrestd import SlurmRestClient
+
+
+class TestSlurmRestClient(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.simulator_dir = os.path.join(self.tmp_dir, "simulator")
+        self.simulator = self._simulator()
+        self.server = SlurmRestdServer(self.simulator_dir)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+        self.client = SlurmRestClient(self.server.url, user_name="funk_001")
+        self.script = os.path.join(self.tmp_dir, "job.sh")
+        with open(self.script, "w") as fh:
+            fh.write(
+                "#!/bin/bash -l\n"
+                "#SBATCH -A ngi2016001\n"
+                '#SBATCH -J "test_job"\n'
+                "#SBATCH -n 4\n"
+                "#SBATCH -t 0-01:00:30\n"
+                "#SBATCH --mem 8G\n"
+                "#SBATCH --mail-type FAIL,END\n"
+                "echo done\n"
+            )
+        self.array_script = os.path.join(self.tmp_dir, "array.sh")
+        with open(self.array_script, "w") as fh:
+            fh.write("#!/bin/bash -l\n#SBATCH --array 0-4%2\necho done\n")
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+        shutil.rmtree(self.tmp_dir)
+
+    def _simulator(self, **settings):
+        settings = dict(
+            dict(
+                clock="manual",
+                queue_delay=[10, 10],
+                runtime=[100, 100],
+                visibility_lag=30,
+                min_job_age=300,
+            ),
+            **settings
+        )
+        return SlurmSimulator(self.simulator_dir, **settings)
+
+    def test_job_description(self):
+        job = slurmrestd.job_description(self.script, environment={"A": "1"})
+        self.assertDictEqual(
+            {
+                "name": "test_job",
+                "current_working_directory": os.getcwd(),
+                "environment": ["A=1"],
+                "account": "ngi2016001",
+                "tasks": 4,
+                "time_limit": 61,
+                "memory_per_node": 8192,
+                "mail_type": ["FAIL", "END"],
+            },
+            job,
+        )
+        with open(self.script, "w") as fh:
+            fh.write(
+                "#!/bin/bash -l\n"
+                "#SBATCH -t UNLIMITED\n"
+                "#SBATCH --mem 8000\n"
+                "#SBATCH --mem-per-cpu 2G\n"
+                "echo done\n"
+            )
+        job = slurmrestd.job_description(self.script, environment={})
+        self.assertDictEqual({"set": True, "infinite": True}, job["time_limit"])
+        # sbatch reads a number without a unit as megabytes
+        self.assertEqual(8000, job["memory_per_node"])
+        self.assertEqual(2048, job["mem_per_cpu"])
+        # the job runs without a time limit
+        self.assertEqual(1000, self.client.submit_job(self.script))
+        self.simulator.advance(60)
+        accounting = self.simulator.sacct(["-P", "-n", "-X", "-o", "JobID,Timelimit"])
+        self.assertEqual("1000|UNLIMITED\n", accounting.stdout)
+
+    def test_submit_job(self):
+        self.assertEqual(1000, self.client.submit_job(self.script))
+        self.assertEqual("funk_001", self.client.headers["X-SLURM-USER-NAME"])
+        accounting = self.simulator.sacct(
+            ["-P", "-n", "-X", "-o", "JobID,JobName,Account,AllocCPUS,Timelimit"]
+        )
+        # the job is in the accounting once the visibility lag has passed
+        self.assertEqual("", accounting.stdout)
+        self.simulator.advance(60)
+        accounting = self.simulator.sacct(
+            ["-P", "-n", "-X", "-o", "JobID,JobName,Account,AllocCPUS,Timelimit"]
+        )
+        self.assertEqual("1000|test_job|ngi2016001|4|0-01:01:00\n", accounting.stdout)
+        self.assertEqual(1, self.simulator.calls()["slurmrestd"])
+        with self.assertRaises(IOError):
+            self.client.submit_job(os.path.join(self.tmp_dir, "missing.sh"))
+
+    def test_submit_job_error(self):
+        self.server.simulator.settings["submit_failure_rate"] = 1.0
+        with self.assertRaises(RuntimeError):
+            self.client.submit_job(self.script)
+
+    def test_submit_jobs(self):
+        missing_script = os.path.join(self.tmp_dir, "missing.sh")
+        job_ids = self.client.submit_jobs(
+            [self.script, missing_script, self.array_script]
+        )
+        self.assertListEqual(sorted([self.script, self.array_script]), sorted(job_ids))
+        # the scripts are submitted at the same time, in any order; the array tasks
+        # take up a job id each
+        self.assertIn(
+            (job_ids[self.script], job_ids[self.array_script]),
+            [(1000, 1001), (1005, 1000)],
+        )
+
+    def test_get_job_states(self):
+        array_job_id = self.client.submit_job(self.array_script)
+        job_id = self.client.submit_job(self.script)
+        job_specs = [
+            "{}_0".format(array_job_id),
+            "{}_3".format(array_job_id),
+            str(job_id),
+            "12345",
+        ]
+        # slurmctld knows the jobs before they show up in the accounting
+        self.assertDictEqual(
+            {"1000_0": "PENDING", "1000_3": "PENDING", "1005": "PENDING"},
+            self.client.get_job_states(job_specs),
+        )
+        self.simulator.advance(50)
+        self.assertDictEqual(
+            {"1000_0": "RUNNING", "1000_3": "PENDING", "1005": "RUNNING"},
+            self.client.get_job_states(job_specs),
+        )
+        self.client.cancel_job(job_id)
+        # finished jobs are found in the accounting once slurmctld has let go of them
+        self.simulator.advance(1000)
+        self.assertDictEqual(
+            {"1000_0": "COMPLETED", "1000_3": "COMPLETED", "1005": "CANCELLED"},
+            self.client.get_job_states(job_specs),
+        )
+        self.assertDictEqual({}, self.client.get_job_states([]))
+
+    def test_cancel_job(self):
+        with self.assertRaises(RuntimeError):
+            self.client.cancel_job(12345)
+        with self.assertRaises(ValueError):
+            self.client.cancel_job("not-a-job")
+        client = SlurmRestClient("http://127.0.0.1:1", timeout=1)
+        with self.assertRaises(RuntimeError):
+            client.cancel_job(12345)
+
+    def test_get_slurmrestd_client(self):
+        self.assertIsNone(slurmrestd.get_slurmrestd_client(config={"slurm": {}}))
+        config = {"slurm": {"slurmrestd": {"url": self.server.url, "pool_size": 2}}}
+        client = slurmrestd.get_slurmrestd_client(config=config)
+        self.assertEqual(self.server.url, client.base_url)
+        self.assertEqual(2, client.pool_size)
+        self.assertIs(client, slurmrestd.get_slurmrestd_client(config=config))
+
+    def test_slurmrestd_client(self):
+        with mock.patch.object(slurm, "_ngi_config", None), mock.patch.dict(
+            os.environ, {"NGI_CONFIG": os.path.join(self.tmp_dir, "missing.yaml")}
+        ):
+            # without a config file the SLURM commands are used
+            self.assertIsNone(slurm._slurmrestd_client())
+            # and the config file is only looked for once
+            with mock.patch(
+                "ngi_pipeline.utils.slurm.locate_ngi_config"
+            ) as mock_locate:
+                self.assertIsNone(slurm._slurmrestd_client())
+            mock_locate.assert_not_called()
+        self.assertIsNone(slurm._slurmrestd_client({"slurm": {}}))
+        config = {"slurm": {"slurmrestd": {"url": self.server.url}}}
+        self.assertEqual(self.server.url, slurm._slurmrestd_client(config).base_url)
+
+    def test_slurm_utilities(self):
+        with mock.patch(
+            "ngi_pipeline.utils.slurm._slurmrestd_client", return_value=self.client
+        ):
+            job_id = slurm.submit_slurm_script(self.script)
+            self.assertDictEqual(
+                {self.array_script: 1001},
+                slurm.submit_slurm_scripts([self.array_script]),
+            )
+            job_array = slurm.SlurmJobArray(
+                os.path.join(self.tmp_dir, "job_array"), "test_array"
+            )
+            job_array.add_task(self.script)
+            self.assertEqual(1006, job_array.submit())
+            self.assertSetEqual(
+                set(), slurm.wait_for_slurm_jobs([job_id, "1001_4", "1006_0"])
+            )
+            self.assertIsNone(slurm.get_slurm_job_status(job_id))
+            self.assertTrue(slurm.kill_slurm_job_by_id(1001, 4))
+            self.simulator.advance(1000)
+            self.assertDictEqual(
+                {"1000": 0, "1001_4": 1, "1006_0": 0},
+                slurm.get_slurm_job_statuses([job_id, "1001_4", "1006_0"]),
+            )
+            with self.assertRaises(ValueError):
+                slurm.get_slurm_job_status(12345)
+        # no commands were run
+        self.assertSetEqual({"slurmrestd"}, set(self.simulator.calls()))
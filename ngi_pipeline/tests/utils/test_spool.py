@@ -0,0 +1,106 @@
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from ngi_pipeline.utils.spool import JobCompletionSpool, get_job_completion_spool
+
+
+class TestJobCompletionSpool(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.spool = JobCompletionSpool(self.tmp_dir, "piper_ngi")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _run_job(self, exit_code, sample_id="P123_1001", env=None):
+        job_script = "\n".join(
+            [self.spool.job_started_command(), "RC={}".format(exit_code)]
+            + self.spool.job_finished_commands(
+                "P123", sample_id, "merge_process_variantcall", "RC"
+            )
+        )
+        subprocess.check_call(["bash", "-c", job_script], env=env)
+
+    def test_get_job_completion_spool(self):
+        self.assertIsNone(get_job_completion_spool("piper_ngi", {}))
+        spool = get_job_completion_spool(
+            "sarek",
+            {"database": {"record_tracking_db_path": "/path/to/tracking.db"}},
+        )
+        self.assertEqual("/path/to/job_completion_spool/sarek", spool.path)
+        spool = get_job_completion_spool(
+            "sarek", {"database": {"job_completion_spool": "/path/to/spool"}}
+        )
+        self.assertEqual("/path/to/spool/sarek", spool.path)
+        self.assertEqual(3600, spool.poll_interval)
+        spool = get_job_completion_spool(
+            "sarek",
+            {
+                "database": {
+                    "job_completion_spool": "/path/to/spool",
+                    "job_completion_spool_poll_interval": 600,
+                    "job_completion_spool_max_age_days": 7,
+                }
+            },
+        )
+        self.assertEqual(600, spool.poll_interval)
+        self.assertEqual(7, spool.max_age_days)
+
+    def test_poll_overdue(self):
+        spool = JobCompletionSpool(self.tmp_dir, "piper_ngi", poll_interval=600)
+        now = datetime.datetime.now()
+        self.assertTrue(spool.poll_overdue(None))
+        self.assertFalse(spool.poll_overdue(now - datetime.timedelta(seconds=60), now))
+        self.assertTrue(spool.poll_overdue(now - datetime.timedelta(seconds=600), now))
+
+    def test_job_finished_commands(self):
+        self._run_job(1)
+        records = self.spool.new_records()
+        self.assertEqual(1, len(records))
+        record = records[0][1]
+        self.assertEqual("piper_ngi", record["engine"])
+        self.assertEqual("P123_1001", record["sample_id"])
+        self.assertEqual(1, record["exit_code"])
+        self.assertIsNone(record["rsync_exit_code"])
+        self.assertIsNotNone(JobCompletionSpool.record_timestamp(record, "finished_at"))
+        self.assertListEqual([], os.listdir(self.spool.tmp_dir))
+
+    def test_job_finished_commands_job_id(self):
+        env = dict(os.environ, SLURM_JOB_ID="12346")
+        env.pop("SLURM_ARRAY_JOB_ID", None)
+        self._run_job(0, env=env)
+        env.update(SLURM_ARRAY_JOB_ID="12345", SLURM_ARRAY_TASK_ID="3")
+        self._run_job(0, sample_id="P123_1002", env=env)
+        self.assertSetEqual(
+            {"12346", "12345_3"},
+            set(x[1]["job_id"] for x in self.spool.new_records()),
+        )
+
+    def test_acknowledge(self):
+        self._run_job(0)
+        records = self.spool.new_records()
+        self.spool.acknowledge(records)
+        self.assertListEqual([], self.spool.new_records())
+        self.assertListEqual([records[0][0]], os.listdir(self.spool.cur_dir))
+        # consumed records are kept until they are old enough to be pruned
+        self.spool.prune(max_age_days=1)
+        self.assertEqual(1, len(os.listdir(self.spool.cur_dir)))
+        self.spool.prune()
+        self.assertEqual(1, len(os.listdir(self.spool.cur_dir)))
+        self.spool.max_age_days = -1
+        self.spool.prune()
+        self.assertListEqual([], os.listdir(self.spool.cur_dir))
+
+    def test_new_records_invalid(self):
+        os.makedirs(self.spool.new_dir)
+        with open(os.path.join(self.spool.new_dir, "1.1.json"), "w") as fh:
+            fh.write("{not json")
+        with open(os.path.join(self.spool.new_dir, "2.2.json"), "w") as fh:
+            json.dump({"engine": "sarek"}, fh)
+        self.assertListEqual([], self.spool.new_records())
+        self.assertEqual(2, len(os.listdir(self.spool.cur_dir)))
@@ -0,0 +1,67 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from ngi_pipeline.utils import trash
+
+
+class TestTrash(unittest.TestCase):
+    def setUp(self):
+        self.project_dir = tempfile.mkdtemp()
+        self.analysis_dir = os.path.join(self.project_dir, "piper_ngi")
+        self.sample_dir = os.path.join(self.analysis_dir, "05_processed_alignments")
+        os.makedirs(os.path.join(self.sample_dir, "P123_1001.metrics"))
+        self.paths = [
+            os.path.join(self.sample_dir, "P123_1001.bam"),
+            os.path.join(self.sample_dir, "P123_1001.metrics"),
+        ]
+        for file_path in (
+            self.paths[0],
+            os.path.join(self.paths[1], "insert_size.txt"),
+            os.path.join(self.paths[1], "coverage.txt"),
+        ):
+            open(file_path, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.project_dir)
+
+    def test_move_to_trash(self):
+        trash_dir = trash.move_to_trash(
+            self.paths + [os.path.join(self.sample_dir, "missing.bam")],
+            self.project_dir,
+        )
+        self.assertEqual(
+            os.path.join(self.project_dir, ".trash"), os.path.dirname(trash_dir)
+        )
+        for path in self.paths:
+            self.assertFalse(os.path.exists(path))
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(trash_dir, os.path.relpath(path, self.project_dir))
+                )
+            )
+
+    @mock.patch("ngi_pipeline.utils.trash.os.rename")
+    def test_move_to_trash_other_filesystem(self, mock_rename):
+        mock_rename.side_effect = OSError(18, "Invalid cross-device link")
+        trash.move_to_trash(self.paths, self.project_dir)
+        # deleted right away instead
+        for path in self.paths:
+            self.assertFalse(os.path.exists(path))
+
+    def test_reap_trash(self):
+        trash.move_to_trash(self.paths, self.project_dir)
+        # too recent
+        self.assertEqual(0, trash.reap_trash(self.project_dir, min_age=3600))
+        self.assertEqual(3, trash.reap_trash(self.project_dir, max_workers=2))
+        self.assertListEqual([], os.listdir(os.path.join(self.project_dir, ".trash")))
+        self.assertTrue(os.path.exists(self.sample_dir))
+        # nothing to do
+        self.assertEqual(0, trash.reap_trash(os.path.join(self.project_dir, "nowhere")))
+
+    def test_start_trash_reaper(self):
+        trash.move_to_trash(self.paths, self.project_dir)
+        trash.start_trash_reaper([self.project_dir]).join()
+        self.assertListEqual([], os.listdir(os.path.join(self.project_dir, ".trash")))
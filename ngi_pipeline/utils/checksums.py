@@ -0,0 +1,373 @@
+"""MD5 checksums of analysis and delivery files, computed once per file.
+
+The checksums are cached in a manifest keyed by the path of each file (relative
+to a base directory, so that the manifest stays valid when the files are copied
+between node scratch and project storage with their modification times
+preserved) together with its size and modification time. Only the files that
+are missing from the manifest or have changed since they were hashed are read,
+on a pool of worker threads. The checksums are written as the usual ".md5"
+sidecar files (the bare hex digest) and, optionally, as an md5sum-format file
+listing all of them, as described in DELIVERY.README.txt.
+
+The job scripts run this as (see checksum_command):
+
+    python -m ngi_pipeline.utils.checksums --cache <manifest> [--md5sum-file <file>]
+        [--base-dir <dir>] [--threads <n>] <file> [<file> ...]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shlex
+import sys
+
+from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.filesystem import safe_makedir
+from ngi_pipeline.utils.pyutils import ordered_thread_map
+
+LOG = minimal_logger(__name__)
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def compute_md5(file_path, block_size=BLOCK_SIZE):
+    """Compute the MD5 checksum of a file.
+
+    :param str file_path: The path to the file
+    :param int block_size: The number of bytes to read at a time
+
+    :returns: The hex digest
+    :rtype: str
+    """
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as fh:
+        for block in iter(lambda: fh.read(block_size), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def _file_stamp(file_path):
+    """The (size, mtime) of a file, with the mtime in nanoseconds as preserved by
+    cp -p and rsync -t, so that a file rewritten within the same second is seen
+    to have changed."""
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def read_md5_sidecar(file_path):
+    """Return the checksum in the ".md5" sidecar of a file, if there is one that
+    is at least as recent as the file itself.
+
+    :param str file_path: The path to the file (not the sidecar)
+
+    :returns: The hex digest, or None if there is no usable sidecar
+    :rtype: str
+    """
+    sidecar_path = "{}.md5".format(file_path)
+    try:
+        if os.stat(sidecar_path).st_mtime_ns < os.stat(file_path).st_mtime_ns:
+            return None
+        with open(sidecar_path, "r") as fh:
+            # either a bare digest or a line of md5sum output
+            md5 = fh.read().split(None, 1)[0].lower()
+    except (IOError, OSError, IndexError):
+        return None
+    if len(md5) != 32 or any(x not in "0123456789abcdef" for x in md5):
+        return None
+    return md5
+
+
+class ChecksumManifest(object):
+    """The cached checksums of a set of files, stored as JSON."""
+
+    def __init__(self, manifest_path, base_dir=None):
+        """
+        :param str manifest_path: The path to the manifest file; it does not need to exist
+        :param str base_dir: The directory the file paths are keyed relative to
+                             (default: the current working directory)
+        """
+        self.manifest_path = manifest_path
+        self.base_dir = os.path.abspath(base_dir or os.getcwd())
+        self.entries = {}
+        self.changed = False
+        try:
+            with open(manifest_path, "r") as fh:
+                entries = json.load(fh)
+            if not isinstance(entries, dict):
+                raise ValueError("not a checksum manifest")
+            self.entries = entries
+        except (IOError, OSError):
+            pass
+        except ValueError as e:
+            LOG.warning(
+                'Ignoring invalid checksum manifest "{}": {}'.format(manifest_path, e)
+            )
+
+    def __repr__(self):
+        return "ChecksumManifest({})".format(self.manifest_path)
+
+    def key(self, file_path):
+        """The manifest key of a file: its path relative to the base directory."""
+        return os.path.relpath(os.path.abspath(file_path), self.base_dir)
+
+    def lookup(self, file_path):
+        """Return the cached checksum of a file, if it has not changed since it was hashed.
+
+        :param str file_path: The path to the file
+
+        :returns: The hex digest, or None if the file is not in the manifest or is stale
+        :rtype: str
+        """
+        entry = self.entries.get(self.key(file_path))
+        if not entry:
+            return None
+        try:
+            size, mtime = _file_stamp(file_path)
+        except OSError:
+            return None
+        if entry.get("size") != size or entry.get("mtime") != mtime:
+            return None
+        return entry.get("md5")
+
+    def update(self, file_paths, max_workers=4):
+        """Return the checksums of the files, hashing only those that are missing
+        from the manifest or stale. For a file missing from the manifest, a sidecar
+        that is more recent than the file is trusted instead of hashing it; a stale
+        file is always hashed again.
+
+        :param list file_paths: The paths to the files
+        :param int max_workers: The number of files to hash concurrently
+
+        :returns: A dict of file path to hex digest
+        :rtype: dict
+        :raises IOError: If a file could not be read
+        """
+        checksums = {}
+        to_hash = []
+        for file_path in file_paths:
+            md5 = self.lookup(file_path)
+            if md5 is None:
+                to_hash.append(file_path)
+            else:
+                checksums[file_path] = md5
+        if to_hash:
+            LOG.info(
+                "Computing the checksums of {} of {} files".format(
+                    len(to_hash), len(checksums) + len(to_hash)
+                )
+            )
+
+        untracked = set(x for x in to_hash if self.key(x) not in self.entries)
+
+        def _stamp_and_hash(file_path):
+            # stat first so that a file modified while hashing is hashed again next time
+            size, mtime = _file_stamp(file_path)
+            md5 = None
+            if file_path in untracked:
+                md5 = read_md5_sidecar(file_path)
+            return size, mtime, md5 or compute_md5(file_path)
+
+        for file_path, result, exception in ordered_thread_map(
+            _stamp_and_hash, to_hash, max_workers=max_workers
+        ):
+            if exception is not None:
+                raise exception
+            size, mtime, md5 = result
+            self.entries[self.key(file_path)] = {
+                "size": size,
+                "mtime": mtime,
+                "md5": md5,
+            }
+            self.changed = True
+            checksums[file_path] = md5
+        return checksums
+
+    def save(self):
+        """Write the manifest if it has changed; the file is replaced atomically."""
+        if not self.changed:
+            return
+        manifest_dir = os.path.dirname(os.path.abspath(self.manifest_path))
+        safe_makedir(manifest_dir)
+        tmp_path = "{}.{}.tmp".format(self.manifest_path, os.getpid())
+        with open(tmp_path, "w") as fh:
+            json.dump(self.entries, fh, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.manifest_path)
+        self.changed = False
+
+
+def write_md5_sidecars(checksums):
+    """Write the checksums as ".md5" sidecars (the bare hex digest, no newline),
+    leaving the sidecars that are already up to date alone.
+
+    :param dict checksums: A dict of file path to hex digest
+    """
+    for file_path, md5 in checksums.items():
+        sidecar_path = "{}.md5".format(file_path)
+        try:
+            with open(sidecar_path, "r") as fh:
+                if fh.read() == md5:
+                    continue
+        except (IOError, OSError):
+            pass
+        with open(sidecar_path, "w") as fh:
+            fh.write(md5)
+
+
+def write_md5sum_file(md5sum_file_path, checksums, base_dir=None):
+    """Write the checksums in md5sum format ("<digest>  <path>"), with paths
+    relative to base_dir, so that "md5sum -c" can verify them from there.
+
+    :param str md5sum_file_path: The path of the file to write
+    :param dict checksums: A dict of file path to hex digest
+    :param str base_dir: The directory the paths are written relative to
+                         (default: the directory of the md5sum file)
+    """
+    base_dir = base_dir or os.path.dirname(os.path.abspath(md5sum_file_path))
+    lines = sorted(
+        "{}  {}\n".format(md5, os.path.relpath(os.path.abspath(file_path), base_dir))
+        for file_path, md5 in checksums.items()
+    )
+    safe_makedir(os.path.dirname(os.path.abspath(md5sum_file_path)))
+    tmp_path = "{}.{}.tmp".format(md5sum_file_path, os.getpid())
+    with open(tmp_path, "w") as fh:
+        fh.writelines(lines)
+    os.rename(tmp_path, md5sum_file_path)
+
+
+def checksum_files(
+    file_paths,
+    manifest_path,
+    base_dir=None,
+    md5sum_file_path=None,
+    sidecars=True,
+    max_workers=4,
+):
+    """Compute the missing checksums of a set of files, update the manifest and
+    write the sidecars and md5sum file.
+
+    :param list file_paths: The paths to the files
+    :param str manifest_path: The path to the checksum manifest
+    :param str base_dir: The directory the paths are relative to, in the manifest
+                         and in the md5sum file
+    :param str md5sum_file_path: The md5sum-format file to write, if any
+    :param bool sidecars: Whether to write the ".md5" sidecars
+    :param int max_workers: The number of files to hash concurrently
+
+    :returns: A dict of file path to hex digest
+    :rtype: dict
+    """
+    manifest = ChecksumManifest(manifest_path, base_dir=base_dir)
+    try:
+        checksums = manifest.update(file_paths, max_workers=max_workers)
+    finally:
+        # keep what was computed before a failure
+        manifest.save()
+    if sidecars:
+        write_md5_sidecars(checksums)
+    if md5sum_file_path:
+        write_md5sum_file(md5sum_file_path, checksums, base_dir=base_dir)
+    return checksums
+
+
+def checksum_command(
+    files_variable, manifest_path, base_dir=None, md5sum_file_path=None, threads=4
+):
+    """Return the shell command that checksums the files in a shell variable from
+    a job script. If the checksum stage cannot be run on the node, the sidecars
+    and the md5sum file are written with md5sum instead.
+
+    :param str files_variable: The name of the shell variable listing the files (may
+                               hold globs)
+    :param str manifest_path: The path to the checksum manifest
+    :param str base_dir: The directory the paths are relative to (may use shell variables)
+    :param str md5sum_file_path: The md5sum-format file to write, if any
+    :param int threads: The number of files to hash concurrently
+
+    :returns: A shell command line
+    :rtype: str
+    """
+    options = ["--cache", shlex.quote(manifest_path), "--threads", str(threads)]
+    if base_dir:
+        options.extend(["--base-dir", '"{}"'.format(base_dir)])
+    if md5sum_file_path:
+        options.extend(["--md5sum-file", '"{}"'.format(md5sum_file_path)])
+    # the fallback; globs that match nothing are skipped without failing the job
+    fallback = [
+        "for f in ${}; do".format(files_variable),
+        "if [[ -f $f ]]; then",
+        "md5=$(md5sum \"$f\" | awk '{print $1}');",
+        'printf %s "$md5" > "$f.md5";',
+    ]
+    if md5sum_file_path:
+        # paths relative to base_dir, as written by write_md5sum_file
+        md5sum_file = '"{}"'.format(md5sum_file_path)
+        relative_to = '"{}"'.format(base_dir or "$(dirname {})".format(md5sum_file))
+        fallback = [
+            'mkdir -p "$(dirname {})" && : > {} &&'.format(md5sum_file, md5sum_file)
+        ] + fallback
+        fallback.append(
+            'echo "$md5  $(realpath --relative-to={} "$f")" >> {};'.format(
+                relative_to, md5sum_file
+            )
+        )
+    fallback.extend(["fi;", "done"])
+    return "{python} -m {module} {options} ${files} || {{ {fallback}; }}".format(
+        python=shlex.quote(sys.executable),
+        module=__name__,
+        options=" ".join(options),
+        files=files_variable,
+        fallback=" ".join(fallback),
+    )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Compute the MD5 checksums of files that have changed since "
+        "they were last hashed and write them as .md5 sidecars."
+    )
+    parser.add_argument(
+        "-c", "--cache", required=True, help="The checksum manifest to use and update"
+    )
+    parser.add_argument(
+        "-b",
+        "--base-dir",
+        help="The directory paths are relative to (default: current directory)",
+    )
+    parser.add_argument(
+        "-m", "--md5sum-file", help="Also write the checksums in md5sum format here"
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=4,
+        help="The number of files to hash at once",
+    )
+    parser.add_argument(
+        "--no-sidecars",
+        dest="sidecars",
+        action="store_false",
+        help="Do not write .md5 sidecars",
+    )
+    parser.add_argument("files", nargs="*")
+    parsed_args = parser.parse_args(args)
+    # unmatched globs are passed on as-is by the shell
+    file_paths = [x for x in parsed_args.files if os.path.isfile(x)]
+    try:
+        checksum_files(
+            file_paths,
+            parsed_args.cache,
+            base_dir=parsed_args.base_dir,
+            md5sum_file_path=parsed_args.md5sum_file,
+            sidecars=parsed_args.sidecars,
+            max_workers=parsed_args.threads,
+        )
+    except (IOError, OSError) as e:
+        LOG.error("Could not compute checksums: {}".format(e))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
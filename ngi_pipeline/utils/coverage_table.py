@@ -0,0 +1,403 @@
+"""A columnar table of the coverage per contig and the duplication of the samples
+of a project, for analyses across samples (e.g. how uniform the coverage of each
+chromosome is over thousands of samples) that Charon's scalar metrics cannot serve.
+
+The table is kept under ANALYSIS/<project>/coverage_table:
+
+    staged/<sample>.npz       the coverage of a sample, written when its analysis finishes
+    current -> table.<ns>     the consolidated table, one .npy file per column:
+        samples.npy               (samples,) sample ids
+        contigs.npy               (contigs,) contig names
+        contig_lengths.npy        (contigs,) int64
+        mapped_bases.npy          (samples, contigs) int64
+        mean_coverage.npy         (samples, contigs) float64, NaN where not reported
+        percent_duplication.npy   (samples,) float64, NaN where not known
+        staged_mtimes.npy         (samples,) int64, the mtime of the staged file of each row
+
+Writing the staged file of a sample is cheap; update_coverage_table then merges
+the samples staged since the last update into a new version of the table, which
+replaces the current one atomically. The columns are plain .npy files, so they
+can be loaded memory-mapped (see CoverageTable.load) and aggregated with the
+vectorized helpers below without reading the whole table into memory.
+"""
+
+import contextlib
+import errno
+import os
+import shutil
+import time
+import warnings
+
+import numpy as np
+
+from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.filesystem import safe_makedir
+
+LOG = minimal_logger(__name__)
+
+TABLE_DIRNAME = "coverage_table"
+STAGED_DIRNAME = "staged"
+CURRENT_LINK = "current"
+TABLE_VERSION_PREFIX = "table."
+COLUMNS = (
+    "samples",
+    "contigs",
+    "contig_lengths",
+    "mapped_bases",
+    "mean_coverage",
+    "percent_duplication",
+    "staged_mtimes",
+)
+# The autosomes, named as in both the b37 and the hg38 references
+AUTOSOMES = tuple(str(x) for x in range(1, 23)) + tuple(
+    "chr{}".format(x) for x in range(1, 23)
+)
+
+
+def coverage_table_dir(project_base_path, project_id):
+    """The directory of the coverage table of a project.
+
+    :param str project_base_path: The path to the project dir
+    :param str project_id: The project id
+
+    :rtype: str
+    """
+    return os.path.join(project_base_path, "ANALYSIS", project_id, TABLE_DIRNAME)
+
+
+def stage_sample_coverage(
+    table_dir, sample_id, genome_results, percent_duplication=None
+):
+    """Write the coverage of a finished sample for the next update of the table,
+    replacing what was staged for the sample before.
+
+    :param str table_dir: The directory of the coverage table
+    :param str sample_id: The sample id
+    :param GenomeResults genome_results: The parsed Qualimap report of the sample
+    :param float percent_duplication: The duplication of the sample, if known
+
+    :returns: The path to the staged file
+    :rtype: str
+    """
+    contigs = genome_results.contigs
+    staged_dir = safe_makedir(os.path.join(table_dir, STAGED_DIRNAME))
+    staged_path = os.path.join(staged_dir, "{}.npz".format(sample_id))
+    tmp_path = "{}.{}.tmp".format(staged_path, os.getpid())
+    with open(tmp_path, "wb") as fh:
+        np.savez(
+            fh,
+            contigs=np.array(contigs.names, dtype=str),
+            contig_lengths=np.array(contigs.lengths, dtype=np.int64),
+            mapped_bases=np.array(contigs.mapped_bases, dtype=np.int64),
+            mean_coverage=np.array(contigs.mean_coverage, dtype=np.float64),
+            percent_duplication=np.float64(
+                np.nan if percent_duplication is None else percent_duplication
+            ),
+        )
+    os.rename(tmp_path, staged_path)
+    return staged_path
+
+
+class CoverageTable(object):
+    """The consolidated coverage table of a project, as arrays (see the module
+    docstring for the columns)."""
+
+    def __init__(
+        self,
+        samples,
+        contigs,
+        contig_lengths,
+        mapped_bases,
+        mean_coverage,
+        percent_duplication,
+        staged_mtimes,
+    ):
+        self.samples = samples
+        self.contigs = contigs
+        self.contig_lengths = contig_lengths
+        self.mapped_bases = mapped_bases
+        self.mean_coverage = mean_coverage
+        self.percent_duplication = percent_duplication
+        self.staged_mtimes = staged_mtimes
+
+    def __repr__(self):
+        return "CoverageTable({} samples x {} contigs)".format(
+            len(self.samples), len(self.contigs)
+        )
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            samples=np.array([], dtype=str),
+            contigs=np.array([], dtype=str),
+            contig_lengths=np.zeros(0, dtype=np.int64),
+            mapped_bases=np.zeros((0, 0), dtype=np.int64),
+            mean_coverage=np.zeros((0, 0), dtype=np.float64),
+            percent_duplication=np.zeros(0, dtype=np.float64),
+            staged_mtimes=np.zeros(0, dtype=np.int64),
+        )
+
+    @classmethod
+    def load(cls, table_dir, mmap_mode="r"):
+        """Load the current version of a coverage table.
+
+        :param str table_dir: The directory of the coverage table
+        :param str mmap_mode: How to memory-map the columns (see numpy.load), or
+                              None to read them into memory
+
+        :returns: The table, or None if there is none yet
+        :rtype: CoverageTable
+        """
+        current_dir = os.path.join(table_dir, CURRENT_LINK)
+        try:
+            return cls(
+                **dict(
+                    (
+                        column,
+                        np.load(
+                            os.path.join(current_dir, "{}.npy".format(column)),
+                            mmap_mode=mmap_mode,
+                            allow_pickle=False,
+                        ),
+                    )
+                    for column in COLUMNS
+                )
+            )
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+    def save(self, table_dir):
+        """Write the table as a new version and make it the current one; the
+        previous version is removed.
+
+        :param str table_dir: The directory of the coverage table
+        """
+        version_dir = safe_makedir(
+            os.path.join(table_dir, "{}{}".format(TABLE_VERSION_PREFIX, time.time_ns()))
+        )
+        for column in COLUMNS:
+            np.save(
+                os.path.join(version_dir, "{}.npy".format(column)),
+                getattr(self, column),
+                allow_pickle=False,
+            )
+        current_link = os.path.join(table_dir, CURRENT_LINK)
+        previous_dir = (
+            os.path.realpath(current_link) if os.path.islink(current_link) else None
+        )
+        tmp_link = "{}.{}.tmp".format(current_link, os.getpid())
+        os.symlink(os.path.basename(version_dir), tmp_link)
+        os.rename(tmp_link, current_link)
+        if previous_dir and previous_dir != os.path.realpath(version_dir):
+            # readers that have it memory-mapped keep their view
+            shutil.rmtree(previous_dir, ignore_errors=True)
+
+    def sample_index(self, sample_id):
+        """The row of a sample, or None if it is not in the table."""
+        rows = np.flatnonzero(self.samples == sample_id)
+        return int(rows[0]) if len(rows) else None
+
+
+def update_coverage_table(table_dir):
+    """Merge the samples staged since the last update into the coverage table of a
+    project. Samples whose staged file has been removed are dropped from it.
+
+    :param str table_dir: The directory of the coverage table
+
+    :returns: The updated table, or None if there is nothing staged
+    :rtype: CoverageTable
+    """
+    staged_dir = os.path.join(table_dir, STAGED_DIRNAME)
+    try:
+        staged = dict(
+            (x.name[: -len(".npz")], x.stat().st_mtime_ns)
+            for x in os.scandir(staged_dir)
+            if x.name.endswith(".npz")
+        )
+    except OSError:
+        return None
+    table = CoverageTable.load(table_dir, mmap_mode=None) or CoverageTable.empty()
+    known = dict(zip(table.samples.tolist(), table.staged_mtimes.tolist()))
+    changed = sorted(
+        sample_id
+        for sample_id, mtime in staged.items()
+        if known.get(sample_id) != mtime
+    )
+    keep = np.isin(table.samples, list(staged))
+    if not changed and keep.all():
+        return table
+    LOG.info(
+        "Updating the coverage table in {} with {} samples".format(
+            table_dir, len(changed)
+        )
+    )
+    staged_samples = {}
+    for sample_id in changed:
+        with np.load(
+            os.path.join(staged_dir, "{}.npz".format(sample_id)), allow_pickle=False
+        ) as npz:
+            staged_samples[sample_id] = dict((key, npz[key]) for key in npz.files)
+    # new contigs are added after the ones already in the table
+    contigs = table.contigs.tolist()
+    contig_index = dict((x, i) for i, x in enumerate(contigs))
+    for data in staged_samples.values():
+        for contig in data["contigs"].tolist():
+            if contig not in contig_index:
+                contig_index[contig] = len(contigs)
+                contigs.append(contig)
+    samples = [x for x in table.samples[keep].tolist() if x not in staged_samples]
+    samples.extend(changed)
+    n_samples, n_contigs = len(samples), len(contigs)
+    n_kept = n_samples - len(changed)
+    n_old_contigs = len(table.contigs)
+    updated = CoverageTable(
+        samples=np.array(samples, dtype=str),
+        contigs=np.array(contigs, dtype=str),
+        contig_lengths=np.zeros(n_contigs, dtype=np.int64),
+        mapped_bases=np.zeros((n_samples, n_contigs), dtype=np.int64),
+        mean_coverage=np.full((n_samples, n_contigs), np.nan, dtype=np.float64),
+        percent_duplication=np.full(n_samples, np.nan, dtype=np.float64),
+        staged_mtimes=np.zeros(n_samples, dtype=np.int64),
+    )
+    # the rows kept from the table, in the same order
+    kept_rows = keep & ~np.isin(table.samples, changed)
+    updated.contig_lengths[:n_old_contigs] = table.contig_lengths
+    updated.mapped_bases[:n_kept, :n_old_contigs] = table.mapped_bases[kept_rows]
+    updated.mean_coverage[:n_kept, :n_old_contigs] = table.mean_coverage[kept_rows]
+    updated.percent_duplication[:n_kept] = table.percent_duplication[kept_rows]
+    updated.staged_mtimes[:n_kept] = table.staged_mtimes[kept_rows]
+    for row, sample_id in enumerate(changed, n_kept):
+        data = staged_samples[sample_id]
+        columns = np.array(
+            [contig_index[x] for x in data["contigs"].tolist()], dtype=np.intp
+        )
+        updated.contig_lengths[columns] = data["contig_lengths"]
+        updated.mapped_bases[row, columns] = data["mapped_bases"]
+        updated.mean_coverage[row, columns] = data["mean_coverage"]
+        updated.percent_duplication[row] = data["percent_duplication"]
+        updated.staged_mtimes[row] = staged[sample_id]
+    updated.save(table_dir)
+    return updated
+
+
+@contextlib.contextmanager
+def _nan_tolerant():
+    """Let NaN (contigs or samples without values, divisions by zero) come out of
+    the computations as NaN without warnings."""
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        yield
+
+
+def _contig_mask(table, contigs):
+    return np.isin(table.contigs, list(contigs))
+
+
+def autosomal_coverage(table, autosomes=AUTOSOMES):
+    """The mean coverage of the autosomes of each sample, i.e. the bases mapped to
+    them divided by their total length.
+
+    :param CoverageTable table: The coverage table
+    :param autosomes: The names of the autosomal contigs
+
+    :returns: A (samples,) array, NaN for samples without autosomes
+    """
+    mask = _contig_mask(table, autosomes)
+    lengths = table.contig_lengths[mask].sum()
+    if not lengths:
+        return np.full(len(table.samples), np.nan)
+    return table.mapped_bases[:, mask].sum(axis=1) / float(lengths)
+
+
+def normalized_coverage(table, autosomes=AUTOSOMES):
+    """The mean coverage of each contig relative to the autosomal coverage of the
+    sample, making the samples comparable regardless of how deep they were sequenced.
+
+    :param CoverageTable table: The coverage table
+    :param autosomes: The names of the autosomal contigs
+
+    :returns: A (samples, contigs) array
+    """
+    with _nan_tolerant():
+        return table.mean_coverage / autosomal_coverage(table, autosomes)[:, None]
+
+
+def contig_coverage_summary(table, percentiles=(5, 25, 50, 75, 95), normalize=True):
+    """Summarize the coverage of each contig across the samples.
+
+    :param CoverageTable table: The coverage table
+    :param percentiles: The percentiles to compute
+    :param bool normalize: Whether to summarize the coverage relative to the
+                           autosomal coverage of each sample (see normalized_coverage)
+
+    :returns: A dict with the (contigs,) arrays "mean" and "std" and the
+              (percentiles, contigs) array "percentiles", ignoring missing values
+    :rtype: dict
+    """
+    coverage = normalized_coverage(table) if normalize else table.mean_coverage
+    with _nan_tolerant():
+        return {
+            "mean": np.nanmean(coverage, axis=0),
+            "std": np.nanstd(coverage, axis=0),
+            "percentiles": np.nanpercentile(coverage, percentiles, axis=0),
+        }
+
+
+def robust_z_scores(values, axis=0):
+    """The deviation of values from their median, in units of the scaled median
+    absolute deviation, so that a few outliers do not mask each other.
+
+    :param values: The values
+    :param int axis: The axis to compute the median along
+
+    :returns: An array of the shape of values; NaN where the deviation is undefined
+    """
+    values = np.asarray(values, dtype=np.float64)
+    with _nan_tolerant():
+        median = np.nanmedian(values, axis=axis, keepdims=True)
+        mad = 1.4826 * np.nanmedian(np.abs(values - median), axis=axis, keepdims=True)
+        return (values - median) / mad
+
+
+def coverage_outliers(table, threshold=3.5, normalize=True):
+    """Flag the contigs of samples whose coverage deviates from that of the other
+    samples (e.g. aneuploidies, contamination, capture failures).
+
+    :param CoverageTable table: The coverage table
+    :param float threshold: The robust z-score beyond which coverage is an outlier
+    :param bool normalize: Whether to compare the coverage relative to the
+                           autosomal coverage of each sample
+
+    :returns: A boolean (samples, contigs) array
+    """
+    coverage = normalized_coverage(table) if normalize else table.mean_coverage
+    with _nan_tolerant():
+        return np.abs(robust_z_scores(coverage, axis=0)) > threshold
+
+
+def duplication_outliers(table, threshold=3.5):
+    """Flag the samples whose duplication deviates from that of the other samples.
+
+    :param CoverageTable table: The coverage table
+    :param float threshold: The robust z-score beyond which duplication is an outlier
+
+    :returns: A boolean (samples,) array
+    """
+    with _nan_tolerant():
+        return np.abs(robust_z_scores(table.percent_duplication)) > threshold
+
+
+def update_coverage_tables(table_dirs):
+    """Update the coverage tables of several projects, logging the ones that fail.
+
+    :param list table_dirs: The directories of the coverage tables
+    """
+    for table_dir in table_dirs:
+        try:
+            update_coverage_table(table_dir)
+        except (IOError, OSError, ValueError) as e:
+            LOG.error(
+                "Could not update the coverage table in {}: {}".format(table_dir, e)
+            )
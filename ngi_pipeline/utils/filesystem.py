@@ -456,3 +456,20 @@ def match_files_under_dir(dirname, pattern, pt_style="regex", realpath=True):
                 else:
                     matches.extend(list(map(os.path.abspath, file_paths)))
     return matches
+
+
+def total_file_size(file_paths):
+    """Sum up the sizes of files, skipping the ones that cannot be accessed.
+
+    :param list file_paths: The paths to the files
+
+    :returns: The total size in bytes
+    :rtype: int
+    """
+    total_size = 0
+    for file_path in file_paths:
+        try:
+            total_size += os.path.getsize(file_path)
+        except OSError:
+            LOG.debug('Could not get the size of file "{}"'.format(file_path))
+    return total_size
@@ -0,0 +1,485 @@
+"""A resource-aware scheduler for running jobs on the local machine.
+
+Jobs are submitted to a persistent queue along with the cores and memory they
+need and a priority. A queued job is started as soon as the running jobs leave
+enough of the machine for it, the highest priority first and first come, first
+served within a priority. A job that does not fit holds back the jobs queued
+after it, so that big jobs are not starved by a stream of small ones. There is
+no daemon: the queue is scheduled whenever a job is submitted or polled, and
+by every job script once its command has finished.
+
+The queue is a directory shared by all the processes using it:
+
+    <queue_dir>/capacity.json          the cores and memory available to the jobs
+    <queue_dir>/lock                   held while the queue is changed
+    <queue_dir>/next_job_id            the id of the next job submitted
+    <queue_dir>/jobs/<job id>.json     the job records
+    <queue_dir>/jobs/<job id>.sh       the job scripts, with their .out, .err and
+                                       .exit_code files
+
+The id of a job is in the environment variable NGI_LOCAL_JOB_ID of its script.
+The exit code of a job is also written to the exit code file passed when it is
+submitted, in the format read by ngi_pipeline.engines.sarek.process.ProcessExitStatus:
+the file is truncated when the job is queued and the exit code is written on
+the first line once the job has finished.
+
+The queue can be inspected and scheduled from the command line:
+
+    python -m ngi_pipeline.utils.local_scheduler [--queue-dir <dir>] {schedule,list,cancel <job id>}
+"""
+
+import argparse
+import contextlib
+import datetime
+import errno
+import fcntl
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+
+from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.classes import with_ngi_config
+from ngi_pipeline.utils.filesystem import safe_makedir
+from ngi_pipeline.utils.slurm import slurm_memory_to_bytes
+
+LOG = minimal_logger(__name__)
+
+# The states of a job; jobs in a final state no longer take up any resources
+JOB_QUEUED = "QUEUED"
+JOB_RUNNING = "RUNNING"
+JOB_DONE = "DONE"
+JOB_FAILED = "FAILED"
+JOB_CANCELLED = "CANCELLED"
+ACTIVE_JOB_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+
+def machine_cores():
+    """The number of cores of this machine."""
+    return os.cpu_count() or 1
+
+
+def machine_memory():
+    """The physical memory of this machine, in bytes."""
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def _memory_to_bytes(memory):
+    """Memory given as a number of bytes or as a SLURM memory string (e.g. "64G")."""
+    if memory is None or isinstance(memory, int):
+        return memory
+    return slurm_memory_to_bytes(str(memory))
+
+
+@with_ngi_config
+def get_local_scheduler(config=None, config_file_path=None):
+    """Return the local scheduler configured by the "local_scheduler" section of
+    the config:
+
+        local_scheduler:
+            queue_dir: /path/to/queue   # required
+            cores: 32                   # default is all the cores of the machine
+            memory: 256G                # default is all the memory of the machine
+
+    :param dict config: The parsed NGI configuration
+
+    :returns: The scheduler, or None if no queue directory is configured
+    :rtype: LocalScheduler
+    """
+    scheduler_config = (config or {}).get("local_scheduler") or {}
+    if not scheduler_config.get("queue_dir"):
+        return None
+    return LocalScheduler(
+        scheduler_config["queue_dir"],
+        cores=scheduler_config.get("cores"),
+        memory=scheduler_config.get("memory"),
+    )
+
+
+class LocalScheduler(object):
+    """The queue of jobs run on this machine."""
+
+    def __init__(self, queue_dir, cores=None, memory=None):
+        """
+        :param str queue_dir: The directory holding the queue; created if missing
+        :param int cores: The number of cores available to the jobs. If not
+                          specified, what was given when the queue was last set
+                          up is used, or else all the cores of the machine
+        :param memory: The memory available to the jobs, in bytes or as a SLURM
+                       memory string (e.g. "256G"); defaults as for cores
+        """
+        self.queue_dir = os.path.abspath(queue_dir)
+        self.jobs_dir = os.path.join(self.queue_dir, "jobs")
+        safe_makedir(self.jobs_dir)
+        self._capacity_path = os.path.join(self.queue_dir, "capacity.json")
+        self._lock_path = os.path.join(self.queue_dir, "lock")
+        self._next_job_id_path = os.path.join(self.queue_dir, "next_job_id")
+        # the processes of the jobs started by this instance, reaped when polled
+        self._processes = {}
+        memory = _memory_to_bytes(memory)
+        capacity = self._read_json(self._capacity_path) or {}
+        if cores is not None or memory is not None:
+            capacity = {
+                "cores": int(cores or capacity.get("cores") or machine_cores()),
+                "memory": int(memory or capacity.get("memory") or machine_memory()),
+            }
+            with self._locked():
+                self._write_json(self._capacity_path, capacity)
+        self.cores = capacity.get("cores") or machine_cores()
+        self.memory = capacity.get("memory") or machine_memory()
+
+    def __repr__(self):
+        return "LocalScheduler({}, {} cores, {} bytes)".format(
+            self.queue_dir, self.cores, self.memory
+        )
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path, "r") as fh:
+                return json.load(fh)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            LOG.warning('Ignoring unreadable file "{}"'.format(path))
+        return None
+
+    @staticmethod
+    def _write_json(path, data):
+        # write to a temporary file first, so that readers never see a partial record
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, "w") as fh:
+            json.dump(data, fh, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def _job_path(self, job_id, extension):
+        return os.path.join(self.jobs_dir, "{}.{}".format(job_id, extension))
+
+    def _read_job(self, job_id):
+        return self._read_json(self._job_path(job_id, "json"))
+
+    def _write_job(self, job):
+        self._write_json(self._job_path(job["job_id"], "json"), job)
+
+    def _jobs(self):
+        jobs = []
+        for file_name in os.listdir(self.jobs_dir):
+            name, extension = os.path.splitext(file_name)
+            if extension == ".json" and name.isdigit():
+                job = self._read_job(int(name))
+                if job is not None:
+                    jobs.append(job)
+        return sorted(jobs, key=lambda job: job["job_id"])
+
+    def _allocate_job_id(self):
+        try:
+            with open(self._next_job_id_path, "r") as fh:
+                job_id = int(fh.read().strip() or 1)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            job_id = 1
+        with open(self._next_job_id_path, "w") as fh:
+            fh.write("{}\n".format(job_id + 1))
+        return job_id
+
+    def _job_script(
+        self, job_id, command, exit_code_path, start_commands, finish_commands
+    ):
+        job_exit_code_path = self._job_path(job_id, "exit_code")
+        lines = ["#! /bin/bash -l", "", "export NGI_LOCAL_JOB_ID={}".format(job_id)]
+        if exit_code_path:
+            lines.append('echo "" > "{}"'.format(exit_code_path))
+        lines.extend(start_commands or [])
+        lines.extend(
+            [
+                # in a subshell, so that the exit code is written even if the command exits
+                "(",
+                command,
+                ")",
+                "NGI_EXIT_CODE=$?",
+                'echo "$NGI_EXIT_CODE" > "{}"'.format(job_exit_code_path),
+            ]
+        )
+        if exit_code_path:
+            lines.append('echo "$NGI_EXIT_CODE" > "{}"'.format(exit_code_path))
+        lines.extend(finish_commands or [])
+        # let the next jobs in the queue start, now that this one has finished
+        lines.append(
+            "{} -m {} --queue-dir {} schedule > /dev/null 2>&1".format(
+                shlex.quote(sys.executable), __name__, shlex.quote(self.queue_dir)
+            )
+        )
+        lines.append("exit $NGI_EXIT_CODE")
+        return "\n".join(lines) + "\n"
+
+    def submit(
+        self,
+        command,
+        job_name=None,
+        working_dir=None,
+        exit_code_path=None,
+        cores=None,
+        memory=None,
+        priority=0,
+        start_commands=None,
+        finish_commands=None,
+    ):
+        """Queue a job, starting it right away if there is room for it.
+
+        :param str command: The shell command line to run
+        :param str job_name: A name for the job (default is taken from the command)
+        :param str working_dir: The directory to run the command in (created if missing)
+        :param str exit_code_path: A file to write the exit code of the command to
+        :param int cores: The number of cores the job needs (default is 1)
+        :param memory: The memory the job needs, in bytes or as a SLURM memory string (default is none)
+        :param int priority: Jobs with a higher priority are started first
+        :param list start_commands: Shell commands to run before the command, e.g. setting
+                                    variables used by the finish commands
+        :param list finish_commands: Shell commands to run after the exit code has been
+                                     written; the exit code is in the variable NGI_EXIT_CODE
+
+        :returns: The job id
+        :rtype: int
+        :raises ValueError: If the job needs more cores or memory than is available to the jobs
+        """
+        cores = int(cores or 1)
+        memory = _memory_to_bytes(memory) or 0
+        if cores > self.cores or memory > self.memory:
+            raise ValueError(
+                "Job needs {} cores and {} bytes, only {} cores and {} bytes are available".format(
+                    cores, memory, self.cores, self.memory
+                )
+            )
+        working_dir = os.path.abspath(working_dir or os.curdir)
+        with self._locked():
+            job_id = self._allocate_job_id()
+            script_path = self._job_path(job_id, "sh")
+            with open(script_path, "w") as fh:
+                fh.write(
+                    self._job_script(
+                        job_id, command, exit_code_path, start_commands, finish_commands
+                    )
+                )
+            if exit_code_path:
+                # the exit code of an earlier run of the job should not be picked up
+                safe_makedir(os.path.dirname(os.path.abspath(exit_code_path)))
+                open(exit_code_path, "w").close()
+            self._write_job(
+                {
+                    "job_id": job_id,
+                    "job_name": job_name or command.replace(" ", "_")[0:20],
+                    "script": script_path,
+                    "working_dir": working_dir,
+                    "exit_code_path": exit_code_path,
+                    "cores": cores,
+                    "memory": memory,
+                    "priority": int(priority or 0),
+                    "state": JOB_QUEUED,
+                    "pid": None,
+                    "exit_code": None,
+                    "submitted_at": datetime.datetime.now().isoformat(),
+                    "started_at": None,
+                    "finished_at": None,
+                }
+            )
+            LOG.debug("Queued job {}: {}".format(job_id, command))
+            self._schedule()
+        return job_id
+
+    def _process_running(self, job):
+        process = self._processes.get(job["job_id"])
+        if process is not None:
+            # started by this instance, reap it once it has exited
+            return process.poll() is None
+        try:
+            os.kill(job["pid"], 0)
+            return True
+        except OSError as e:
+            if e.errno == errno.EPERM:
+                return True
+            if e.errno != errno.ESRCH:
+                raise
+        return False
+
+    def _refresh(self, jobs):
+        """Record the running jobs that have finished since the last time."""
+        for job in jobs:
+            if job["state"] != JOB_RUNNING:
+                continue
+            exit_code = self._read_exit_code(job["job_id"])
+            if exit_code is None and self._process_running(job):
+                continue
+            if exit_code is None:
+                # the exit code may have been written just before the process exited
+                exit_code = self._read_exit_code(job["job_id"])
+            job["state"] = JOB_DONE if exit_code == 0 else JOB_FAILED
+            job["exit_code"] = exit_code
+            job["finished_at"] = datetime.datetime.now().isoformat()
+            self._processes.pop(job["job_id"], None)
+            self._write_job(job)
+            LOG.debug(
+                "Job {} finished with exit code {}".format(job["job_id"], exit_code)
+            )
+
+    def _read_exit_code(self, job_id):
+        try:
+            with open(self._job_path(job_id, "exit_code"), "r") as fh:
+                return int(fh.readline().strip())
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            pass
+        return None
+
+    def _start(self, job):
+        safe_makedir(job["working_dir"])
+        with open(self._job_path(job["job_id"], "out"), "w") as stdout, open(
+            self._job_path(job["job_id"], "err"), "w"
+        ) as stderr:
+            process = subprocess.Popen(
+                ["/bin/bash", job["script"]],
+                cwd=job["working_dir"],
+                stdin=subprocess.DEVNULL,
+                stdout=stdout,
+                stderr=stderr,
+                # in a session of its own, so that the job can be cancelled as a whole
+                start_new_session=True,
+            )
+        self._processes[job["job_id"]] = process
+        job["state"] = JOB_RUNNING
+        job["pid"] = process.pid
+        job["started_at"] = datetime.datetime.now().isoformat()
+        self._write_job(job)
+        LOG.debug(
+            "Started job {} ({}) with pid {}".format(
+                job["job_id"], job["job_name"], process.pid
+            )
+        )
+
+    def _schedule(self):
+        jobs = self._jobs()
+        self._refresh(jobs)
+        running = [job for job in jobs if job["state"] == JOB_RUNNING]
+        free_cores = self.cores - sum(job["cores"] for job in running)
+        free_memory = self.memory - sum(job["memory"] for job in running)
+        started = []
+        for job in sorted(
+            (job for job in jobs if job["state"] == JOB_QUEUED),
+            key=lambda job: (-job["priority"], job["job_id"]),
+        ):
+            if job["cores"] > free_cores or job["memory"] > free_memory:
+                # hold back the jobs after this one until there is room for it
+                break
+            self._start(job)
+            free_cores -= job["cores"]
+            free_memory -= job["memory"]
+            started.append(job["job_id"])
+        return started
+
+    def schedule(self):
+        """Record the jobs that have finished and start the queued jobs there is room for.
+
+        :returns: The ids of the jobs started
+        :rtype: list
+        """
+        with self._locked():
+            return self._schedule()
+
+    def poll(self, job_ids=None):
+        """Get the current records of jobs, after scheduling the queue.
+
+        :param list job_ids: The ids of the jobs to get (default is all jobs)
+
+        :returns: The job records (dicts) of the jobs found, keyed by job id
+        :rtype: dict
+        """
+        with self._locked():
+            self._schedule()
+            jobs = dict((job["job_id"], job) for job in self._jobs())
+        if job_ids is None:
+            return jobs
+        return dict(
+            (int(job_id), jobs[int(job_id)])
+            for job_id in job_ids
+            if int(job_id) in jobs
+        )
+
+    def cancel(self, job_id):
+        """Cancel a job. A running job is sent SIGTERM, along with any processes it has started.
+
+        :param int job_id: The id of the job
+
+        :returns: True if the job was cancelled, False if it was not queued or running
+        :rtype: bool
+        """
+        with self._locked():
+            job = self._read_job(int(job_id))
+            if job is None or job["state"] not in ACTIVE_JOB_STATES:
+                return False
+            if job["state"] == JOB_RUNNING:
+                try:
+                    os.killpg(job["pid"], signal.SIGTERM)
+                except OSError as e:
+                    if e.errno != errno.ESRCH:
+                        raise
+            job["state"] = JOB_CANCELLED
+            job["finished_at"] = datetime.datetime.now().isoformat()
+            self._processes.pop(job["job_id"], None)
+            self._write_job(job)
+            self._schedule()
+        return True
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Schedule and inspect the queue of jobs run on this machine."
+    )
+    parser.add_argument(
+        "-q",
+        "--queue-dir",
+        help="The queue directory (default is the queue_dir in the local_scheduler config section)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("schedule", help="Start the queued jobs there is room for")
+    subparsers.add_parser("list", help="List the queued and running jobs")
+    cancel_parser = subparsers.add_parser("cancel", help="Cancel a job")
+    cancel_parser.add_argument("job_id", type=int)
+    parsed_args = parser.parse_args(args)
+    if parsed_args.queue_dir:
+        scheduler = LocalScheduler(parsed_args.queue_dir)
+    else:
+        scheduler = get_local_scheduler()
+        if scheduler is None:
+            parser.error("no queue directory configured")
+    if parsed_args.command == "schedule":
+        scheduler.schedule()
+    elif parsed_args.command == "list":
+        for job in scheduler.poll().values():
+            if job["state"] in ACTIVE_JOB_STATES:
+                print(
+                    "{job_id}\t{state}\t{priority}\t{cores}\t{memory}\t{job_name}".format(
+                        **job
+                    )
+                )
+    elif not scheduler.cancel(parsed_args.job_id):
+        print("Job {} is not queued or running".format(parsed_args.job_id))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,8 @@
 import collections
 import six
 
+from concurrent.futures import ThreadPoolExecutor
+
 
 def flatten(nested_list):
     """All I ever need to know about flattening irregular lists of lists I learned from
@@ -15,3 +17,40 @@ def flatten(nested_list):
                 yield sub
         else:
             yield elt
+
+
+def ordered_thread_map(function, items, max_workers=1):
+    """Apply a function to each of the items on a bounded pool of worker threads.
+
+    The results are yielded in the same order as the items, regardless of the order
+    in which the workers finish, as (item, result, exception) tuples; exception is
+    whatever (Exception subclass) was raised by the function for that item, or None.
+    With max_workers <= 1 the items are processed serially in the calling thread.
+
+    :param function: The function to call with each item
+    :param items: An iterable of items
+    :param int max_workers: The maximum number of items processed concurrently
+    """
+    items = list(items)
+    if not max_workers or max_workers <= 1 or len(items) <= 1:
+        for item in items:
+            try:
+                result = function(item)
+            except Exception as e:
+                yield item, None, e
+            else:
+                yield item, result, None
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [executor.submit(function, item) for item in items]
+        try:
+            for item, future in zip(items, futures):
+                exception = future.exception()
+                if exception is not None:
+                    yield item, None, exception
+                else:
+                    yield item, future.result(), None
+        finally:
+            # If the caller stops early, don't start on the items not yet picked up
+            for future in futures:
+                future.cancel()
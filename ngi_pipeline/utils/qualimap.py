@@ -0,0 +1,266 @@
+"""Parsing of the genome_results.txt report written by Qualimap bamqc.
+
+The report is read in a single pass, keeping track of the ">>>>>>> Section"
+header each line belongs to, and everything that is used downstream is
+extracted at once: the "key = value" assignments, the cumulative coverage
+("There is a 95.2% of reference with a coverageData >= 10X") and the coverage
+per contig. The line handler is picked once per section header rather than
+trying every kind of line on every line, numbers are converted without going
+through the locale, and the coverage per contig (thousands of rows for
+references with alt and decoy contigs) is kept in compact columnar arrays. The
+parsed results are cached by the path, modification time and size of the file,
+so the piper and sarek parsers asking for different metrics from the same
+report only read it once.
+"""
+
+import array
+import collections
+import functools
+import math
+import os
+
+SECTION_PREFIX = ">>>>>>>"
+GLOBALS_SECTION = "Globals"
+COVERAGE_SECTION = "Coverage"
+CONTIG_COVERAGE_SECTION = "Coverage per contig"
+
+# The coverage of a contig; mean coverage and standard deviation may be None
+ContigCoverage = collections.namedtuple(
+    "ContigCoverage",
+    ["contig", "length", "mapped_bases", "mean_coverage", "standard_deviation"],
+)
+
+_NUMERIC_CHARS = frozenset("0123456789,.")
+
+
+def parse_number(value):
+    """Parse the number at the start of a value from the report, ignoring
+    thousands separators and whatever follows it (e.g. "1,234 bp", "47.15%").
+
+    :param str value: The value
+    :returns: The number, or None if the value does not start with a number
+    :rtype: float
+    """
+    end = 0
+    while end < len(value) and value[end] in _NUMERIC_CHARS:
+        end += 1
+    if not end:
+        return None
+    try:
+        return float(value[:end].replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _none_if_nan(value):
+    return None if math.isnan(value) else value
+
+
+class ContigTable(object):
+    """The coverage per contig, stored as one array per column. Indexing and
+    iterating give ContigCoverage tuples."""
+
+    def __init__(self):
+        self.names = []
+        self.lengths = array.array("q")
+        self.mapped_bases = array.array("q")
+        # NaN where the report has no (numeric) value
+        self.mean_coverage = array.array("d")
+        self.standard_deviation = array.array("d")
+        self._index = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        return ContigCoverage(
+            contig=self.names[i],
+            length=self.lengths[i],
+            mapped_bases=self.mapped_bases[i],
+            mean_coverage=_none_if_nan(self.mean_coverage[i]),
+            standard_deviation=_none_if_nan(self.standard_deviation[i]),
+        )
+
+    def __iter__(self):
+        for i in range(len(self.names)):
+            yield self[i]
+
+    def append(self, name, length, mapped_bases, mean_coverage, standard_deviation):
+        self.names.append(name)
+        self.lengths.append(length)
+        self.mapped_bases.append(mapped_bases)
+        self.mean_coverage.append(
+            float("nan") if mean_coverage is None else mean_coverage
+        )
+        self.standard_deviation.append(
+            float("nan") if standard_deviation is None else standard_deviation
+        )
+        self._index = None
+
+    def index(self, name):
+        """The row of a contig, or None if it is not in the table.
+
+        :param str name: The name of the contig
+        :rtype: int
+        """
+        if self._index is None:
+            self._index = {x: i for i, x in enumerate(self.names)}
+        return self._index.get(name)
+
+    def get(self, name):
+        """The coverage of a contig, or None if it is not in the table.
+
+        :param str name: The name of the contig
+        :rtype: ContigCoverage
+        """
+        i = self.index(name)
+        return None if i is None else self[i]
+
+
+class GenomeResults(object):
+    """The contents of a Qualimap genome_results.txt report. Instances are shared
+    through the cache and should not be modified."""
+
+    def __init__(self, path):
+        self.path = path
+        # "key = value" assignments by section; values are numbers where possible
+        self.sections = collections.OrderedDict()
+        # the assignments of all sections together
+        self.values = {}
+        # percentage of the reference covered at least "<N>X"
+        self.cumulative_coverage = collections.OrderedDict()
+        self.contigs = ContigTable()
+
+    def __repr__(self):
+        return "GenomeResults({})".format(self.path)
+
+    def number_of_reads(self):
+        """The number of reads in the Globals section, or 0 if not reported.
+
+        :rtype: int
+        """
+        value = self.sections.get(GLOBALS_SECTION, {}).get("number of reads")
+        return int(value) if isinstance(value, float) else 0
+
+    def autosomal_coverage(self, autosomes=None):
+        """The mean coverage of the autosomes, i.e. the bases mapped to them divided
+        by their total length.
+
+        :param list autosomes: The names of the autosomal contigs (default: the
+                               contigs named 1 to 22)
+        :returns: The coverage, or 0.0 if there are no autosomes in the report
+        :rtype: float
+        """
+        autosomes = set(autosomes or (str(x) for x in range(1, 23)))
+        length = 0
+        mapped_bases = 0
+        for i, name in enumerate(self.contigs.names):
+            if name in autosomes:
+                length += self.contigs.lengths[i]
+                mapped_bases += self.contigs.mapped_bases[i]
+        if length and mapped_bases:
+            return float(mapped_bases) / length
+        return 0.0
+
+    def parse(self, fh):
+        """Parse the lines of a report.
+
+        :param fh: An iterable of the lines of the report
+        """
+        section = None
+        assignments = {}
+        # lines before any section header can be of any kind
+        handler = self._parse_headerless_line
+        for line in fh:
+            if line.startswith(SECTION_PREFIX):
+                section = line[len(SECTION_PREFIX) :].strip()
+                assignments = self.sections.setdefault(section, {})
+                handler = self._section_handler(section)
+                continue
+            handler(line, assignments)
+
+    def _section_handler(self, section):
+        if section == CONTIG_COVERAGE_SECTION:
+            return self._parse_contig_line
+        if section == COVERAGE_SECTION:
+            return self._parse_coverage_line
+        return self._parse_assignment
+
+    def _parse_assignment(self, line, assignments):
+        key, separator, value = line.partition("=")
+        if not separator:
+            return
+        key = key.strip()
+        value = value.strip()
+        if key and value:
+            number = parse_number(value)
+            assignments[key] = value if number is None else number
+            self.values[key] = assignments[key]
+
+    def _parse_coverage_line(self, line, assignments):
+        if ">= " in line and "%" in line:
+            self._parse_cumulative_coverage(line)
+        else:
+            self._parse_assignment(line, assignments)
+
+    def _parse_contig_line(self, line, assignments=None):
+        self._parse_contig_coverage(line)
+
+    def _parse_headerless_line(self, line, assignments):
+        if ">= " in line and "%" in line:
+            self._parse_cumulative_coverage(line)
+        elif "=" in line:
+            self._parse_assignment(line, assignments)
+        else:
+            # recognize the contig lines by their shape
+            self._parse_contig_coverage(line, strict=True)
+
+    def _parse_cumulative_coverage(self, line):
+        percentage, _, rest = line.partition("%")
+        coverage = rest.rpartition(">= ")[2].strip()
+        value = parse_number(percentage.split()[-1]) if percentage.split() else None
+        if value is not None and coverage[:-1].isdigit() and coverage.endswith("X"):
+            self.cumulative_coverage[coverage] = value
+
+    def _parse_contig_coverage(self, line, strict=False):
+        fields = line.split()
+        if len(fields) != 5 and (strict or len(fields) < 3):
+            return
+        if not (fields[1].isdigit() and fields[2].isdigit()):
+            return
+        self.contigs.append(
+            fields[0],
+            int(fields[1]),
+            int(fields[2]),
+            _parse_float(fields[3]) if len(fields) > 3 else None,
+            _parse_float(fields[4]) if len(fields) > 4 else None,
+        )
+
+
+@functools.lru_cache(maxsize=512)
+def _parse_genome_results_cached(path, mtime, size):
+    genome_results = GenomeResults(path)
+    with open(path, "r") as fh:
+        genome_results.parse(fh)
+    return genome_results
+
+
+def parse_genome_results(genome_results_file):
+    """Parse a Qualimap genome_results.txt report, or return the results parsed
+    earlier if the file has not changed since.
+
+    :param str genome_results_file: The path to the report
+
+    :rtype: GenomeResults
+    :raises IOError: If the report cannot be read
+    """
+    path = os.path.realpath(genome_results_file)
+    stat = os.stat(path)
+    return _parse_genome_results_cached(path, stat.st_mtime_ns, stat.st_size)
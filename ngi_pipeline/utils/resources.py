@@ -0,0 +1,133 @@
+"""Predict the resources to request for a SLURM job from the metrics of earlier
+jobs of the same workflow, as harvested into the tracking database (see
+ngi_pipeline.database.tracking.harvest_job_metrics).
+
+Walltime is predicted from the time per input byte of the earlier jobs, cores
+from the CPU time they actually used per unit of elapsed time and memory from
+their peak RSS. A high percentile of the earlier jobs is taken and multiplied by
+a safety margin, and the result is capped by the configuration. The prediction
+is configured in the "resource_prediction" part of the slurm config section:
+
+    slurm:
+        resource_prediction:
+            safety_margin: 1.5        # multiplier applied to the predictions
+            percentile: 90            # percentile of the earlier jobs to use
+            min_history: 3            # fewer earlier jobs than this: no prediction
+            history_size: 50          # number of most recent jobs to consider
+            min_walltime: "0-01:00:00"
+            max_walltime: "10-00:00:00"
+            max_cores: 16
+            mem_per_core: "6.4G"      # request enough cores for the predicted memory
+"""
+
+import collections
+import math
+
+from ngi_pipeline.database.tracking import JobMetrics, get_db_session
+from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.slurm import (
+    seconds_to_slurm_time,
+    slurm_duration_to_seconds,
+    slurm_memory_to_bytes,
+)
+from sqlalchemy.exc import SQLAlchemyError
+
+LOG = minimal_logger(__name__)
+
+# The predicted resources; walltime in seconds, memory in bytes
+JobResources = collections.namedtuple("JobResources", ["walltime", "cores", "memory"])
+
+
+def _percentile(values, percentile):
+    """The nearest-rank percentile of a non-empty list of values."""
+    values = sorted(values)
+    rank = int(math.ceil(percentile / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def predict_job_resources(engine, workflow, input_bytes, config):
+    """Predict the walltime, cores and memory a job will need.
+
+    :param str engine: The engine running the workflow (e.g. "piper_ngi")
+    :param str workflow: The workflow, as recorded in the tracking database
+    :param int input_bytes: The total size of the input fastq files, if known
+    :param dict config: The parsed NGI configuration
+
+    :returns: The predicted resources, or None if prediction is not configured or
+              there are not enough earlier jobs to base it on
+    :rtype: JobResources
+    """
+    prediction_config = (config or {}).get("slurm", {}).get("resource_prediction")
+    if not prediction_config:
+        return None
+    if not isinstance(prediction_config, dict):
+        prediction_config = {}
+    try:
+        with get_db_session(config=config) as session:
+            history = JobMetrics.history(
+                session,
+                engine,
+                workflow,
+                limit=prediction_config.get("history_size", 50),
+            ).all()
+    except (KeyError, RuntimeError, SQLAlchemyError) as e:
+        LOG.warning(
+            "Could not get the job history of {}/{}: {}".format(engine, workflow, e)
+        )
+        return None
+    if len(history) < prediction_config.get("min_history", 3):
+        LOG.debug(
+            "Not enough earlier {}/{} jobs to predict resources from".format(
+                engine, workflow
+            )
+        )
+        return None
+    margin = float(prediction_config.get("safety_margin", 1.5))
+    percentile = float(prediction_config.get("percentile", 90))
+
+    # walltime scales with the input size if we know it, otherwise go by the jobs
+    seconds_per_byte = [x.elapsed / x.input_bytes for x in history if x.input_bytes]
+    if input_bytes and seconds_per_byte:
+        walltime = _percentile(seconds_per_byte, percentile) * input_bytes
+    else:
+        walltime = _percentile([x.elapsed for x in history], percentile)
+    walltime *= margin
+    min_walltime = slurm_duration_to_seconds(
+        str(prediction_config.get("min_walltime", "0-01:00:00"))
+    )
+    max_walltime = slurm_duration_to_seconds(
+        str(prediction_config.get("max_walltime", ""))
+    )
+    walltime = max(walltime, min_walltime or 0)
+    if max_walltime:
+        walltime = min(walltime, max_walltime)
+
+    used_cores = [x.total_cpu / x.elapsed for x in history if x.total_cpu is not None]
+    cores = (
+        int(math.ceil(_percentile(used_cores, percentile) * margin))
+        if used_cores
+        else None
+    )
+    peak_memory = [x.max_rss for x in history if x.max_rss]
+    memory = int(_percentile(peak_memory, percentile) * margin) if peak_memory else None
+    mem_per_core = slurm_memory_to_bytes(str(prediction_config.get("mem_per_core", "")))
+    if memory and mem_per_core:
+        cores = max(cores or 1, int(math.ceil(float(memory) / mem_per_core)))
+    if cores is not None:
+        cores = max(cores, 1)
+        if prediction_config.get("max_cores"):
+            cores = min(cores, int(prediction_config["max_cores"]))
+
+    job_resources = JobResources(walltime=walltime, cores=cores, memory=memory)
+    LOG.info(
+        "Predicted resources for {}/{} from {} earlier jobs: walltime {}, "
+        "{} cores, memory {}".format(
+            engine,
+            workflow,
+            len(history),
+            seconds_to_slurm_time(walltime),
+            cores,
+            memory,
+        )
+    )
+    return job_resources
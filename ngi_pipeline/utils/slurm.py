@@ -1,24 +1,91 @@
 """Various utilities for interacting with SLURM"""
 
+import collections
+import datetime
+import os
+import re
 import shlex
 import subprocess
+import time
 
 from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.config import load_yaml_config, locate_ngi_config
 from six.moves import map
 
 
 LOG = minimal_logger(__name__)
 
+# the config file, read the first time a caller without a config of its own needs it
+_ngi_config = None
 
-def kill_slurm_job_by_id(slurm_job_id):
+
+def _slurmrestd_client(config=None):
+    """The slurmrestd client to use instead of the SLURM commands, if the config
+    sets one up (see ngi_pipeline.utils.slurmrestd); None otherwise, also if no
+    config is passed and there is no config file. The config file is only read
+    once."""
+    # imported here as the client builds on the utilities of this module
+    from ngi_pipeline.utils.slurmrestd import get_slurmrestd_client
+
+    global _ngi_config
+    if config is None:
+        if _ngi_config is None:
+            try:
+                _ngi_config = load_yaml_config(locate_ngi_config())
+            except (IOError, OSError, RuntimeError) as e:
+                LOG.debug("No config file, using the SLURM commands: {}".format(e))
+                _ngi_config = {}
+        config = _ngi_config
+    if not config:
+        return None
+    return get_slurmrestd_client(config=config)
+
+
+def slurm_job_spec(slurm_job_id, array_task_id=None):
+    """Return the id SLURM knows a job by: the job id, or for a task of a job
+    array the array job id and the task id joined by an underscore.
+
+    :param int slurm_job_id: The id of the slurm job (or job array); a job
+                             specification is also accepted
+    :param int array_task_id: The id of the task in the job array, if any
+
+    :returns: The job specification, e.g. "12345" or "12345_7"
+    :rtype: str
+
+    :raises ValueError: If the ids are not/cannot be converted to ints
+    """
+    if array_task_id is None and "_" in str(slurm_job_id):
+        slurm_job_id, array_task_id = str(slurm_job_id).split("_", 1)
+    try:
+        if array_task_id is None:
+            return "{:d}".format(int(slurm_job_id))
+        return "{:d}_{:d}".format(int(slurm_job_id), int(array_task_id))
+    except TypeError as e:
+        raise ValueError(e)
+
+
+def kill_slurm_job_by_id(slurm_job_id, array_task_id=None, config=None):
     """Try to kill a slurm job based on its job ID.
 
     :param int slurm_job_id: The id of the slurm job to kill
+    :param int array_task_id: The id of the task to kill, if the job is a job array
+    :param dict config: The parsed NGI configuration, which may set up slurmrestd
+                        (default is the config file, if there is one)
     :returns: True if the kill succeeded
     :rtype: bool
     :raises RuntimeError: If the kill did not succed
     """
+    if array_task_id is not None:
+        slurm_job_id = slurm_job_spec(slurm_job_id, array_task_id)
     LOG.info("Attempting to kill slurm job id {}".format(slurm_job_id))
+    slurmrestd_client = _slurmrestd_client(config)
+    if slurmrestd_client is not None:
+        try:
+            slurmrestd_client.cancel_job(slurm_job_id)
+        except (RuntimeError, ValueError) as e:
+            raise RuntimeError('Could not kill job "{}": {}"'.format(slurm_job_id, e))
+        LOG.info('slurm job id "{}" killed.'.format(slurm_job_id))
+        return True
     try:
         subprocess.check_call(shlex.split("scancel {}".format(slurm_job_id)))
         LOG.info('slurm job id "{}" killed.'.format(slurm_job_id))
@@ -42,10 +109,13 @@ SLURM_EXIT_CODES = {
 }
 
 
-def get_slurm_job_status(slurm_job_id):
+def get_slurm_job_status(slurm_job_id, array_task_id=None, config=None):
     """Gets the State of a SLURM job and returns it as an integer (or None).
 
     :param int slurm_job_id: An integer of your choosing
+    :param int array_task_id: The id of the task, if the job is a job array
+    :param dict config: The parsed NGI configuration, which may set up slurmrestd
+                        (default is the config file, if there is one)
 
     :returns: The status of the job (None == Queued/Running, 0 == Success, 1 == Failure)
     :rtype: None or int
@@ -55,7 +125,9 @@ def get_slurm_job_status(slurm_job_id):
     :raises RuntimeError: If the slurm job status is not understood
     """
     try:
-        check_cl = "sacct -n -j {:d} -o STATE".format(slurm_job_id)
+        check_cl = "sacct -n -j {} -o STATE".format(
+            slurm_job_spec(slurm_job_id, array_task_id)
+        )
         # If the sbatch job has finished, this returns two lines. For example:
         # $ sacct -j 3655032
         #       JobID         JobName    Partition   Account  AllocCPUS    State    ExitCode
@@ -68,8 +140,13 @@ def get_slurm_job_status(slurm_job_id):
         # actual sbatch command for the bash interpreter? Unclear.
     except ValueError:
         raise TypeError("SLURM Job ID not an integer: {}".format(slurm_job_id))
-    LOG.debug('Checking slurm job status with cl "{}"...'.format(check_cl))
-    job_status = subprocess.check_output(shlex.split(check_cl)).decode("utf-8")
+    slurmrestd_client = _slurmrestd_client(config)
+    if slurmrestd_client is not None:
+        job_spec = slurm_job_spec(slurm_job_id, array_task_id)
+        job_status = slurmrestd_client.get_job_states([job_spec]).get(job_spec, "")
+    else:
+        LOG.debug('Checking slurm job status with cl "{}"...'.format(check_cl))
+        job_status = subprocess.check_output(shlex.split(check_cl)).decode("utf-8")
     LOG.debug('job status for job {} is "{}"'.format(slurm_job_id, job_status.strip()))
     if not job_status:
         raise ValueError("No such slurm job found: {}".format(slurm_job_id))
@@ -80,6 +157,173 @@ def get_slurm_job_status(slurm_job_id):
             raise RuntimeError("SLURM job status not understood: {}".format(job_status))
 
 
+# The pending tasks of a job array are listed together, e.g. "12345_[3-5,8%2]"
+PENDING_ARRAY_TASKS_RE = re.compile(r"^(\d+)_\[([\d,\-]+)(?:%\d+)?\]$")
+
+
+def _expand_job_ids(job_id):
+    """The job specifications of a JobID reported by sacct, expanding the pending
+    tasks of a job array; an empty list if it is not a job (e.g. a job step)."""
+    match = PENDING_ARRAY_TASKS_RE.match(job_id)
+    if not match:
+        try:
+            return [slurm_job_spec(job_id)]
+        except ValueError:
+            return []
+    array_job_id, task_ranges = match.groups()
+    job_ids = []
+    for task_range in task_ranges.split(","):
+        first, _, last = task_range.partition("-")
+        job_ids.extend(
+            slurm_job_spec(array_job_id, x)
+            for x in range(int(first), int(last or first) + 1)
+        )
+    return job_ids
+
+
+def get_slurm_job_statuses(slurm_job_ids, batch_size=200, config=None):
+    """Get the State of several SLURM jobs, querying sacct for a batch of jobs at a
+    time rather than once per job (see get_slurm_job_status).
+
+    :param list slurm_job_ids: The ids of the jobs, either job ids or job array
+                               task specifications (see slurm_job_spec)
+    :param int batch_size: The number of jobs to query sacct for at a time; all the
+                           jobs are queried together over slurmrestd
+    :param dict config: The parsed NGI configuration, which may set up slurmrestd
+                        (default is the config file, if there is one)
+
+    :returns: A dict with the job specification (str) as key and the status of the
+              job (None == Queued/Running, 0 == Success, 1 == Failure) as value; jobs
+              unknown to sacct or in a state that is not understood are left out
+    :rtype: dict
+
+    :raises RuntimeError: If sacct or slurmrestd could not be run
+    """
+    slurm_job_ids = sorted(set(slurm_job_spec(x) for x in slurm_job_ids))
+    slurmrestd_client = _slurmrestd_client(config)
+    if slurmrestd_client is not None:
+        job_statuses = {}
+        for job_spec, state in slurmrestd_client.get_job_states(slurm_job_ids).items():
+            try:
+                job_statuses[job_spec] = SLURM_EXIT_CODES[state]
+            except KeyError:
+                LOG.debug('slurm job status not understood: "{}"'.format(state))
+        return job_statuses
+    job_statuses = {}
+    for start in range(0, len(slurm_job_ids), batch_size):
+        batch = slurm_job_ids[start : start + batch_size]
+        check_cl = [
+            "sacct",
+            "--parsable2",
+            "--noheader",
+            "-j",
+            ",".join(batch),
+            "-o",
+            "JobID,State",
+        ]
+        LOG.debug(
+            'Checking slurm job statuses with cl "{}"...'.format(" ".join(check_cl))
+        )
+        try:
+            sacct_output = subprocess.check_output(check_cl).decode("utf-8")
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise RuntimeError("Could not get slurm job statuses: {}".format(e))
+        for line in sacct_output.splitlines():
+            job_id, _, state = line.partition("|")
+            try:
+                status = SLURM_EXIT_CODES[state.split()[0].strip("+")]
+            except (IndexError, KeyError):
+                LOG.debug('slurm job status not understood: "{}"'.format(line))
+                continue
+            for job_spec in _expand_job_ids(job_id):
+                # the job allocation line comes before those of its steps
+                job_statuses.setdefault(job_spec, status)
+    requested = set(slurm_job_ids)
+    return dict((k, v) for k, v in job_statuses.items() if k in requested)
+
+
+def wait_for_slurm_jobs(
+    slurm_job_ids,
+    max_wait=60,
+    initial_delay=0.5,
+    max_delay=10,
+    batch_size=200,
+    config=None,
+):
+    """Wait until newly submitted SLURM jobs are visible to sacct, which takes a
+    few seconds after sbatch returns. All the jobs are checked together with one
+    sacct call per batch, and the jobs not seen yet are checked again after a
+    delay that doubles every time, until a total of max_wait seconds has been
+    spent waiting. If slurmrestd is configured, slurmctld is asked for the jobs
+    instead, which knows them as soon as they are submitted.
+
+    :param list slurm_job_ids: The ids of the jobs, either job ids or job array
+                               task specifications (see slurm_job_spec)
+    :param float max_wait: The number of seconds to wait at most
+    :param float initial_delay: The number of seconds to wait before checking again
+    :param float max_delay: The longest delay between checks
+    :param int batch_size: The number of jobs to query sacct for at a time
+    :param dict config: The parsed NGI configuration, which may set up slurmrestd
+                        (default is the config file, if there is one)
+
+    :returns: The specifications of the jobs that could not be found
+    :rtype: set
+    """
+    missing = set(slurm_job_spec(x) for x in slurm_job_ids)
+    slurmrestd_client = _slurmrestd_client(config)
+    waited = 0
+    delay = initial_delay
+    while missing and slurmrestd_client is not None:
+        # slurmctld knows the jobs as soon as they are submitted
+        try:
+            missing -= set(slurmrestd_client.get_job_states(missing))
+        except RuntimeError as e:
+            LOG.debug("Could not check for slurm jobs: {}".format(e))
+        if not missing or waited + delay > max_wait:
+            return missing
+        time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, max_delay)
+    while missing:
+        pending = sorted(missing)
+        for start in range(0, len(pending), batch_size):
+            check_cl = [
+                "sacct",
+                "--noheader",
+                "--allocations",
+                "-j",
+                ",".join(pending[start : start + batch_size]),
+                "-o",
+                "JobID",
+            ]
+            try:
+                sacct_output = subprocess.check_output(check_cl).decode("utf-8")
+            except (OSError, subprocess.CalledProcessError) as e:
+                LOG.debug("Could not check for slurm jobs: {}".format(e))
+                continue
+            for job_id in sacct_output.split():
+                try:
+                    missing.discard(slurm_job_spec(job_id))
+                except ValueError:
+                    # pending array tasks are listed as e.g. "123_[1-4]"
+                    match = re.match(r"^(\d+)_\[", job_id)
+                    if match:
+                        missing = set(
+                            x for x in missing if x.split("_")[0] != match.group(1)
+                        )
+        if not missing or waited + delay > max_wait:
+            break
+        LOG.debug(
+            "Waiting {:.1f}s for {} slurm jobs to become visible".format(
+                delay, len(missing)
+            )
+        )
+        time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, max_delay)
+    return missing
+
+
 def slurm_time_to_seconds(slurm_time_str):
     """Convert a time in a normal goddamned format into seconds.
     Must follow the format:
@@ -99,3 +343,457 @@ def slurm_time_to_seconds(slurm_time_str):
         LOG.error('Couldn\'t parse passed time "{}": {}'.format(slurm_time_str, e))
         return 345600
     return seconds
+
+
+def seconds_to_slurm_time(seconds):
+    """Convert a number of seconds into a SLURM time limit (days-hours:minutes:seconds),
+    rounding up to whole minutes.
+
+    :param float seconds: The number of seconds
+
+    :returns: The time limit, e.g. "0-12:35:00"
+    :rtype: str
+    """
+    minutes = int(-(-seconds // 60))
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    return "{:d}-{:02d}:{:02d}:00".format(days, hours, minutes)
+
+
+def slurm_time_limit_to_seconds(slurm_time_limit):
+    """Convert a time limit as given to sbatch (e.g. "72:00:00", "3-00:00:00", "3-12"
+    or "90", in minutes) into seconds.
+
+    :param str slurm_time_limit: The time limit
+
+    :returns: The number of seconds, or None if no time limit is given
+    :rtype: float
+    """
+    if slurm_time_limit is None:
+        return None
+    slurm_time_limit = str(slurm_time_limit)
+    if slurm_time_limit.isdigit():
+        return int(slurm_time_limit) * 60
+    seconds = slurm_duration_to_seconds(slurm_time_limit)
+    if seconds is None and "-" in slurm_time_limit:
+        # days and hours
+        days, _, hours = slurm_time_limit.partition("-")
+        seconds = (int(days) * 24 + int(hours or 0)) * 3600
+    return seconds
+
+
+def submit_slurm_script(script_path, config=None):
+    """Submit a job script with sbatch, or over slurmrestd if it is configured.
+
+    :param str script_path: The path to the job script
+    :param dict config: The parsed NGI configuration, which may set up slurmrestd
+                        (default is the config file, if there is one)
+
+    :returns: The job id
+    :rtype: int
+
+    :raises RuntimeError: If the job could not be submitted
+    """
+    slurmrestd_client = _slurmrestd_client(config)
+    if slurmrestd_client is not None:
+        return slurmrestd_client.submit_job(script_path)
+    try:
+        sbatch_output = subprocess.check_output(["sbatch", script_path]).decode("utf-8")
+        return int(re.search(r"Submitted batch job (\d+)", sbatch_output).groups()[0])
+    except (AttributeError, OSError, subprocess.CalledProcessError) as e:
+        raise RuntimeError("Could not submit {}: {}".format(script_path, e))
+
+
+def submit_slurm_scripts(script_paths, config=None):
+    """Submit several job scripts, over slurmrestd with several requests at a time
+    if it is configured and else with sbatch one after the other.
+
+    :param list script_paths: The paths to the job scripts
+    :param dict config: The parsed NGI configuration, which may set up slurmrestd
+                        (default is the config file, if there is one)
+
+    :returns: A dict with the script path as key and the job id as value; the
+              scripts that could not be submitted are logged and left out
+    :rtype: dict
+    """
+    slurmrestd_client = _slurmrestd_client(config)
+    if slurmrestd_client is not None:
+        return slurmrestd_client.submit_jobs(script_paths)
+    job_ids = {}
+    for script_path in script_paths:
+        try:
+            job_ids[script_path] = submit_slurm_script(script_path, config=config)
+        except RuntimeError as e:
+            LOG.error(e)
+    return job_ids
+
+
+# The sacct fields harvested for finished jobs, in the order they are requested
+SLURM_METRICS_FIELDS = (
+    "JobID",
+    "JobIDRaw",
+    "State",
+    "Elapsed",
+    "TotalCPU",
+    "MaxRSS",
+    "AllocCPUS",
+    "Timelimit",
+)
+
+_SLURM_MEMORY_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def slurm_duration_to_seconds(slurm_duration_str):
+    """Convert a duration as reported by sacct ([days-][hours:]minutes:seconds[.fraction],
+    e.g. "1-02:03:04" or "12:34.567") into seconds.
+
+    :param str slurm_duration_str: The duration string
+
+    :returns: The number of seconds, or None if the duration is empty or not a duration
+              (e.g. "UNLIMITED")
+    :rtype: float
+    """
+    try:
+        days = 0
+        if "-" in slurm_duration_str:
+            days, slurm_duration_str = slurm_duration_str.split("-")
+        parts = [float(x) for x in slurm_duration_str.split(":")]
+        if not 2 <= len(parts) <= 3:
+            return None
+        seconds = 0.0
+        for part in parts:
+            seconds = seconds * 60 + part
+        return seconds + int(days) * 24 * 3600
+    except (AttributeError, ValueError):
+        return None
+
+
+def slurm_memory_to_bytes(slurm_memory_str):
+    """Convert a memory size as reported by sacct (e.g. "123456K", "1.5G") into bytes.
+
+    :param str slurm_memory_str: The memory size string
+
+    :returns: The number of bytes, or None if the size is empty or not understood
+    :rtype: int
+    """
+    try:
+        unit = slurm_memory_str[-1:].upper()
+        if unit.isdigit():
+            unit = ""
+        else:
+            slurm_memory_str = slurm_memory_str[:-1]
+        return int(float(slurm_memory_str) * _SLURM_MEMORY_UNITS[unit])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def get_slurm_job_metrics(slurm_job_ids, batch_size=200):
+    """Get the resource usage of finished SLURM jobs, querying sacct for a batch of
+    jobs at a time. The job allocation line gives the state, elapsed time, CPU time,
+    allocated cores and time limit, while the peak memory use is the largest MaxRSS
+    of the job steps.
+
+    :param list slurm_job_ids: The ids of the jobs to get the metrics for, either
+                               job ids or job array task specifications (see
+                               slurm_job_spec)
+    :param int batch_size: The number of jobs to query sacct for at a time
+
+    :returns: A dict with the job specification (str) as key and a dict with the
+              keys slurm_job_id (the unique id of the job or array task), state,
+              elapsed, total_cpu (seconds), max_rss (bytes), alloc_cpus and
+              timelimit (seconds) as value; jobs unknown to sacct are left out
+    :rtype: dict
+
+    :raises RuntimeError: If sacct could not be run
+    """
+    slurm_job_ids = sorted(set(str(x) for x in slurm_job_ids))
+    job_metrics = {}
+    for start in range(0, len(slurm_job_ids), batch_size):
+        batch = slurm_job_ids[start : start + batch_size]
+        metrics_cl = [
+            "sacct",
+            "--parsable2",
+            "--noheader",
+            "-j",
+            ",".join(batch),
+            "-o",
+            ",".join(SLURM_METRICS_FIELDS),
+        ]
+        LOG.debug(
+            'Getting slurm job metrics with cl "{}"...'.format(" ".join(metrics_cl))
+        )
+        try:
+            sacct_output = subprocess.check_output(metrics_cl).decode("utf-8")
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise RuntimeError("Could not get slurm job metrics: {}".format(e))
+        for line in sacct_output.splitlines():
+            fields = dict(zip(SLURM_METRICS_FIELDS, line.split("|")))
+            if len(fields) != len(SLURM_METRICS_FIELDS):
+                continue
+            job_id, _, step = fields["JobID"].partition(".")
+            try:
+                job_id = slurm_job_spec(job_id)
+            except ValueError:
+                # e.g. pending array tasks ("123_[1-4]") or heterogeneous jobs
+                continue
+            metrics = job_metrics.setdefault(job_id, {"max_rss": None})
+            max_rss = slurm_memory_to_bytes(fields["MaxRSS"])
+            if max_rss is not None:
+                metrics["max_rss"] = max(metrics["max_rss"] or 0, max_rss)
+            if not step:
+                try:
+                    alloc_cpus = int(fields["AllocCPUS"])
+                except ValueError:
+                    alloc_cpus = None
+                metrics.update(
+                    slurm_job_id=int(fields["JobIDRaw"]),
+                    state=fields["State"].split()[0] if fields["State"] else None,
+                    elapsed=slurm_duration_to_seconds(fields["Elapsed"]),
+                    total_cpu=slurm_duration_to_seconds(fields["TotalCPU"]),
+                    alloc_cpus=alloc_cpus,
+                    timelimit=slurm_duration_to_seconds(fields["Timelimit"]),
+                )
+    # step lines of jobs whose allocation line was not returned are of no use
+    return dict((k, v) for k, v in job_metrics.items() if "state" in v)
+
+
+# A task of a job array: the job script, where to write its output and where to run it
+SlurmArrayTask = collections.namedtuple(
+    "SlurmArrayTask", ["script", "stdout", "stderr", "working_dir", "key"]
+)
+
+# sbatch options that are set per task by the job array driver script
+_ARRAY_TASK_OPTIONS = {
+    "-J": "--job-name",
+    "-o": "--output",
+    "-e": "--error",
+    "-D": "--chdir",
+    "-a": "--array",
+}
+# sbatch options for which the largest request of the tasks is used
+_ARRAY_MAX_OPTIONS = {"-n": "--ntasks", "-t": "--time"}
+
+
+def _parse_sbatch_options(script_path):
+    """Parse the #SBATCH options in the header of a job script.
+
+    :param str script_path: The path to the job script
+
+    :returns: A list of (option, value) tuples, with long option names where a short
+              option of interest has one; the value is None for flags
+    :rtype: list
+    """
+    aliases = dict(_ARRAY_TASK_OPTIONS, **_ARRAY_MAX_OPTIONS)
+    options = []
+    with open(script_path, "r") as fh:
+        for line in fh:
+            if not line.startswith("#SBATCH"):
+                continue
+            tokens = shlex.split(line[len("#SBATCH") :])
+            if not tokens:
+                continue
+            option, _, value = tokens[0].partition("=")
+            if not value:
+                value = " ".join(tokens[1:]) or None
+            options.append((aliases.get(option, option), value))
+    return options
+
+
+class SlurmJobArray(object):
+    """Collects job scripts and submits them as the tasks of a single SLURM job
+    array, rather than as one job each.
+
+    The scripts are listed in an index file, one line per task, and submitted with
+    a driver script that runs the script on the line given by the array task id,
+    with the output and working directory of the task. The sbatch options of the
+    driver are those of the task scripts, with the largest number of cores and time
+    limit requested by any of them. The number of tasks running at the same time
+    can be limited with a throttle (the "%N" suffix of the array specification).
+    """
+
+    def __init__(self, array_dir, job_name, throttle=None):
+        """
+        :param str array_dir: The directory to write the index file and driver script to
+        :param str job_name: The name of the job array
+        :param int throttle: The maximum number of tasks to run simultaneously
+        """
+        self.array_dir = array_dir
+        self.job_name = job_name
+        self.throttle = throttle
+        self.tasks = []
+        self.job_id = None
+        self.index_file = None
+        self.driver_script = None
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __repr__(self):
+        return "SlurmJobArray({}, {} tasks)".format(self.job_name, len(self.tasks))
+
+    def add_task(
+        self, script_path, stdout=None, stderr=None, working_dir=None, key=None
+    ):
+        """Add a job script as a task of the job array.
+
+        :param str script_path: The path to the job script
+        :param str stdout: The file to write the output of the task to (default is
+                           the output file in the sbatch options of the script, or
+                           the script path with an .out suffix)
+        :param str stderr: The file to write the errors of the task to (default is
+                           the error file in the sbatch options of the script, or
+                           the script path with an .err suffix)
+        :param str working_dir: The directory to run the task in (default is the
+                                working directory in the sbatch options of the
+                                script, or the directory of the script)
+        :param key: Something to identify the task by, e.g. the sample it analyzes
+
+        :returns: The array task id of the task
+        :rtype: int
+
+        :raises ValueError: If the job array has already been submitted
+        """
+        if self.job_id is not None:
+            raise ValueError(
+                "Job array {} has already been submitted as job {}".format(
+                    self.job_name, self.job_id
+                )
+            )
+        script_path = os.path.abspath(script_path)
+        script_options = dict(_parse_sbatch_options(script_path))
+        self.tasks.append(
+            SlurmArrayTask(
+                script=script_path,
+                stdout=stdout
+                or script_options.get("--output")
+                or "{}.out".format(script_path),
+                stderr=stderr
+                or script_options.get("--error")
+                or "{}.err".format(script_path),
+                working_dir=working_dir
+                or script_options.get("--chdir")
+                or os.path.dirname(script_path),
+                key=key,
+            )
+        )
+        return len(self.tasks) - 1
+
+    def task_job_specs(self):
+        """The SLURM job specification (see slurm_job_spec) of each task of the
+        submitted job array.
+
+        :returns: A list of (task key, array task id, job specification) tuples
+        :rtype: list
+        """
+        return [
+            (task.key, task_id, slurm_job_spec(self.job_id, task_id))
+            for task_id, task in enumerate(self.tasks)
+        ]
+
+    def _sbatch_options(self):
+        """Merge the sbatch options of the task scripts."""
+        merged = collections.OrderedDict()
+        for task in self.tasks:
+            for option, value in _parse_sbatch_options(task.script):
+                if option in _ARRAY_TASK_OPTIONS.values():
+                    continue
+                if option not in merged:
+                    merged[option] = value
+                elif option == "--ntasks":
+                    merged[option] = str(max(int(merged[option]), int(value)))
+                elif option == "--time":
+                    seconds = [
+                        slurm_duration_to_seconds(x) for x in (merged[option], value)
+                    ]
+                    if None not in seconds:
+                        merged[option] = seconds_to_slurm_time(max(seconds))
+        return list(merged.items())
+
+    def write(self):
+        """Write the index file and the driver script of the job array.
+
+        :returns: The path to the driver script
+        :rtype: str
+
+        :raises ValueError: If the job array has no tasks
+        """
+        if not self.tasks:
+            raise ValueError("Job array {} has no tasks".format(self.job_name))
+        if not os.path.isdir(self.array_dir):
+            os.makedirs(self.array_dir)
+        file_base = os.path.join(
+            self.array_dir,
+            "{}.{}".format(
+                self.job_name, datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f")
+            ),
+        )
+        self.index_file = "{}.array_index".format(file_base)
+        self.driver_script = "{}.array.sbatch".format(file_base)
+        with open(self.index_file, "w") as fh:
+            for task in self.tasks:
+                fh.write(
+                    "\t".join([task.script, task.stdout, task.stderr, task.working_dir])
+                    + "\n"
+                )
+        array_spec = "0-{}".format(len(self.tasks) - 1)
+        if self.throttle:
+            array_spec += "%{:d}".format(int(self.throttle))
+        driver_lines = ["#!/bin/bash -l", ""]
+        for option, value in self._sbatch_options():
+            driver_lines.append(
+                "#SBATCH {}".format(
+                    option if value is None else "{} {}".format(option, value)
+                )
+            )
+        driver_lines.extend(
+            [
+                "#SBATCH --job-name {}".format(self.job_name),
+                "#SBATCH --output {}_%A_%a.out".format(file_base),
+                "#SBATCH --error {}_%A_%a.err".format(file_base),
+                "#SBATCH --array {}".format(array_spec),
+                "",
+                "IFS=$'\\t' read -r NGI_TASK_SCRIPT NGI_TASK_STDOUT NGI_TASK_STDERR "
+                'NGI_TASK_WORKDIR < <(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" {})'.format(
+                    shlex.quote(self.index_file)
+                ),
+                'cd "$NGI_TASK_WORKDIR" || exit 1',
+                'bash -l "$NGI_TASK_SCRIPT" > "$NGI_TASK_STDOUT" 2> "$NGI_TASK_STDERR"',
+                "",
+            ]
+        )
+        with open(self.driver_script, "w") as fh:
+            fh.write("\n".join(driver_lines))
+        return self.driver_script
+
+    def submit(self, config=None):
+        """Write the job array files and submit the job array (see submit_slurm_script).
+
+        :param dict config: The parsed NGI configuration, which may set up
+                            slurmrestd (default is the config file, if there is one)
+
+        :returns: The job id of the job array
+        :rtype: int
+
+        :raises ValueError: If the job array has no tasks or was already submitted
+        :raises RuntimeError: If the job array could not be submitted
+        """
+        if self.job_id is not None:
+            raise ValueError(
+                "Job array {} has already been submitted as job {}".format(
+                    self.job_name, self.job_id
+                )
+            )
+        driver_script = self.write()
+        LOG.info(
+            'Submitting {} tasks as job array "{}" (throttle {})'.format(
+                len(self.tasks), driver_script, self.throttle or "none"
+            )
+        )
+        try:
+            self.job_id = submit_slurm_script(driver_script, config=config)
+        except RuntimeError as e:
+            raise RuntimeError(
+                'Could not submit job array "{}": {}'.format(driver_script, e)
+            )
+        LOG.info("Job array {} submitted as job {}".format(self.job_name, self.job_id))
+        return self.job_id
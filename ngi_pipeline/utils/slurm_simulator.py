@@ -0,0 +1,1152 @@
+"""A deterministic simulator of a SLURM cluster, for testing the job trackers at scale.
+
+Drop-in sbatch, sacct, squeue and scancel commands keep their jobs in a state
+file instead of running them on a cluster. Put the directory they are installed
+in first on the PATH and the code calling the SLURM commands runs unchanged:
+
+    python -m ngi_pipeline.utils.slurm_simulator --dir <simulator dir> setup [--seed 1 ...]
+    export PATH=<simulator dir>/bin:$PATH
+
+When a job is submitted, how long it waits in the queue, how long it runs, how
+much memory it uses and whether it fails are drawn from a random generator seeded
+with the seed of the simulator and the job id, so the same submissions always
+play out in the same way. The state of a job at a given time follows from these,
+so nothing has to run in the background. The simulated time is either the wall
+clock, optionally sped up, or a manual clock that is only moved on by `advance`.
+A job is only listed by sacct some time after it was submitted, as on a busy
+cluster; squeue lists it right away.
+
+The simulator directory holds:
+
+    <simulator dir>/config.json     the settings, see DEFAULT_SETTINGS
+    <simulator dir>/state.json      the submitted jobs and the manual clock
+    <simulator dir>/lock            held while the state is read or changed
+    <simulator dir>/calls.log       one line per command run, for counting them
+    <simulator dir>/bin/            the sbatch, sacct, squeue and scancel commands
+    <simulator dir>/scripts/        the job scripts submitted over slurmrestd
+
+The simulator can also stand in for slurmrestd (see ngi_pipeline.utils.slurmrestd),
+serving the jobs over HTTP as slurmctld and the accounting would:
+
+    python -m ngi_pipeline.utils.slurm_simulator --dir <simulator dir> serve [--port 6820]
+"""
+
+import argparse
+import collections
+import contextlib
+import datetime
+import fcntl
+import json
+import os
+import random
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from ngi_pipeline.utils.slurm import (
+    _parse_sbatch_options,
+    seconds_to_slurm_time,
+    slurm_time_limit_to_seconds,
+)
+
+SIMULATED_COMMANDS = ("sbatch", "sacct", "squeue", "scancel")
+
+DEFAULT_SETTINGS = {
+    # seeds the random draws made for each job
+    "seed": 0,
+    # the id of the first job submitted
+    "first_job_id": 1000,
+    # the range of seconds a job waits in the queue before it starts
+    "queue_delay": [0, 60],
+    # the range of seconds a job runs; it times out if this exceeds its time limit
+    "runtime": [60, 3600],
+    # the range of the peak memory use of a job, in bytes
+    "max_rss": [2**30, 2**34],
+    # the fraction of jobs that fail (exit code 1)
+    "failure_rate": 0.0,
+    # the fraction of sbatch calls that fail without submitting the job
+    "submit_failure_rate": 0.0,
+    # the seconds after its submission before a job is listed by sacct
+    "visibility_lag": 0,
+    # "wall" for the wall clock, sped up by time_scale, or "manual"
+    "clock": "wall",
+    "time_scale": 1.0,
+    # run the job scripts once the jobs have finished, taking the exit code of the
+    # job from the script; the scripts of the jobs that fail are not run
+    "run_scripts": False,
+    # the seconds slurmctld keeps finished jobs, after which slurmrestd only finds
+    # them in the accounting
+    "min_job_age": 300,
+}
+
+# the fields listed by sacct if none are asked for
+DEFAULT_SACCT_FIELDS = (
+    "JobID",
+    "JobName",
+    "Partition",
+    "Account",
+    "AllocCPUS",
+    "State",
+    "ExitCode",
+)
+
+DEFAULT_SQUEUE_FORMAT = "%.18i %.9P %.8j %.8u %.2t %.10M %.6D %R"
+
+# the compact states listed by squeue
+SQUEUE_STATE_CODES = {"PENDING": "PD", "RUNNING": "R"}
+
+SimulatorResult = collections.namedtuple(
+    "SimulatorResult", ["stdout", "stderr", "exit_code"]
+)
+
+
+class _ArgumentParser(argparse.ArgumentParser):
+    """An argument parser raising on errors instead of exiting, as the simulated
+    commands are also run in-process."""
+
+    def __init__(self, prog):
+        super(_ArgumentParser, self).__init__(prog=prog, add_help=False)
+
+    def error(self, message):
+        raise ValueError(message)
+
+
+def _format_duration(seconds):
+    """A duration as listed by sacct and squeue, e.g. "1-02:03:04" or "02:03:04"."""
+    seconds = int(max(0, seconds))
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    duration = "{:02d}:{:02d}:{:02d}".format(hours, minutes, seconds)
+    return "{}-{}".format(days, duration) if days else duration
+
+
+def _format_timestamp(timestamp):
+    if timestamp is None:
+        return "Unknown"
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _parse_array_spec(array_spec):
+    """The task ids and throttle of an array specification, e.g. "0-9%2" or "1,3,5-7"."""
+    array_spec, _, throttle = array_spec.partition("%")
+    task_ids = []
+    for task_range in array_spec.split(","):
+        task_range, _, step = task_range.partition(":")
+        first, _, last = task_range.partition("-")
+        task_ids.extend(range(int(first), int(last or first) + 1, int(step or 1)))
+    return sorted(set(task_ids)), int(throttle) if throttle else None
+
+
+def _compress_task_ids(task_ids):
+    """Task ids as ranges, e.g. [1, 2, 3, 5] as "1-3,5"."""
+    ranges = []
+    for task_id in sorted(task_ids):
+        if ranges and ranges[-1][1] == task_id - 1:
+            ranges[-1][1] = task_id
+        else:
+            ranges.append([task_id, task_id])
+    return ",".join(
+        str(first) if first == last else "{}-{}".format(first, last)
+        for first, last in ranges
+    )
+
+
+class SlurmSimulator(object):
+    """A simulated SLURM cluster, kept in a directory."""
+
+    def __init__(self, simulator_dir, **settings):
+        """
+        :param str simulator_dir: The directory holding the simulator; created if missing
+        :param settings: The settings of the simulator, see DEFAULT_SETTINGS. If any
+                         are given, the simulator is set up anew with these and the
+                         defaults for the rest, removing the jobs submitted so far
+        """
+        self.simulator_dir = os.path.abspath(simulator_dir)
+        self.bin_dir = os.path.join(self.simulator_dir, "bin")
+        self.scripts_dir = os.path.join(self.simulator_dir, "scripts")
+        # the name the commands run are counted under, if not their own
+        self.call_name = None
+        self._config_path = os.path.join(self.simulator_dir, "config.json")
+        self._state_path = os.path.join(self.simulator_dir, "state.json")
+        self._lock_path = os.path.join(self.simulator_dir, "lock")
+        self._calls_path = os.path.join(self.simulator_dir, "calls.log")
+        if settings or not os.path.exists(self._config_path):
+            unknown = set(settings) - set(DEFAULT_SETTINGS)
+            if unknown:
+                raise ValueError(
+                    "Unknown simulator settings: {}".format(", ".join(sorted(unknown)))
+                )
+            self.settings = dict(DEFAULT_SETTINGS, **settings)
+            self.settings["started_at"] = time.time()
+            if not os.path.isdir(self.simulator_dir):
+                os.makedirs(self.simulator_dir)
+            with self._locked():
+                self._write_json(self._config_path, self.settings)
+                self._write_json(
+                    self._state_path,
+                    {
+                        "next_job_id": self.settings["first_job_id"],
+                        "now": self.settings["started_at"],
+                        "jobs": {},
+                    },
+                )
+                open(self._calls_path, "w").close()
+        else:
+            with open(self._config_path, "r") as fh:
+                self.settings = json.load(fh)
+
+    def __repr__(self):
+        return "SlurmSimulator({})".format(self.simulator_dir)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, "w") as fh:
+            json.dump(data, fh)
+        os.replace(tmp_path, path)
+
+    def _read_state(self):
+        with open(self._state_path, "r") as fh:
+            return json.load(fh)
+
+    def _now(self, state):
+        if self.settings["clock"] == "manual":
+            return state["now"]
+        started_at = self.settings["started_at"]
+        return started_at + (time.time() - started_at) * self.settings["time_scale"]
+
+    def now(self):
+        """The simulated time, as seconds since the epoch."""
+        with self._locked():
+            return self._now(self._read_state())
+
+    def advance(self, seconds):
+        """Move the manual clock on.
+
+        :param float seconds: The number of seconds to move the clock on by
+
+        :returns: The simulated time
+        :rtype: float
+        :raises ValueError: If the simulator runs on the wall clock
+        """
+        if self.settings["clock"] != "manual":
+            raise ValueError("Only the manual clock can be advanced")
+        with self._locked():
+            state = self._read_state()
+            state["now"] += seconds
+            self._write_json(self._state_path, state)
+            return state["now"]
+
+    def install_commands(self):
+        """Write the sbatch, sacct, squeue and scancel commands of this simulator.
+
+        :returns: The directory holding the commands, to put first on the PATH
+        :rtype: str
+        """
+        if not os.path.isdir(self.bin_dir):
+            os.makedirs(self.bin_dir)
+        # the package is found also if it is not installed
+        package_dir = os.path.dirname(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        # the logging of the slurm utilities needs a configuration file
+        ngi_config = os.environ.get("NGI_CONFIG")
+        for command in SIMULATED_COMMANDS:
+            command_path = os.path.join(self.bin_dir, command)
+            with open(command_path, "w") as fh:
+                fh.write("#!/bin/sh\n")
+                if ngi_config:
+                    fh.write(
+                        "export NGI_CONFIG=${{NGI_CONFIG:-{}}}\n".format(
+                            shlex.quote(os.path.abspath(ngi_config))
+                        )
+                    )
+                fh.write(
+                    'PYTHONPATH={}${{PYTHONPATH:+:$PYTHONPATH}} exec {} -m {} --dir {} {} "$@"\n'.format(
+                        shlex.quote(package_dir),
+                        shlex.quote(sys.executable),
+                        __name__,
+                        shlex.quote(self.simulator_dir),
+                        command,
+                    )
+                )
+            os.chmod(command_path, 0o755)
+        return self.bin_dir
+
+    def environ(self, environ=None):
+        """An environment in which the simulated commands are run instead of the real ones.
+
+        :param dict environ: The environment to start from (default is that of this process)
+
+        :returns: The environment
+        :rtype: dict
+        """
+        environ = dict(os.environ if environ is None else environ)
+        environ["PATH"] = os.pathsep.join(
+            [self.install_commands(), environ.get("PATH", os.defpath)]
+        )
+        return environ
+
+    def calls(self):
+        """The number of times each simulated command has been run.
+
+        :rtype: collections.Counter
+        """
+        with open(self._calls_path, "r") as fh:
+            return collections.Counter(line.strip() for line in fh if line.strip())
+
+    def _record_call(self, command):
+        # a single append, so that concurrent commands do not need the lock for it
+        with open(self._calls_path, "a") as fh:
+            fh.write("{}\n".format(command))
+
+    def _draw(self, *key):
+        return random.Random("-".join(str(x) for x in (self.settings["seed"],) + key))
+
+    def _schedule_tasks(self, job, submitted):
+        """Draw the start, end and outcome of the tasks of a job, starting the tasks of
+        a job array as the throttle allows."""
+        running_ends = []
+        for task in job["tasks"]:
+            rnd = self._draw(job["job_id"], task["task_id"])
+            start = submitted + rnd.uniform(*self.settings["queue_delay"])
+            if job["throttle"] and len(running_ends) >= job["throttle"]:
+                running_ends.sort()
+                start = max(start, running_ends.pop(0))
+            runtime = rnd.uniform(*self.settings["runtime"])
+            failed = rnd.random() < self.settings["failure_rate"]
+            task.update(
+                start=start,
+                end=start + runtime,
+                exit_code=1 if failed else 0,
+                max_rss=int(rnd.uniform(*self.settings["max_rss"])),
+                cpu_efficiency=rnd.uniform(0.5, 1.0),
+                failed=failed,
+                timeout=False,
+                cancelled=None,
+                script_run=False,
+            )
+            if job["time_limit"] is not None and runtime > job["time_limit"]:
+                task.update(end=start + job["time_limit"], exit_code=0, timeout=True)
+            running_ends.append(task["end"])
+
+    def _task_state(self, task, now):
+        """The state of a task at a time and, once it has started, its elapsed seconds."""
+        cancelled = task["cancelled"]
+        if cancelled is not None and cancelled < task["end"] and cancelled <= now:
+            return "CANCELLED", max(0.0, cancelled - task["start"])
+        if now < task["start"]:
+            return "PENDING", None
+        if now < task["end"]:
+            return "RUNNING", now - task["start"]
+        elapsed = task["end"] - task["start"]
+        if task["timeout"]:
+            return "TIMEOUT", elapsed
+        return ("COMPLETED" if task["exit_code"] == 0 else "FAILED"), elapsed
+
+    def _run_finished_scripts(self, state, now):
+        """Run the scripts of the jobs that have finished since last time, if so configured."""
+        changed = False
+        for job in state["jobs"].values():
+            for task in job["tasks"]:
+                if (
+                    task["script_run"]
+                    or task["failed"]
+                    or task["cancelled"] is not None
+                ):
+                    continue
+                if now < task["end"]:
+                    continue
+                task["script_run"] = True
+                task["exit_code"] = self._run_script(job, task)
+                changed = True
+        return changed
+
+    @staticmethod
+    def _substitute_filename_pattern(pattern, job, task):
+        array_job_id = str(job["job_id"])
+        task_id = "" if task["task_id"] is None else str(task["task_id"])
+        return (
+            pattern.replace("%A", array_job_id)
+            .replace("%a", task_id)
+            .replace("%j", str(task["raw_id"]))
+            .replace("%x", job["name"])
+        )
+
+    def _run_script(self, job, task):
+        work_dir = job["work_dir"]
+        stdout = self._substitute_filename_pattern(
+            job["stdout"]
+            or os.path.join(
+                work_dir,
+                "slurm-%A_%a.out" if task["task_id"] is not None else "slurm-%j.out",
+            ),
+            job,
+            task,
+        )
+        stderr = (
+            self._substitute_filename_pattern(job["stderr"], job, task)
+            if job["stderr"]
+            else stdout
+        )
+        environ = dict(
+            os.environ,
+            SLURM_JOB_ID=str(task["raw_id"]),
+            SLURM_JOB_NAME=job["name"],
+            SLURM_SUBMIT_DIR=work_dir,
+        )
+        if task["task_id"] is not None:
+            environ.update(
+                SLURM_ARRAY_JOB_ID=str(job["job_id"]),
+                SLURM_ARRAY_TASK_ID=str(task["task_id"]),
+            )
+        try:
+            with open(stdout, "a") as out_fh, open(stderr, "a") as err_fh:
+                return subprocess.call(
+                    ["/bin/bash", job["script"]] + job["script_args"],
+                    cwd=work_dir,
+                    env=environ,
+                    stdin=subprocess.DEVNULL,
+                    stdout=out_fh,
+                    stderr=err_fh,
+                )
+        except (IOError, OSError):
+            return 1
+
+    @contextlib.contextmanager
+    def _state(self, command, modify=False):
+        """The state of the simulator as of now, saved again if modify is set or
+        scripts have been run."""
+        self._record_call(self.call_name or command)
+        with self._locked():
+            state = self._read_state()
+            now = self._now(state)
+            changed = False
+            if self.settings["run_scripts"]:
+                changed = self._run_finished_scripts(state, now)
+            yield state, now
+            if modify or changed:
+                self._write_json(self._state_path, state)
+
+    def _select_tasks(self, state, job_specs, now=None):
+        """The (job, task) pairs of the job specifications, in job id order; all jobs
+        if none are given. A job array is selected by its job id, its tasks by
+        "<job id>_<task id>". Jobs not visible to sacct yet are left out if now is given.
+        """
+        selected = []
+        wanted = None
+        if job_specs:
+            wanted = collections.defaultdict(set)
+            for job_spec in job_specs:
+                job_id, _, task_id = str(job_spec).partition("_")
+                wanted[job_id].add(int(task_id) if task_id else None)
+        for job_id in sorted(state["jobs"], key=int):
+            if wanted is not None and job_id not in wanted:
+                continue
+            job = state["jobs"][job_id]
+            if (
+                now is not None
+                and now < job["submitted"] + self.settings["visibility_lag"]
+            ):
+                continue
+            for task in job["tasks"]:
+                if (
+                    wanted is None
+                    or None in wanted[job_id]
+                    or task["task_id"] in wanted[job_id]
+                ):
+                    selected.append((job, task))
+        return selected
+
+    def sbatch(self, args):
+        """Submit a job script, see `sbatch --help` of the real command for the
+        options that are supported; the options in the #SBATCH lines of the
+        script are used where not given.
+
+        :param list args: The command line arguments
+        :rtype: SimulatorResult
+        """
+        parser = _ArgumentParser(prog="sbatch")
+        for option in (
+            ("-J", "--job-name"),
+            ("-o", "--output"),
+            ("-e", "--error"),
+            ("-D", "--chdir"),
+            ("-a", "--array"),
+            ("-n", "--ntasks"),
+            ("-c", "--cpus-per-task"),
+            ("-t", "--time"),
+            ("-A", "--account"),
+            ("-p", "--partition"),
+            ("-N", "--nodes"),
+            ("-d", "--dependency"),
+            ("--mail-user",),
+            ("--mail-type",),
+            ("--qos",),
+        ):
+            parser.add_argument(*option)
+        parser.add_argument("--parsable", action="store_true")
+        parser.add_argument("script")
+        parser.add_argument("script_args", nargs=argparse.REMAINDER)
+        try:
+            parsed_args = parser.parse_args(args)
+            script_options = dict(_parse_sbatch_options(parsed_args.script))
+        except ValueError as e:
+            return SimulatorResult("", "sbatch: error: {}\n".format(e), 1)
+        except IOError as e:
+            return SimulatorResult(
+                "",
+                "sbatch: error: Unable to open file {}: {}\n".format(
+                    parsed_args.script, e
+                ),
+                1,
+            )
+
+        def _option(*names):
+            for name in names:
+                value = getattr(parsed_args, name.lstrip("-").replace("-", "_"), None)
+                if value is None:
+                    value = script_options.get(name)
+                if value is not None:
+                    return value
+            return None
+
+        with self._state("sbatch", modify=True) as (state, now):
+            job_id = state["next_job_id"]
+            state["submissions"] = state.get("submissions", 0) + 1
+            if (
+                self._draw("sbatch", state["submissions"]).random()
+                < self.settings["submit_failure_rate"]
+            ):
+                return SimulatorResult(
+                    "",
+                    "sbatch: error: Batch job submission failed: "
+                    "Socket timed out on send/recv operation\n",
+                    1,
+                )
+            array_spec = _option("--array")
+            task_ids, throttle = (
+                _parse_array_spec(array_spec) if array_spec else ([None], None)
+            )
+            work_dir = _option("--chdir") or os.getcwd()
+            cores = int(_option("--ntasks") or 1) * int(
+                _option("--cpus-per-task", "-c") or 1
+            )
+            job = {
+                "job_id": job_id,
+                "name": _option("--job-name") or os.path.basename(parsed_args.script),
+                "script": os.path.abspath(parsed_args.script),
+                "script_args": parsed_args.script_args,
+                "work_dir": work_dir,
+                "stdout": _option("--output"),
+                "stderr": _option("--error"),
+                "account": _option("--account", "-A") or "",
+                "partition": _option("--partition", "-p") or "core",
+                "cores": cores,
+                "time_limit": slurm_time_limit_to_seconds(_option("--time")),
+                "throttle": throttle,
+                "submitted": now,
+                "tasks": [
+                    # each task of a job array has a job id of its own
+                    {"task_id": task_id, "raw_id": job_id + i}
+                    for i, task_id in enumerate(task_ids)
+                ],
+            }
+            self._schedule_tasks(job, now)
+            state["jobs"][str(job_id)] = job
+            state["next_job_id"] = job_id + len(task_ids)
+        if parsed_args.parsable:
+            return SimulatorResult("{}\n".format(job_id), "", 0)
+        return SimulatorResult("Submitted batch job {}\n".format(job_id), "", 0)
+
+    def _sacct_fields(self, job, task, job_spec, state, elapsed, step=None):
+        """The sacct fields of a task, or of its batch step, keyed by their
+        lower case names since sacct matches the field names case-insensitively.
+        """
+        ended = state not in ("PENDING", "RUNNING")
+        exit_code = task["exit_code"] if ended else 0
+        if state == "CANCELLED":
+            exit_code = 0
+        fields = {
+            "JobID": job_spec if step is None else "{}.{}".format(job_spec, step),
+            "JobIDRaw": (
+                str(task["raw_id"])
+                if step is None
+                else "{}.{}".format(task["raw_id"], step)
+            ),
+            "JobName": job["name"] if step is None else step,
+            "Partition": job["partition"] if step is None else "",
+            "Account": job["account"],
+            "AllocCPUS": str(job["cores"]),
+            "State": (
+                "CANCELLED by 0" if state == "CANCELLED" and step is None else state
+            ),
+            "ExitCode": "{}:0".format(exit_code),
+            "Elapsed": _format_duration(elapsed or 0),
+            "TotalCPU": (
+                _format_duration((elapsed or 0) * job["cores"] * task["cpu_efficiency"])
+                if ended
+                else "00:00:00"
+            ),
+            "MaxRSS": (
+                "{}K".format(task["max_rss"] // 1024)
+                if step is not None and ended
+                else ""
+            ),
+            "Timelimit": (
+                ""
+                if step is not None
+                else (
+                    seconds_to_slurm_time(job["time_limit"])
+                    if job["time_limit"] is not None
+                    else "UNLIMITED"
+                )
+            ),
+            "Submit": _format_timestamp(job["submitted"]),
+            "Start": _format_timestamp(task["start"] if state != "PENDING" else None),
+            "End": _format_timestamp(
+                task["start"] + elapsed if ended and elapsed is not None else None
+            ),
+        }
+        return dict((name.lower(), value) for name, value in fields.items())
+
+    def sacct(self, args):
+        """List the jobs known to the accounting, supporting the -j/--jobs,
+        -o/--format, -n/--noheader, -P/--parsable2, -p/--parsable and
+        -X/--allocations options. The pending tasks of a job array are listed
+        together, e.g. as "1234_[3-7%2]". Jobs submitted less than visibility_lag
+        seconds ago are not listed.
+
+        :param list args: The command line arguments
+        :rtype: SimulatorResult
+        """
+        parser = _ArgumentParser(prog="sacct")
+        parser.add_argument("-j", "--jobs")
+        parser.add_argument("-o", "--format")
+        parser.add_argument("-n", "--noheader", action="store_true")
+        parser.add_argument("-P", "--parsable2", action="store_true")
+        parser.add_argument("-p", "--parsable", action="store_true")
+        parser.add_argument("-X", "--allocations", action="store_true")
+        try:
+            parsed_args, _ = parser.parse_known_args(args)
+        except ValueError as e:
+            return SimulatorResult("", "sacct: error: {}\n".format(e), 1)
+        fields = (
+            [x.split("%")[0] for x in parsed_args.format.split(",")]
+            if parsed_args.format
+            else list(DEFAULT_SACCT_FIELDS)
+        )
+        job_specs = parsed_args.jobs.split(",") if parsed_args.jobs else None
+        rows = []
+        with self._state("sacct") as (state, now):
+            pending_tasks = collections.OrderedDict()
+            for job, task in self._select_tasks(state, job_specs, now=now):
+                task_state, elapsed = self._task_state(task, now)
+                if task["task_id"] is None:
+                    job_spec = str(job["job_id"])
+                elif task_state == "PENDING":
+                    # listed together once all the tasks of the job have been seen
+                    pending_tasks.setdefault(job["job_id"], (job, task, []))[2].append(
+                        task["task_id"]
+                    )
+                    continue
+                else:
+                    job_spec = "{}_{}".format(job["job_id"], task["task_id"])
+                rows.append(
+                    self._sacct_fields(job, task, job_spec, task_state, elapsed)
+                )
+                if task_state != "PENDING" and not parsed_args.allocations:
+                    rows.append(
+                        self._sacct_fields(
+                            job, task, job_spec, task_state, elapsed, step="batch"
+                        )
+                    )
+            for job, task, task_ids in pending_tasks.values():
+                job_spec = "{}_[{}{}]".format(
+                    job["job_id"],
+                    _compress_task_ids(task_ids),
+                    "%{}".format(job["throttle"]) if job["throttle"] else "",
+                )
+                rows.append(self._sacct_fields(job, task, job_spec, "PENDING", None))
+        lines = []
+        if parsed_args.parsable2 or parsed_args.parsable:
+            end = "|" if parsed_args.parsable and not parsed_args.parsable2 else ""
+            if not parsed_args.noheader:
+                lines.append("|".join(fields) + end)
+            lines.extend(
+                "|".join(row.get(field.lower(), "") for field in fields) + end
+                for row in rows
+            )
+        else:
+            widths = [12 if field.lower() == "jobid" else 10 for field in fields]
+
+            def _fixed_width(values):
+                return " ".join(
+                    (value if len(value) <= width else value[: width - 1] + "+").rjust(
+                        width
+                    )
+                    for value, width in zip(values, widths)
+                )
+
+            if not parsed_args.noheader:
+                lines.append(_fixed_width(fields))
+                lines.append(" ".join("-" * width for width in widths))
+            lines.extend(
+                _fixed_width([row.get(field.lower(), "") for field in fields])
+                for row in rows
+            )
+        return SimulatorResult("".join(line + "\n" for line in lines), "", 0)
+
+    def squeue(self, args):
+        """List the pending and running jobs, supporting the -j/--jobs,
+        -t/--states, -o/--format and -h/--noheader options.
+
+        :param list args: The command line arguments
+        :rtype: SimulatorResult
+        """
+        parser = _ArgumentParser(prog="squeue")
+        parser.add_argument("-j", "--jobs")
+        parser.add_argument("-t", "--states")
+        parser.add_argument("-o", "--format", default=DEFAULT_SQUEUE_FORMAT)
+        parser.add_argument("-h", "--noheader", action="store_true")
+        parser.add_argument("-u", "--user")
+        try:
+            parsed_args, _ = parser.parse_known_args(args)
+        except ValueError as e:
+            return SimulatorResult("", "squeue: error: {}\n".format(e), 1)
+        states = None
+        if parsed_args.states:
+            states = set()
+            for state in parsed_args.states.upper().split(","):
+                states.add(state)
+                states.update(
+                    name for name, code in SQUEUE_STATE_CODES.items() if code == state
+                )
+        job_specs = parsed_args.jobs.split(",") if parsed_args.jobs else None
+        rows = []
+        with self._state("squeue") as (state, now):
+            pending_tasks = collections.OrderedDict()
+            for job, task in self._select_tasks(state, job_specs):
+                task_state, elapsed = self._task_state(task, now)
+                if task_state not in SQUEUE_STATE_CODES or (
+                    states is not None and task_state not in states
+                ):
+                    continue
+                if task["task_id"] is not None and task_state == "PENDING":
+                    pending_tasks.setdefault(job["job_id"], (job, []))[1].append(
+                        task["task_id"]
+                    )
+                    continue
+                job_spec = (
+                    str(job["job_id"])
+                    if task["task_id"] is None
+                    else "{}_{}".format(job["job_id"], task["task_id"])
+                )
+                rows.append((job, job_spec, task_state, elapsed))
+            for job, task_ids in pending_tasks.values():
+                job_spec = "{}_[{}{}]".format(
+                    job["job_id"],
+                    _compress_task_ids(task_ids),
+                    "%{}".format(job["throttle"]) if job["throttle"] else "",
+                )
+                rows.append((job, job_spec, "PENDING", None))
+        user = os.environ.get("USER", "ngi")
+
+        def _squeue_field(code, job, job_spec, task_state, elapsed):
+            return {
+                "i": job_spec,
+                "A": str(job["job_id"]),
+                "j": job["name"],
+                "P": job["partition"],
+                "a": job["account"],
+                "u": user,
+                "T": task_state,
+                "t": SQUEUE_STATE_CODES[task_state],
+                "M": _format_duration(elapsed or 0),
+                "l": (
+                    _format_duration(job["time_limit"])
+                    if job["time_limit"] is not None
+                    else "UNLIMITED"
+                ),
+                "C": str(job["cores"]),
+                "D": "1",
+                "R": "(Priority)" if task_state == "PENDING" else "sim-node",
+            }.get(code, "")
+
+        headers = {
+            "i": "JOBID",
+            "A": "ARRAY_JOB_ID",
+            "j": "NAME",
+            "P": "PARTITION",
+            "a": "ACCOUNT",
+            "u": "USER",
+            "T": "STATE",
+            "t": "ST",
+            "M": "TIME",
+            "l": "TIME_LIMIT",
+            "C": "CPUS",
+            "D": "NODES",
+            "R": "NODELIST(REASON)",
+        }
+        field_re = re.compile(r"%(\.?)(\d*)([a-zA-Z])")
+
+        def _format_line(value_fn):
+            def _replace(match):
+                right, width, code = match.groups()
+                value = value_fn(code)
+                if width:
+                    value = value[: int(width)]
+                    value = (
+                        value.rjust(int(width)) if right else value.ljust(int(width))
+                    )
+                return value
+
+            return field_re.sub(_replace, parsed_args.format)
+
+        lines = []
+        if not parsed_args.noheader:
+            lines.append(_format_line(lambda code: headers.get(code, "")))
+        for row in rows:
+            lines.append(_format_line(lambda code, row=row: _squeue_field(code, *row)))
+        return SimulatorResult("".join(line + "\n" for line in lines), "", 0)
+
+    def scancel(self, args):
+        """Cancel jobs, or tasks of job arrays, that have not finished yet.
+
+        :param list args: The command line arguments, the job specifications
+        :rtype: SimulatorResult
+        """
+        job_specs = [x for x in args if not x.startswith("-")]
+        if not job_specs:
+            return SimulatorResult(
+                "", "scancel: error: No job identification provided\n", 1
+            )
+        errors = []
+        with self._state("scancel", modify=True) as (state, now):
+            for job_spec in job_specs:
+                selected = self._select_tasks(state, [job_spec])
+                if not selected:
+                    errors.append(
+                        "scancel: error: Kill job error on job id {}: "
+                        "Invalid job id specified\n".format(job_spec)
+                    )
+                    continue
+                for _, task in selected:
+                    if self._task_state(task, now)[0] in ("PENDING", "RUNNING"):
+                        task["cancelled"] = now
+        return SimulatorResult("", "".join(errors), 1 if errors else 0)
+
+    def controller_jobs(self):
+        """The jobs known to slurmctld, as listed by slurmrestd: all jobs that are
+        queued or running or have finished less than min_job_age seconds ago, with
+        the pending tasks of a job array listed together.
+
+        :returns: The job records
+        :rtype: list
+        """
+        records = []
+        with self._state("controller_jobs") as (state, now):
+            pending_tasks = collections.OrderedDict()
+            for job, task in self._select_tasks(state, None):
+                task_state, elapsed = self._task_state(task, now)
+                if (
+                    elapsed is not None
+                    and task_state != "RUNNING"
+                    and task["start"] + elapsed + self.settings["min_job_age"] <= now
+                ):
+                    continue
+                if task["task_id"] is not None and task_state == "PENDING":
+                    pending_tasks.setdefault(job["job_id"], (job, []))[1].append(
+                        task["task_id"]
+                    )
+                    continue
+                records.append(self._controller_job(job, task, task_state))
+            for job, task_ids in pending_tasks.values():
+                record = self._controller_job(job, None, "PENDING")
+                record["array_task_string"] = "{}{}".format(
+                    _compress_task_ids(task_ids),
+                    "%{}".format(job["throttle"]) if job["throttle"] else "",
+                )
+                records.append(record)
+        return records
+
+    @staticmethod
+    def _controller_job(job, task, task_state):
+        def _number(value):
+            return {"set": value is not None, "infinite": False, "number": value or 0}
+
+        is_array = job["tasks"][0]["task_id"] is not None
+        return {
+            "job_id": task["raw_id"] if task else job["job_id"],
+            "array_job_id": _number(job["job_id"] if is_array else None),
+            "array_task_id": _number(task["task_id"] if task else None),
+            "name": job["name"],
+            "job_state": [task_state],
+        }
+
+    def accounting_job(self, job_spec):
+        """A job or task of a job array as found in the accounting by slurmrestd,
+        once it is visible to sacct.
+
+        :param str job_spec: The job specification, e.g. "1234" or "1234_5"
+
+        :returns: The job record, or None if the job is not found
+        :rtype: dict
+        """
+        with self._state("accounting_job") as (state, now):
+            try:
+                selected = self._select_tasks(state, [job_spec], now=now)
+            except ValueError:
+                return None
+            if len(selected) != 1:
+                return None
+            job, task = selected[0]
+            task_state, _ = self._task_state(task, now)
+        is_array = task["task_id"] is not None
+        return {
+            "job_id": task["raw_id"],
+            "name": job["name"],
+            "array": {
+                "job_id": job["job_id"] if is_array else 0,
+                "task_id": {
+                    "set": is_array,
+                    "infinite": False,
+                    "number": task["task_id"] or 0,
+                },
+            },
+            "state": {"current": [task_state], "reason": "None"},
+        }
+
+    def submit_job(self, script, job):
+        """Submit a job as slurmrestd is asked to, the job script along with the
+        description of the job.
+
+        :param str script: The job script
+        :param dict job: The job description, see ngi_pipeline.utils.slurmrestd
+
+        :returns: What sbatch would have returned for the job
+        :rtype: SimulatorResult
+        """
+        if not os.path.isdir(self.scripts_dir):
+            os.makedirs(self.scripts_dir)
+        fd, script_path = tempfile.mkstemp(suffix=".sh", dir=self.scripts_dir)
+        with os.fdopen(fd, "w") as fh:
+            fh.write(script)
+        args = ["--parsable"]
+        for field, option in (
+            ("name", "--job-name"),
+            ("standard_output", "--output"),
+            ("standard_error", "--error"),
+            ("current_working_directory", "--chdir"),
+            ("array", "--array"),
+            ("tasks", "--ntasks"),
+            ("cpus_per_task", "--cpus-per-task"),
+            ("time_limit", "--time"),
+            ("account", "--account"),
+            ("partition", "--partition"),
+        ):
+            value = job.get(field)
+            if isinstance(value, dict):
+                value = value.get("number") if value.get("set", True) else None
+            if value is not None:
+                args.extend([option, str(value)])
+        return self.sbatch(args + [script_path])
+
+    def run_command(self, command, args):
+        """Run one of the simulated commands.
+
+        :param str command: One of sbatch, sacct, squeue and scancel
+        :param list args: The command line arguments
+
+        :rtype: SimulatorResult
+        """
+        if command not in SIMULATED_COMMANDS:
+            raise ValueError("Not a simulated command: {}".format(command))
+        return getattr(self, command)(list(args))
+
+
+class _SlurmRestdHandler(BaseHTTPRequestHandler):
+    """Answers the slurmrestd requests made by ngi_pipeline.utils.slurmrestd."""
+
+    # keep the connections alive, as slurmrestd does
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, result=None, errors=()):
+        body = json.dumps(
+            dict(
+                result or {},
+                errors=[{"description": error} for error in errors],
+                warnings=[],
+            )
+        ).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        simulator = self.server.simulator
+        # <plugin>/<version>/<endpoint>
+        parts = urlparse(self.path).path.strip("/").split("/")
+        endpoint = (method, parts[0], tuple(parts[2:3]))
+        if endpoint == ("GET", "slurm", ("jobs",)):
+            return self._reply(200, {"jobs": simulator.controller_jobs()})
+        if endpoint == ("GET", "slurmdb", ("job",)) and len(parts) == 4:
+            job = simulator.accounting_job(parts[3])
+            if job is None:
+                return self._reply(404, errors=["Job {} not found".format(parts[3])])
+            return self._reply(200, {"jobs": [job]})
+        if endpoint == ("POST", "slurm", ("job",)) and parts[3:] == ["submit"]:
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                request = json.loads(self.rfile.read(length).decode("utf-8"))
+                result = simulator.submit_job(request["script"], request.get("job", {}))
+            except (KeyError, ValueError) as e:
+                return self._reply(400, errors=["Invalid request: {}".format(e)])
+            if result.exit_code:
+                return self._reply(500, errors=[result.stderr.strip()])
+            return self._reply(200, {"job_id": int(result.stdout.strip())})
+        if endpoint == ("DELETE", "slurm", ("job",)) and len(parts) == 4:
+            result = simulator.scancel([parts[3]])
+            if result.exit_code:
+                return self._reply(404, errors=[result.stderr.strip()])
+            return self._reply(200)
+        return self._reply(
+            404, errors=["Unknown endpoint {} {}".format(method, self.path)]
+        )
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+class SlurmRestdServer(ThreadingHTTPServer):
+    """A stand-in for slurmrestd, serving the jobs of a simulator. The requests
+    are counted as "slurmrestd" calls of the simulator."""
+
+    daemon_threads = True
+
+    def __init__(self, simulator_dir, host="127.0.0.1", port=0):
+        """
+        :param str simulator_dir: The directory holding the simulator
+        :param str host: The address to listen on
+        :param int port: The port to listen on; any free port if 0
+        """
+        ThreadingHTTPServer.__init__(self, (host, port), _SlurmRestdHandler)
+        self.simulator = SlurmSimulator(simulator_dir)
+        self.simulator.call_name = "slurmrestd"
+
+    @property
+    def url(self):
+        """The url to configure as the slurmrestd url."""
+        host, port = self.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Run a simulated SLURM command, or set up the simulator."
+    )
+    parser.add_argument(
+        "-d",
+        "--dir",
+        default=os.environ.get("SLURM_SIMULATOR_DIR"),
+        help="The simulator directory (default is $SLURM_SIMULATOR_DIR)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    setup_parser = subparsers.add_parser(
+        "setup", help="Set up the simulator anew and install its commands"
+    )
+    for setting, default in sorted(DEFAULT_SETTINGS.items()):
+        option = "--{}".format(setting.replace("_", "-"))
+        if isinstance(default, bool):
+            setup_parser.add_argument(option, dest=setting, action="store_true")
+        elif isinstance(default, list):
+            setup_parser.add_argument(
+                option, dest=setting, type=float, nargs=2, metavar=("MIN", "MAX")
+            )
+        else:
+            setup_parser.add_argument(option, dest=setting, type=type(default))
+    advance_parser = subparsers.add_parser("advance", help="Move the manual clock on")
+    advance_parser.add_argument("seconds", type=float)
+    subparsers.add_parser("calls", help="Count the simulated commands run")
+    serve_parser = subparsers.add_parser("serve", help="Stand in for slurmrestd")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=6820)
+    for command in SIMULATED_COMMANDS:
+        subparsers.add_parser(
+            command, help="The simulated {}".format(command), add_help=False
+        )
+    args = sys.argv[1:] if args is None else list(args)
+    command_args = []
+    for i, arg in enumerate(args):
+        if arg in SIMULATED_COMMANDS:
+            # the arguments of the simulated commands are passed on as they are
+            args, command_args = args[: i + 1], args[i + 1 :]
+            break
+    parsed_args = parser.parse_args(args)
+    if not parsed_args.dir:
+        parser.error("no simulator directory given")
+    if parsed_args.command == "setup":
+        settings = dict(
+            (setting, getattr(parsed_args, setting))
+            for setting in DEFAULT_SETTINGS
+            if getattr(parsed_args, setting) not in (None, False)
+        )
+        simulator = SlurmSimulator(parsed_args.dir, **settings)
+        print(simulator.install_commands())
+        return 0
+    if parsed_args.command == "serve":
+        server = SlurmRestdServer(
+            parsed_args.dir, host=parsed_args.host, port=parsed_args.port
+        )
+        print(server.url)
+        sys.stdout.flush()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+    simulator = SlurmSimulator(parsed_args.dir)
+    if parsed_args.command == "advance":
+        simulator.advance(parsed_args.seconds)
+        return 0
+    if parsed_args.command == "calls":
+        for command, count in sorted(simulator.calls().items()):
+            print("{}\t{}".format(command, count))
+        return 0
+    result = simulator.run_command(parsed_args.command, command_args)
+    sys.stdout.write(result.stdout)
+    sys.stderr.write(result.stderr)
+    return result.exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
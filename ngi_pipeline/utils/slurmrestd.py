@@ -0,0 +1,333 @@
+"""A client for slurmrestd, the REST API of SLURM.
+
+Talking to slurmrestd over a pooled keep-alive HTTP session saves forking sbatch,
+sacct and scancel for every job submitted, checked or cancelled. The state of all
+the jobs still known to slurmctld is fetched with a single request, without a
+slurmdbd round trip; only the jobs that have since been purged from slurmctld are
+looked up in the accounting.
+
+The client is used by ngi_pipeline.utils.slurm in place of the SLURM commands if
+the url of slurmrestd is configured:
+
+    slurm:
+        slurmrestd:
+            url: http://slurmctld:6820
+            user_name: funk_001     # default is the user running the pipeline
+            token: <JWT>            # default is $SLURM_JWT
+            api_version: v0.0.40
+            pool_size: 10           # the number of connections kept open
+"""
+
+import getpass
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.classes import with_ngi_config
+from ngi_pipeline.utils.slurm import (
+    _expand_job_ids,
+    _parse_sbatch_options,
+    slurm_job_spec,
+    slurm_memory_to_bytes,
+    slurm_time_limit_to_seconds,
+)
+
+LOG = minimal_logger(__name__)
+
+DEFAULT_API_VERSION = "v0.0.40"
+
+# the job description fields of the sbatch options, where they are not just the
+# option with dashes replaced by underscores
+SBATCH_OPTION_FIELDS = {
+    "-A": "account",
+    "-p": "partition",
+    "-N": "nodes",
+    "-c": "cpus_per_task",
+    "-d": "dependency",
+    "--job-name": "name",
+    "--output": "standard_output",
+    "--error": "standard_error",
+    "--chdir": "current_working_directory",
+    "--ntasks": "tasks",
+    "--time": "time_limit",
+    "--mem": "memory_per_node",
+}
+
+# the clients configured so far, so that their connections are reused
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+@with_ngi_config
+def get_slurmrestd_client(config=None, config_file_path=None):
+    """Return the slurmrestd client configured by the "slurmrestd" entry of the
+    "slurm" section of the config (see the module docstring). The same client is
+    returned for the same configuration, keeping its connections open.
+
+    :param dict config: The parsed NGI configuration
+
+    :returns: The client, or None if no slurmrestd url is configured
+    :rtype: SlurmRestClient
+    """
+    restd_config = ((config or {}).get("slurm") or {}).get("slurmrestd") or {}
+    if not restd_config.get("url"):
+        return None
+    key = tuple(sorted((k, str(v)) for k, v in restd_config.items()))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = SlurmRestClient(
+                restd_config["url"],
+                user_name=restd_config.get("user_name"),
+                token=restd_config.get("token"),
+                api_version=restd_config.get("api_version", DEFAULT_API_VERSION),
+                pool_size=int(restd_config.get("pool_size", 10)),
+            )
+        return _clients[key]
+
+
+def _number(value):
+    """A number as returned by slurmrestd, either plain or as a
+    {"set": ..., "infinite": ..., "number": ...} object; None if not set."""
+    if isinstance(value, dict):
+        if not value.get("set", True) or value.get("infinite"):
+            return None
+        value = value.get("number")
+    return value
+
+
+def _state(value):
+    """The base state of a job as returned by slurmrestd, which lists the state
+    with its flags from v0.0.40 on (e.g. ["PENDING", "REQUEUED"]) and nests it in
+    the accounting records."""
+    if isinstance(value, dict):
+        value = value.get("current")
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return value.split()[0] if value else None
+
+
+def job_description(script_path, environment=None):
+    """The slurmrestd description of a job from the #SBATCH options of its script.
+
+    :param str script_path: The path to the job script
+    :param dict environment: The environment of the job (default is that of this
+                             process, as sbatch exports it)
+
+    :returns: The job description
+    :rtype: dict
+    """
+    environment = os.environ if environment is None else environment
+    job = {
+        "name": os.path.basename(script_path),
+        "current_working_directory": os.getcwd(),
+        "environment": ["{}={}".format(k, v) for k, v in sorted(environment.items())],
+    }
+    for option, value in _parse_sbatch_options(script_path):
+        field = SBATCH_OPTION_FIELDS.get(option) or option.lstrip("-").replace("-", "_")
+        if field == "time_limit":
+            seconds = slurm_time_limit_to_seconds(value)
+            if seconds is None:
+                # e.g. UNLIMITED
+                value = {"set": True, "infinite": True}
+            else:
+                value = int(-(-seconds // 60))
+        elif field in ("memory_per_node", "mem_per_cpu"):
+            # sbatch reads a number without a unit as megabytes
+            if value[-1:].isdigit():
+                value += "M"
+            value = slurm_memory_to_bytes(value) // 1024**2
+        elif field in ("tasks", "cpus_per_task"):
+            value = int(value)
+        elif field == "mail_type":
+            value = value.split(",")
+        job[field] = True if value is None else value
+    return job
+
+
+class SlurmRestClient(requests.Session):
+    """A session with slurmrestd, keeping a pool of connections open."""
+
+    def __init__(
+        self,
+        base_url,
+        user_name=None,
+        token=None,
+        api_version=DEFAULT_API_VERSION,
+        pool_size=10,
+        timeout=30,
+    ):
+        """
+        :param str base_url: The url of slurmrestd, e.g. "http://slurmctld:6820"
+        :param str user_name: The user to act as (default is the user running this)
+        :param str token: The JWT authenticating the user (default is $SLURM_JWT);
+                          without a token, slurmrestd must authenticate the user
+                          otherwise, e.g. through its unix socket
+        :param str api_version: The version of the REST API to use
+        :param int pool_size: The number of connections kept open, which is also
+                              the number of requests sent at the same time by the
+                              bulk operations
+        :param float timeout: The seconds to wait for slurmrestd to answer
+        """
+        super(SlurmRestClient, self).__init__()
+        self.base_url = base_url.rstrip("/")
+        self.api_version = api_version
+        self.pool_size = pool_size
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.headers["X-SLURM-USER-NAME"] = user_name or getpass.getuser()
+        token = token or os.environ.get("SLURM_JWT")
+        if token:
+            self.headers["X-SLURM-USER-TOKEN"] = token
+
+    def __repr__(self):
+        return "SlurmRestClient({})".format(self.base_url)
+
+    def _call(self, method, plugin, path, **kwargs):
+        """Send a request to slurmrestd and return the decoded response.
+
+        :raises RuntimeError: If slurmrestd could not be reached or reports errors
+        """
+        url = "{}/{}/{}/{}".format(self.base_url, plugin, self.api_version, path)
+        try:
+            response = self.request(method, url, timeout=self.timeout, **kwargs)
+            result = response.json() if response.content else {}
+        except (requests.RequestException, ValueError) as e:
+            raise RuntimeError("Could not {} {}: {}".format(method, url, e))
+        errors = [
+            error.get("description") or error.get("error") or str(error)
+            for error in result.get("errors") or []
+        ]
+        if errors or not response.ok:
+            raise RuntimeError(
+                "slurmrestd could not {} {}: {}".format(
+                    method, url, "; ".join(errors) or response.reason
+                )
+            )
+        for warning in result.get("warnings") or []:
+            LOG.warning("slurmrestd: {}".format(warning.get("description", warning)))
+        return result
+
+    def submit_job(self, script_path):
+        """Submit a job script, as sbatch would.
+
+        :param str script_path: The path to the job script
+
+        :returns: The job id
+        :rtype: int
+
+        :raises RuntimeError: If the job could not be submitted
+        """
+        with open(script_path, "r") as fh:
+            script = fh.read()
+        result = self._call(
+            "POST",
+            "slurm",
+            "job/submit",
+            json={"script": script, "job": job_description(script_path)},
+        )
+        job_id = int(result["job_id"])
+        LOG.debug("Submitted {} as slurm job {}".format(script_path, job_id))
+        return job_id
+
+    def submit_jobs(self, script_paths):
+        """Submit several job scripts, sending as many requests at the same time as
+        there are pooled connections.
+
+        :param list script_paths: The paths to the job scripts
+
+        :returns: A dict with the script path as key and the job id as value; the
+                  scripts that could not be submitted are logged and left out
+        :rtype: dict
+        """
+
+        def _submit(script_path):
+            try:
+                return script_path, self.submit_job(script_path)
+            except (IOError, RuntimeError) as e:
+                LOG.error("Could not submit {}: {}".format(script_path, e))
+                return script_path, None
+
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            submitted = executor.map(_submit, script_paths)
+            return dict((k, v) for k, v in submitted if v is not None)
+
+    def get_job_states(self, slurm_job_ids):
+        """Get the state of several jobs. All the jobs known to slurmctld are listed
+        with one request, and the few jobs not among them, which have finished a
+        while ago, are then looked up in the accounting.
+
+        :param list slurm_job_ids: The ids of the jobs, either job ids or job array
+                                   task specifications (see slurm_job_spec)
+
+        :returns: A dict with the job specification (str) as key and the state of
+                  the job (e.g. "RUNNING") as value; unknown jobs are left out
+        :rtype: dict
+
+        :raises RuntimeError: If the jobs could not be listed
+        """
+        requested = set(slurm_job_spec(x) for x in slurm_job_ids)
+        if not requested:
+            return {}
+        job_states = {}
+        for job in self._call("GET", "slurm", "jobs").get("jobs") or []:
+            array_job_id = _number(job.get("array_job_id"))
+            array_task_id = _number(job.get("array_task_id"))
+            if not array_job_id:
+                job_specs = [slurm_job_spec(job["job_id"])]
+            elif array_task_id is not None:
+                job_specs = [slurm_job_spec(array_job_id, array_task_id)]
+            else:
+                # the pending tasks of a job array, e.g. "3-7%2"
+                job_specs = _expand_job_ids(
+                    "{}_[{}]".format(array_job_id, job.get("array_task_string"))
+                )
+            state = _state(job.get("job_state"))
+            for job_spec in job_specs:
+                if job_spec in requested and state:
+                    job_states[job_spec] = state
+        missing = sorted(requested - set(job_states))
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+                for job_spec, state in executor.map(
+                    self._get_finished_job_state, missing
+                ):
+                    if state:
+                        job_states[job_spec] = state
+        return job_states
+
+    def _get_finished_job_state(self, job_spec):
+        """The job specification and the state of a job in the accounting, None if
+        the job is not found."""
+        try:
+            result = self._call("GET", "slurmdb", "job/{}".format(job_spec))
+        except RuntimeError as e:
+            LOG.debug("slurm job {} not found: {}".format(job_spec, e))
+            return job_spec, None
+        for job in result.get("jobs") or []:
+            array = job.get("array") or {}
+            array_job_id = _number(array.get("job_id"))
+            array_task_id = _number(array.get("task_id"))
+            if array_job_id and array_task_id is not None:
+                found = slurm_job_spec(array_job_id, array_task_id)
+            else:
+                found = slurm_job_spec(job["job_id"])
+            if found == job_spec:
+                return job_spec, _state(job.get("state"))
+        return job_spec, None
+
+    def cancel_job(self, slurm_job_id):
+        """Cancel a job, as scancel would.
+
+        :param slurm_job_id: The id of the job, or a job array task specification
+
+        :raises RuntimeError: If the job could not be cancelled
+        """
+        self._call("DELETE", "slurm", "job/{}".format(slurm_job_spec(slurm_job_id)))
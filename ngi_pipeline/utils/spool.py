@@ -0,0 +1,296 @@
+"""Job completion spool.
+
+Finished jobs drop a small JSON completion record into a spool directory shared
+with the trackers, so that a tracking cycle only has to look at the jobs that
+have finished since the last cycle instead of opening the exit code file of
+every tracked job. The layout follows the maildir convention, with one spool
+per engine:
+
+    <spool_dir>/<engine>/tmp/  records being written by a job
+    <spool_dir>/<engine>/new/  complete records, not yet consumed
+    <spool_dir>/<engine>/cur/  records consumed by the tracker
+
+Moving a record from new/ to cur/ acts as the tracker's cursor; this is only
+done once the outcome has been committed to the tracking database. The consumed
+records are pruned by the tracking cycle once they are old enough.
+"""
+
+import datetime
+import json
+import os
+import re
+import shlex
+import time
+
+from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.filesystem import safe_makedir
+
+LOG = minimal_logger(__name__)
+
+# the seconds a job may go without a completion record before SLURM is asked about it
+DEFAULT_POLL_INTERVAL = 3600
+# the days consumed records are kept around
+DEFAULT_MAX_AGE_DAYS = 30
+
+
+def get_job_completion_spool(engine, config):
+    """Return the job completion spool for an engine, as configured by the
+    "job_completion_spool" option in the database section of the config (the
+    default is a "job_completion_spool" directory next to the tracking database).
+    The "job_completion_spool_poll_interval" (seconds) and
+    "job_completion_spool_max_age_days" options of the same section set how long
+    a job may go without reporting before it is polled, and how long consumed
+    records are kept.
+
+    :param str engine: The name of the engine (e.g. "piper_ngi")
+    :param dict config: The parsed NGI configuration
+
+    :returns: The spool, or None if no location could be determined
+    :rtype: JobCompletionSpool
+    """
+    database_config = (config or {}).get("database", {})
+    spool_dir = database_config.get("job_completion_spool")
+    if not spool_dir and database_config.get("record_tracking_db_path"):
+        spool_dir = os.path.join(
+            os.path.dirname(
+                os.path.abspath(database_config["record_tracking_db_path"])
+            ),
+            "job_completion_spool",
+        )
+    if not spool_dir:
+        return None
+    return JobCompletionSpool(
+        spool_dir,
+        engine,
+        poll_interval=database_config.get(
+            "job_completion_spool_poll_interval", DEFAULT_POLL_INTERVAL
+        ),
+        max_age_days=database_config.get(
+            "job_completion_spool_max_age_days", DEFAULT_MAX_AGE_DAYS
+        ),
+    )
+
+
+class JobCompletionSpool(object):
+    """The spool directory where the jobs of one engine write their completion records."""
+
+    # the fields written by the job itself; the others are fixed when the job is submitted
+    JOB_FIELDS = (
+        "job_id",
+        "exit_code",
+        "rsync_exit_code",
+        "started_at",
+        "finished_at",
+        "host",
+    )
+
+    def __init__(
+        self,
+        spool_dir,
+        engine,
+        poll_interval=DEFAULT_POLL_INTERVAL,
+        max_age_days=DEFAULT_MAX_AGE_DAYS,
+    ):
+        """
+        :param str spool_dir: The directory holding the spools of all engines
+        :param str engine: The name of the engine (e.g. "piper_ngi")
+        :param int poll_interval: The seconds a tracked job may go without a
+                                  completion record before it is polled
+        :param int max_age_days: The days consumed records are kept around
+        """
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.max_age_days = max_age_days
+        self.path = os.path.join(spool_dir, engine)
+        self.tmp_dir = os.path.join(self.path, "tmp")
+        self.new_dir = os.path.join(self.path, "new")
+        self.cur_dir = os.path.join(self.path, "cur")
+
+    def __repr__(self):
+        return "JobCompletionSpool({})".format(self.path)
+
+    @staticmethod
+    def job_started_command():
+        """The shell command to put at the start of a job script to record its start time."""
+        return "NGI_JOB_STARTED=$(date +%s)"
+
+    def job_finished_commands(
+        self,
+        project_id,
+        sample_id,
+        workflow,
+        exit_code_variable,
+        rsync_exit_code_variable=None,
+    ):
+        """Return the shell commands that write the completion record at the end of
+        a job script. The record is written to tmp/ and then moved into new/, so the
+        tracker never sees a partially written record. The record is named after the
+        finish time, the job id and the sample, so a job analyzing several samples
+        writes one record per sample. The job id recorded for a task of a job array
+        is the array job id and the task id joined by an underscore, as for
+        ngi_pipeline.utils.slurm.slurm_job_spec, and for a job queued with the local
+        scheduler it is the local job id.
+
+        :param str project_id: The project id
+        :param str sample_id: The sample id
+        :param str workflow: The workflow as recorded in the tracking database
+        :param str exit_code_variable: The name of the shell variable holding the exit code
+        :param str rsync_exit_code_variable: The name of the shell variable holding the exit
+                                             code of copying back the results, if any
+
+        :returns: A list of shell command lines
+        :rtype: list
+        """
+        fixed_fields = json.dumps(
+            {
+                "engine": self.engine,
+                "project_id": project_id,
+                "sample_id": sample_id,
+                "workflow": workflow,
+            },
+            sort_keys=True,
+        )
+        # printf template: the fixed fields followed by the ones only known to the job
+        record_template = "{}, {}}}\\n".format(
+            fixed_fields[:-1].replace("%", "%%"),
+            ", ".join(
+                (
+                    '"{}": "%s"'.format(field)
+                    if field in ("job_id", "host")
+                    else '"{}": %s'.format(field)
+                )
+                for field in self.JOB_FIELDS
+            ),
+        )
+        record_values = [
+            '"$NGI_JOB_ID"',
+            '"${{{}:-null}}"'.format(exit_code_variable),
+            (
+                '"${{{}:-null}}"'.format(rsync_exit_code_variable)
+                if rsync_exit_code_variable
+                else "null"
+            ),
+            '"${NGI_JOB_STARTED:-null}"',
+            '"$NGI_JOB_FINISHED"',
+            '"$(hostname)"',
+        ]
+        # the samples analyzed together in one job each get a record of their own
+        record_name = "${{NGI_JOB_FINISHED}}.${{NGI_JOB_ID}}.{}.json".format(
+            re.sub(r"[^\w.-]", "_", sample_id)
+        )
+        tmp_record = '"{}/{}"'.format(self.tmp_dir, record_name)
+        new_record = '"{}/{}"'.format(self.new_dir, record_name)
+        return [
+            "NGI_JOB_FINISHED=$(date +%s)",
+            "NGI_JOB_ID=${SLURM_ARRAY_JOB_ID:+${SLURM_ARRAY_JOB_ID}_${SLURM_ARRAY_TASK_ID}}",
+            "NGI_JOB_ID=${NGI_JOB_ID:-${SLURM_JOB_ID:-${NGI_LOCAL_JOB_ID:-$$}}}",
+            'mkdir -p "{}" "{}"'.format(self.tmp_dir, self.new_dir),
+            "printf {} {} > {} && mv {} {}".format(
+                shlex.quote(record_template),
+                " ".join(record_values),
+                tmp_record,
+                tmp_record,
+                new_record,
+            ),
+        ]
+
+    def new_records(self):
+        """Read the records that have not been consumed yet, oldest first. Records
+        that cannot be parsed are logged and moved out of the way.
+
+        :returns: A list of (record name, record dict) tuples
+        :rtype: list
+        """
+        try:
+            record_names = sorted(
+                x for x in os.listdir(self.new_dir) if x.endswith(".json")
+            )
+        except OSError:
+            # nothing has been spooled yet
+            return []
+        records = []
+        for record_name in record_names:
+            record_path = os.path.join(self.new_dir, record_name)
+            try:
+                with open(record_path, "r") as fh:
+                    record = json.load(fh)
+                if not isinstance(record, dict) or record.get("engine") != self.engine:
+                    raise ValueError("not a {} completion record".format(self.engine))
+            except (IOError, ValueError) as e:
+                LOG.warning(
+                    'Skipping invalid job completion record "{}": {}'.format(
+                        record_path, e
+                    )
+                )
+                self.acknowledge([(record_name, None)])
+                continue
+            records.append((record_name, record))
+        return records
+
+    def acknowledge(self, records):
+        """Mark records as consumed by moving them from new/ to cur/.
+
+        :param list records: The (record name, record dict) tuples to mark as consumed
+        """
+        if not records:
+            return
+        safe_makedir(self.cur_dir)
+        for record_name, _ in records:
+            try:
+                os.rename(
+                    os.path.join(self.new_dir, record_name),
+                    os.path.join(self.cur_dir, record_name),
+                )
+            except OSError as e:
+                LOG.warning(
+                    'Could not mark job completion record "{}" as consumed: {}'.format(
+                        record_name, e
+                    )
+                )
+
+    def prune(self, max_age_days=None):
+        """Remove consumed records older than max_age_days.
+
+        :param int max_age_days: The number of days to keep consumed records around
+                                 (default is the max_age_days of the spool)
+        """
+        if max_age_days is None:
+            max_age_days = self.max_age_days
+        cutoff = time.time() - max_age_days * 24 * 3600
+        try:
+            record_names = os.listdir(self.cur_dir)
+        except OSError:
+            return
+        for record_name in record_names:
+            record_path = os.path.join(self.cur_dir, record_name)
+            try:
+                if os.path.getmtime(record_path) < cutoff:
+                    os.remove(record_path)
+            except OSError:
+                pass
+
+    def poll_overdue(self, last_checked, now=None):
+        """Whether a tracked job that has not written a completion record should be
+        polled, i.e. whether it has gone poll_interval seconds without being
+        checked. A job killed by SLURM (e.g. for running out of time or memory)
+        never writes its record, so it is only caught this way.
+
+        :param datetime last_checked: When the job was last polled or, if it has not
+                                      been polled yet, submitted
+        :param datetime now: The current time (default is now)
+
+        :returns: True if the job should be polled
+        :rtype: bool
+        """
+        if last_checked is None:
+            return True
+        now = now or datetime.datetime.now()
+        return (now - last_checked).total_seconds() >= self.poll_interval
+
+    @staticmethod
+    def record_timestamp(record, field):
+        """Return a time field of a record as a datetime, or None if it was not recorded."""
+        try:
+            return datetime.datetime.fromtimestamp(int(record[field]))
+        except (KeyError, TypeError, ValueError):
+            return None
@@ -0,0 +1,198 @@
+"""Deferred deletion of analysis files.
+
+Deleting the results of an earlier analysis (large BAM and VCF files and whole
+directory trees) can take minutes on a shared filesystem. Instead of deleting
+them while the launcher waits, they are renamed into a per-project trash
+directory, which is a single metadata operation as long as the trash is on the
+same filesystem:
+
+    <project dir>/.trash/<timestamp>/<path relative to the project dir>
+
+The trash is emptied by a reaper, either in a background thread of the launcher
+(see start_trash_reaper) or from cron:
+
+    python -m ngi_pipeline.utils.trash [--workers <n>] [--min-age <hours>] <project dir> [...]
+"""
+
+import argparse
+import datetime
+import errno
+import os
+import shutil
+import sys
+import threading
+import time
+
+from ngi_pipeline.log.loggers import minimal_logger
+from ngi_pipeline.utils.filesystem import safe_makedir
+from ngi_pipeline.utils.pyutils import ordered_thread_map
+
+LOG = minimal_logger(__name__)
+
+TRASH_DIRNAME = ".trash"
+
+
+def _remove_path(path):
+    """Delete a file or a directory tree right away."""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def move_to_trash(paths, project_dir):
+    """Move files and directories into the trash of a project. Paths that cannot
+    be renamed into the trash (e.g. as they are on another filesystem) are deleted
+    right away instead.
+
+    :param list paths: The files and directories to remove; they should be under project_dir
+    :param str project_dir: The project directory holding the trash
+
+    :returns: The timestamped trash directory the paths were moved to
+    :rtype: str
+    :raises OSError: If a path could be neither moved nor deleted; the other
+                     paths are still removed
+    """
+    project_dir = os.path.abspath(project_dir)
+    trash_dir = os.path.join(
+        project_dir,
+        TRASH_DIRNAME,
+        datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S:%f"),
+    )
+    errors = []
+    for path in paths:
+        abs_path = os.path.abspath(path)
+        rel_path = os.path.relpath(abs_path, project_dir)
+        if rel_path.startswith(os.pardir):
+            # keep whatever is outside the project dir apart
+            rel_path = os.path.join("_external", abs_path.lstrip(os.sep))
+        trash_path = os.path.join(trash_dir, rel_path)
+        LOG.debug("Moving {} to the trash at {}".format(path, trash_path))
+        try:
+            safe_makedir(os.path.dirname(trash_path))
+            os.rename(abs_path, trash_path)
+        except OSError as e:
+            if e.errno == errno.ENOENT and not os.path.lexists(abs_path):
+                continue
+            LOG.debug(
+                "Could not move {} to the trash ({}); deleting it".format(path, e)
+            )
+            try:
+                _remove_path(abs_path)
+            except OSError as e:
+                errors.append("{}: {}".format(path, e))
+    if errors:
+        raise OSError("Could not remove {}".format(", ".join(errors)))
+    return trash_dir
+
+
+def reap_trash(project_dir, max_workers=4, min_age=0):
+    """Delete what has been moved to the trash of a project, deleting at most
+    max_workers files at a time.
+
+    :param str project_dir: The project directory holding the trash (or the trash itself)
+    :param int max_workers: The number of files deleted concurrently
+    :param float min_age: Leave what was moved to the trash less than this many seconds ago
+
+    :returns: The number of files deleted
+    :rtype: int
+    """
+    trash_root = project_dir
+    if os.path.basename(os.path.normpath(project_dir)) != TRASH_DIRNAME:
+        trash_root = os.path.join(project_dir, TRASH_DIRNAME)
+    try:
+        trash_dirs = sorted(os.listdir(trash_root))
+    except OSError:
+        return 0
+    files_deleted = 0
+    for trash_dirname in trash_dirs:
+        trash_dir = os.path.join(trash_root, trash_dirname)
+        try:
+            if time.time() - os.path.getmtime(trash_dir) < min_age:
+                continue
+        except OSError:
+            continue
+        file_paths = []
+        dir_paths = []
+        for dirpath, dirnames, filenames in os.walk(trash_dir):
+            dir_paths.append(dirpath)
+            file_paths.extend(os.path.join(dirpath, x) for x in filenames)
+            # symlinks to directories are removed as files
+            file_paths.extend(
+                os.path.join(dirpath, x)
+                for x in dirnames
+                if os.path.islink(os.path.join(dirpath, x))
+            )
+        LOG.info(
+            "Deleting {} files from the trash at {}".format(len(file_paths), trash_dir)
+        )
+        for file_path, _, exception in ordered_thread_map(
+            os.remove, file_paths, max_workers=max_workers
+        ):
+            if exception is None:
+                files_deleted += 1
+            elif not isinstance(exception, OSError) or exception.errno != errno.ENOENT:
+                LOG.warning("Could not delete {}: {}".format(file_path, exception))
+        # the deepest directories first
+        for dir_path in reversed(dir_paths):
+            try:
+                os.rmdir(dir_path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    LOG.warning("Could not delete {}: {}".format(dir_path, e))
+    return files_deleted
+
+
+def start_trash_reaper(project_dirs, max_workers=4):
+    """Empty the trash of projects in a background thread. The thread is not a
+    daemon, so the process does not exit until the trash has been emptied.
+
+    :param list project_dirs: The project directories holding the trash
+    :param int max_workers: The number of files deleted concurrently
+
+    :returns: The reaper thread
+    :rtype: threading.Thread
+    """
+
+    def _reap():
+        for project_dir in project_dirs:
+            try:
+                reap_trash(project_dir, max_workers=max_workers)
+            except Exception as e:
+                LOG.error("Could not empty the trash of {}: {}".format(project_dir, e))
+
+    reaper = threading.Thread(target=_reap, name="trash-reaper")
+    reaper.start()
+    return reaper
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Delete the analysis files moved to the trash of projects."
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=4,
+        help="The number of files deleted at once",
+    )
+    parser.add_argument(
+        "--min-age",
+        type=float,
+        default=0,
+        help="Leave what was moved to the trash less than this many hours ago",
+    )
+    parser.add_argument("project_dirs", nargs="+", metavar="project_dir")
+    parsed_args = parser.parse_args(args)
+    for project_dir in parsed_args.project_dirs:
+        reap_trash(
+            project_dir,
+            max_workers=parsed_args.workers,
+            min_age=parsed_args.min_age * 3600,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())